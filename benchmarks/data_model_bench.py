@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark construction of ``boson.data_model`` objects.
+
+Each scenario builds and keeps ``count`` objects (one million by
+default) in a fresh child process, and reports the construction rate
+and the growth of the resident set size.  Memory figures are only
+available where ``/proc/self/statm`` is.
+
+Run with ``python -m benchmarks.data_model_bench [count]``.
+"""
+
+import gc
+import multiprocessing
+import os
+import sys
+import time
+
+from boson.data_model import reservation
+from boson.data_model import resource
+from boson.data_model import service
+
+
+def _rss():
+    """Return the resident set size in bytes, or ``None``."""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _fixtures():
+    svc = service.Service('nova', ['tenant_id', 'user_id'])
+    return svc, dict(
+        instances=resource.Resource(svc, 'instances'),
+        fixed_ips=resource.Resource(svc, 'fixed_ips', ['instance']),
+    )
+
+
+def specific_resources(count):
+    """Specific resources without parameters."""
+
+    svc, res = _fixtures()
+    return [resource.SpecificResource(res['instances'])
+            for i in xrange(count)]
+
+
+def param_resources(count):
+    """Specific resources over 1000 distinct sets of parameters."""
+
+    svc, res = _fixtures()
+    params = [dict(instance='instance-%d' % i) for i in range(1000)]
+    return [resource.SpecificResource(res['fixed_ips'], params[i % 1000])
+            for i in xrange(count)]
+
+
+def service_users(count):
+    """Service users over 1000 distinct tenants."""
+
+    svc, res = _fixtures()
+    auth = [dict(tenant_id='tenant-%d' % i, user_id='user', roles=[])
+            for i in range(1000)]
+    return [service.ServiceUser(svc, auth[i % 1000]) for i in xrange(count)]
+
+
+def reservations(count):
+    """Reservations of one specific resource each."""
+
+    svc, res = _fixtures()
+    svc_user = service.ServiceUser(svc, dict(tenant_id='t', user_id='u'))
+    spc = resource.SpecificResource(res['instances'])
+    return [reservation.Reservation(svc_user, {spc: 1}, resv_id='resv')
+            for i in xrange(count)]
+
+
+SCENARIOS = (specific_resources, param_resources, service_users,
+             reservations)
+
+
+def _measure(args):
+    """Run one scenario; executed in a child process."""
+
+    name, count = args
+    scenario = globals()[name]
+
+    gc.collect()
+    before = _rss()
+    start = time.time()
+    objects = scenario(count)
+    elapsed = time.time() - start
+    gc.collect()
+    after = _rss()
+
+    growth = after - before if before is not None else None
+    del objects
+    return name, elapsed, growth
+
+
+def run(count=1000000):
+    """
+    Run every scenario, each in its own process.  Returns a list of
+    ``(name, seconds, bytes of RSS growth or None)`` tuples.
+    """
+
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        return pool.map(_measure, [(s.__name__, count) for s in SCENARIOS],
+                        chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=sys.argv[1:]):
+    count = int(argv[0]) if argv else 1000000
+
+    for name, elapsed, growth in run(count):
+        memory = ('%7.1f MiB  %5.0f B/obj' %
+                  (growth / 1048576.0, float(growth) / count)
+                  if growth is not None else 'n/a')
+        print '%-20s %8d objs  %7.2f s  %10.0f objs/s  %s' % (
+            name, count, elapsed, count / elapsed, memory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark ``jsonutils.to_primitive()`` on usage listing payloads.
+
+Run with ``python -m benchmarks.jsonutils_bench [items] [repeat]``.
+"""
+
+import datetime
+import sys
+import timeit
+
+from boson.db import models
+from boson.openstack.common import jsonutils
+from boson import utils
+
+
+class FakeUsage(object):
+    """Stands in for a database row wrapped by ``models.Usage``."""
+
+    def __init__(self, idx, now):
+        self.id = utils.generate_uuid()
+        self.created_at = now
+        self.updated_at = now
+        self.resource_id = utils.generate_uuid()
+        self.parameter_data = dict(security_group='sg-%d' % (idx % 7))
+        self.auth_data = dict(tenant_id='tenant-%d' % (idx % 100),
+                              quota_class='default')
+        self.used = idx % 13
+        self.reserved = idx % 3
+        self.generation = idx % 5
+        self.until_refresh = None
+        self.refresh_id = None
+
+
+def dict_payload(count):
+    """A listing of usages as plain dictionaries."""
+
+    now = datetime.datetime.utcnow()
+    return dict(usages=[dict(id=utils.generate_uuid(),
+                             created_at=now,
+                             updated_at=None,
+                             resource='nova/instances',
+                             parameter_data=dict(security_group='sg-%d' %
+                                                 (i % 7)),
+                             auth_data=dict(tenant_id='tenant-%d' %
+                                            (i % 100)),
+                             used=i % 13,
+                             reserved=i % 3,
+                             generation=i % 5,
+                             fields=set(['tenant_id']))
+                        for i in range(count)])
+
+
+def model_payload(count):
+    """A listing of usages as ``models.Usage`` objects."""
+
+    now = datetime.datetime.utcnow()
+    return dict(usages=[models.Usage(None, None, FakeUsage(i, now))
+                        for i in range(count)])
+
+
+def run(count=10000, repeat=5):
+    """
+    Time the conversion of each payload and return a dictionary
+    mapping payload names to the best time, in seconds.
+    """
+
+    results = {}
+    for name, factory in (('dicts', dict_payload), ('models', model_payload)):
+        payload = factory(count)
+        timer = timeit.Timer(lambda: jsonutils.to_primitive(payload))
+        results[name] = min(timer.repeat(repeat=repeat, number=1))
+    return results
+
+
+def main(argv=sys.argv[1:]):
+    count = int(argv[0]) if argv else 10000
+    repeat = int(argv[1]) if len(argv) > 1 else 5
+
+    for name, best in sorted(run(count, repeat).items()):
+        print '%-8s %6d items  %8.2f ms  %10.0f items/s' % (
+            name, count, best * 1000, count / best)
+
+
+if __name__ == '__main__':
+    main()
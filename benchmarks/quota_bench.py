@@ -0,0 +1,466 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark the quota engine under concurrent load.
+
+Seeds services, resources, tenants, and usages into a database, then
+drives a mixed reserve/commit/rollback/expire workload from several
+threads or processes, and reports throughput, latency percentiles,
+and SQL queries per operation.
+
+Run with ``python -m benchmarks.quota_bench [options]``; see
+``--help``.  The database is given as an SQLAlchemy URL, so a local
+MySQL or PostgreSQL server can be benchmarked as well as SQLite::
+
+    python -m benchmarks.quota_bench --workers 8 --processes \\
+        --database sqlite:////tmp/boson-bench.db --output before.json
+
+An in-memory SQLite database only supports a single worker.  The
+workload is driven by a fixed random seed, and the JSON written by
+``--output`` has a stable layout, so results from different commits
+can be compared directly.  ``--concurrency`` selects how usage
+records are updated, so the locking, optimistic, and ledger modes
+can be compared on the same workload; in ledger mode, a
+``boson.db.usage_ledger.Compactor`` runs in the background while the
+workers do, unless the database is in memory, and the ledger is
+compacted once more at the end.  ``--batch-window`` puts a
+``boson.combiner.ReservationCombiner`` shared by the workers of each
+process in front of the engine.  ``--statements`` selects whether
+reservations are made with the precompiled statements of the fast path
+or through the ORM, so the two can be compared on the same workload.
+"""
+
+import datetime
+import json
+import multiprocessing
+import optparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import sqlalchemy
+
+from boson import combiner
+from boson import context
+from boson.data_model import resource as dm_resource
+from boson.data_model import service as dm_service
+from boson.db import usage_ledger
+from boson.db.sqlalchemy import api as sa_api
+from boson.db.sqlalchemy import models as sa_models
+from boson.db.sqlalchemy import session as db_session
+from boson import exceptions
+from boson.openstack.common import cfg
+from boson.openstack.common import timeutils
+from boson import quota
+from boson import utils
+
+
+OPERATIONS = ('reserve', 'commit', 'rollback', 'expire')
+
+
+class QueryCounter(object):
+    """Count the SQL statements executed by each thread."""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                                self._before_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               ctxt, executemany):
+        self._local.count = self.count + 1
+
+    @property
+    def count(self):
+        """The number of statements executed by the current thread."""
+
+        return getattr(self._local, 'count', 0)
+
+
+def configure(database, concurrency='locking', statements='core'):
+    """
+    Point the database layer at the benchmark database, and select
+    how usage records are updated and reservations made.
+    """
+
+    cfg.CONF.set_override('database_connection', database)
+    cfg.CONF.set_override('sql_connection_debug', 0)
+    cfg.CONF.set_override('usage_concurrency', concurrency)
+    cfg.CONF.set_override('reservation_fast_path', statements == 'core')
+    return db_session.get_engine()
+
+
+def seed(engine, services, resources, tenants):
+    """
+    Create fresh tables and seed them.  Each service gets one category
+    and ``resources`` resources, each with a generous default quota
+    and a usage record for each of ``tenants`` tenants.
+
+    :returns: A list of ``(service name, [resource names])`` tuples.
+    """
+
+    sa_models.BASE.metadata.drop_all(engine)
+    sa_models.BASE.metadata.create_all(engine)
+
+    dbapi = sa_api.API()
+    ctxt = context.get_admin_context()
+    dbapi.create_session(ctxt)
+
+    layout = []
+    for svc_idx in range(services):
+        with dbapi.transaction(ctxt):
+            service = dbapi.create_service(ctxt, 'service-%d' % svc_idx,
+                                           set(['tenant_id']))
+            category = dbapi.create_category(ctxt, service, 'default',
+                                             set(['tenant_id']),
+                                             [set(['tenant_id']), set()])
+            names = []
+            for res_idx in range(resources):
+                resource = dbapi.create_resource(ctxt, service, category,
+                                                 'resource-%d' % res_idx,
+                                                 set())
+                dbapi.create_quota(ctxt, resource, {}, 10 ** 9)
+                for tenant_idx in range(tenants):
+                    dbapi.create_usage(ctxt, resource, {},
+                                       dict(tenant_id='tenant-%d' %
+                                            tenant_idx))
+                names.append(resource.name)
+        layout.append((service.name, names))
+
+    ctxt.session.close()
+    return layout
+
+
+def make_combiner(options):
+    """
+    Create the reservation combiner for the workers of a process, or
+    return ``None`` if reservations are not combined.
+    """
+
+    if options.batch_window <= 0:
+        return None
+    return combiner.ReservationCombiner(
+        quota.QuotaEngine(sa_api.API()), window=options.batch_window,
+        size=options.batch_size)
+
+
+def run_worker(worker_id, options, layout, counter, combiner_=None):
+    """
+    Run the workload for a single worker.  Reservations are made
+    through ``combiner_``, if given.
+
+    :returns: A dictionary mapping operation names to lists of
+              ``(latency in microseconds, queries, outcome)`` tuples.
+    """
+
+    rng = random.Random(options.seed + worker_id)
+    dbapi = sa_api.API()
+    ctxt = context.Context('bench', None)
+    dbapi.create_session(ctxt)
+    engine = quota.QuotaEngine(dbapi)
+
+    targets = []
+    for svc_name, res_names in layout:
+        service = dm_service.Service(svc_name, ['tenant_id'])
+        users = [dm_service.ServiceUser(service,
+                                        dict(tenant_id='tenant-%d' % i))
+                 for i in range(options.tenants)]
+        for res_name in res_names:
+            spc = dm_resource.SpecificResource(
+                dm_resource.Resource(service, res_name))
+            targets.append((users, spc))
+
+    samples = dict((op, []) for op in OPERATIONS)
+
+    def timed(op, func, *args, **kwargs):
+        queries = counter.count
+        start = time.time()
+        outcome = 'ok'
+        result = None
+        try:
+            result = func(*args, **kwargs)
+        except exceptions.OverQuota:
+            outcome = 'over_quota'
+        except Exception as exc:
+            outcome = exc.__class__.__name__
+        samples[op].append(((time.time() - start) * 1000000,
+                            counter.count - queries, outcome))
+        return result
+
+    for i in range(options.ops):
+        users, spc = rng.choice(targets)
+        svc_user = rng.choice(users)
+        choice = rng.random()
+
+        # Reservations neither committed nor rolled back are left to
+        # expire immediately
+        expire = None
+        if choice >= options.commit_ratio + options.rollback_ratio:
+            expire = timeutils.utcnow()
+
+        resv = timed('reserve', (combiner_ or engine).reserve, ctxt,
+                     svc_user, {spc: rng.randint(1, 3)}, expire=expire)
+        if resv is not None:
+            if choice < options.commit_ratio:
+                timed('commit', engine.commit, ctxt, resv.resv_id)
+            elif expire is None:
+                timed('rollback', engine.rollback, ctxt, resv.resv_id)
+
+        if worker_id == 0 and (i + 1) % options.expire_every == 0:
+            timed('expire', engine.expire, ctxt)
+
+    ctxt.session.close()
+    return samples
+
+
+def _process_worker(args):
+    """Entry point for worker processes."""
+
+    worker_id, options, layout = args
+
+    # Connections inherited from the parent must not be shared
+    db_session.after_fork()
+    engine = db_session.get_engine()
+    return run_worker(worker_id, options, layout, QueryCounter(engine),
+                      make_combiner(options))
+
+
+def run(options):
+    """
+    Seed the database and run the workload.
+
+    :returns: A dictionary of results, suitable for serializing to
+              JSON.
+    """
+
+    if options.workers > 1 and options.database == 'sqlite://':
+        raise ValueError('an in-memory SQLite database only supports a '
+                         'single worker')
+
+    engine = configure(options.database, options.concurrency,
+                       options.statements)
+    layout = seed(engine, options.services, options.resources,
+                  options.tenants)
+
+    combiner_ = None
+    compactor = None
+    if options.concurrency == 'ledger':
+        compactor = usage_ledger.Compactor(sa_api.API())
+        if options.database != 'sqlite://':
+            compactor.start()
+
+    start = time.time()
+    if options.processes:
+        pool = multiprocessing.Pool(options.workers)
+        try:
+            results = pool.map(_process_worker,
+                               [(i, options, layout)
+                                for i in range(options.workers)])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        counter = QueryCounter(engine)
+        combiner_ = make_combiner(options)
+        results = [None] * options.workers
+
+        def target(worker_id):
+            results[worker_id] = run_worker(worker_id, options, layout,
+                                            counter, combiner_)
+
+        threads = [threading.Thread(target=target, args=(i,))
+                   for i in range(options.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.time() - start
+
+    if compactor is not None:
+        compactor.stop()
+        ctxt = context.get_admin_context()
+        compactor.dbapi.create_session(ctxt)
+        compactor.compact(ctxt)
+        ctxt.session.close()
+
+    summary = summarize(options, results, elapsed)
+    if combiner_ is not None:
+        summary['batch_sizes'] = combiner_.batch_sizes.snapshot()
+    return summary
+
+
+def summarize(options, results, elapsed):
+    """Combine the samples of all workers into a result dictionary."""
+
+    operations = {}
+    total = 0
+    for op in OPERATIONS:
+        histogram = utils.Histogram()
+        queries = 0
+        outcomes = {}
+        for samples in results:
+            for latency, count, outcome in samples[op]:
+                histogram.record(latency)
+                queries += count
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        total += histogram.count
+        operations[op] = dict(
+            count=histogram.count,
+            outcomes=outcomes,
+            latency_us=histogram.snapshot(),
+            queries_per_op=(float(queries) / histogram.count
+                            if histogram.count else None),
+        )
+
+    return dict(
+        version=1,
+        revision=_git_revision(),
+        timestamp=datetime.datetime.utcnow().isoformat(),
+        config=dict(
+            database=_redact(options.database),
+            services=options.services,
+            resources=options.resources,
+            tenants=options.tenants,
+            workers=options.workers,
+            mode='processes' if options.processes else 'threads',
+            concurrency=options.concurrency,
+            statements=options.statements,
+            batch_window=options.batch_window,
+            batch_size=options.batch_size,
+            ops=options.ops,
+            commit_ratio=options.commit_ratio,
+            rollback_ratio=options.rollback_ratio,
+            expire_every=options.expire_every,
+            seed=options.seed,
+        ),
+        elapsed=elapsed,
+        throughput=total / elapsed if elapsed else None,
+        operations=operations,
+    )
+
+
+def _git_revision():
+    """Return the commit being benchmarked, if known."""
+
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(
+                                    __file__)))
+        out = proc.communicate()[0].strip()
+    except OSError:
+        return None
+    return out if proc.returncode == 0 else None
+
+
+def _redact(url):
+    """Hide any password in a database URL."""
+
+    url = sqlalchemy.engine.url.make_url(url)
+    if url.password:
+        url.password = '***'
+    return str(url)
+
+
+def report(results, stream=sys.stdout):
+    """Print a human-readable summary of the results."""
+
+    config = results['config']
+    stream.write('%s, %d %s, %s, %s, %d ops each: %.1f ops/s in %.2f s\n' % (
+        config['database'], config['workers'], config['mode'],
+        config.get('concurrency', 'locking'),
+        config.get('statements', 'orm'), config['ops'],
+        results['throughput'] or 0, results['elapsed']))
+    stream.write('%-9s %7s %9s %9s %9s %9s %8s  %s\n' % (
+        'op', 'count', 'p50 us', 'p90 us', 'p99 us', 'p99.9 us',
+        'queries', 'outcomes'))
+    for op in OPERATIONS:
+        stats = results['operations'][op]
+        if not stats['count']:
+            continue
+        latency = stats['latency_us']
+        stream.write('%-9s %7d %9d %9d %9d %9d %8.1f  %s\n' % (
+            op, stats['count'], latency['p50'], latency['p90'],
+            latency['p99'], latency['p99.9'], stats['queries_per_op'],
+            ', '.join('%s=%d' % item
+                      for item in sorted(stats['outcomes'].items()))))
+    batches = results.get('batch_sizes')
+    if batches and batches['count']:
+        stream.write('%d batches, mean %.1f reservations, max %d\n' % (
+            batches['count'], batches['mean'], batches['max']))
+
+
+def main(argv=sys.argv[1:]):
+    parser = optparse.OptionParser(
+        usage='%prog [options]',
+        description='Benchmark the quota engine under concurrent load.')
+    parser.add_option('--database', default='sqlite://',
+                      help='SQLAlchemy URL of the database to benchmark '
+                           '(default: in-memory SQLite); the tables are '
+                           'dropped and recreated')
+    parser.add_option('--services', type='int', default=2)
+    parser.add_option('--resources', type='int', default=5,
+                      help='resources per service')
+    parser.add_option('--tenants', type='int', default=50)
+    parser.add_option('--workers', type='int', default=1)
+    parser.add_option('--processes', action='store_true', default=False,
+                      help='run workers as processes instead of threads')
+    parser.add_option('--ops', type='int', default=1000,
+                      help='reservations per worker')
+    parser.add_option('--commit-ratio', type='float', default=0.7)
+    parser.add_option('--rollback-ratio', type='float', default=0.2,
+                      help='the remaining reservations are left to expire')
+    parser.add_option('--expire-every', type='int', default=100,
+                      help='reservations between expiry runs')
+    parser.add_option('--concurrency', type='choice',
+                      choices=['locking', 'optimistic', 'ledger'],
+                      default='locking',
+                      help='how usage records are updated (default: '
+                           'locking)')
+    parser.add_option('--statements', type='choice',
+                      choices=['core', 'orm'], default='core',
+                      help='make reservations with the precompiled '
+                           'statements of the fast path or through the '
+                           'ORM (default: core)')
+    parser.add_option('--batch-window', type='int', default=0,
+                      help='milliseconds concurrent reservations of the '
+                           'same usages wait to be combined (default: 0, '
+                           'not combined)')
+    parser.add_option('--batch-size', type='int', default=100,
+                      help='maximum reservations combined in a batch')
+    parser.add_option('--seed', type='int', default=42)
+    parser.add_option('--output', help='write JSON results to this file')
+    options, args = parser.parse_args(argv)
+
+    try:
+        results = run(options)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    report(results)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Administrative WSGI application, exposing internal statistics of a
+running Boson server.
+"""
+
+import webob
+import webob.dec
+import webob.exc
+
+from boson.db.sqlalchemy import session as db_session
+from boson.openstack.common import jsonutils
+from boson import utils
+
+
+class AdminApp(object):
+    """
+    A WSGI application serving read-only administrative endpoints:
+
+    ``GET /timings``
+        The latency histograms of ``boson.utils.TIMERS``, as a JSON
+        object mapping timer names to summaries in microseconds.
+
+    ``GET /health``
+        The readiness of the database, as reported by
+        ``boson.db.sqlalchemy.session.status()``.  Answers with a
+        status of 200 once the database is ready, and 503 otherwise.
+    """
+
+    def __init__(self):
+        self.routes = {
+            '/health': self.health,
+            '/timings': self.timings,
+        }
+
+    @webob.dec.wsgify
+    def __call__(self, req):
+        handler = self.routes.get(req.path_info.rstrip('/'))
+        if handler is None:
+            return webob.exc.HTTPNotFound()
+        if req.method != 'GET':
+            return webob.exc.HTTPMethodNotAllowed(allow='GET')
+
+        return handler(req)
+
+    def _json(self, body, status=200):
+        """Build a JSON response."""
+
+        return webob.Response(body=jsonutils.dumps(body), status=status,
+                              content_type='application/json')
+
+    def health(self, req):
+        """Report the readiness of the database."""
+
+        database = db_session.status()
+        status = 200 if database['status'] == 'ready' else 503
+        return self._json(dict(database=database), status=status)
+
+    def timings(self, req):
+        """Report the recorded timings."""
+
+        return self._json(utils.TIMERS.report())
+
+
+def app_factory(global_conf, **local_conf):
+    """Paste application factory for the administrative application."""
+
+    utils.setup_timing()
+    db_session.start()
+    return AdminApp()
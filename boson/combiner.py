@@ -0,0 +1,204 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Group commit of concurrent reservations.
+
+When many workers reserve against the same usage record at once, each
+transaction waits for the lock held by the one before, then commits
+on its own.  A ``ReservationCombiner`` placed in front of the quota
+engine merges the requests for the same usage key arriving within a
+short window, and has the first of the callers make them all in a
+single transaction with ``QuotaEngine.reserve_batch()``; each caller
+then gets its own result.
+"""
+
+import threading
+
+from boson.openstack.common import cfg
+from boson import utils
+
+
+combiner_opts = [
+    cfg.IntOpt('reservation_batch_window',
+               default=5,
+               help='Number of milliseconds a reservation request waits '
+                    'for concurrent requests for the same usages to be '
+                    'combined with; 0 disables combining'),
+    cfg.IntOpt('reservation_batch_size',
+               default=100,
+               help='Maximum number of reservation requests combined '
+                    'into one transaction'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(combiner_opts)
+
+
+def usage_key(svc_user, deltas):
+    """
+    Compute the key under which reservation requests are combined:
+    the service, the authentication and authorization data, and the
+    resources and resource parameter data reserved.
+    """
+
+    return (svc_user.service.name, utils.dict_serialize(svc_user.auth_data),
+            tuple(sorted((spc_resource.resource.name,
+                          utils.dict_serialize(spc_resource.param_data))
+                         for spc_resource in deltas)))
+
+
+class _Batch(object):
+    """Reservation requests to be made in one transaction."""
+
+    __slots__ = ('requests', 'results', 'full', 'done')
+
+    def __init__(self):
+        self.requests = []
+        self.results = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class ReservationCombiner(object):
+    """
+    Combine concurrent reservation requests for the same usages into
+    batches, each made in a single transaction.
+
+    The first request for a key opens a batch and waits up to
+    ``reservation_batch_window`` milliseconds, or until the batch
+    holds ``reservation_batch_size`` requests, for others to join it.
+    It then makes the reservations of the whole batch, in the order
+    they arrived, and hands each waiting request its result.  Works
+    with native threads as well as eventlet green threads, provided
+    ``threading`` has been monkey-patched.
+    """
+
+    def __init__(self, engine, window=None, size=None):
+        """
+        Initialize a ReservationCombiner.
+
+        :param engine: The ``boson.quota.QuotaEngine`` to make the
+                       reservations with.
+        :param window: The number of milliseconds to wait for requests
+                       to combine.  Defaults to the
+                       ``reservation_batch_window`` option.
+        :param size: The maximum number of requests in a batch.
+                     Defaults to the ``reservation_batch_size`` option.
+        """
+
+        self.engine = engine
+        self._window = window
+        self._size = size
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        # The number of requests in each batch made
+        self.batch_sizes = utils.Histogram()
+
+    @property
+    def window(self):
+        """The number of seconds to wait for requests to combine."""
+
+        if self._window is None:
+            return CONF.reservation_batch_window / 1000.0
+        return self._window / 1000.0
+
+    @property
+    def size(self):
+        """The maximum number of requests in a batch."""
+
+        if self._size is None:
+            return CONF.reservation_batch_size
+        return self._size
+
+    def reserve(self, context, svc_user, deltas, expire=None, req_id=None):
+        """
+        Reserve resources, possibly together with concurrent requests
+        for the same usages; see ``QuotaEngine.reserve()``.  Raises an
+        ``OverQuota`` exception if this request would take the usage
+        of a resource over its limit, given the requests combined
+        with it that arrived first.
+
+        :param context: The current context for accessing the
+                        database.  Only the context of the first
+                        request of a batch is used.
+        :param svc_user: The ``ServiceUser`` to reserve resources for.
+        :param deltas: A dictionary mapping ``SpecificResource``
+                       objects to the deltas to reserve.
+        :param expire: The date and time at which the reservation will
+                       expire.
+        :param req_id: An optional ID provided by the caller, unique
+                       for the service.
+
+        :returns: An instance of
+                  ``boson.data_model.reservation.Reservation``.
+        """
+
+        window = self.window
+        if window <= 0:
+            return self.engine.reserve(context, svc_user, deltas,
+                                       expire=expire, req_id=req_id)
+
+        key = usage_key(svc_user, deltas)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch()
+            index = len(batch.requests)
+            batch.requests.append((svc_user, deltas, expire, req_id))
+
+            # A full batch is closed to further requests
+            if len(batch.requests) >= self.size:
+                del self._pending[key]
+                batch.full.set()
+
+        if leader:
+            self._run(context, key, batch, window)
+        else:
+            batch.done.wait()
+
+        result = batch.results[index]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _run(self, context, key, batch, window):
+        """Wait for requests to join a batch, then make them."""
+
+        with utils.timed('reserve.batch_wait'):
+            batch.full.wait(window)
+        with self._lock:
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+
+        requests = batch.requests
+        self.batch_sizes.record(len(requests))
+        try:
+            if len(requests) == 1:
+                svc_user, deltas, expire, req_id = requests[0]
+                batch.results = [self.engine.reserve(
+                    context, svc_user, deltas, expire=expire,
+                    req_id=req_id)]
+            else:
+                batch.results = self.engine.reserve_batch(context, requests)
+        except Exception as exc:
+            # Every request of the batch failed
+            batch.results = [exc] * len(requests)
+        finally:
+            batch.done.set()
@@ -22,6 +22,8 @@ class Quota(object):
     a simple limit.
     """
 
+    __slots__ = ('resource', 'category', 'limit', 'auth_data')
+
     def __init__(self, resource, category, auth_data=None, limit=None):
         """
         Initialize a Quota. Testing ..
@@ -43,5 +45,6 @@ class Quota(object):
         # Filter the authentication/authorization data
         if not auth_data:
             auth_data = {}
-        self.auth_data = dict((k, v) for k, v in auth_data.items()
-                              if k in resource.service.auth_fields)
+        self.auth_data = dict((k, auth_data[k])
+                              for k in resource.service.auth_fields
+                              if k in auth_data)
@@ -21,6 +21,8 @@ class Request(object):
     Represent a resource reservation request.
     """
 
+    __slots__ = ('svc_user', 'deltas', 'req_id')
+
     def __init__(self, svc_user, deltas, req_id=None):
         """
         Initialize a Request.
@@ -24,6 +24,8 @@ class Reservation(object):
     resources together with service user.
     """
 
+    __slots__ = ('svc_user', 'deltas', 'resv_id', 'req_id')
+
     def __init__(self, svc_user, deltas, resv_id=None, req_id=None):
         """
         Initialize a Reservation.
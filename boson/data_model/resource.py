@@ -15,14 +15,31 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import weakref
+
 from boson.openstack.common.gettextutils import _
 
 
+class _CanonicalName(object):
+    """
+    The canonical name of a specific resource, with its hash value.
+    Shared by all equal ``SpecificResource`` objects alive at once.
+    """
+
+    __slots__ = ('name', 'hash', '__weakref__')
+
+    def __init__(self, name):
+        self.name = name
+        self.hash = hash(name)
+
+
 class Resource(object):
     """
     Represent a resource.
     """
 
+    __slots__ = ('service', 'name', 'params', '_names', '__weakref__')
+
     def __init__(self, service, name, params=None):
         """
         Initialize a Resource.
@@ -37,7 +54,37 @@ class Resource(object):
 
         self.service = service
         self.name = name
-        self.params = set(params) if params else set()
+        self.params = frozenset(params) if params else frozenset()
+
+        # Canonical names of the specific resources currently alive,
+        # keyed by their sorted parameter names and value reprs
+        self._names = weakref.WeakValueDictionary()
+
+    def _canonical_name(self, param_data):
+        """
+        Return the ``_CanonicalName`` for a specific resource with the
+        given (filtered) parameter data.
+        """
+
+        # Keyed on the reprs the name is built from, since values which
+        # compare equal, such as True and 1, may have different reprs
+        key = tuple(sorted((k, repr(v)) for k, v in param_data.items()))
+        canon = self._names.get(key)
+        if canon is None:
+            canon = _CanonicalName(self._build_name(key))
+            self._names[key] = canon
+        return canon
+
+    def _build_name(self, param_items):
+        """
+        Build the canonical name from sorted parameter names and value
+        reprs.
+        """
+
+        name = '%s/%s' % (self.service.name, self.name)
+        if param_items:
+            name += '/%s' % '/'.join('%s=%s' % item for item in param_items)
+        return name
 
 
 class SpecificResource(object):
@@ -45,6 +92,8 @@ class SpecificResource(object):
     Represent a single resource.
     """
 
+    __slots__ = ('resource', 'param_data', '_canon')
+
     def __init__(self, resource, param_data=None):
         """
         Initialize a SpecificResource.
@@ -61,34 +110,35 @@ class SpecificResource(object):
         # Filter the parameter data
         if not param_data:
             param_data = {}
-        self.param_data = dict((k, v) for k, v in param_data.items()
-                               if k in resource.params)
+        self.param_data = dict((k, param_data[k]) for k in resource.params
+                               if k in param_data)
 
         # Make sure we got everything
-        missing = resource.params - set(self.param_data.keys())
-        if missing:
+        if len(self.param_data) != len(resource.params):
+            missing = resource.params.difference(self.param_data)
             raise ValueError(_("Missing parameter data fields: %s") %
                              ', '.join(repr(f) for f in sorted(missing)))
 
-        # Build the canonical resource name
-        self.name = '%s/%s' % (resource.service.name, resource.name)
-        if self.param_data:
-            param_items = ['%s=%r' % (k, v) for k, v in
-                           sorted(self.param_data.items(),
-                                  key=lambda x: x[0])]
-            self.name += '/%s' % '/'.join(param_items)
+        # Look up the canonical resource name
+        self._canon = resource._canonical_name(self.param_data)
+
+    @property
+    def name(self):
+        """The canonical name of the resource."""
+
+        return self._canon.name
 
     def __hash__(self):
         """Return a hash value of this resource."""
 
-        return hash(self.name)
+        return self._canon.hash
 
     def __eq__(self, other):
         """Compare two resources and return equality."""
 
-        return self.name == other.name
+        return self._canon is other._canon or self.name == other.name
 
     def __ne__(self, other):
         """Compare two resources and return inequality."""
 
-        return self.name != other.name
+        return not self.__eq__(other)
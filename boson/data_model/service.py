@@ -25,6 +25,8 @@ class Category(object):
     per-tenant basis.
     """
 
+    __slots__ = ('service', 'name', 'usage_fields', 'quota_fieldsets')
+
     def __init__(self, service, name, usage_fields, quota_fieldsets):
         """
         Initialize a Category.
@@ -44,10 +46,8 @@ class Category(object):
 
         self.service = service
         self.name = name
-        self.usage_fields = set(fld for fld in usage_fields
-                                if fld in service.auth_fields)
-        self.quota_fieldsets = [set(fld for fld in fieldset
-                                    if fld in service.auth_fields)
+        self.usage_fields = service.auth_fields.intersection(usage_fields)
+        self.quota_fieldsets = [service.auth_fields.intersection(fieldset)
                                 for fieldset in quota_fieldsets]
 
 
@@ -56,6 +56,8 @@ class Service(object):
     Represent a single service.
     """
 
+    __slots__ = ('name', 'auth_fields', 'categories', '__weakref__')
+
     def __init__(self, name, auth_fields):
         """
         Initialize a Service.
@@ -68,7 +70,7 @@ class Service(object):
         """
 
         self.name = name
-        self.auth_fields = set(auth_fields)
+        self.auth_fields = frozenset(auth_fields)
         self.categories = {}
 
     def add_category(self, category):
@@ -85,6 +87,8 @@ class ServiceUser(object):
     the authentication and authorization data relevant to the user.
     """
 
+    __slots__ = ('service', 'auth_data')
+
     def __init__(self, service, auth_data):
         """
         Initialize a ServiceUser.
@@ -97,11 +101,11 @@ class ServiceUser(object):
         self.service = service
 
         # Filter the authentication/authorization data
-        self.auth_data = dict((k, v) for k, v in auth_data.items()
-                              if k in service.auth_fields)
+        self.auth_data = dict((k, auth_data[k]) for k in service.auth_fields
+                              if k in auth_data)
 
         # Make sure we got everything
-        missing = service.auth_fields - set(self.auth_data.keys())
-        if missing:
+        if len(self.auth_data) != len(service.auth_fields):
+            missing = service.auth_fields.difference(self.auth_data)
             raise ValueError(_("Missing auth data fields: %s") %
                              ', '.join(repr(f) for f in sorted(missing)))
@@ -23,6 +23,9 @@ class Usage(object):
     reservations).
     """
 
+    __slots__ = ('spc_resource', 'category', 'usage', 'reserved', 'auth_data',
+                 'refresh_id')
+
     def __init__(self, spc_resource, category, auth_data, usage=0, reserved=0):
         """
         Initialize a Usage.
@@ -43,7 +46,7 @@ class Usage(object):
         self.reserved = reserved
 
         auth_fields = spc_resource.resource.service.auth_fields
-        self.auth_data = dict((k, v) for k, v in auth_data.items()
-                              if k in auth_fields)
+        self.auth_data = dict((k, auth_data[k]) for k in auth_fields
+                              if k in auth_data)
 
         self.refresh_id = None
@@ -16,6 +16,7 @@
 #    under the License.
 
 import abc
+import collections
 
 from boson.openstack.common.gettextutils import _
 from boson.openstack.common import log as logging
@@ -24,6 +25,14 @@ from boson.openstack.common import log as logging
 LOG = logging.getLogger(__name__)
 
 
+# One row of a usage report: the resource name, the resource
+# parameter data, the amounts used and reserved, and the applicable
+# limit (None if unlimited)
+UsageReport = collections.namedtuple('UsageReport', ['resource',
+                                                     'param_data', 'used',
+                                                     'reserved', 'limit'])
+
+
 class APITransaction(object):
     """
     A context manager for managing transactions.  Implements the
@@ -248,6 +257,9 @@ class API(object):
     def commit(self, context):
         """
         End a transaction, committing the changes to the database.
+        Raises a ``ConcurrentUpdate`` exception if a usage record
+        read without locking was updated concurrently, in which case
+        the transaction is rolled back.
 
         :param context: The current context for accessing the
                         database.
@@ -269,9 +281,8 @@ class API(object):
     @abc.abstractmethod
     def create_service(self, context, name, auth_fields):
         """
-        Create a new service.  Raises a Duplicate exception in the
-        event that the new service is a duplicate of an existing
-        service.
+        Create a new service.  If a service of the same name already
+        exists, it is returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -342,9 +353,9 @@ class API(object):
     @abc.abstractmethod
     def create_category(self, context, service, name, usage_fset, quota_fsets):
         """
-        Create a new category on a service.  Raises a Duplicate
-        exception in the event that the new category is a duplicate of
-        an existing category for the service.
+        Create a new category on a service.  If a category of the same
+        name already exists for the service, it is marked as seen and
+        returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -439,9 +450,9 @@ class API(object):
     def create_resource(self, context, service, category, name, parameters,
                         absolute=False):
         """
-        Create a new resource on a service.  Raises a Duplicate
-        exception in the event that the new resource is a duplicate of
-        an existing resource for the service.
+        Create a new resource on a service.  If a resource of the same
+        name already exists for the service, it is marked as seen and
+        returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -534,13 +545,97 @@ class API(object):
 
         pass  # Pragma: nocover
 
+    @abc.abstractmethod
+    def find_resources(self, context, service, prefix=None, pattern=None):
+        """
+        Find the resources of a service by name, using an in-memory
+        index of the resource names.  Resource names are hierarchical,
+        with components separated by '/'.
+
+        :param context: The current context for accessing the
+                        database.
+        :param service: The ``Service`` or service ID of the service
+                        to find the resources of.
+        :param prefix: Find the resources named ``prefix`` or with
+                       names beginning with ``prefix`` followed by
+                       '/'.  An empty prefix finds all resources.
+        :param pattern: Find the resources with names matching a
+                        pattern.  Each component of the pattern may
+                        contain the shell-style wildcards '*', '?',
+                        and '[...]'; a component of '**' matches any
+                        number of components.
+
+        Note: provide exactly one of ``prefix`` and ``pattern``.  If
+        both or neither are provided, a TypeError will be raised.
+
+        :returns: A list of the IDs of the matching resources, ordered
+                  by resource name.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def mark_seen(self, context, categories=(), resources=()):
+        """
+        Record that categories and resources were declared by their
+        service, setting their ``last_seen`` to now.  Whatever records
+        a service's declarations must call this with all the
+        categories and resources declared, before purging is enabled
+        with the ``resource_purge_age`` option.
+
+        :param context: The current context for accessing the
+                        database.
+        :param categories: A sequence of ``Category`` objects or UUIDs
+                           of the categories declared.
+        :param resources: A sequence of ``Resource`` objects or UUIDs
+                          of the resources declared.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def purge_resources(self, context, before, limit):
+        """
+        Delete resources last declared before a given time, together
+        with their usages, quotas, reserved items, and usage ledger
+        entries.
+
+        :param context: The current context for accessing the
+                        database.
+        :param before: The date and time before which resources must
+                       have been last declared to be deleted.
+        :param limit: The maximum number of resources to delete.
+
+        :returns: A list of the names of the deleted resources.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def purge_categories(self, context, before, limit):
+        """
+        Delete categories last declared before a given time, which no
+        longer contain any resources.
+
+        :param context: The current context for accessing the
+                        database.
+        :param before: The date and time before which categories must
+                       have been last declared to be deleted.
+        :param limit: The maximum number of categories to delete.
+
+        :returns: A list of the names of the deleted categories.
+        """
+
+        pass  # Pragma: nocover
+
     @abc.abstractmethod
     def create_usage(self, context, resource, param_data, auth_data, used=0,
                      reserved=0, until_refresh=0, refresh_id=None):
         """
-        Create a new usage for a given resource and user.  Raises a
-        Duplicate exception in the event that the new usage is a
-        duplicate of an existing usage.
+        Create a new usage for a given resource and user.  If a usage
+        with the same parameter data and authentication and
+        authorization data already exists for the resource, it is
+        returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -582,7 +677,7 @@ class API(object):
 
     @abc.abstractmethod
     def get_usage(self, context, id=None, resource=None, param_data=None,
-                  auth_data=None, hints=None):
+                  auth_data=None, hints=None, lock=False, auth_key=None):
         """
         Look up a specific usage by id or by resource, parameter data,
         and authentication and authorization data.
@@ -605,6 +700,12 @@ class API(object):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param lock: If ``True``, the usage record is locked against
+                     concurrent updates until the end of the current
+                     transaction.
+        :param auth_key: The serialized form of ``auth_data``, as
+                         produced by ``boson.utils.dict_serialize()``,
+                         if already known.
 
         Note: either provide ``id`` or provide all three of
         ``resource``, ``param_data``, and ``auth_data``.  If an
@@ -625,8 +726,9 @@ class API(object):
 
         :param context: The current context for accessing the
                         database.
-        :param resource: A ``Service`` or service ID to filter the
-                         list of returned usages.
+        :param resource: A ``Resource``, a resource ID, or a sequence
+                         of resource IDs to filter the list of
+                         returned usages.
         :param param_data: Resource parameter data (a dictionary) to
                            filter the list of returned usages.  Should
                            be used in conjunction with the
@@ -650,12 +752,129 @@ class API(object):
 
         pass  # Pragma: nocover
 
+    @abc.abstractmethod
+    def get_usage_row(self, context, resource, param_data, auth_data,
+                      lock=False, auth_key=None):
+        """
+        Look up the amounts of a specific usage, bypassing the object
+        model.  For use on the reservation hot path, together with
+        ``update_reserved()``.  If no matching usage can be found, a
+        KeyError will be raised.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: The ``Resource`` or resource ID of the
+                         resource to look up the usage for.
+        :param param_data: Resource parameter data (a dictionary).
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param lock: If ``True``, the usage record is locked against
+                     concurrent updates until the end of the current
+                     transaction.
+        :param auth_key: The serialized form of ``auth_data``, as
+                         produced by ``boson.utils.dict_serialize()``,
+                         if already known.
+
+        :returns: A row with the ``id``, ``used``, ``reserved``, and
+                  ``generation`` of the usage.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def usage_might_exist(self, context, resource, param_data, auth_data,
+                          auth_key=None):
+        """
+        Determine, without querying the database, whether a specific
+        usage may exist.  Returns ``False`` only if the usage is
+        certainly missing, although usages created by other processes
+        may be taken as missing for a while.  For skipping the lookup
+        of a usage about to be created if missing; lookups themselves
+        always query the database.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: The ``Resource`` or resource ID of the
+                         resource of the usage.
+        :param param_data: Resource parameter data (a dictionary).
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param auth_key: The serialized form of ``auth_data``, as
+                         produced by ``boson.utils.dict_serialize()``,
+                         if already known.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def update_reserved(self, context, usages):
+        """
+        Add to the amounts reserved of usages.  Raises a
+        ``ConcurrentUpdate`` exception if any of the usage records was
+        updated since it was looked up.
+
+        :param context: The current context for accessing the
+                        database.
+        :param usages: A sequence of tuples of a usage row, as returned
+                       by ``get_usage_row()``, and the amount to add to
+                       its amount reserved.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def append_ledger(self, context, entries):
+        """
+        Append changes of the amounts of usages to the usage ledger.
+
+        :param context: The current context for accessing the
+                        database.
+        :param entries: A sequence of tuples of the UUID of the usage,
+                        and the amounts to add to its amount used and
+                        amount reserved.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def get_usage_amounts(self, context, usage_ids):
+        """
+        Look up the amounts used and reserved of usages, including the
+        changes appended to the usage ledger and not yet folded into
+        the usage records.
+
+        :param context: The current context for accessing the
+                        database.
+        :param usage_ids: A sequence of the UUIDs of the usages.
+
+        :returns: A dictionary mapping the UUID of each usage found to
+                  a tuple of its amount used and amount reserved.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def compact_ledger(self, context, limit):
+        """
+        Fold the oldest entries of the usage ledger into the usage
+        records, and delete them.  Raises a ``ConcurrentUpdate``
+        exception if any of the entries was folded concurrently.
+
+        :param context: The current context for accessing the
+                        database.
+        :param limit: The maximum number of entries to fold.
+
+        :returns: The number of entries folded.
+        """
+
+        pass  # Pragma: nocover
+
     @abc.abstractmethod
     def create_quota(self, context, resource, auth_data, limit=None):
         """
-        Create a new quota for a given resource and user.  Raises a
-        Duplicate exception in the event that the new usage is a
-        duplicate of an existing quota.
+        Create a new quota for a given resource and user.  If a quota
+        with the same authentication and authorization data already
+        exists for the resource, it is returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -676,7 +895,7 @@ class API(object):
 
     @abc.abstractmethod
     def get_quota(self, context, id=None, resource=None, auth_data=None,
-                  hints=None):
+                  hints=None, auth_key=None):
         """
         Look up a specific quota by id or by resource and
         authentication and authorization data.
@@ -698,6 +917,9 @@ class API(object):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param auth_key: The serialized form of ``auth_data``, as
+                         produced by ``boson.utils.dict_serialize()``,
+                         if already known.
 
         Note: either provide ``id`` or both ``resource`` and
         ``auth_data``.  If an invalid combination of arguments is
@@ -738,14 +960,51 @@ class API(object):
         pass  # Pragma: nocover
 
     @abc.abstractmethod
-    def create_reservation(self, context, expire):
+    def get_usage_report(self, context, service, auth_data):
         """
-        Create a new reservation.
+        Report the usages and limits of all resources of a service for
+        a given user.  This is a read-only operation; no model objects
+        are constructed.
+
+        :param context: The current context for accessing the
+                        database.
+        :param service: The ``Service`` or service ID to report on.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary) identifying the user.
+
+        :returns: A list of ``UsageReport`` tuples, ordered by resource
+                  name.  Resources without a usage record for the user
+                  are reported with no parameter data and zero usage;
+                  resources with parameters have one row per usage
+                  record.  The limit is that of the most specific
+                  applicable quota.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def create_reservation(self, context, expire, service=None,
+                           auth_data=None, req_id=None, id=None):
+        """
+        Create a new reservation.  If a ``req_id`` is given and a
+        reservation with the same ``req_id`` already exists for the
+        service, it is returned instead.
 
         :param context: The current context for accessing the
                         database.
         :param expire: A date and time at which the reservation will
                        expire.
+        :param service: The service making the reservation.  Can be
+                        either a ``Service`` object or a UUID of an
+                        existing service.  Required if ``req_id`` is
+                        given.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary) of the user the reservation is
+                          made for.
+        :param req_id: An ID for the reservation provided by the
+                       service, unique for that service.
+        :param id: The ID of the new reservation.  Defaults to a newly
+                   generated UUID.
 
         :returns: An instance of ``boson.db.models.Reservation``.
         """
@@ -777,13 +1036,52 @@ class API(object):
         pass  # Pragma: nocover
 
     @abc.abstractmethod
-    def get_reservation(self, context, id, hints=None):
+    def insert_reservations(self, context, reservations):
         """
-        Look up a specific reservation by id.
+        Insert new reservations without request IDs, bypassing the
+        object model.  For use on the reservation hot path.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservations: A sequence of tuples of the ID of the new
+                             reservation, the date and time at which
+                             it will expire, the service making it (a
+                             ``Service`` object or a UUID), and the
+                             authentication and authorization data (a
+                             dictionary) of the user it is made for.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def insert_reserved_items(self, context, items):
+        """
+        Reserve amounts of specific resources, bypassing the object
+        model.  For use on the reservation hot path.
+
+        :param context: The current context for accessing the
+                        database.
+        :param items: A sequence of tuples of the UUIDs of the
+                      reservation, the resource, and the usage, and
+                      the amount to reserve.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def get_reservation(self, context, id=None, service=None, req_id=None,
+                        hints=None):
+        """
+        Look up a specific reservation by id, or by service and the
+        request ID provided by that service.  Finished reservations are
+        found until archived.
 
         :param context: The current context for accessing the
                         database.
         :param id: The ID of the reservation to look up.
+        :param service: The ``Service`` or service ID of the service
+                        which made the reservation.
+        :param req_id: The request ID provided by the service.
         :param hints: An optional list of hints indicating which
                       attributes of the model will be required by the
                       calling code.  Only those attributes which
@@ -795,8 +1093,10 @@ class API(object):
                       represented as lists, there is no need to use
                       square brackets.)
 
-        Note: if no matching reservation can be found, a KeyError will
-        be raised.
+        Note: either provide ``id`` or both ``service`` and
+        ``req_id``.  If an invalid combination of arguments is
+        provided, a TypeError will be raised.  If no matching
+        reservation can be found, a KeyError will be raised.
 
         :returns: An instance of ``boson.db.models.Reservation``.
         """
@@ -804,12 +1104,91 @@ class API(object):
         pass  # Pragma: nocover
 
     @abc.abstractmethod
-    def expire_reservations(self, context):
+    def commit_reservation(self, context, reservation, lock=True,
+                           ledger=False):
+        """
+        Commit a reservation.  The delta of each reserved item is
+        applied to the amount used in the corresponding usage record,
+        positive deltas are released from the amount reserved, and the
+        reservation is marked finished.  Raises a ``KeyError`` if the
+        reservation is already finished.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservation: The reservation to commit.  Can be either
+                            a ``Reservation`` object or a UUID of an
+                            existing reservation.
+        :param lock: If ``True`` (the default), the usage records are
+                     locked against concurrent updates until the end
+                     of the current transaction.
+        :param ledger: If ``True``, the changes of the usages are
+                       appended to the usage ledger rather than made
+                       to the usage records.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def rollback_reservation(self, context, reservation, lock=True,
+                             ledger=False):
         """
-        Rolls back all expired reservations.
+        Roll back a reservation.  Positive deltas of the reserved items
+        are released from the amount reserved in the corresponding
+        usage records, and the reservation is marked finished.  Raises
+        a ``KeyError`` if the reservation is already finished.
 
         :param context: The current context for accessing the
                         database.
+        :param reservation: The reservation to roll back.  Can be
+                            either a ``Reservation`` object or a UUID of
+                            an existing reservation.
+        :param lock: If ``True`` (the default), the usage records are
+                     locked against concurrent updates until the end
+                     of the current transaction.
+        :param ledger: If ``True``, the changes of the usages are
+                       appended to the usage ledger rather than made
+                       to the usage records.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def expire_reservations(self, context, lock=True, ledger=False,
+                            limit=None):
+        """
+        Rolls back expired reservations, oldest first.
+
+        :param context: The current context for accessing the
+                        database.
+        :param lock: If ``True`` (the default), the usage records are
+                     locked against concurrent updates until the end
+                     of the current transaction.
+        :param ledger: If ``True``, the changes of the usages are
+                       appended to the usage ledger rather than made
+                       to the usage records.
+        :param limit: The maximum number of reservations to roll back.
+                      Defaults to all of the expired reservations.
+
+        :returns: A list of the reservations rolled back, in order of
+                  expiration.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def archive_reservations(self, context, before, limit):
+        """
+        Move reservations finished before a given time, oldest first,
+        and their reserved items, to the archive tables.
+
+        :param context: The current context for accessing the
+                        database.
+        :param before: The date and time before which reservations
+                       must have been finished to be archived.
+        :param limit: The maximum number of reservations to archive.
+
+        :returns: A list of the times at which the archived
+                  reservations were finished, oldest first.
         """
 
         pass  # Pragma: nocover
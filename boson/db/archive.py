@@ -0,0 +1,154 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Archiving of finished reservations.
+
+Committed and rolled back reservations are kept, with their reserved
+items, so that retried requests find them again.  Left there, they
+would grow the ``reservations`` and ``reserved_items`` tables without
+bound.  An ``Archiver`` moves the reservations finished more than
+``reservation_archive_retention`` hours ago to the
+``reservations_archive`` and ``reserved_items_archive`` tables, in
+batches, each in a short transaction of its own.
+"""
+
+import datetime
+
+from boson.db import periodic
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import log as logging
+from boson.openstack.common import timeutils
+from boson import utils
+
+
+LOG = logging.getLogger(__name__)
+
+archive_opts = [
+    cfg.IntOpt('reservation_archive_retention',
+               default=24,
+               help='Number of hours finished reservations are kept, and '
+                    'found again by retried requests, before being '
+                    'archived'),
+    cfg.IntOpt('reservation_archive_batch',
+               default=100,
+               help='Maximum number of reservations archived in one '
+                    'transaction'),
+    cfg.IntOpt('reservation_archive_interval',
+               default=300,
+               help='Number of seconds between archivings of finished '
+                    'reservations'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(archive_opts)
+
+
+class Archiver(periodic.PeriodicTask):
+    """
+    Move the reservations finished ``reservation_archive_retention``
+    hours ago or more to the archive tables, in batches of at most
+    ``reservation_archive_batch`` reservations, each in its own
+    transaction.
+
+    Each batch is timed into the ``archive.batch`` histogram of
+    ``boson.utils.TIMERS``, and each run into ``archive.total``; the
+    number of reservations archived by each batch is recorded in
+    ``batch_sizes``.  The ``archive.lag`` histogram records how long
+    past the retention period the oldest reservation of each batch
+    was kept.
+    """
+
+    task = 'archive'
+    interval_opt = 'reservation_archive_interval'
+
+    def __init__(self, dbapi, retention=None, batch=None, interval=None):
+        """
+        Initialize an Archiver.
+
+        :param dbapi: The database API object.
+        :param retention: The number of hours finished reservations
+                          are kept before being archived.  Defaults to
+                          the ``reservation_archive_retention`` option.
+        :param batch: The maximum number of reservations archived in
+                      one transaction.  Defaults to the
+                      ``reservation_archive_batch`` option.
+        :param interval: The number of seconds between archivings run
+                         by ``start()``.  Defaults to the
+                         ``reservation_archive_interval`` option.
+        """
+
+        super(Archiver, self).__init__(dbapi, interval)
+        self._retention = retention
+        self._batch = batch
+
+        # The number of reservations archived by each batch
+        self.batch_sizes = utils.Histogram()
+
+    @property
+    def retention(self):
+        """The number of hours finished reservations are kept."""
+
+        if self._retention is None:
+            return CONF.reservation_archive_retention
+        return self._retention
+
+    @property
+    def batch(self):
+        """The maximum number of reservations archived at once."""
+
+        if self._batch is None:
+            return CONF.reservation_archive_batch
+        return self._batch
+
+    def archive(self, context):
+        """
+        Archive all the reservations finished before the retention
+        period.
+
+        :param context: The current context for accessing the
+                        database.
+
+        :returns: The number of reservations archived.
+        """
+
+        batch = self.batch
+        before = timeutils.utcnow() - datetime.timedelta(
+            hours=self.retention)
+        total = 0
+        with utils.timed('archive.total'):
+            while True:
+                with utils.timed('archive.batch'):
+                    with self.dbapi.transaction(context):
+                        finished = self.dbapi.archive_reservations(
+                            context, before, batch)
+
+                self.batch_sizes.record(len(finished))
+                if finished:
+                    lag = utils.total_seconds(before - finished[0])
+                    utils.TIMERS.record('archive.lag', max(lag, 0))
+
+                total += len(finished)
+                if len(finished) < batch:
+                    break
+
+        if total:
+            LOG.debug(_("Archived %(total)d reservations finished before "
+                        "%(before)s") % dict(total=total, before=before))
+
+        return total
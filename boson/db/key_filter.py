@@ -0,0 +1,227 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Bloom filters of the keys of database tables.
+
+The first reservation of a user looks for a usage record before
+creating it.  A ``KeyFilter`` holds a Bloom filter of the keys present
+in a table, so that lookups of keys which are certainly missing can
+be answered without a query.  The filter is rebuilt from the table in
+the background every ``key_filter_interval`` seconds, and keys created
+through the same process are added to it at once; keys created by
+other processes may thus be treated as missing until the next rebuild.
+A filter is therefore only suitable where a false negative merely
+costs an extra query, such as a creation which is ignored if the row
+exists.
+"""
+
+import hashlib
+import math
+import struct
+import threading
+import time
+
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import log as logging
+from boson import utils
+
+
+LOG = logging.getLogger(__name__)
+
+
+key_filter_opts = [
+    cfg.IntOpt('key_filter_interval',
+               default=60,
+               help='Number of seconds between rebuilds of the filters '
+                    'used to skip lookups of missing usages; 0 disables '
+                    'the filters'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(key_filter_opts)
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of strings.  Membership tests may give false
+    positives, at about the configured error rate while no more than
+    ``capacity`` keys have been added, but never false negatives.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        Initialize a BloomFilter.
+
+        :param capacity: The number of keys the filter is sized for.
+        :param error_rate: The rate of false positives at capacity.
+        """
+
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) /
+                                  math.log(2) ** 2))
+        self.hashes = max(int(round(self.size * math.log(2) / capacity)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        """Return the bit positions of a key, by double hashing."""
+
+        digest = hashlib.md5(key).digest()
+        first, second = struct.unpack('<QQ', digest)
+        return [(first + i * second) % self.size
+                for i in range(self.hashes)]
+
+    def add(self, key):
+        """Add a key to the filter."""
+
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        """Test whether a key may have been added to the filter."""
+
+        for pos in self._positions(key):
+            if not self._bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class KeyFilter(object):
+    """
+    A thread-safe ``BloomFilter`` of the keys of a table, periodically
+    rebuilt in the background.  Until first built, every key may be
+    present.
+
+    A key added while the transaction creating it is still open may be
+    missing from the table as read by a rebuild; keys added through
+    ``add()`` are therefore also added to the filters built in the
+    next two rebuilds.
+    """
+
+    def __init__(self, loader, interval=None):
+        """
+        Initialize a KeyFilter.
+
+        :param loader: A callable returning a sequence of all the keys
+                       in the table.  It is called in the background,
+                       and must thus not use the session of the caller.
+        :param interval: The number of seconds between rebuilds.
+                         Defaults to the ``key_filter_interval``
+                         option.
+        """
+
+        self._loader = loader
+        self._interval = interval
+        self._filter = None
+        self._built = 0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+        # Keys added since the last rebuild started, and before that
+        self._added = []
+        self._previous = []
+
+    @property
+    def interval(self):
+        """The number of seconds between rebuilds."""
+
+        if self._interval is None:
+            return CONF.key_filter_interval
+        return self._interval
+
+    def _start_rebuild(self):
+        """
+        Start rebuilding the filter in the background, unless it is
+        already being rebuilt.
+        """
+
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            added = self._previous + self._added
+            self._previous = self._added
+            self._added = []
+
+        utils.spawn(self._rebuild, added)
+
+    def _rebuild(self, added):
+        """
+        Rebuild the filter from the table.
+
+        :param added: The keys added through ``add()`` which may be
+                      missing from the table as read.
+        """
+
+        try:
+            keys = self._loader()
+            bloom = BloomFilter(max(2 * len(keys), 1024))
+            for key in keys:
+                bloom.add(key)
+        except Exception:
+            LOG.exception(_("Failed to rebuild a key filter"))
+            with self._lock:
+                # Retried once the interval elapses again
+                self._rebuilding = False
+                self._added = added + self._added
+                self._built = time.time()
+            return
+
+        with self._lock:
+            # Include the keys added while the table was read
+            for key in added + self._added:
+                bloom.add(key)
+            self._rebuilding = False
+            self._filter = bloom
+            self._built = time.time()
+
+    def might_contain(self, key):
+        """
+        Test whether a key may be present in the table, starting a
+        rebuild of the filter if one is due.  Returns ``False`` only if
+        the key is certainly missing; always returns ``True`` if the
+        filter is disabled or not yet built.
+
+        :param key: The key to test.
+        """
+
+        interval = self.interval
+        if interval <= 0:
+            return True
+        if self._built + interval < time.time():
+            self._start_rebuild()
+
+        bloom = self._filter
+        return bloom is None or key in bloom
+
+    def add(self, key):
+        """Record a key newly created in the table."""
+
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(key)
+            self._added.append(key)
+
+    def clear(self):
+        """Discard the filter, so that it is rebuilt on next use."""
+
+        with self._lock:
+            self._filter = None
+            self._built = 0
+            self._added = []
+            self._previous = []
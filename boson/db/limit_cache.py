@@ -0,0 +1,282 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory cache of resolved quota limits.
+
+Limits are cached per resource, keyed by the serialized
+authentication and authorization data of the quotas applicable to a
+user.  So are the lookups of quotas found missing, since most users
+have no quota of their own, and their lookups fall through to a less
+specific quota.  The database API invalidates the limits and missing
+quotas of a resource whenever one of its quotas is created, updated,
+or deleted in this process; entries also expire after
+``limit_cache_ttl`` seconds, so that changes made by other processes
+are eventually seen.  Expired entries are dropped as new ones are
+cached, and at most ``limit_cache_size`` resources and as many limits
+and missing quotas are kept, the oldest being dropped first.
+"""
+
+import collections
+import threading
+import time
+
+from boson.openstack.common import cfg
+
+
+limit_cache_opts = [
+    cfg.IntOpt('limit_cache_ttl',
+               default=60,
+               help='Number of seconds resolved quota limits and resource '
+                    'lookups are cached for; 0 disables the cache'),
+    cfg.IntOpt('limit_cache_size',
+               default=10000,
+               help='Maximum number of resource lookups, of resolved '
+                    'quota limits, and of missing quotas kept in the '
+                    'cache'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(limit_cache_opts)
+
+
+class LimitCache(object):
+    """
+    A cache of resource lookups and resolved limits.
+
+    To avoid caching a limit read from the database concurrently with
+    a change to the quotas of the resource, callers obtain the
+    ``generation()`` of the resource before reading, and pass it to
+    ``set_limit()``; the limit is then only cached if the resource
+    has not been invalidated in the meantime.  The same goes for
+    ``set_quota_missing()``.
+    """
+
+    def __init__(self, ttl=None, size=None):
+        """
+        Initialize a LimitCache.
+
+        :param ttl: The number of seconds entries are cached for.
+                    Defaults to the ``limit_cache_ttl`` option.
+        :param size: The maximum number of resources, of limits, and
+                     of missing quotas cached.  Defaults to the
+                     ``limit_cache_size`` option.
+        """
+
+        self._ttl = ttl
+        self._size = size
+
+        # The keys of the entries in the order they were cached, which
+        # since they all live as long is also the order they expire in,
+        # each with the expiry time of the entry cached; a key cached
+        # again is left behind with its earlier expiry time
+        self._resources = {}
+        self._resource_order = collections.deque()
+        self._limits = {}
+        self._limit_order = collections.deque()
+        self._missing = {}
+        self._missing_order = collections.deque()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        """The number of seconds entries are cached for."""
+
+        return CONF.limit_cache_ttl if self._ttl is None else self._ttl
+
+    @property
+    def size(self):
+        """
+        The maximum number of resources, of limits, and of missing
+        quotas cached.
+        """
+
+        return CONF.limit_cache_size if self._size is None else self._size
+
+    def _store(self, entries, order, key, entry, now):
+        """
+        Cache an entry, dropping expired entries and then the oldest
+        ones beyond ``size``.  Must be called with the lock held.
+
+        :param entries: The dictionary of entries, each a tuple
+                        starting with its expiry time.
+        :param order: The deque of the keys of ``entries`` in the order
+                      they were cached, with their expiry times.
+        """
+
+        entries[key] = entry
+        order.append((key, entry[0]))
+
+        size = self.size
+        while order:
+            oldest, expires = order[0]
+            current = entries.get(oldest)
+            if current is not None and current[0] == expires:
+                if expires >= now and len(entries) <= size:
+                    break
+                del entries[oldest]
+            order.popleft()
+
+    def get_resource(self, service, name):
+        """
+        Look up a cached resource.  Raises a ``KeyError`` if the
+        resource is not cached.
+
+        :param service: The name of the service.
+        :param name: The name of the resource.
+        """
+
+        expires, value = self._resources[(service, name)]
+        if expires < time.time():
+            raise KeyError((service, name))
+        return value
+
+    def set_resource(self, service, name, value):
+        """
+        Cache a resource.
+
+        :param service: The name of the service.
+        :param name: The name of the resource.
+        :param value: The value to cache for the resource.
+        """
+
+        ttl = self.ttl
+        if ttl <= 0:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._store(self._resources, self._resource_order,
+                        (service, name), (now + ttl, value), now)
+
+    def generation(self, resource_id):
+        """
+        Return an opaque value which changes whenever the limits of a
+        resource are invalidated.
+        """
+
+        return (self._epoch, self._generations.get(resource_id, 0))
+
+    def get_limit(self, resource_id, key):
+        """
+        Look up a cached limit.  Raises a ``KeyError`` if the limit is
+        not cached.
+
+        :param resource_id: The ID of the resource.
+        :param key: A tuple of the serialized authentication and
+                    authorization data of the applicable quotas, from
+                    most specific to least specific.
+        """
+
+        expires, generation, limit = self._limits[(resource_id, key)]
+        if expires < time.time() or generation != self.generation(
+                resource_id):
+            raise KeyError(key)
+        return limit
+
+    def set_limit(self, resource_id, key, limit, generation):
+        """
+        Cache a limit, unless the limits of the resource have been
+        invalidated since ``generation`` was obtained.
+
+        :param resource_id: The ID of the resource.
+        :param key: A tuple of the serialized authentication and
+                    authorization data of the applicable quotas, from
+                    most specific to least specific.
+        :param limit: The limit; ``None`` if unlimited.
+        :param generation: The ``generation()`` of the resource
+                           before the limit was read.
+        """
+
+        ttl = self.ttl
+        if ttl <= 0:
+            return
+
+        now = time.time()
+        with self._lock:
+            if self.generation(resource_id) == generation:
+                self._store(self._limits, self._limit_order,
+                            (resource_id, key),
+                            (now + ttl, generation, limit), now)
+
+    def quota_missing(self, resource_id, auth_key):
+        """
+        Determine whether a quota is cached as missing.
+
+        :param resource_id: The ID of the resource.
+        :param auth_key: The serialized authentication and
+                         authorization data of the quota.
+        """
+
+        entry = self._missing.get((resource_id, auth_key))
+        if entry is None:
+            return False
+        expires, generation = entry
+        return (expires >= time.time() and
+                generation == self.generation(resource_id))
+
+    def set_quota_missing(self, resource_id, auth_key, generation):
+        """
+        Cache a quota as missing, unless the limits of the resource
+        have been invalidated since ``generation`` was obtained.
+
+        :param resource_id: The ID of the resource.
+        :param auth_key: The serialized authentication and
+                         authorization data of the quota.
+        :param generation: The ``generation()`` of the resource
+                           before the quota was looked up.
+        """
+
+        ttl = self.ttl
+        if ttl <= 0:
+            return
+
+        now = time.time()
+        with self._lock:
+            if self.generation(resource_id) == generation:
+                self._store(self._missing, self._missing_order,
+                            (resource_id, auth_key), (now + ttl, generation),
+                            now)
+
+    def invalidate(self, resource_id):
+        """
+        Discard the cached limits and missing quotas of a resource.
+        They are no longer returned, and are dropped from the cache as
+        they expire.
+        """
+
+        with self._lock:
+            self._generations[resource_id] = \
+                self._generations.get(resource_id, 0) + 1
+
+    def clear(self):
+        """Discard all cached resources, limits, and missing quotas."""
+
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            self._resources.clear()
+            self._resource_order.clear()
+            self._limits.clear()
+            self._limit_order.clear()
+            self._missing.clear()
+            self._missing_order.clear()
+
+
+LIMITS = LimitCache()
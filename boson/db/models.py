@@ -19,7 +19,9 @@ import sys
 
 import metatools
 
+from boson import exceptions
 from boson.openstack.common.gettextutils import _
+from boson.openstack.common import jsonutils
 
 
 def _get_klass(klass):
@@ -66,6 +68,24 @@ class BaseRef(object):
             self._klass = _get_klass(self._klass_name)
         return self._klass
 
+    def __get__(self, model, owner):
+        """
+        Retrieve the referenced object(s) for a model instance.  The
+        result is cached on the instance.
+        """
+
+        if model is None:
+            return self
+
+        cache = model._cache
+        if cache is None:
+            cache = model._cache = {}
+        try:
+            return cache[self.field]
+        except KeyError:
+            value = cache[self.field] = self(model)
+            return value
+
 
 class Ref(BaseRef):
     """
@@ -89,6 +109,18 @@ class Ref(BaseRef):
 
         self.base_field = '%s_id' % field
 
+    def __set__(self, model, value):
+        """
+        Update the reference of a model instance, by updating the
+        corresponding ID field in the base object and saving it.
+        """
+
+        setattr(model._base_obj, self.base_field, value.id)
+        model._dbapi._save(model._context, model._base_obj)
+        if model._cache is None:
+            model._cache = {}
+        model._cache[self.field] = value
+
     def __call__(self, model):
         """
         Retrieve an instance of the appropriate model class for this
@@ -107,6 +139,13 @@ class ListRef(BaseRef):
     A reference to a list of instances of another model class.
     """
 
+    def __set__(self, model, value):
+        """
+        Prohibit setting list references.
+        """
+
+        raise AttributeError(_('cannot set %r attribute') % self.field)
+
     def __call__(self, model):
         """
         Retrieve a list of instances of the appropriate model class
@@ -120,11 +159,54 @@ class ListRef(BaseRef):
                                            self.klass)
 
 
+class Field(object):
+    """
+    A simple field of a model class.  Values are read from and written
+    through to the base object; nothing is copied into the model
+    instance.
+    """
+
+    __slots__ = ('name', 'ref')
+
+    def __init__(self, name):
+        """
+        Initialize a field.
+
+        :param name: The name of the field.
+        """
+
+        self.name = name
+
+        # Changing an ID field invalidates the corresponding reference
+        self.ref = name[:-3] if name[-3:] == '_id' else None
+
+    def __get__(self, model, owner):
+        """
+        Retrieve the value of the field from the base object.
+        """
+
+        if model is None:
+            return self
+        return getattr(model._base_obj, self.name)
+
+    def __set__(self, model, value):
+        """
+        Update the value of the field in the base object and call the
+        dbapi to save it.
+        """
+
+        setattr(model._base_obj, self.name, value)
+        model._dbapi._save(model._context, model._base_obj)
+        if self.ref and model._cache:
+            model._cache.pop(self.ref, None)
+
+
 class BaseModelMeta(metatools.MetaClass):
     """
     Metaclass for class BaseModel.  Uses the metatools package to
-    allow for inheritance of field names, and translates lists of
-    references into the dictionary needed by BaseModel.__getattr__().
+    allow for inheritance of field names, translates lists of
+    references into the dictionary needed by BaseModel.__getitem__(),
+    and installs a descriptor for each declared field and reference.
     """
 
     def __new__(mcs, name, bases, namespace):
@@ -142,6 +224,16 @@ class BaseModelMeta(metatools.MetaClass):
         namespace['_refs'] = refs
         namespace.setdefault('_fields', set())
 
+        # Install descriptors for the declared fields and references;
+        # inherited ones are found through the base classes
+        for fld in namespace['_fields']:
+            namespace.setdefault(fld, Field(fld))
+        for ref in decl_refs:
+            namespace.setdefault(ref.field, ref)
+
+        # Model instances carry no attribute dictionary
+        namespace.setdefault('__slots__', ())
+
         # Inherit _fields and _refs
         for base in mcs.iter_bases(bases):
             mcs.inherit_set(base, namespace, '_fields')
@@ -164,9 +256,15 @@ class BaseModel(object):
     both _fields and _refs are subject to inheritance behavior; that
     is, BaseModel declares the 'created_at' and 'updated_at' fields,
     which will automatically be declared for all subclasses.
+
+    Each field and reference is available as an attribute, through a
+    descriptor installed by the metaclass.  Field values are read
+    from the base object on access, and referenced objects are
+    retrieved on first access and cached.
     """
 
     __metaclass__ = BaseModelMeta
+    __slots__ = ('_context', '_dbapi', '_base_obj', '_hints', '_cache')
 
     _fields = set(['created_at', 'updated_at', 'id'])
     _refs = []
@@ -193,71 +291,37 @@ class BaseModel(object):
         self._context = context
         self._dbapi = dbapi
         self._base_obj = base_obj
-        self._values = dict((fld, getattr(base_obj, fld))
-                            for fld in self._fields)
-        self._cache = {}
         self._hints = hints
+        self._cache = None
 
     def __getitem__(self, name):
         """
         Retrieve the value of a given field (item syntax).
         """
 
-        # For simple values, return the value
-        if name in self._fields:
-            return self._values[name]
-
-        # For reference values, return the referenced object
-        elif name in self._refs:
-            if name not in self._cache:
-                self._cache[name] = self._refs[name](self)
-            return self._cache[name]
+        if name in self._fields or name in self._refs:
+            return getattr(self, name)
 
         # OK, don't know that name
         raise KeyError(name)
 
     def __getattr__(self, name):
         """
-        Retrieve the value of a given field (attribute syntax).
+        Called for attributes other than fields and references.
         """
 
-        try:
-            return self.__getitem__(name)
-        except KeyError:
-            # OK, don't know that attribute
-            raise AttributeError(_('cannot get %r attribute') % name)
+        # OK, don't know that attribute
+        raise AttributeError(_('cannot get %r attribute') % name)
 
     def __setitem__(self, name, value):
         """
         Set the value of a given field.
         """
 
-        # For simple values, update the value in the base object and
-        # call the dbapi to save it
-        if name in self._fields:
-            setattr(self._base_obj, name, value)
-            self._dbapi._save(self._context, self._base_obj)
-            self._values[name] = value
-
-            # If there's a corresponding reference, invalidate the
-            # corresponding cache entry
-            if name[-3:] == '_id':
-                self._cache.pop(name[:-3], None)
-
-            return
-
-        # For reference values, update the corresponding field in the
-        # base object and call the dbapi to save it
-        elif name in self._refs:
-            ref = self._refs[name]
-
-            # If it's a simple reference, update it
-            if isinstance(ref, Ref):
-                setattr(self._base_obj, ref.base_field, value.id)
-                self._dbapi._save(self._context, self._base_obj)
-                self._values[ref.base_field] = value.id
-                self._cache[name] = value
-                return
+        # Fields and simple references are set through their
+        # descriptors
+        if name in self._fields or isinstance(self._refs.get(name), Ref):
+            return object.__setattr__(self, name, value)
 
         # Can't set that field
         raise KeyError(name)
@@ -267,15 +331,13 @@ class BaseModel(object):
         Set the value of a given field.
         """
 
-        # Delegate internal attributes to regular setting
-        if name[0] == '_':
-            return super(BaseModel, self).__setattr__(name, value)
+        # Delegate internal attributes, fields, and references to
+        # regular setting
+        if name[0] == '_' or name in self._fields or name in self._refs:
+            return object.__setattr__(self, name, value)
 
-        try:
-            return self.__setitem__(name, value)
-        except KeyError:
-            # Don't know that attribute
-            raise AttributeError(_('cannot set %r attribute') % name)
+        # Don't know that attribute
+        raise AttributeError(_('cannot set %r attribute') % name)
 
     def __delitem__(self, name):
         """
@@ -308,7 +370,7 @@ class BaseModel(object):
             if name in self._fields:
                 # Make sure we didn't have a duplicate
                 if name in values:
-                    raise AmbiguousFieldUpdate(field=name)
+                    raise exceptions.AmbiguousFieldUpdate(field=name)
 
                 # Save the value we're going to set
                 values[name] = value
@@ -328,10 +390,11 @@ class BaseModel(object):
                 if isinstance(ref, Ref):
                     # Make sure we didn't have a duplicate
                     if ref.base_field in values:
-                        raise AmbiguousFieldUpdate(field=ref.base_field)
+                        raise exceptions.AmbiguousFieldUpdate(
+                            field=ref.base_field)
 
                     # Save the value we're going to set
-                    values[name] = value.id  # sanity-checks the value, too
+                    values[ref.base_field] = value.id  # sanity-checks too
 
                     # Mark the cache for update
                     cache[name] = value
@@ -349,8 +412,9 @@ class BaseModel(object):
         # Save it...
         self._dbapi._save(self._context, self._base_obj)
 
-        # Install the changes to the values and the cache
-        self._values.update(values)
+        # Install the changes to the cache
+        if self._cache is None:
+            self._cache = {}
         self._cache.update(cache)
 
         # Handle cache invalidations
@@ -367,6 +431,18 @@ class BaseModel(object):
         self._dbapi._delete(self._context, self._base_obj)
 
 
+def _model_to_primitive(model):
+    """
+    Convert a model object to a dictionary of its simple fields, for
+    ``jsonutils.to_primitive()``.  References are not followed.
+    """
+
+    return dict((fld, model[fld]) for fld in model._fields)
+
+
+jsonutils.register_converter(BaseModel, _model_to_primitive)
+
+
 class Service(BaseModel):
     """
     Represent a single service.
@@ -433,12 +509,17 @@ class Category(BaseModel):
         specific to least specific.  The list will always contain an
         empty set, for looking up a default quota value.
 
+    *last_seen*
+        The date and time at which the category was last declared by
+        its service.
+
     *resources*
         A list of Resource objects representing the associated
         resources.
     """
 
-    _fields = set(['service_id', 'name', 'usage_fset', 'quota_fsets'])
+    _fields = set(['service_id', 'name', 'usage_fset', 'quota_fsets',
+                   'last_seen'])
     _refs = [
         Ref('service', 'Service'),
         ListRef('resources', 'Resource'),
@@ -485,6 +566,11 @@ class Resource(BaseModel):
         resources, such as the number of files that can be injected
         into an instance.
 
+    *last_seen*
+        The date and time at which the resource was last declared by
+        its service.  Resources not declared for long enough are
+        purged; see ``boson.db.purge``.
+
     *usages*
         A list of Usage objects representing the current usage of this
         resource.
@@ -499,7 +585,7 @@ class Resource(BaseModel):
     """
 
     _fields = set(['service_id', 'category_id', 'name', 'parameters',
-                   'absolute'])
+                   'absolute', 'last_seen'])
     _refs = [
         Ref('service', 'Service'),
         Ref('category', 'Category'),
@@ -556,6 +642,10 @@ class Usage(BaseModel):
         only refreshed once, and also to mark a usage record as
         currently being refreshed.
 
+    *generation*
+        Incremented by every update of the usage record; used to
+        detect concurrent updates.
+
     *reserved_items*
         A list of ReservedItem objects representing the currently
         reserved items counted by this usage.  (Note that reserved
@@ -565,7 +655,7 @@ class Usage(BaseModel):
     """
 
     _fields = set(['resource_id', 'parameter_data', 'auth_data', 'used',
-                   'reserved', 'until_refresh', 'refresh_id'])
+                   'reserved', 'until_refresh', 'refresh_id', 'generation'])
     _refs = [
         Ref('resource', 'Resource'),
         ListRef('reserved_items', 'ReservedItem'),
@@ -620,13 +710,42 @@ class Reservation(BaseModel):
         used to ensure that service errors do not leave reserved items
         around indefinitely.
 
+    *service_id*
+        The ID of the service the reservation was made by, if known.
+
+    *service*
+        The Service object the reservation was made by, if known.
+
+    *auth_data*
+        The authentication and authorization data of the user the
+        reservation was made for, if known.
+
+    *req_id*
+        An ID provided by the service making the reservation, unique
+        for that service.  Used to find the reservation again when a
+        request is retried.
+
+    *finished_at*
+        The time at which the reservation was committed or rolled
+        back, or ``None`` while it is outstanding.  Finished
+        reservations are kept, with their reserved items, until
+        archived; see ``boson.db.archive``.
+
+    *committed*
+        ``True`` if the reservation was committed, ``False`` if it was
+        rolled back, or ``None`` while it is outstanding.
+
     *reserved_items*
         A list of ReservedItem objects representing the actual
         resource reservations.
     """
 
-    _fields = set(['expire'])
-    _refs = [ListRef('reserved_items', 'ReservedItem')]
+    _fields = set(['expire', 'service_id', 'auth_data', 'req_id',
+                   'finished_at', 'committed'])
+    _refs = [
+        Ref('service', 'Service'),
+        ListRef('reserved_items', 'ReservedItem'),
+    ]
 
 
 class ReservedItem(BaseModel):
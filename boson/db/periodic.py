@@ -0,0 +1,101 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Database maintenance jobs run periodically in the background.
+"""
+
+from boson import context as boson_context
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import log as logging
+from boson import utils
+
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+
+
+class PeriodicTask(object):
+    """
+    Base class of the jobs which ``start()`` runs every ``interval``
+    seconds in the background, with an administrative context and a
+    database session of its own, until ``stop()`` is called.  A
+    failing run is logged, and the job runs again after the interval.
+
+    Subclasses provide the job as a method taking the context, named
+    by the ``task`` class attribute, and name the option giving the
+    default interval in ``interval_opt``.
+    """
+
+    # The name of the method running the job
+    task = None
+
+    # The name of the option giving the default number of seconds
+    # between runs
+    interval_opt = None
+
+    def __init__(self, dbapi, interval=None):
+        """
+        Initialize a periodic task.
+
+        :param dbapi: The database API object.
+        :param interval: The number of seconds between runs.  Defaults
+                         to the option named by ``interval_opt``.
+        """
+
+        self.dbapi = dbapi
+        self._interval = interval
+        self._running = False
+
+    @property
+    def interval(self):
+        """The number of seconds between runs."""
+
+        if self._interval is None:
+            return CONF[self.interval_opt]
+        return self._interval
+
+    def start(self):
+        """Start running the job periodically, in the background."""
+
+        self._running = True
+        utils.spawn(self._run)
+
+    def stop(self):
+        """Stop running the job after the current run."""
+
+        self._running = False
+
+    def _run(self):
+        """Run the job every ``interval`` seconds."""
+
+        context = boson_context.get_admin_context()
+        self.dbapi.create_session(context)
+        while self._running:
+            utils.sleep(self.interval)
+            if not self._running:
+                break
+
+            try:
+                getattr(self, self.task)(context)
+            except Exception:
+                LOG.exception(_("Periodic %(task)s of %(cls)s failed") %
+                              dict(task=self.task,
+                                   cls=self.__class__.__name__))
+            finally:
+                context.session.close()
@@ -0,0 +1,164 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Purging of resources no longer declared by their services.
+
+Categories and resources have their ``last_seen`` time updated when
+their service declares them, by creating them again through the
+database API or by passing them to its ``mark_seen()``.
+Resources a service has stopped declaring keep their quotas, usages,
+and reserved items forever unless removed; a ``Purger`` deletes the
+resources unseen for ``resource_purge_age`` days, together with the
+rows depending on them, and then the categories left empty, in
+batches.
+
+Purging is disabled by default: it must only be enabled where every
+service declares its categories and resources in one of these ways,
+or resources still in use would be purged once they are old enough.
+"""
+
+import datetime
+
+from boson.db import periodic
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import log as logging
+from boson.openstack.common import timeutils
+from boson import utils
+
+
+LOG = logging.getLogger(__name__)
+
+purge_opts = [
+    cfg.IntOpt('resource_purge_age',
+               default=0,
+               help='Number of days after which resources and categories '
+                    'no longer declared by their service are purged; 0 '
+                    'disables purging.  Only enable this if services '
+                    'declare their categories and resources again when '
+                    'they start'),
+    cfg.IntOpt('resource_purge_batch',
+               default=10,
+               help='Maximum number of resources or categories purged in '
+                    'one transaction'),
+    cfg.IntOpt('resource_purge_interval',
+               default=3600,
+               help='Number of seconds between purges of resources no '
+                    'longer declared'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(purge_opts)
+
+
+class Purger(periodic.PeriodicTask):
+    """
+    Delete the resources and categories not declared by their service
+    for ``resource_purge_age`` days, in batches of at most
+    ``resource_purge_batch`` resources or categories, each in its own
+    transaction.  Purges are timed into the ``purge.total`` histogram
+    of ``boson.utils.TIMERS``.
+    """
+
+    task = 'purge'
+    interval_opt = 'resource_purge_interval'
+
+    def __init__(self, dbapi, age=None, batch=None, interval=None):
+        """
+        Initialize a Purger.
+
+        :param dbapi: The database API object.
+        :param age: The number of days after which resources are
+                    purged.  Defaults to the ``resource_purge_age``
+                    option.
+        :param batch: The maximum number of resources or categories
+                      deleted in one transaction.  Defaults to the
+                      ``resource_purge_batch`` option.
+        :param interval: The number of seconds between purges run by
+                         ``start()``.  Defaults to the
+                         ``resource_purge_interval`` option.
+        """
+
+        super(Purger, self).__init__(dbapi, interval)
+        self._age = age
+        self._batch = batch
+
+    @property
+    def age(self):
+        """The number of days after which resources are purged."""
+
+        if self._age is None:
+            return CONF.resource_purge_age
+        return self._age
+
+    @property
+    def batch(self):
+        """The maximum number of rows deleted in one transaction."""
+
+        if self._batch is None:
+            return CONF.resource_purge_batch
+        return self._batch
+
+    def _purge(self, context, func, before):
+        """
+        Call a purge method of the database API in batches, until it
+        deletes fewer rows than the batch size.
+
+        :returns: The number of rows deleted.
+        """
+
+        batch = self.batch
+        total = 0
+        while True:
+            with self.dbapi.transaction(context):
+                names = func(context, before, batch)
+
+            total += len(names)
+            if len(names) < batch:
+                return total
+
+    def purge(self, context):
+        """
+        Delete the resources and categories unseen for ``age`` days.
+        Does nothing if ``age`` is 0.
+
+        :param context: The current context for accessing the
+                        database.
+
+        :returns: A tuple of the numbers of resources and categories
+                  deleted.
+        """
+
+        age = self.age
+        if age <= 0:
+            return 0, 0
+
+        before = timeutils.utcnow() - datetime.timedelta(days=age)
+        with utils.timed('purge.total'):
+            resources = self._purge(context, self.dbapi.purge_resources,
+                                    before)
+            categories = self._purge(context, self.dbapi.purge_categories,
+                                     before)
+
+        if resources or categories:
+            LOG.info(_("Purged %(resources)d resources and %(categories)d "
+                       "categories unseen since %(before)s") %
+                     dict(resources=resources, categories=categories,
+                          before=before))
+
+        return resources, categories
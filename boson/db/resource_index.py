@@ -0,0 +1,264 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory index of resource names.
+
+Resources are named with hierarchical strings, the components of which
+are separated by '/'.  The index keeps a trie of the resource names of
+each service, so that the resources under a given prefix, or matching
+a wildcard pattern, can be found without scanning the resources table.
+"""
+
+import fnmatch
+import threading
+
+
+SEPARATOR = '/'
+
+
+def _split(name):
+    """Split a resource name or pattern into its components."""
+
+    return name.split(SEPARATOR) if name else []
+
+
+def _is_wildcard(component):
+    """Determine whether a pattern component contains wildcards."""
+
+    return '*' in component or '?' in component or '[' in component
+
+
+class _Node(object):
+    """A node of a ``ResourceTrie``."""
+
+    __slots__ = ('children', 'name', 'resource_id')
+
+    def __init__(self):
+        self.children = {}
+        self.name = None
+        self.resource_id = None
+
+
+class ResourceTrie(object):
+    """
+    A trie of resource names, mapping each name to a resource ID.
+    Each level of the trie corresponds to one component of the names.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._count = 0
+
+    def __len__(self):
+        """Return the number of names in the trie."""
+
+        return self._count
+
+    def add(self, name, resource_id):
+        """
+        Add a resource name to the trie.
+
+        :param name: The name of the resource.
+        :param resource_id: The ID of the resource.
+        """
+
+        node = self._root
+        for component in _split(name):
+            child = node.children.get(component)
+            if child is None:
+                child = node.children[component] = _Node()
+            node = child
+
+        if node.name is None:
+            self._count += 1
+        node.name = name
+        node.resource_id = resource_id
+
+    def _find(self, name):
+        """Find the node for a name or prefix, or ``None``."""
+
+        node = self._root
+        for component in _split(name):
+            node = node.children.get(component)
+            if node is None:
+                break
+        return node
+
+    def get(self, name):
+        """
+        Look up the resource ID for a name.  Raises a ``KeyError`` if
+        the name is not in the trie.
+        """
+
+        node = self._find(name)
+        if node is None or node.name is None:
+            raise KeyError(name)
+        return node.resource_id
+
+    @staticmethod
+    def _collect(node, found):
+        """Collect the names at and below a node."""
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.name is not None:
+                found[node.name] = node.resource_id
+            stack.extend(node.children.values())
+
+    @staticmethod
+    def _sorted(found):
+        """Return the resource IDs of the found names, by name."""
+
+        return [found[name] for name in sorted(found)]
+
+    def prefix(self, prefix):
+        """
+        Return the IDs of the resources named ``prefix`` or with names
+        beginning with ``prefix`` followed by '/', ordered by name.  An
+        empty prefix matches all resources.
+        """
+
+        found = {}
+        node = self._find(prefix)
+        if node is not None:
+            self._collect(node, found)
+        return self._sorted(found)
+
+    def match(self, pattern):
+        """
+        Return the IDs of the resources with names matching a pattern,
+        ordered by name.  Each component of the pattern is matched
+        against the corresponding component of the names, and may
+        contain the shell-style wildcards '*', '?', and '[...]'; a
+        component of '**' matches any number of components, including
+        none.  For example, 'network/*' matches 'network/fixed_ips'
+        but not 'network' or 'network/fixed_ips/v6', while
+        'network/**' matches all three.
+        """
+
+        found = {}
+        components = _split(pattern)
+        stack = [(self._root, 0)]
+        while stack:
+            node, idx = stack.pop()
+            if idx == len(components):
+                if node.name is not None:
+                    found[node.name] = node.resource_id
+                continue
+
+            component = components[idx]
+            if component == '**':
+                stack.append((node, idx + 1))
+                stack.extend((child, idx) for child in node.children.values())
+            elif _is_wildcard(component):
+                stack.extend((child, idx + 1)
+                             for key, child in node.children.items()
+                             if fnmatch.fnmatchcase(key, component))
+            else:
+                child = node.children.get(component)
+                if child is not None:
+                    stack.append((child, idx + 1))
+
+        return self._sorted(found)
+
+
+class ResourceIndex(object):
+    """
+    A thread-safe collection of ``ResourceTrie`` objects, one per
+    service.  The trie of a service is built from the database on
+    first use, and then kept up to date as resources are created
+    through the same process.  Resources created by other processes
+    are only seen after ``forget()``.
+    """
+
+    def __init__(self):
+        self._tries = {}
+        self._lock = threading.Lock()
+
+    def _get(self, service_id, loader):
+        """
+        Find or build the trie of a service.  Must be called with the
+        lock held.
+        """
+
+        trie = self._tries.get(service_id)
+        if trie is None:
+            trie = ResourceTrie()
+            for name, resource_id in loader():
+                trie.add(name, resource_id)
+            self._tries[service_id] = trie
+        return trie
+
+    def add(self, service_id, name, resource_id):
+        """
+        Record a newly created resource.  Nothing is done if the trie
+        of the service has not yet been built, since the resource will
+        be loaded along with the others.
+
+        :param service_id: The ID of the service.
+        :param name: The name of the resource.
+        :param resource_id: The ID of the resource.
+        """
+
+        with self._lock:
+            trie = self._tries.get(service_id)
+            if trie is not None:
+                trie.add(name, resource_id)
+
+    def forget(self, service_id=None):
+        """
+        Discard the trie of a service, or of all services, so that it
+        will be rebuilt on next use.
+        """
+
+        with self._lock:
+            if service_id is None:
+                self._tries.clear()
+            else:
+                self._tries.pop(service_id, None)
+
+    def prefix(self, service_id, prefix, loader):
+        """
+        Return the IDs of the resources of a service under a prefix;
+        see ``ResourceTrie.prefix()``.
+
+        :param service_id: The ID of the service.
+        :param prefix: The prefix of the resource names.
+        :param loader: A callable returning an iterable of ``(name,
+                       resource ID)`` tuples for all resources of the
+                       service, used to build its trie if necessary.
+        """
+
+        with self._lock:
+            return self._get(service_id, loader).prefix(prefix)
+
+    def match(self, service_id, pattern, loader):
+        """
+        Return the IDs of the resources of a service matching a
+        pattern; see ``ResourceTrie.match()``.
+
+        :param service_id: The ID of the service.
+        :param pattern: The pattern to match resource names against.
+        :param loader: A callable returning an iterable of ``(name,
+                       resource ID)`` tuples for all resources of the
+                       service, used to build its trie if necessary.
+        """
+
+        with self._lock:
+            return self._get(service_id, loader).match(pattern)
@@ -0,0 +1,118 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Coalescing of identical concurrent calls.
+
+When many callers make the same lookup at once, such as at startup or
+just after a cache has been invalidated, only the first of them need
+run it; the others wait for it to finish and share its result.
+"""
+
+import sys
+import threading
+
+try:
+    from eventlet import event as eventlet_event
+except ImportError:
+    eventlet_event = None
+
+from boson import utils
+
+
+class _GreenEvent(object):
+    """
+    An event for green threads, used when ``threading`` has not been
+    monkey-patched, since blocking on a ``threading.Event`` would
+    block every green thread of the native thread.
+    """
+
+    def __init__(self):
+        self._event = eventlet_event.Event()
+
+    def set(self):
+        self._event.send()
+
+    def wait(self):
+        self._event.wait()
+
+
+class _Flight(object):
+    """A call in progress, and its outcome."""
+
+    __slots__ = ('done', 'result', 'exc_info')
+
+    def __init__(self):
+        self.done = _GreenEvent() if utils.in_green_thread() else \
+            threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls made with the same key, so that only one
+    of them runs at a time and the others share its outcome.  Works
+    with native threads, and with eventlet green threads whether or
+    not ``threading`` has been monkey-patched; all the callers of a
+    key should however be of the same kind.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """
+        Call a function, unless a call with the same key is already in
+        progress, in which case wait for it to finish instead.  If the
+        call raises an exception, it is raised to every caller.
+
+        :param key: A hashable key identifying the call.
+        :param func: The function to call.
+        :param args: The arguments to pass to the function.
+
+        :returns: A tuple of the result of the call, and ``True`` if
+                  this caller made the call or ``False`` if it shares
+                  the result of another.
+        """
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], \
+                    flight.exc_info[2]
+            return flight.result, False
+
+        try:
+            flight.result = func(*args)
+        except Exception:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            # Later calls must not get this outcome
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+        return flight.result, True
@@ -0,0 +1,101 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Keep finished reservations until archived
+
+Revision ID: 2a7d4c9f1e38
+Revises: 8c3d5a7e2f61
+Create Date: 2012-12-13 11:04:27.518390
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2a7d4c9f1e38'
+down_revision = '8c3d5a7e2f61'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import expression
+
+
+def upgrade():
+    """
+    Record when and how reservations were finished, and create the
+    tables finished reservations are archived to.  Expired
+    reservations are now found by the same index as those due to be
+    archived.  The archived IDs are strings until revision
+    e3b8d1f5c742.
+    """
+
+    op.add_column('reservations', sa.Column('finished_at', sa.DateTime))
+    op.add_column('reservations', sa.Column('committed', sa.Boolean))
+    op.drop_index('reservations_expire_idx', 'reservations')
+    op.create_index('reservations_finished_expire_idx', 'reservations',
+                    ['finished_at', 'expire'])
+
+    op.create_table(
+        'reservations_archive',
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime),
+        sa.Column('expire', sa.DateTime, nullable=False),
+        sa.Column('service_id', sa.String(36)),
+        sa.Column('auth_data', sa.Text),
+        sa.Column('req_id', sa.String(255)),
+        sa.Column('finished_at', sa.DateTime),
+        sa.Column('committed', sa.Boolean),
+        sa.Column('archived_at', sa.DateTime, nullable=False),
+    )
+    op.create_table(
+        'reserved_items_archive',
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime),
+        sa.Column('reservation_id', sa.String(36), nullable=False),
+        sa.Column('resource_id', sa.String(36), nullable=False),
+        sa.Column('usage_id', sa.String(36), nullable=False),
+        sa.Column('delta', sa.BigInteger, nullable=False),
+        sa.Column('archived_at', sa.DateTime, nullable=False),
+    )
+    op.create_index('reserved_items_archive_reservation_idx',
+                    'reserved_items_archive', ['reservation_id'])
+
+
+def downgrade():
+    """
+    Drop the archive tables and the record of how reservations were
+    finished.  Finished reservations not yet archived are deleted, as
+    they were when finished before this revision.
+    """
+
+    op.drop_table('reserved_items_archive')
+    op.drop_table('reservations_archive')
+
+    reservations = expression.table('reservations',
+                                    expression.column('id'),
+                                    expression.column('finished_at'))
+    items = expression.table('reserved_items',
+                             expression.column('reservation_id'))
+    finished = reservations.c.finished_at != expression.null()
+    op.execute(items.delete().where(items.c.reservation_id.in_(
+        sa.select([reservations.c.id]).where(finished))))
+    op.execute(reservations.delete().where(finished))
+
+    op.drop_index('reservations_finished_expire_idx', 'reservations')
+    op.create_index('reservations_expire_idx', 'reservations', ['expire'])
+    op.drop_column('reservations', 'committed')
+    op.drop_column('reservations', 'finished_at')
@@ -0,0 +1,161 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Add unique keys
+
+Revision ID: 3a9d7c2b51e4
+Revises: 1f22e3c5ff66
+Create Date: 2012-11-19 15:02:41.220135
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a9d7c2b51e4'
+down_revision = '1f22e3c5ff66'
+
+import hashlib
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# The serialization of dictionaries and the key hash as of this
+# revision; later changes to the application's must not change the
+# hashes computed here
+_serialize_re = re.compile(r"""[/%="']""")
+_deserialize_re = re.compile(r'%([0-9A-Fa-f]{2})')
+
+
+def _serialize(value):
+    """Serialize a single value."""
+
+    if value is None:
+        return 'null'
+    elif value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif isinstance(value, (int, long)):
+        return str(value)
+    elif isinstance(value, basestring):
+        return '"%s"' % _serialize_re.sub(
+            lambda x: '%%%02X' % ord(x.group(0)), value)
+    else:
+        raise ValueError("Cannot encode value %r" % value)
+
+
+def _deserialize(value):
+    """Deserialize a single value."""
+
+    if (value[:1], value[-1:]) in [('"', '"'), ("'", "'")]:
+        return _deserialize_re.sub(lambda x: chr(int(x.group(1), 16)),
+                                   value[1:-1])
+    elif value.isdigit():
+        return int(value)
+    else:
+        try:
+            return dict(null=None, true=True, false=False)[value.lower()]
+        except KeyError:
+            raise ValueError("Cannot decode value %r" % value)
+
+
+def _dict_serialize(data):
+    """Serialize a data dictionary with consistent key ordering."""
+
+    return '/'.join('%s=%s' % (k, _serialize(v))
+                    for k, v in sorted(data.items(), key=lambda x: x[0]))
+
+
+def _dict_deserialize(data):
+    """Deserialize a data string produced by _dict_serialize()."""
+
+    result = {}
+    if not data:
+        return result
+
+    for comp in data.split('/'):
+        key, value = comp.split('=')
+        result[key] = _deserialize(value)
+
+    return result
+
+
+def _key_hash(*data):
+    """Compute a digest of the serialized form of dictionaries."""
+
+    return hashlib.sha1('\n'.join(_dict_serialize(d or {})
+                                  for d in data)).hexdigest()
+
+
+def _backfill(table, *columns):
+    """Compute the key hashes of existing rows."""
+
+    conn = op.get_bind()
+    tab = sa.sql.table(table, sa.sql.column('id'), sa.sql.column('key_hash'),
+                       *[sa.sql.column(c) for c in columns])
+    for row in conn.execute(sa.select([tab.c.id] +
+                                      [tab.c[c] for c in columns])):
+        data = [_dict_deserialize(row[c]) for c in columns]
+        conn.execute(tab.update().where(tab.c.id == row['id']).
+                     values(key_hash=_key_hash(*data)))
+
+
+def upgrade():
+    """
+    Add unique indexes on the natural keys of the services,
+    categories, resources, usages, and quotas tables.  Usages and
+    quotas are keyed on a hash of their serialized dictionaries.
+
+    Existing duplicate rows must be merged before upgrading.
+    """
+
+    op.add_column('usages', sa.Column('key_hash', sa.String(40)))
+    _backfill('usages', 'parameter_data', 'auth_data')
+    op.add_column('quotas', sa.Column('key_hash', sa.String(40)))
+    _backfill('quotas', 'auth_data')
+
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('usages', 'key_hash', nullable=False,
+                        existing_type=sa.String(40))
+        op.alter_column('quotas', 'key_hash', nullable=False,
+                        existing_type=sa.String(40))
+
+    op.create_index('services_name_idx', 'services', ['name'], unique=True)
+    op.create_index('categories_service_name_idx', 'categories',
+                    ['service_id', 'name'], unique=True)
+    op.create_index('resources_service_name_idx', 'resources',
+                    ['service_id', 'name'], unique=True)
+    op.create_index('usages_resource_key_idx', 'usages',
+                    ['resource_id', 'key_hash'], unique=True)
+    op.create_index('quotas_resource_key_idx', 'quotas',
+                    ['resource_id', 'key_hash'], unique=True)
+
+
+def downgrade():
+    """
+    Drop the unique indexes.
+    """
+
+    op.drop_index('quotas_resource_key_idx', 'quotas')
+    op.drop_index('usages_resource_key_idx', 'usages')
+    op.drop_index('resources_service_name_idx', 'resources')
+    op.drop_index('categories_service_name_idx', 'categories')
+    op.drop_index('services_name_idx', 'services')
+
+    op.drop_column('quotas', 'key_hash')
+    op.drop_column('usages', 'key_hash')
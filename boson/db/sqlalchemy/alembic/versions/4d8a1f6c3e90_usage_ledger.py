@@ -0,0 +1,60 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Add the usage ledger
+
+Revision ID: 4d8a1f6c3e90
+Revises: 9b3f6e2d4a17
+Create Date: 2012-12-06 16:45:12.092711
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d8a1f6c3e90'
+down_revision = '9b3f6e2d4a17'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    Create the usage ledger, to which changes of the amounts of usages
+    are appended in the ``ledger`` mode of ``usage_concurrency``.
+    Usage IDs are strings until revision e3b8d1f5c742.
+    """
+
+    op.create_table(
+        'usage_ledger',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'),
+                  primary_key=True, autoincrement=True),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('usage_id', sa.String(36), sa.ForeignKey('usages.id'),
+                  nullable=False),
+        sa.Column('used', sa.BigInteger, nullable=False),
+        sa.Column('reserved', sa.BigInteger, nullable=False),
+    )
+    op.create_index('usage_ledger_usage_idx', 'usage_ledger', ['usage_id'])
+
+
+def downgrade():
+    """
+    Drop the usage ledger.  Entries not yet folded into the usage
+    records are lost.
+    """
+
+    op.drop_table('usage_ledger')
@@ -0,0 +1,67 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Record the origin and request ID of reservations
+
+Revision ID: 5c1e8f0a7d32
+Revises: 3a9d7c2b51e4
+Create Date: 2012-11-26 10:41:07.532118
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c1e8f0a7d32'
+down_revision = '3a9d7c2b51e4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    Add the service, authentication data, and request ID of the
+    reservation, with a unique index on the service and request ID.
+    Existing reservations have none of these.
+    """
+
+    op.add_column('reservations', sa.Column('service_id', sa.String(36)))
+    op.add_column('reservations', sa.Column('auth_data', sa.Text))
+    op.add_column('reservations', sa.Column('req_id', sa.String(255)))
+
+    # SQLite cannot add constraints to existing tables
+    if op.get_bind().dialect.name != 'sqlite':
+        op.create_foreign_key('reservations_service_id_fkey',
+                              'reservations', 'services', ['service_id'],
+                              ['id'])
+
+    op.create_index('reservations_service_req_idx', 'reservations',
+                    ['service_id', 'req_id'], unique=True)
+
+
+def downgrade():
+    """
+    Drop the origin and request ID of reservations.
+    """
+
+    op.drop_index('reservations_service_req_idx', 'reservations')
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('reservations_service_id_fkey', 'reservations',
+                           type_='foreignkey')
+
+    op.drop_column('reservations', 'req_id')
+    op.drop_column('reservations', 'auth_data')
+    op.drop_column('reservations', 'service_id')
@@ -0,0 +1,47 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Index reservations by expiration time
+
+Revision ID: 6f2c9e4b8a15
+Revises: 4d8a1f6c3e90
+Create Date: 2012-12-10 11:08:43.517290
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6f2c9e4b8a15'
+down_revision = '4d8a1f6c3e90'
+
+from alembic import op
+
+
+def upgrade():
+    """
+    Index reservations by expiration time, so that expired
+    reservations are found without scanning the table.
+    """
+
+    op.create_index('reservations_expire_idx', 'reservations', ['expire'])
+
+
+def downgrade():
+    """
+    Drop the index of reservations by expiration time.
+    """
+
+    op.drop_index('reservations_expire_idx', 'reservations')
@@ -0,0 +1,49 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Add a generation to usage records
+
+Revision ID: 7e4b2a9c1d58
+Revises: 5c1e8f0a7d32
+Create Date: 2012-11-28 14:02:51.318204
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7e4b2a9c1d58'
+down_revision = '5c1e8f0a7d32'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    Add the generation of usage records, used to detect concurrent
+    updates.  Existing records start at generation 0.
+    """
+
+    op.add_column('usages', sa.Column('generation', sa.BigInteger,
+                                      nullable=False, server_default='0'))
+
+
+def downgrade():
+    """
+    Drop the generation of usage records.
+    """
+
+    op.drop_column('usages', 'generation')
@@ -0,0 +1,60 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Record when resources and categories were last declared
+
+Revision ID: 8c3d5a7e2f61
+Revises: 6f2c9e4b8a15
+Create Date: 2012-12-12 15:32:06.204817
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c3d5a7e2f61'
+down_revision = '6f2c9e4b8a15'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import expression
+
+
+_TABLES = ('resources', 'categories')
+
+
+def upgrade():
+    """
+    Add the time at which resources and categories were last declared
+    by their service.  Existing records are taken to have been
+    declared now, so that they are not purged before their services
+    have had the chance to declare them again.
+    """
+
+    for table in _TABLES:
+        op.add_column(table, sa.Column('last_seen', sa.DateTime))
+        op.execute(expression.table(table, expression.column('last_seen')).
+                   update().
+                   values(last_seen=sa.func.current_timestamp()))
+
+
+def downgrade():
+    """
+    Drop the time at which resources and categories were last
+    declared.
+    """
+
+    for table in _TABLES:
+        op.drop_column(table, 'last_seen')
@@ -0,0 +1,193 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Add binary UUID shadow columns
+
+Revision ID: 9b3f6e2d4a17
+Revises: 7e4b2a9c1d58
+Create Date: 2012-12-04 10:21:37.604913
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9b3f6e2d4a17'
+down_revision = '7e4b2a9c1d58'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import expression
+
+
+# The ID and foreign key columns, with whether they are nullable
+_COLUMNS = [
+    ('services', 'id', False),
+    ('categories', 'id', False),
+    ('categories', 'service_id', False),
+    ('resources', 'id', False),
+    ('resources', 'service_id', False),
+    ('resources', 'category_id', False),
+    ('usages', 'id', False),
+    ('usages', 'resource_id', False),
+    ('quotas', 'id', False),
+    ('quotas', 'resource_id', False),
+    ('reservations', 'id', False),
+    ('reservations', 'service_id', True),
+    ('reserved_items', 'id', False),
+    ('reserved_items', 'reservation_id', False),
+    ('reserved_items', 'resource_id', False),
+    ('reserved_items', 'usage_id', False),
+]
+
+# The number of rows filled in by each statement of the backfill
+_BATCH = 1000
+
+
+def _tables():
+    """Return the names of the tables, in order."""
+
+    tables = []
+    for table, _column, _nullable in _COLUMNS:
+        if table not in tables:
+            tables.append(table)
+    return tables
+
+
+def _columns(table):
+    """Return the names of the ID and foreign key columns of a table."""
+
+    return [column for tab, column, _nullable in _COLUMNS if tab == table]
+
+
+def _to_uuid(dialect, column):
+    """Return the SQL converting a string column to a binary UUID."""
+
+    if dialect == 'postgresql':
+        return '%s::uuid' % column
+    return "UNHEX(REPLACE(%s, '-', ''))" % column
+
+
+def _create_triggers(dialect):
+    """
+    Create the triggers filling in the shadow columns of the rows
+    inserted or updated.
+    """
+
+    for table in _tables():
+        if dialect == 'postgresql':
+            sets = ''.join('NEW.%s_uuid := %s; ' %
+                           (column, _to_uuid(dialect, 'NEW.' + column))
+                           for column in _columns(table))
+            op.execute('CREATE FUNCTION %(table)s_uuid() RETURNS trigger '
+                       'AS $$ BEGIN %(sets)sRETURN NEW; END $$ '
+                       'LANGUAGE plpgsql' % locals())
+            op.execute('CREATE TRIGGER %(table)s_uuid BEFORE INSERT OR '
+                       'UPDATE ON %(table)s FOR EACH ROW EXECUTE '
+                       'PROCEDURE %(table)s_uuid()' % locals())
+        else:
+            sets = ', '.join('NEW.%s_uuid = %s' %
+                             (column, _to_uuid(dialect, 'NEW.' + column))
+                             for column in _columns(table))
+            for event in ('insert', 'update'):
+                op.execute('CREATE TRIGGER %(table)s_uuid_%(event)s BEFORE '
+                           '%(event)s ON %(table)s FOR EACH ROW SET '
+                           '%(sets)s' % locals())
+
+
+def _drop_triggers(dialect):
+    """Drop the triggers filling in the shadow columns."""
+
+    for table in _tables():
+        if dialect == 'postgresql':
+            op.execute('DROP TRIGGER %(table)s_uuid ON %(table)s' % locals())
+            op.execute('DROP FUNCTION %(table)s_uuid()' % locals())
+        else:
+            for event in ('insert', 'update'):
+                op.execute('DROP TRIGGER %(table)s_uuid_%(event)s' %
+                           locals())
+
+
+def _backfill(dialect):
+    """
+    Fill in the shadow columns of the existing rows, walking each
+    table in ranges of at most ``_BATCH`` IDs.  Rows inserted or
+    updated meanwhile are filled in by the triggers.
+    """
+
+    conn = op.get_bind()
+    for table in _tables():
+        ids = expression.table(table, expression.column('id')).c.id
+        sets = ', '.join('%s_uuid = %s' % (column, _to_uuid(dialect, column))
+                         for column in _columns(table))
+        update = sa.text('UPDATE %(table)s SET %(sets)s '
+                         'WHERE id >= :first AND id <= :last' % locals())
+
+        last = ''
+        while True:
+            batch = [row[0] for row in
+                     conn.execute(sa.select([ids]).where(ids > last).
+                                  order_by(ids).limit(_BATCH))]
+            if not batch:
+                break
+            conn.execute(update, first=batch[0], last=batch[-1])
+            last = batch[-1]
+
+
+def upgrade():
+    """
+    Start storing the IDs and the foreign keys referring to them as
+    16-byte UUIDs, rather than 36-character strings: ``BINARY(16)``
+    on MySQL, and the native ``UUID`` type on PostgreSQL.  SQLite
+    keeps the strings.
+
+    Each column gets a nullable ``<column>_uuid`` shadow column, which
+    triggers keep in step with the string on every insert and update,
+    so that the service can keep running on the string columns.  The
+    existing rows are then filled in by ranges of IDs.  On MySQL,
+    which runs the upgrade outside of a transaction, each range is
+    committed as it is filled in; creating the triggers may require
+    the ``SUPER`` privilege or ``log_bin_trust_function_creators``.
+
+    Revision e3b8d1f5c742 switches over to the shadow columns and
+    drops the strings.
+    """
+
+    dialect = op.get_bind().dialect.name
+    if dialect not in ('mysql', 'postgresql'):
+        return
+
+    coltype = postgresql.UUID() if dialect == 'postgresql' else \
+        mysql.BINARY(16)
+    for table, column, _nullable in _COLUMNS:
+        op.add_column(table, sa.Column('%s_uuid' % column, coltype))
+    _create_triggers(dialect)
+    _backfill(dialect)
+
+
+def downgrade():
+    """
+    Drop the shadow columns and their triggers.
+    """
+
+    dialect = op.get_bind().dialect.name
+    if dialect not in ('mysql', 'postgresql'):
+        return
+
+    _drop_triggers(dialect)
+    for table, column, _nullable in _COLUMNS:
+        op.drop_column(table, '%s_uuid' % column)
@@ -0,0 +1,337 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Switch over to the binary UUID shadow columns
+
+Revision ID: e3b8d1f5c742
+Revises: 2a7d4c9f1e38
+Create Date: 2012-12-18 15:02:44.318270
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e3b8d1f5c742'
+down_revision = '2a7d4c9f1e38'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+from sqlalchemy.engine import reflection
+
+
+# The ID and foreign key columns with shadow columns, with whether
+# they are nullable
+_COLUMNS = [
+    ('services', 'id', False),
+    ('categories', 'id', False),
+    ('categories', 'service_id', False),
+    ('resources', 'id', False),
+    ('resources', 'service_id', False),
+    ('resources', 'category_id', False),
+    ('usages', 'id', False),
+    ('usages', 'resource_id', False),
+    ('quotas', 'id', False),
+    ('quotas', 'resource_id', False),
+    ('reservations', 'id', False),
+    ('reservations', 'service_id', True),
+    ('reserved_items', 'id', False),
+    ('reserved_items', 'reservation_id', False),
+    ('reserved_items', 'resource_id', False),
+    ('reserved_items', 'usage_id', False),
+]
+
+# The ID columns of the tables created since the shadow columns were
+# added, which nothing writes to until this revision is deployed
+_CONVERTED = [
+    ('usage_ledger', 'usage_id', False),
+    ('reservations_archive', 'id', False),
+    ('reservations_archive', 'service_id', True),
+    ('reserved_items_archive', 'id', False),
+    ('reserved_items_archive', 'reservation_id', False),
+    ('reserved_items_archive', 'resource_id', False),
+    ('reserved_items_archive', 'usage_id', False),
+]
+
+# The unique indexes on the shadowed columns
+_INDEXES = [
+    ('categories', 'categories_service_name_idx', ['service_id', 'name']),
+    ('resources', 'resources_service_name_idx', ['service_id', 'name']),
+    ('usages', 'usages_resource_key_idx', ['resource_id', 'key_hash']),
+    ('quotas', 'quotas_resource_key_idx', ['resource_id', 'key_hash']),
+    ('reservations', 'reservations_service_req_idx',
+     ['service_id', 'req_id']),
+]
+
+# Format the hexadecimal digits of a binary UUID in its string form
+_MYSQL_UUID_STR = ("LOWER(INSERT(INSERT(INSERT(INSERT(HEX(%(column)s), "
+                   "9, 0, '-'), 14, 0, '-'), 19, 0, '-'), 24, 0, '-'))")
+
+
+def _tables():
+    """Return the names of the tables with shadow columns, in order."""
+
+    tables = []
+    for table, _column, _nullable in _COLUMNS:
+        if table not in tables:
+            tables.append(table)
+    return tables
+
+
+def _columns(table):
+    """
+    Return the names of the shadowed columns of a table, with whether
+    they are nullable.
+    """
+
+    return [(column, nullable) for tab, column, nullable in _COLUMNS
+            if tab == table]
+
+
+def _indexes(table):
+    """Return the unique indexes on the shadowed columns of a table."""
+
+    return [(name, columns) for tab, name, columns in _INDEXES
+            if tab == table]
+
+
+def _uuid_type(dialect):
+    """Return the SQL type of binary UUIDs."""
+
+    return 'uuid' if dialect == 'postgresql' else 'BINARY(16)'
+
+
+def _drop_foreign_keys():
+    """
+    Drop the foreign key constraints between the tables, which were
+    created unnamed, so that their columns can be replaced.  Returns
+    the dropped constraints.
+    """
+
+    inspector = reflection.Inspector.from_engine(op.get_bind())
+    tables = set(table for table, _column, _nullable in _COLUMNS + _CONVERTED)
+    fkeys = []
+    for table in sorted(tables):
+        for fkey in inspector.get_foreign_keys(table):
+            if fkey['referred_table'] in tables:
+                op.drop_constraint(fkey['name'], table, type_='foreignkey')
+                fkeys.append((table, fkey))
+    return fkeys
+
+
+def _create_foreign_keys(fkeys):
+    """Recreate the foreign key constraints dropped."""
+
+    for table, fkey in fkeys:
+        op.create_foreign_key(fkey['name'], table, fkey['referred_table'],
+                              fkey['constrained_columns'],
+                              fkey['referred_columns'])
+
+
+def _create_triggers(dialect):
+    """
+    Create the triggers filling in the shadow columns of the rows
+    inserted or updated.
+    """
+
+    for table in _tables():
+        if dialect == 'postgresql':
+            sets = ''.join('NEW.%s_uuid := NEW.%s::uuid; ' % (column, column)
+                           for column, _nullable in _columns(table))
+            op.execute('CREATE FUNCTION %(table)s_uuid() RETURNS trigger '
+                       'AS $$ BEGIN %(sets)sRETURN NEW; END $$ '
+                       'LANGUAGE plpgsql' % locals())
+            op.execute('CREATE TRIGGER %(table)s_uuid BEFORE INSERT OR '
+                       'UPDATE ON %(table)s FOR EACH ROW EXECUTE '
+                       'PROCEDURE %(table)s_uuid()' % locals())
+        else:
+            sets = ', '.join("NEW.%s_uuid = UNHEX(REPLACE(NEW.%s, '-', ''))" %
+                             (column, column)
+                             for column, _nullable in _columns(table))
+            for event in ('insert', 'update'):
+                op.execute('CREATE TRIGGER %(table)s_uuid_%(event)s BEFORE '
+                           '%(event)s ON %(table)s FOR EACH ROW SET '
+                           '%(sets)s' % locals())
+
+
+def _drop_triggers(dialect):
+    """Drop the triggers filling in the shadow columns."""
+
+    for table in _tables():
+        if dialect == 'postgresql':
+            op.execute('DROP TRIGGER %(table)s_uuid ON %(table)s' % locals())
+            op.execute('DROP FUNCTION %(table)s_uuid()' % locals())
+        else:
+            for event in ('insert', 'update'):
+                op.execute('DROP TRIGGER %(table)s_uuid_%(event)s' %
+                           locals())
+
+
+def _switch(dialect, table):
+    """
+    Replace the string columns of a table by their shadow columns,
+    and rebuild the primary key and unique indexes on them.  On
+    MySQL, the table is altered by a single statement, so that it is
+    only rebuilt once.
+    """
+
+    uuid_type = _uuid_type(dialect)
+    null = dict((nullable, 'NULL' if nullable else 'NOT NULL')
+                for nullable in (True, False))
+    columns = _columns(table)
+    indexes = _indexes(table)
+
+    if dialect == 'mysql':
+        specs = ['DROP PRIMARY KEY']
+        specs.extend('DROP INDEX %s' % name for name, _cols in indexes)
+        specs.extend('DROP COLUMN %s' % column for column, _null in columns)
+        specs.extend('CHANGE %s_uuid %s %s %s' %
+                     (column, column, uuid_type, null[nullable])
+                     for column, nullable in columns)
+        specs.append('ADD PRIMARY KEY (id)')
+        specs.extend('ADD UNIQUE INDEX %s (%s)' % (name, ', '.join(cols))
+                     for name, cols in indexes)
+        op.execute('ALTER TABLE %s %s' % (table, ', '.join(specs)))
+        return
+
+    for name, _cols in indexes:
+        op.execute('DROP INDEX %s' % name)
+    op.execute('ALTER TABLE %s %s' % (table, ', '.join(
+        'DROP COLUMN %s' % column for column, _null in columns)))
+    for column, _nullable in columns:
+        op.execute('ALTER TABLE %(table)s RENAME COLUMN %(column)s_uuid '
+                   'TO %(column)s' % locals())
+    specs = ['ALTER COLUMN %s SET NOT NULL' % column
+             for column, nullable in columns if not nullable]
+    specs.append('ADD PRIMARY KEY (id)')
+    op.execute('ALTER TABLE %s %s' % (table, ', '.join(specs)))
+    for name, cols in indexes:
+        op.execute('CREATE UNIQUE INDEX %s ON %s (%s)' %
+                   (name, table, ', '.join(cols)))
+
+
+def _unswitch(dialect, table):
+    """
+    Restore the string columns of a table from the binary ones, which
+    become shadow columns again, and rebuild the primary key and
+    unique indexes on the strings.
+    """
+
+    uuid_type = _uuid_type(dialect)
+    columns = _columns(table)
+    indexes = _indexes(table)
+
+    if dialect == 'mysql':
+        specs = ['DROP PRIMARY KEY']
+        specs.extend('DROP INDEX %s' % name for name, _cols in indexes)
+        specs.extend('CHANGE %s %s_uuid %s NULL' % (column, column, uuid_type)
+                     for column, _nullable in columns)
+        specs.extend('ADD COLUMN %s VARCHAR(36) NULL' % column
+                     for column, _nullable in columns)
+        op.execute('ALTER TABLE %s %s' % (table, ', '.join(specs)))
+        op.execute('UPDATE %s SET %s' % (table, ', '.join(
+            '%s = %s' % (column,
+                         _MYSQL_UUID_STR % dict(column='%s_uuid' % column))
+            for column, _nullable in columns)))
+        specs = ['MODIFY %s VARCHAR(36) NOT NULL' % column
+                 for column, nullable in columns if not nullable]
+    else:
+        for name, _cols in indexes:
+            op.execute('DROP INDEX %s' % name)
+        op.execute('ALTER TABLE %(table)s DROP CONSTRAINT %(table)s_pkey' %
+                   locals())
+        for column, _nullable in columns:
+            op.execute('ALTER TABLE %(table)s RENAME COLUMN %(column)s '
+                       'TO %(column)s_uuid' % locals())
+        op.execute('ALTER TABLE %s %s' % (table, ', '.join(
+            'ALTER COLUMN %s_uuid DROP NOT NULL, ADD COLUMN %s varchar(36)' %
+            (column, column) for column, _nullable in columns)))
+        op.execute('UPDATE %s SET %s' % (table, ', '.join(
+            '%s = %s_uuid::text' % (column, column)
+            for column, _nullable in columns)))
+        specs = ['ALTER COLUMN %s SET NOT NULL' % column
+                 for column, nullable in columns if not nullable]
+
+    specs.append('ADD PRIMARY KEY (id)')
+    op.execute('ALTER TABLE %s %s' % (table, ', '.join(specs)))
+    for name, cols in indexes:
+        op.create_index(name, table, cols, unique=True)
+
+
+def upgrade():
+    """
+    Switch the IDs and the foreign keys referring to them over to the
+    binary UUID shadow columns added by revision 9b3f6e2d4a17, and
+    drop the string columns.  Deploy the service of this revision
+    along with it.
+
+    Every row has been filled in by then, so only the primary keys
+    and unique indexes are rebuilt, while the tables are locked.  The
+    tables created since the shadow columns were added are empty
+    until then, and their columns are converted in place.
+    """
+
+    dialect = op.get_bind().dialect.name
+    if dialect not in ('mysql', 'postgresql'):
+        return
+
+    fkeys = _drop_foreign_keys()
+    _drop_triggers(dialect)
+    for table in _tables():
+        _switch(dialect, table)
+    for table, column, nullable in _CONVERTED:
+        if dialect == 'postgresql':
+            op.execute('ALTER TABLE %(table)s ALTER COLUMN %(column)s '
+                       'TYPE uuid USING %(column)s::uuid' % locals())
+        else:
+            # Switch to a binary string first, so that the bytes of
+            # the UUIDs are not taken as characters
+            op.alter_column(table, column, type_=mysql.VARBINARY(36),
+                            existing_nullable=nullable)
+            op.execute("UPDATE %(table)s SET %(column)s = "
+                       "UNHEX(REPLACE(%(column)s, '-', ''))" % locals())
+            op.alter_column(table, column, type_=mysql.BINARY(16),
+                            existing_nullable=nullable)
+    _create_foreign_keys(fkeys)
+
+
+def downgrade():
+    """
+    Switch the IDs and foreign keys back to 36-character strings,
+    keeping the binary UUIDs as shadow columns.  Every row is
+    rewritten; downgrade while the service is stopped.
+    """
+
+    dialect = op.get_bind().dialect.name
+    if dialect not in ('mysql', 'postgresql'):
+        return
+
+    fkeys = _drop_foreign_keys()
+    for table, column, nullable in _CONVERTED:
+        if dialect == 'postgresql':
+            op.execute('ALTER TABLE %(table)s ALTER COLUMN %(column)s '
+                       'TYPE varchar(36) USING %(column)s::text' % locals())
+        else:
+            op.alter_column(table, column, type_=mysql.VARBINARY(36),
+                            existing_nullable=nullable)
+            op.execute(("UPDATE %(table)s SET %(column)s = " +
+                        _MYSQL_UUID_STR) % locals())
+            op.alter_column(table, column, type_=sa.String(36),
+                            existing_nullable=nullable)
+    for table in _tables():
+        _unswitch(dialect, table)
+    _create_triggers(dialect)
+    _create_foreign_keys(fkeys)
@@ -14,19 +14,302 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import contextlib
+import copy
 import datetime
 
+import sqlalchemy as sa
+from sqlalchemy.ext import compiler as sa_compiler
+from sqlalchemy import orm
+from sqlalchemy.orm import attributes as orm_attributes
+from sqlalchemy.orm import exc as orm_exc
+from sqlalchemy.orm import util as orm_util
+from sqlalchemy.sql import expression as sa_expression
+
+from boson import exceptions
 from boson import utils
-from boson.exceptions import Duplicate
 
 from boson.db import api
+from boson.db import key_filter
+from boson.db import limit_cache
+from boson.db import resource_index
+from boson.db import single_flight
+from boson.db import usage_ledger
 from boson.db.sqlalchemy import models as sa_models
+from boson.db.sqlalchemy import profiling
 from boson.db.sqlalchemy import session as db_session
+from boson.db.sqlalchemy import statements
+from boson.openstack.common.gettextutils import _
 from boson.openstack.common import log as logging
+from boson.openstack.common import timeutils
 
 
 LOG = logging.getLogger(__name__)
 
+# Resource names of each service, for find_resources()
+_RESOURCE_INDEX = resource_index.ResourceIndex()
+
+# Concurrent identical lookups of services and quotas
+_LOOKUPS = single_flight.SingleFlight()
+
+
+def _load_usage_keys():
+    """
+    Load the keys of all the rows of the usages table, for a
+    ``KeyFilter``.  Runs in the background, with a session of its own.
+    """
+
+    session = db_session.get_session()
+    try:
+        return [resource_id + key_hash for resource_id, key_hash in
+                session.query(sa_models.Usage.resource_id,
+                              sa_models.Usage.key_hash)
+                if key_hash]
+    finally:
+        session.close()
+
+
+# Keys of the existing usages, for usage_might_exist().  A usage wrongly
+# taken as missing is created, which is ignored since it exists; lookups
+# of usages always query the database.
+_USAGE_KEYS = key_filter.KeyFilter(_load_usage_keys)
+
+
+def _valid_lookup(id, *keys):
+    """
+    Determine whether a lookup was given either an ``id`` or all of
+    the other ``keys``, but not both.
+    """
+
+    if id is not None:
+        return all(k is None for k in keys)
+    return all(k is not None for k in keys)
+
+
+@contextlib.contextmanager
+def _detect_conflicts(session):
+    """
+    Translate the failure of a flush to update a usage record, whose
+    generation was changed by a concurrent transaction, into a
+    ``ConcurrentUpdate`` exception.  The session is rolled back.
+    """
+
+    try:
+        yield
+    except orm_exc.StaleDataError as exc:
+        session.rollback()
+        raise exceptions.ConcurrentUpdate(reason=exc)
+
+
+def _quotas_changed(session, resource_id):
+    """
+    Invalidate the cached limits of a resource whose quotas have
+    changed.  The limits are invalidated again when the session
+    commits, in case they were cached from the database in between.
+    """
+
+    limit_cache.LIMITS.invalidate(resource_id)
+    changed = getattr(session, 'boson_quota_changes', None)
+    if changed is None:
+        changed = session.boson_quota_changes = set()
+    changed.add(resource_id)
+
+
+def _quota_written(mapper, connection, target):
+    """Invalidate the cached limits on quota updates and deletions."""
+
+    _quotas_changed(orm.object_session(target), target.resource_id)
+
+
+def _invalidate_committed(session):
+    """Invalidate the cached limits changed by a committed session."""
+
+    changed = getattr(session, 'boson_quota_changes', None)
+    if changed:
+        for resource_id in changed:
+            limit_cache.LIMITS.invalidate(resource_id)
+        changed.clear()
+
+
+def _forget_rolled_back(session):
+    """Forget the quota changes of a rolled back session."""
+
+    changed = getattr(session, 'boson_quota_changes', None)
+    if changed:
+        changed.clear()
+
+
+def _mark_written(session, *args):
+    """Record that the current transaction of a session has written."""
+
+    session.boson_written = True
+
+
+def _clear_written(session):
+    """Forget the writes of a session's finished transaction."""
+
+    session.boson_written = False
+
+
+def _mark_seen(session, model, ids, now):
+    """
+    Set the ``last_seen`` of the categories or resources with the
+    given IDs to now.
+    """
+
+    # Being declared again is not a modification; in particular,
+    # resolution plans are rebuilt when their category is modified
+    session.query(model).\
+        filter(model.id.in_(ids)).\
+        update(dict(last_seen=now, updated_at=model.__table__.c.updated_at),
+               synchronize_session=False)
+    _mark_written(session)
+
+
+def _ledger_appended(session, entries):
+    """
+    Record ledger entries appended in the current transaction of a
+    session, to be added to the running totals once it commits.
+    """
+
+    appended = getattr(session, 'boson_ledger', None)
+    if appended is None:
+        appended = session.boson_ledger = []
+    appended.extend(entries)
+
+
+def _ledger_committing(session):
+    """Record that the ledger entries of a session are being committed."""
+
+    appended = getattr(session, 'boson_ledger', None)
+    if appended:
+        usage_ledger.TOTALS.committing(appended)
+        session.boson_ledger_committing = True
+
+
+def _ledger_finished(session, success):
+    """Apply or discard the ledger entries of a finished transaction."""
+
+    appended = getattr(session, 'boson_ledger', None)
+    if not appended:
+        return
+
+    if getattr(session, 'boson_ledger_committing', False):
+        usage_ledger.TOTALS.committed(appended, success)
+        session.boson_ledger_committing = False
+    session.boson_ledger = []
+
+
+def _ledger_committed(session):
+    """Add the ledger entries of a committed session to the totals."""
+
+    _ledger_finished(session, True)
+
+
+def _ledger_rolled_back(session):
+    """Discard the ledger entries of a rolled back session."""
+
+    _ledger_finished(session, False)
+
+
+def _first_values(query):
+    """
+    Run a lookup query for ``_first()``.  Returns the first row found,
+    or ``None``, along with a copy of the values of its columns, for
+    callers sharing the lookup to build their own copy of the row from.
+    """
+
+    row = query.first()
+    if row is None:
+        return None, None
+
+    mapper = orm.object_mapper(row)
+    values = dict((prop.key, copy.deepcopy(getattr(row, prop.key)))
+                  for prop in mapper.iterate_properties
+                  if isinstance(prop, orm.ColumnProperty))
+    return row, values
+
+
+def _first(context, key, query):
+    """
+    Return the first row found by a lookup query, or ``None``.
+    Concurrent lookups with the same key share a single query; each
+    of the other callers builds its own copy of the row found from the
+    values of its columns, and merges it into its session without
+    querying again.  Sessions which have written in their current
+    transaction run the query on their own, since it must see their
+    own writes.
+
+    :param context: The current context for accessing the database.
+    :param key: A key identifying the lookup.
+    :param query: The query for the lookup.
+    """
+
+    session = context.session
+    if (getattr(session, 'boson_written', False) or session.new or
+            session.dirty or session.deleted):
+        return query.first()
+
+    (row, values), leader = _LOOKUPS.do(key, _first_values, query)
+    if row is None or leader:
+        return row
+
+    # The row belongs to the session of the leader, which may change
+    # it at any time; only the values read when it was loaded are used
+    model = type(row)
+    copied = orm.class_mapper(model).class_manager.new_instance()
+    for name, value in values.items():
+        orm_attributes.set_committed_value(copied, name,
+                                           copy.deepcopy(value))
+    orm_attributes.instance_state(copied).key = \
+        orm_util.identity_key(model, values['id'])
+    return session.merge(copied, load=False)
+
+
+sa.event.listen(sa_models.Quota, 'after_update', _quota_written)
+sa.event.listen(sa_models.Quota, 'after_delete', _quota_written)
+sa.event.listen(orm.Session, 'after_commit', _invalidate_committed)
+sa.event.listen(orm.Session, 'after_rollback', _forget_rolled_back)
+sa.event.listen(orm.Session, 'after_flush', _mark_written)
+sa.event.listen(orm.Session, 'after_commit', _clear_written)
+sa.event.listen(orm.Session, 'after_rollback', _clear_written)
+sa.event.listen(orm.Session, 'before_commit', _ledger_committing)
+sa.event.listen(orm.Session, 'after_commit', _ledger_committed)
+sa.event.listen(orm.Session, 'after_rollback', _ledger_rolled_back)
+
+
+class _InsertOrIgnore(sa_expression.Insert):
+    """
+    An INSERT which silently does nothing if the new row would violate
+    a unique index.
+    """
+
+    pass
+
+
+@sa_compiler.compiles(_InsertOrIgnore)
+def _insert_or_ignore(insert, compiler, **kw):
+    # No portable syntax; a duplicate raises an IntegrityError
+    return compiler.visit_insert(insert, **kw)
+
+
+@sa_compiler.compiles(_InsertOrIgnore, 'sqlite')
+def _insert_or_ignore_sqlite(insert, compiler, **kw):
+    return compiler.visit_insert(insert.prefix_with('OR IGNORE'), **kw)
+
+
+@sa_compiler.compiles(_InsertOrIgnore, 'mysql')
+def _insert_or_ignore_mysql(insert, compiler, **kw):
+    return (compiler.visit_insert(insert, **kw) +
+            ' ON DUPLICATE KEY UPDATE id = id')
+
+
+@sa_compiler.compiles(_InsertOrIgnore, 'postgresql')
+def _insert_or_ignore_postgresql(insert, compiler, **kw):
+    return compiler.visit_insert(insert, **kw) + ' ON CONFLICT DO NOTHING'
+
+
+@utils.timed_methods('db')
 class API(api.API):
     def create_session(self, context):
         """
@@ -37,9 +320,9 @@ class API(api.API):
         :param context: The current context for accessing the
                         database.
         """
-        self.context = context
         session = db_session.get_session()
-        self.context.session = session
+        profiling.tag_session(session, context.request_id)
+        context.session = session
         return session
 
     def begin(self, context):
@@ -55,12 +338,15 @@ class API(api.API):
     def commit(self, context):
         """
         End a transaction, committing the changes to the database.
+        Raises a ``ConcurrentUpdate`` exception if a usage record
+        read without locking was updated concurrently, in which case
+        the transaction is rolled back.
 
         :param context: The current context for accessing the
                         database.
         """
-        self.context = context
-        self.context.session.commit()
+        with _detect_conflicts(context.session):
+            context.session.commit()
         
 
     def rollback(self, context):
@@ -70,15 +356,50 @@ class API(api.API):
         :param context: The current context for accessing the
                         database.
         """
-        self.session = context.session
-        self.session.rollback()
-        
+        context.session.rollback()
+
+    def _create(self, context, model, key, **values):
+        """
+        Insert a new row, unless it would duplicate an existing row on
+        a unique index, and return the new or existing row.  A single
+        insert-or-ignore statement is used, so concurrent creation of
+        the same object cannot produce duplicates.  An existing
+        category or resource is marked as seen, as by
+        ``mark_seen()``.
+
+        :param context: The current context for accessing the
+                        database.
+        :param model: The model class of the row.
+        :param key: A sequence of the names of the columns of the
+                    unique index.
+        :param values: The column values of the new row.
+        """
+
+        now = timeutils.utcnow()
+        values.setdefault('id', utils.generate_uuid())
+        values.setdefault('created_at', now)
+        values.setdefault('updated_at', now)
+
+        # Make sure rows the new row refers to have been written
+        context.session.flush()
+        context.session.execute(_InsertOrIgnore(model.__table__, values),
+                                mapper=model)
+        _mark_written(context.session)
+
+        query = context.session.query(model)
+        for column in key:
+            query = query.filter(getattr(model, column) == values[column])
+        row = query.one()
+
+        if row.id != values['id'] and 'last_seen' in model.__table__.c:
+            _mark_seen(context.session, model, [row.id], now)
+            orm_attributes.set_committed_value(row, 'last_seen', now)
+        return row
 
     def create_service(self, context, name, auth_fields):
         """
-        Create a new service.  Raises a Duplicate exception in the
-        event that the new service is a duplicate of an existing
-        service.
+        Create a new service.  If a service of the same name already
+        exists, it is returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -91,22 +412,9 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.Service``.
         """
-        service = context.session.query(sa_models.Service).\
-                                filter(sa_models.Service.name==name).first()
-        try:
-            if service is not None:
-                LOG.error('Error in creating new service.Service of same'
-                          'name %s already present'%name)
-                raise Duplicate(klass=service)
-        except Exception as err:
-            LOG.exception(err)
-        new_service = sa_models.Service(id=utils.generate_uuid(),
-                                        name=name,
-                                        created_at=datetime.datetime.now(),
-                                        updated_at=datetime.datetime.now(),
-                                        auth_fields=auth_fields)
-        context.session.add(new_service)
-        return new_service
+
+        return self._create(context, sa_models.Service, ('name',),
+                            name=name, auth_fields=auth_fields)
 
     def get_service(self, context, id=None, name=None, hints=None):
         """
@@ -133,32 +441,22 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.Service``.
         """
-        try:
-            if id and name is not None:
-                LOG.error('DB access error at service table.Values' 
-                          'of both id and name are not allowed')
-                raise TypeError
-            elif id and name is None:
-                LOG.error('DB access error at service table.Null values'
-                          'of both id and name are not allowed')               
-                raise TypeError
-        except Exception as err:
-            LOG.exception(err)
-        service = context.session.query(sa_models.Service)        
+
+        if not _valid_lookup(id, name):
+            raise TypeError(_("Exactly one of 'id' and 'name' must be "
+                              "provided"))
+
+        query = context.session.query(sa_models.Service)
         if id is not None:
-            service = service.filter(sa_models.Service.id==id)
-        else: 
-            service = service.filter(sa_models.Service.name==name)                    
-        service = service.first()
+            query = query.filter(sa_models.Service.id == id)
+        else:
+            query = query.filter(sa_models.Service.name == name)
+
+        service = _first(context, ('service', id, name), query)
         if service is None:
-                try:
-                    LOG.error('No matching service for %s found'%(id or name)) 
-                    raise KeyError(id or name)
-                except Exception as err:
-                    LOG.exception(err)            
-        else:    
-            return service       
-       
+            raise KeyError(id or name)
+        return service
+
     def get_services(self, context, hints=None):
         """
         Retrieve a list of all defined services.
@@ -188,9 +486,9 @@ class API(api.API):
  
     def create_category(self, context, service, name, usage_fset, quota_fsets):
         """
-        Create a new category on a service.  Raises a Duplicate
-        exception in the event that the new category is a duplicate of
-        an existing category for the service.
+        Create a new category on a service.  If a category of the same
+        name already exists for the service, it is marked as seen and
+        returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -220,28 +518,13 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.Category``.
         """
-        if isinstance(sa_models.Service, service):
-            service = service.id        
-        category = context.session.query(sa_models.Category).\
-                                filter(sa_models.Category.name==name).\
-                                filter(sa_models.Category.service_id==service).\
-                                first()
-        try:
-            if category is not None:
-                LOG.error('Error in creating new category.Category of same'
-                      'name %s for service %s is already present'%(name,service))
-                raise Duplicate(klass=category) 
-        except Exception as err:
-            LOG.exception(err)   
-        new_category = sa_models.Category(id=utils.generate_uuid(),
-                                          name=name,
-                                          created_at=datetime.datetime.now(),
-                                          updated_at=datetime.datetime.now(),
-                                          service_id=service,
-                                          usage_fset=usage_fset,
-                                          quota_fsets=quota_fsets)
-        context.session.add(new_category)
-        return new_category
+
+        if isinstance(service, sa_models.Service):
+            service = service.id
+        return self._create(context, sa_models.Category,
+                            ('service_id', 'name'), service_id=service,
+                            name=name, usage_fset=usage_fset,
+                            quota_fsets=quota_fsets)
 
     def get_category(self, context, id=None, service=None, name=None,
                      hints=None):
@@ -272,35 +555,24 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.Category``.
         """
-        try:
-            if id and name and service is not None:
-                LOG.error('DB access error at categories table.'
-                          'Values of id,service and name '
-                          'altogether is not allowed')
-                raise TypeError                    
-            elif id and name and service is None:
-                LOG.error('DB access error at categories table.'
-                          'Null values of id,service and name '
-                          'altogether is not allowed')               
-                raise TypeError
-        except Exception as err:
-            LOG.exception(err)
-        category = context.session.query(sa_models.Category)        
+
+        if isinstance(service, sa_models.Service):
+            service = service.id
+        if not _valid_lookup(id, service, name):
+            raise TypeError(_("Provide either 'id' or both 'service' and "
+                              "'name'"))
+
+        query = context.session.query(sa_models.Category)
         if id is not None:
-            category = category.filter(sa_models.Category.id==id)
-        else: 
-            category = category.filter(sa_models.Category.name==name).\
-                                    filter(sa_models.Service.id==service.id)
-        category = category.first()                                   
+            query = query.filter(sa_models.Category.id == id)
+        else:
+            query = query.filter(sa_models.Category.service_id == service).\
+                filter(sa_models.Category.name == name)
+
+        category = query.first()
         if category is None:
-            try:
-                LOG.error("No matching category found for %s"%(name or id))
-                raise KeyError(id or name)
-            except Exception as err:
-                LOG.exception(err)
-        else:    
-            return category
-        
+            raise KeyError(id or name)
+        return category
 
     def get_categories(self, context, service, hints=None):
         """
@@ -348,9 +620,9 @@ class API(api.API):
     def create_resource(self, context, service, category, name, parameters,
                         absolute=False):
         """
-        Create a new resource on a service.  Raises a Duplicate
-        exception in the event that the new resource is a duplicate of
-        an existing resource for the service.
+        Create a new resource on a service.  If a resource of the same
+        name already exists for the service, it is marked as seen and
+        returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -382,33 +654,17 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.Resource``.
         """
+
         if isinstance(service, sa_models.Service):
             service = service.id
         if isinstance(category, sa_models.Category):
             category = category.id
-        resource = context.session.query(sa_models.Resource).\
-                                filter(sa_models.Resource.name==name).\
-                                filter(sa_models.Resource.service_id==service).\
-                                filter(sa_models.Resource.category_id==category).\
-                                first()
-        try:
-            if resource is not None:
-                LOG.error('Error in creating new resource.Resource of same'
-                          'name %s for service %s and category %s is already'
-                          'present'%(name,service,category))
-                raise Duplicate(klass=resource) 
-        except Exception as err:
-            LOG.exception(err) 
-        new_resource = sa_models.Resource(id=utils.generate_uuid(),
-                                          name=name,
-                                          parameters=parameters,
-                                          created_at=datetime.datetime.now(),
-                                          updated_at=datetime.datetime.now(),
-                                          service_id=service,
-                                          category_id=category,
-                                          absolute=absolute)
-        context.session.add(new_resource)
-        return new_resource        
+        resource = self._create(context, sa_models.Resource,
+                                ('service_id', 'name'), service_id=service,
+                                category_id=category, name=name,
+                                parameters=parameters, absolute=absolute)
+        _RESOURCE_INDEX.add(service, resource.name, resource.id)
+        return resource
 
     def get_resource(self, context, id=None, service=None, name=None,
                      hints=None):
@@ -439,37 +695,24 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.Resource``.
         """
-        if isinstance(sa_models.Service,service):
-            service = service.id      
-        try:
-            if id and name and service is not None:
-                LOG.error('DB access error at resource table.Values'
-                          'of all id,name and service is not allowed ')
-                raise TypeError
-                    
-            elif id and name and service is None:
-                LOG.error('DB access error at resource table.Null values'
-                          'of all id,name and service is not allowed ')               
-                raise TypeError
-        except Exception as err:
-            LOG.exception(err)
-        resource = context.session.query(sa_models.Resource)        
+
+        if isinstance(service, sa_models.Service):
+            service = service.id
+        if not _valid_lookup(id, service, name):
+            raise TypeError(_("Provide either 'id' or both 'service' and "
+                              "'name'"))
+
+        query = context.session.query(sa_models.Resource)
         if id is not None:
-            resource = resource.filter(sa_models.Resource.id==id)
-        else: 
-            resource = resource.filter(sa_models.Resource.name==name).\
-                              filter(sa_models.Resource.service_id==service)
-        resource = resource.first()                         
+            query = query.filter(sa_models.Resource.id == id)
+        else:
+            query = query.filter(sa_models.Resource.service_id == service).\
+                filter(sa_models.Resource.name == name)
+
+        resource = query.first()
         if resource is None:
-            try:
-                LOG.error('No matching resource found for requested %s'
-                          'resource'%(name or id))
-                raise KeyError(id or name)
-            except Exception as err:
-                LOG.exception(err)
-        else:    
-            return resource
-        
+            raise KeyError(id or name)
+        return resource
 
     def get_resources(self, context, service, hints=None):
         """
@@ -516,12 +759,163 @@ class API(api.API):
             return all_resources
         pass
 
+    def find_resources(self, context, service, prefix=None, pattern=None):
+        """
+        Find the resources of a service by name, using an in-memory
+        index of the resource names.  Resource names are hierarchical,
+        with components separated by '/'.
+
+        :param context: The current context for accessing the
+                        database.
+        :param service: The ``Service`` or service ID of the service
+                        to find the resources of.
+        :param prefix: Find the resources named ``prefix`` or with
+                       names beginning with ``prefix`` followed by
+                       '/'.  An empty prefix finds all resources.
+        :param pattern: Find the resources with names matching a
+                        pattern.  Each component of the pattern may
+                        contain the shell-style wildcards '*', '?',
+                        and '[...]'; a component of '**' matches any
+                        number of components.
+
+        Note: provide exactly one of ``prefix`` and ``pattern``.  If
+        both or neither are provided, a TypeError will be raised.
+
+        :returns: A list of the IDs of the matching resources, ordered
+                  by resource name.
+        """
+
+        if (prefix is None) == (pattern is None):
+            raise TypeError(_("Provide either 'prefix' or 'pattern'"))
+        if isinstance(service, sa_models.Service):
+            service = service.id
+
+        def loader():
+            return context.session.query(sa_models.Resource.name,
+                                         sa_models.Resource.id).\
+                filter(sa_models.Resource.service_id == service)
+
+        if prefix is not None:
+            return _RESOURCE_INDEX.prefix(service, prefix, loader)
+        return _RESOURCE_INDEX.match(service, pattern, loader)
+
+    def mark_seen(self, context, categories=(), resources=()):
+        """
+        Record that categories and resources were declared by their
+        service, setting their ``last_seen`` to now.  A service
+        registering itself calls this once, with all the categories
+        and resources it declared, so that each table is updated with
+        a single statement.
+
+        :param context: The current context for accessing the
+                        database.
+        :param categories: A sequence of ``Category`` objects or UUIDs
+                           of the categories declared.
+        :param resources: A sequence of ``Resource`` objects or UUIDs
+                          of the resources declared.
+        """
+
+        now = timeutils.utcnow()
+        for model, objs in ((sa_models.Category, categories),
+                            (sa_models.Resource, resources)):
+            ids = [obj.id if isinstance(obj, model) else obj
+                   for obj in objs]
+            if ids:
+                _mark_seen(context.session, model, ids, now)
+
+    def purge_resources(self, context, before, limit):
+        """
+        Delete resources last declared before a given time, together
+        with their usages, quotas, reserved items, and usage ledger
+        entries.  Reservations left without any reserved items are
+        left to expire.
+
+        :param context: The current context for accessing the
+                        database.
+        :param before: The date and time before which resources must
+                       have been last declared to be deleted.
+        :param limit: The maximum number of resources to delete.
+
+        :returns: A list of the names of the deleted resources.
+        """
+
+        session = context.session
+        resources = session.query(sa_models.Resource.id,
+                                  sa_models.Resource.service_id,
+                                  sa_models.Resource.name).\
+            filter(sa_models.Resource.last_seen < before).\
+            order_by(sa_models.Resource.last_seen).\
+            limit(limit).\
+            all()
+        if not resources:
+            return []
+
+        ids = [id for id, _service_id, _name in resources]
+        usage_ids = sa.select([sa_models.Usage.id]).\
+            where(sa_models.Usage.resource_id.in_(ids))
+
+        # Rows referring to others are deleted first
+        for model, clause in (
+                (sa_models.ReservedItem,
+                 sa_models.ReservedItem.resource_id.in_(ids)),
+                (sa_models.LedgerEntry,
+                 sa_models.LedgerEntry.usage_id.in_(usage_ids)),
+                (sa_models.Usage, sa_models.Usage.resource_id.in_(ids)),
+                (sa_models.Quota, sa_models.Quota.resource_id.in_(ids)),
+                (sa_models.Resource, sa_models.Resource.id.in_(ids))):
+            session.execute(model.__table__.delete().where(clause))
+        _mark_written(session)
+
+        # Cached lookups of the resources, and of their usages and
+        # limits, are no longer valid
+        for service_id in set(service_id
+                              for _id, service_id, _name in resources):
+            _RESOURCE_INDEX.forget(service_id)
+        limit_cache.LIMITS.clear()
+        usage_ledger.TOTALS.clear()
+        _USAGE_KEYS.clear()
+
+        return [name for _id, _service_id, name in resources]
+
+    def purge_categories(self, context, before, limit):
+        """
+        Delete categories last declared before a given time, which no
+        longer contain any resources.
+
+        :param context: The current context for accessing the
+                        database.
+        :param before: The date and time before which categories must
+                       have been last declared to be deleted.
+        :param limit: The maximum number of categories to delete.
+
+        :returns: A list of the names of the deleted categories.
+        """
+
+        session = context.session
+        categories = session.query(sa_models.Category.id,
+                                   sa_models.Category.name).\
+            filter(sa_models.Category.last_seen < before).\
+            filter(~sa.exists().where(sa_models.Resource.category_id ==
+                                      sa_models.Category.id)).\
+            order_by(sa_models.Category.last_seen).\
+            limit(limit).\
+            all()
+        if not categories:
+            return []
+
+        session.execute(sa_models.Category.__table__.delete().where(
+            sa_models.Category.id.in_([id for id, _name in categories])))
+        _mark_written(session)
+
+        return [name for _id, name in categories]
+
     def create_usage(self, context, resource, param_data, auth_data, used=0,
                      reserved=0, until_refresh=0, refresh_id=None):
         """
-        Create a new usage for a given resource and user.  Raises a
-        Duplicate exception in the event that the new usage is a
-        duplicate of an existing usage.
+        Create a new usage for a given resource and user.  If a usage
+        with the same parameter data and authentication and
+        authorization data already exists for the resource, it is
+        returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -558,33 +952,23 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.Usage``.
         """
-        if isinstance(sa_models.Resource,resource):
+
+        if isinstance(resource, sa_models.Resource):
             resource = resource.id
-        usage = context.session.query(sa_models.Usage).\
-                              filter(sa_models.Usage.resource_id==resource).\
-                              filter(sa_models.Usage.auth_data==auth_data).\
-                              filter(sa_models.Usage.parameter_data==param_data).\
-                              first()
-        try:
-            if usage is not None:
-                LOG.error('Error in creating new usage.Usage for same'
-                          'resource %s is already present'%(resource))
-                raise Duplicate(klass=usage) 
-        except Exception as err:
-            LOG.exception(err) 
-        new_usage = sa_models.Usage(id=utils.generate_uuid(),
-                                    created_at=datetime.datetime.now(),
-                                    updated_at=datetime.datetime.now(),
-                                    parameter_data=param_data,
-                                    auth_data=auth_data,
-                                    resource_id=resource,
-                                    until_refresh=until_refresh,
-                                    refresh_id=refresh_id)
-        context.session.add(new_usage)
-        return new_usage        
+        key = sa_models.Usage.compute_key_hash(param_data, auth_data)
+        _USAGE_KEYS.add(resource + key)
+        return self._create(context, sa_models.Usage,
+                            ('resource_id', 'key_hash'),
+                            resource_id=resource,
+                            parameter_data=param_data,
+                            auth_data=auth_data,
+                            key_hash=key,
+                            used=used, reserved=reserved,
+                            until_refresh=until_refresh,
+                            refresh_id=refresh_id)
 
     def get_usage(self, context, id=None, resource=None, param_data=None,
-                  auth_data=None, hints=None):
+                  auth_data=None, hints=None, lock=False, auth_key=None):
         """
         Look up a specific usage by id or by resource, parameter data,
         and authentication and authorization data.
@@ -607,6 +991,12 @@ class API(api.API):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param lock: If ``True``, the usage record is locked against
+                     concurrent updates until the end of the current
+                     transaction.
+        :param auth_key: The serialized form of ``auth_data``, as
+                         produced by ``boson.utils.dict_serialize()``,
+                         if already known.
 
         Note: either provide ``id`` or provide all three of
         ``resource``, ``param_data``, and ``auth_data``.  If an
@@ -617,38 +1007,272 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Usage``.
         """
 
-        if isinstance(sa_models.Resource,resource):
+        if isinstance(resource, sa_models.Resource):
             resource = resource.id
-        try:  
-            if id and resource and param_data and auth_data is not None:
-                LOG.error('DB access error at usage table.Values for id,'
-                          'resource,param_data and auth_data altogether'
-                          'is not allowed')
-                raise TypeError                    
-            elif id and resource and param_data and auth_data is None:
-                LOG.error('DB access error at usage table.Null values for'
-                          'id,resource,param_data and auth_data altogether'
-                          'is not allowed')
-                raise TypeError
-        except Exception as err:
-            LOG.exception(err)
-        usage = context.session.query(sa_models.Usage)        
+        if not _valid_lookup(id, resource, param_data, auth_data):
+            raise TypeError(_("Provide either 'id' or all of 'resource', "
+                              "'param_data' and 'auth_data'"))
+
+        query = context.session.query(sa_models.Usage)
         if id is not None:
-            usage = usage.filter(sa_models.Usage.id==id)
-        else: 
-            usage = usage.filter(sa_models.Usage.resource_id==resource).\
-                        filter(sa_models.Usage.parameter_data==param_data).\
-                        filter(sa_models.Usage.auth_data==auth_data)
-        usage = usage.first()                         
+            query = query.filter(sa_models.Usage.id == id)
+        else:
+            key = self._usage_key(context, resource, param_data, auth_data,
+                                  auth_key)
+            query = query.filter(sa_models.Usage.resource_id == resource).\
+                filter(sa_models.Usage.key_hash == key)
+        if lock:
+            query = query.with_lockmode('update')
+
+        usage = query.first()
         if usage is None:
-            try:
-                LOG.error('No matching usage found for %s'
-                           %(id or resource))
-                raise KeyError(id or resource)
-            except Exception as err:
-                LOG.exception(err)
-        else:    
-            return usage
+            raise KeyError(id or resource)
+        return usage
+
+    def _usage_key(self, context, resource, param_data, auth_data,
+                   auth_key):
+        """Compute the key hash of a usage record."""
+
+        if auth_key is None:
+            return sa_models.Usage.compute_key_hash(param_data, auth_data)
+        return sa_models.digest(utils.dict_serialize(param_data), auth_key)
+
+    def usage_might_exist(self, context, resource, param_data, auth_data,
+                          auth_key=None):
+        """
+        Determine, without querying the database, whether a specific
+        usage may exist.  Returns ``False`` only if the usage is
+        certainly missing: it was neither in the table when the filter
+        of the keys of the usages was last built, nor created by this
+        process since.  Usages created by other processes may thus be
+        taken as missing until the filter is rebuilt.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: The ``Resource`` or resource ID of the
+                         resource of the usage.
+        :param param_data: Resource parameter data (a dictionary).
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param auth_key: The serialized form of ``auth_data``, as
+                         produced by ``boson.utils.dict_serialize()``,
+                         if already known.
+        """
+
+        if isinstance(resource, sa_models.Resource):
+            resource = resource.id
+        key = self._usage_key(context, resource, param_data, auth_data,
+                              auth_key)
+        return _USAGE_KEYS.might_contain(resource + key)
+
+    def get_usage_row(self, context, resource, param_data, auth_data,
+                      lock=False, auth_key=None):
+        """
+        Look up the amounts of a specific usage, with a precompiled
+        statement.  If no matching usage can be found, a KeyError will
+        be raised.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: The ``Resource`` or resource ID of the
+                         resource to look up the usage for.
+        :param param_data: Resource parameter data (a dictionary).
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param lock: If ``True``, the usage record is locked against
+                     concurrent updates until the end of the current
+                     transaction.
+        :param auth_key: The serialized form of ``auth_data``, as
+                         produced by ``boson.utils.dict_serialize()``,
+                         if already known.
+
+        :returns: A row with the ``id``, ``used``, ``reserved``, and
+                  ``generation`` of the usage.
+        """
+
+        if isinstance(resource, sa_models.Resource):
+            resource = resource.id
+        key = self._usage_key(context, resource, param_data, auth_data,
+                              auth_key)
+
+        name = 'select_usage_for_update' if lock else 'select_usage'
+        row = statements.execute(context.session.connection(), name,
+                                 dict(resource_id=resource,
+                                      key_hash=key)).first()
+        if row is None:
+            raise KeyError(resource)
+        return row
+
+    def update_reserved(self, context, usages):
+        """
+        Add to the amounts reserved of usages, with a precompiled
+        statement.  Raises a ``ConcurrentUpdate`` exception if any of
+        the usage records was updated since it was looked up.
+
+        :param context: The current context for accessing the
+                        database.
+        :param usages: A sequence of tuples of a usage row, as returned
+                       by ``get_usage_row()``, and the amount to add to
+                       its amount reserved.
+        """
+
+        if not usages:
+            return
+
+        now = timeutils.utcnow()
+        params = [dict(usage_id=row.id, old_generation=row.generation,
+                       delta=delta, now=now)
+                  for row, delta in usages]
+        session = context.session
+        connection = session.connection()
+        if connection.dialect.supports_sane_multi_rowcount:
+            matched = statements.execute(connection, 'update_reserved',
+                                         params).rowcount
+        else:
+            matched = sum(statements.execute(connection, 'update_reserved',
+                                             param).rowcount
+                          for param in params)
+        _mark_written(session)
+
+        if matched != len(params):
+            raise exceptions.ConcurrentUpdate(
+                reason=_("usage records updated since they were read"))
+
+        # Usage objects already loaded in the session are now stale
+        for row, _delta in usages:
+            usage = session.identity_map.get(
+                orm_util.identity_key(sa_models.Usage, row.id))
+            if usage is not None:
+                session.expire(usage)
+
+    def append_ledger(self, context, entries):
+        """
+        Append changes of the amounts of usages to the usage ledger,
+        with a precompiled statement executed once for all of them.
+        The changes are added to the running totals of
+        ``boson.db.usage_ledger.TOTALS`` once the current transaction
+        commits.
+
+        :param context: The current context for accessing the
+                        database.
+        :param entries: A sequence of tuples of the UUID of the usage,
+                        and the amounts to add to its amount used and
+                        amount reserved.
+        """
+
+        entries = [(usage, used, reserved)
+                   for usage, used, reserved in entries
+                   if used or reserved]
+        if not entries:
+            return
+
+        now = timeutils.utcnow()
+        self._execute_many(context, 'insert_ledger_entry', [
+            dict(created_at=now, usage_id=usage, used=used,
+                 reserved=reserved)
+            for usage, used, reserved in entries])
+        _ledger_appended(context.session, entries)
+
+    def get_usage_amounts(self, context, usage_ids):
+        """
+        Look up the amounts used and reserved of usages, including the
+        changes appended to the usage ledger and not yet folded into
+        the usage records.
+
+        :param context: The current context for accessing the
+                        database.
+        :param usage_ids: A sequence of the UUIDs of the usages.
+
+        :returns: A dictionary mapping the UUID of each usage found to
+                  a tuple of its amount used and amount reserved.
+        """
+
+        usage_ids = list(usage_ids)
+        if not usage_ids:
+            return {}
+
+        ledger = sa.select([sa_models.LedgerEntry.usage_id,
+                            sa.func.sum(sa_models.LedgerEntry.used).
+                            label('used'),
+                            sa.func.sum(sa_models.LedgerEntry.reserved).
+                            label('reserved')]).\
+            where(sa_models.LedgerEntry.usage_id.in_(usage_ids)).\
+            group_by(sa_models.LedgerEntry.usage_id).\
+            alias('ledger')
+        query = context.session.query(
+            sa_models.Usage.id,
+            sa_models.Usage.used + sa.func.coalesce(ledger.c.used, 0),
+            sa_models.Usage.reserved +
+            sa.func.coalesce(ledger.c.reserved, 0)).\
+            outerjoin(ledger, ledger.c.usage_id == sa_models.Usage.id).\
+            filter(sa_models.Usage.id.in_(usage_ids))
+
+        return dict((id, (used, reserved))
+                    for id, used, reserved in query)
+
+    def compact_ledger(self, context, limit):
+        """
+        Fold the oldest entries of the usage ledger into the usage
+        records, and delete them.  Raises a ``ConcurrentUpdate``
+        exception if any of the entries was deleted concurrently, by
+        another compaction; the transaction must then be rolled back.
+
+        :param context: The current context for accessing the
+                        database.
+        :param limit: The maximum number of entries to fold.
+
+        :returns: The number of entries folded.
+        """
+
+        session = context.session
+        entries = session.query(sa_models.LedgerEntry.id,
+                                sa_models.LedgerEntry.usage_id,
+                                sa_models.LedgerEntry.used,
+                                sa_models.LedgerEntry.reserved).\
+            order_by(sa_models.LedgerEntry.id).\
+            limit(limit).\
+            all()
+        if not entries:
+            return 0
+
+        totals = {}
+        for _id, usage_id, used, reserved in entries:
+            total = totals.setdefault(usage_id, [0, 0])
+            total[0] += used
+            total[1] += reserved
+
+        # Deleting the entries first waits for a concurrent compaction
+        # of the same entries to finish, and then finds them gone
+        connection = session.connection()
+        params = [dict(entry_id=entry[0]) for entry in entries]
+        if connection.dialect.supports_sane_multi_rowcount:
+            deleted = statements.execute(connection, 'delete_ledger_entry',
+                                         params).rowcount
+        else:
+            deleted = sum(statements.execute(connection,
+                                             'delete_ledger_entry',
+                                             param).rowcount
+                          for param in params)
+        _mark_written(session)
+        if deleted != len(entries):
+            raise exceptions.ConcurrentUpdate(
+                reason=_("usage ledger entries compacted concurrently"))
+
+        # Update the usage records in a consistent order, to avoid
+        # deadlocks
+        now = timeutils.utcnow()
+        statements.execute(connection, 'fold_ledger', [
+            dict(usage_id=usage_id, used_delta=used,
+                 reserved_delta=reserved, now=now)
+            for usage_id, (used, reserved) in sorted(totals.items())])
+
+        for usage_id in totals:
+            usage = session.identity_map.get(
+                orm_util.identity_key(sa_models.Usage, usage_id))
+            if usage is not None:
+                session.expire(usage)
+
+        return len(entries)
 
     def get_usages(self, context, resource=None, param_data=None,
                    auth_data=None, hints=None):
@@ -657,8 +1281,9 @@ class API(api.API):
 
         :param context: The current context for accessing the
                         database.
-        :param resource: A ``Service`` or service ID to filter the
-                         list of returned usages.
+        :param resource: A ``Resource``, a resource ID, or a sequence
+                         of resource IDs to filter the list of
+                         returned usages.
         :param param_data: Resource parameter data (a dictionary) to
                            filter the list of returned usages.  Should
                            be used in conjunction with the
@@ -679,13 +1304,29 @@ class API(api.API):
 
         :returns: A list of instances of ``boson.db.models.Usage``.
         """
-        pass
+
+        query = context.session.query(sa_models.Usage)
+        if isinstance(resource, sa_models.Resource):
+            resource = resource.id
+        if isinstance(resource, basestring):
+            query = query.filter(sa_models.Usage.resource_id == resource)
+        elif resource is not None:
+            resource = list(resource)
+            if not resource:
+                return []
+            query = query.filter(sa_models.Usage.resource_id.in_(resource))
+        if param_data is not None:
+            query = query.filter(sa_models.Usage.parameter_data == param_data)
+        if auth_data is not None:
+            query = query.filter(sa_models.Usage.auth_data == auth_data)
+
+        return query.all()
 
     def create_quota(self, context, resource, auth_data, limit=None):
         """
-        Create a new quota for a given resource and user.  Raises a
-        Duplicate exception in the event that the new quota is a
-        duplicate of an existing quota.
+        Create a new quota for a given resource and user.  If a quota
+        with the same authentication and authorization data already
+        exists for the resource, it is returned instead.
 
         :param context: The current context for accessing the
                         database.
@@ -701,31 +1342,19 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.Quota``.
         """
-        if isinstance(sa_models.Resource,resource):
+
+        if isinstance(resource, sa_models.Resource):
             resource = resource.id
-        quota = context.session.query(sa_models.Quota).\
-                              filter(sa_models.Quota.resource_id==resource).\
-                              filter(sa_models.Quota.auth_data==auth_data).\
-                              first()
-        try:
-            if quota is not None:
-                LOG.error('Error in creating new quota.Quota for same'
-                          'resource %s is already present'%(resource))
-                raise Duplicate(klass=quota) 
-        except Exception as err:
-            LOG.exception(err) 
-              
-        new_quota = sa_models.Quota(id=utils.generate_uuid(),
-                                    created_at=datetime.datetime.now(),
-                                    updated_at=datetime.datetime.now(),
-                                    resorce_id=resource,
-                                    auth_data=auth_data,
-                                    limit=limit)
-        context.session.add(new_quota)
-        return new_quota        
+        key = sa_models.Quota.compute_key_hash(auth_data)
+        quota = self._create(context, sa_models.Quota,
+                             ('resource_id', 'key_hash'),
+                             resource_id=resource, auth_data=auth_data,
+                             key_hash=key, limit=limit)
+        _quotas_changed(context.session, resource)
+        return quota
 
     def get_quota(self, context, id=None, resource=None, auth_data=None,
-                  hints=None):
+                  hints=None, auth_key=None):
         """
         Look up a specific quota by id or by resource and
         authentication and authorization data.
@@ -747,6 +1376,9 @@ class API(api.API):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param auth_key: The serialized form of ``auth_data``, as
+                         produced by ``boson.utils.dict_serialize()``,
+                         if already known.
 
         Note: either provide ``id`` or both ``resource`` and
         ``auth_data``.  If an invalid combination of arguments is
@@ -756,34 +1388,28 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Quota``.
         """
 
-        if isinstance(sa_models.Resource,resource):
+        if isinstance(resource, sa_models.Resource):
             resource = resource.id
-        try:       
-            if id and resource and auth_data is not None:
-                LOG.error('DB access error at quota table.Values for id,'
-                      'resource and auth_data altogether is not allowed')
-                raise TypeError                    
-            elif id and resource and auth_data is None:
-                LOG.error('DB access error at quota table.Values for id,'
-                      'resource and auth_data altogether is not allowed')
-                raise TypeError
-        except Exception as err:
-            LOG.exception(err)
-        quota = context.session.query(sa_models.Quota)        
+        if not _valid_lookup(id, resource, auth_data):
+            raise TypeError(_("Provide either 'id' or both 'resource' and "
+                              "'auth_data'"))
+
+        query = context.session.query(sa_models.Quota)
+        key = None
         if id is not None:
-            quota = quota.filter(sa_models.Quota.id==id)
-        else: 
-            quota = quota.filter(sa_models.Quota.resource_id==resource).\
-                        filter(sa_models.Quota.auth_data==auth_data)
-        quota = quota.first()                         
+            query = query.filter(sa_models.Quota.id == id)
+        else:
+            if auth_key is None:
+                key = sa_models.Quota.compute_key_hash(auth_data)
+            else:
+                key = sa_models.digest(auth_key)
+            query = query.filter(sa_models.Quota.resource_id == resource).\
+                filter(sa_models.Quota.key_hash == key)
+
+        quota = _first(context, ('quota', id, resource, key), query)
         if quota is None:
-            try:
-                LOG.error('No matching quota found for %s'%(id or resource))
-                raise KeyError(id or resource)
-            except Exception as err:
-                LOG.exception(err)
-        else:    
-            return quota
+            raise KeyError(id or resource)
+        return quota
 
     def get_quotas(self, context, resource=None, auth_data=None, hints=None):
         """
@@ -812,24 +1438,143 @@ class API(api.API):
 
         pass
 
-    def create_reservation(self, context, expire):
+    def get_usage_report(self, context, service, auth_data):
         """
-        Create a new reservation.
+        Report the usages and limits of all resources of a service for
+        a given user.  This is a read-only operation; no model objects
+        are constructed.
+
+        The usages and limits are retrieved with a single query over
+        the resources, usages, quotas, and usage ledger tables,
+        selecting only the columns reported; the most specific quota
+        is selected by the database, and the entries of the usage
+        ledger not yet folded into the usage records are added to
+        their amounts.
+
+        :param context: The current context for accessing the
+                        database.
+        :param service: The ``Service`` or service ID to report on.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary) identifying the user.
+
+        :returns: A list of ``boson.db.api.UsageReport`` tuples,
+                  ordered by resource name.  Resources without a usage
+                  record for the user are reported with no parameter
+                  data and zero usage; resources with parameters have
+                  one row per usage record.  The limit is that of the
+                  most specific applicable quota.
+        """
+
+        if isinstance(service, sa_models.Service):
+            service = service.id
+
+        # The categories determine which authentication fields select
+        # the usages and quotas of the user
+        categories = context.session.query(sa_models.Category.id,
+                                           sa_models.Category.usage_fset,
+                                           sa_models.Category.quota_fsets).\
+            filter(sa_models.Category.service_id == service).\
+            all()
+        if not categories:
+            return []
+
+        usage_match = []
+        limit_cases = []
+        for category_id, usage_fset, quota_fsets in categories:
+            in_category = sa_models.Resource.category_id == category_id
+            usage_match.append(sa.and_(
+                in_category,
+                sa_models.Usage.auth_data == utils.project(auth_data,
+                                                           usage_fset)))
+
+            # The first existing quota, in order of the field sets,
+            # supplies the limit, even if that is NULL (unlimited)
+            for fset in quota_fsets:
+                key = sa_models.Quota.compute_key_hash(
+                    utils.project(auth_data, fset))
+                quota_match = sa.and_(
+                    sa_models.Quota.resource_id == sa_models.Resource.id,
+                    sa_models.Quota.key_hash == key)
+                limit_cases.append((
+                    sa.and_(in_category, sa.exists().where(quota_match)),
+                    sa.select([sa_models.Quota.limit]).
+                    where(quota_match).
+                    as_scalar()))
+        limit = sa.case(limit_cases) if limit_cases else sa.null()
+
+        # Changes appended to the usage ledger are not yet included in
+        # the usage records
+        def ledger_sum(column):
+            return sa.func.coalesce(
+                sa.select([sa.func.sum(column)]).
+                where(sa_models.LedgerEntry.usage_id ==
+                      sa_models.Usage.id).
+                as_scalar(), 0)
+
+        query = context.session.query(
+            sa_models.Resource.name,
+            sa_models.Usage.parameter_data,
+            sa_models.Usage.used + ledger_sum(sa_models.LedgerEntry.used),
+            sa_models.Usage.reserved +
+            ledger_sum(sa_models.LedgerEntry.reserved),
+            limit).\
+            outerjoin(sa_models.Usage,
+                      sa.and_(sa_models.Usage.resource_id ==
+                              sa_models.Resource.id,
+                              sa.or_(*usage_match))).\
+            filter(sa_models.Resource.service_id == service).\
+            order_by(sa_models.Resource.name,
+                     sa_models.Usage.parameter_data)
+
+        return [api.UsageReport(name, param_data or {}, used or 0,
+                                reserved or 0, limit)
+                for name, param_data, used, reserved, limit in query]
+
+    def create_reservation(self, context, expire, service=None,
+                           auth_data=None, req_id=None, id=None):
+        """
+        Create a new reservation.  If a ``req_id`` is given and a
+        reservation with the same ``req_id`` already exists for the
+        service, it is returned instead.
 
         :param context: The current context for accessing the
                         database.
         :param expire: A date and time at which the reservation will
                        expire.
+        :param service: The service making the reservation.  Can be
+                        either a ``Service`` object or a UUID of an
+                        existing service.  Required if ``req_id`` is
+                        given.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary) of the user the reservation is
+                          made for.
+        :param req_id: An ID for the reservation provided by the
+                       service, unique for that service.
+        :param id: The ID of the new reservation.  Defaults to a newly
+                   generated UUID.
 
         :returns: An instance of ``boson.db.models.Reservation``.
         """
-        new_reservation = sa_models.Reservation(id=utils.generate_uuid(),
-                                    created_at=datetime.datetime.now(),
-                                    updated_at=datetime.datetime.now(),
-                                    expire=expire)
-        context.session.add(new_reservation)
-        return new_reservation
-        
+
+        if isinstance(service, sa_models.Service):
+            service = service.id
+        values = dict(id=id or utils.generate_uuid(), expire=expire,
+                      service_id=service, auth_data=auth_data,
+                      req_id=req_id)
+
+        # Concurrent retries of a request must not both create a
+        # reservation
+        if req_id is not None:
+            if service is None:
+                raise TypeError(_("A 'req_id' requires a 'service'"))
+            return self._create(context, sa_models.Reservation,
+                                ('service_id', 'req_id'), **values)
+
+        now = timeutils.utcnow()
+        reservation = sa_models.Reservation(created_at=now, updated_at=now,
+                                            **values)
+        context.session.add(reservation)
+        return reservation
 
     def reserve(self, context, reservation, resource, usage, delta):
         """
@@ -851,32 +1596,95 @@ class API(api.API):
 
         :returns: An instance of ``boson.db.models.ReservedItem``.
         """
-        if isinstance(sa_models.Reservation, reservation):
+        if isinstance(reservation, sa_models.Reservation):
             reservation = reservation.id
-            
-        if isinstance(sa_models.Resource, resource):
+        if isinstance(resource, sa_models.Resource):
             resource = resource.id
-            
-        if isinstance(sa_models.Usage,usage):
+        if isinstance(usage, sa_models.Usage):
             usage = usage.id
 
         new_reserved_items = sa_models.ReservedItem(id=utils.generate_uuid(),
                                     created_at=datetime.datetime.now(),
                                     updated_at=datetime.datetime.now(),
                                     reservation_id=reservation,
-                                    resorce_id=resource,
+                                    resource_id=resource,
                                     usage_id=usage,
                                     delta=delta)
         context.session.add(new_reserved_items)
         return new_reserved_items
 
-    def get_reservation(self, context, id, hints=None):
+    def insert_reservations(self, context, reservations):
+        """
+        Insert new reservations without request IDs, with a
+        precompiled statement executed once for all of them.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservations: A sequence of tuples of the ID of the new
+                             reservation, the date and time at which
+                             it will expire, the service making it (a
+                             ``Service`` object or a UUID), and the
+                             authentication and authorization data (a
+                             dictionary) of the user it is made for.
+        """
+
+        if not reservations:
+            return
+
+        now = timeutils.utcnow()
+        params = []
+        for id, expire, service, auth_data in reservations:
+            if isinstance(service, sa_models.Service):
+                service = service.id
+            params.append(dict(id=id, created_at=now, updated_at=now,
+                               expire=expire, service_id=service,
+                               auth_data=auth_data, req_id=None))
+        self._execute_many(context, 'insert_reservation', params)
+
+    def insert_reserved_items(self, context, items):
+        """
+        Reserve amounts of specific resources, with a precompiled
+        statement executed once for all of them.
+
+        :param context: The current context for accessing the
+                        database.
+        :param items: A sequence of tuples of the UUIDs of the
+                      reservation, the resource, and the usage, and
+                      the amount to reserve.
+        """
+
+        if not items:
+            return
+
+        now = timeutils.utcnow()
+        self._execute_many(context, 'insert_reserved_item', [
+            dict(id=utils.generate_uuid(), created_at=now, updated_at=now,
+                 reservation_id=reservation, resource_id=resource,
+                 usage_id=usage, delta=delta)
+            for reservation, resource, usage, delta in items])
+
+    def _execute_many(self, context, name, params):
+        """Execute a precompiled statement writing rows."""
+
+        # Make sure rows the new rows refer to have been written
+        session = context.session
+        session.flush()
+        statements.execute(session.connection(), name, params)
+        _mark_written(session)
+
+    def get_reservation(self, context, id=None, service=None, req_id=None,
+                        hints=None):
         """
-        Look up a specific reservation by id.
+        Look up a specific reservation by id, or by service and the
+        request ID provided by that service.  Finished reservations are
+        found until archived.
 
         :param context: The current context for accessing the
                         database.
         :param id: The ID of the reservation to look up.
+        :param service: The ``Service`` or service ID of the service
+                        which made the reservation.
+        :param req_id: The request ID provided by the service.
         :param hints: An optional list of hints indicating which
                       attributes of the model will be required by the
                       calling code.  Only those attributes which
@@ -888,35 +1696,232 @@ class API(api.API):
                       represented as lists, there is no need to use
                       square brackets.)
 
-        Note: if no matching reservation can be found, a KeyError will
-        be raised.
+        Note: either provide ``id`` or both ``service`` and
+        ``req_id``.  If an invalid combination of arguments is
+        provided, a TypeError will be raised.  If no matching
+        reservation can be found, a KeyError will be raised.
 
         :returns: An instance of ``boson.db.models.Reservation``.
         """
 
-        reservation = context.session.query(sa_models.Reservation)
-        
+        if isinstance(service, sa_models.Service):
+            service = service.id
+        if not _valid_lookup(id, service, req_id):
+            raise TypeError(_("Provide either 'id' or both 'service' and "
+                              "'req_id'"))
+
+        query = context.session.query(sa_models.Reservation)
         if id is not None:
-            reservation = reservation.filter(sa_models.Reservation.id==id)
-            reservation = reservation.first()
-        
-        if reservation is not None:
-            try:
-                LOG.error("No matching reservation found for %s id"%(id))
-                raise KeyError(id)
-            except Exception as err:
-                LOG.exception(err) 
+            query = query.filter(sa_models.Reservation.id == id)
+        else:
+            query = query.filter(sa_models.Reservation.service_id ==
+                                 service).\
+                filter(sa_models.Reservation.req_id == req_id)
+
+        reservation = query.first()
+        if reservation is None:
+            raise KeyError(id or req_id)
         return reservation
 
-    def expire_reservations(self, context):
+    def _finish_reservation(self, context, reservation, commit, lock,
+                            ledger):
+        """
+        Release the reserved items of a reservation from their usage
+        records, applying the deltas to the amounts used if
+        committing, and mark the reservation finished.  With
+        ``ledger``, the changes are appended to the usage ledger
+        instead.  Raises a ``KeyError`` if the reservation does not
+        exist or is already finished.
+
+        The reservation is claimed by marking it finished, with an
+        update conditional on it not being finished yet, before the
+        deltas are applied; of concurrent transactions finishing the
+        same reservation, only one applies them.
+        """
+
+        if not isinstance(reservation, sa_models.Reservation):
+            reservation = self.get_reservation(context, reservation)
+        if reservation.finished_at is not None:
+            raise KeyError(reservation.id)
+
+        # Kept, with the reserved items, until archived
+        session = context.session
+        reservations = sa_models.Reservation.__table__
+        finished_at = timeutils.utcnow()
+        result = session.execute(reservations.update().
+                                 where(reservations.c.id == reservation.id).
+                                 where(reservations.c.finished_at ==
+                                       sa.null()).
+                                 values(finished_at=finished_at,
+                                        committed=commit))
+        _mark_written(session)
+        if result.rowcount != 1:
+            raise KeyError(reservation.id)
+        orm_attributes.set_committed_value(reservation, 'finished_at',
+                                           finished_at)
+        orm_attributes.set_committed_value(reservation, 'committed',
+                                           commit)
+
+        items = reservation.reserved_items
+        if ledger:
+            self.append_ledger(context, [
+                (item.usage_id, item.delta if commit else 0,
+                 -item.delta if item.delta > 0 else 0)
+                for item in items])
+        else:
+            usage_ids = set(item.usage_id for item in items)
+            usages = {}
+            if usage_ids:
+                query = context.session.query(sa_models.Usage).\
+                    filter(sa_models.Usage.id.in_(usage_ids))
+                if lock:
+                    query = query.with_lockmode('update')
+                usages = dict((usage.id, usage) for usage in query)
+
+            for item in items:
+                usage = usages[item.usage_id]
+                if item.delta > 0:
+                    usage.reserved -= item.delta
+                if commit:
+                    usage.used += item.delta
+
+    def commit_reservation(self, context, reservation, lock=True,
+                           ledger=False):
         """
-        Rolls back all expired reservations.
+        Commit a reservation.  The delta of each reserved item is
+        applied to the amount used in the corresponding usage record,
+        positive deltas are released from the amount reserved, and the
+        reservation is marked finished.
 
         :param context: The current context for accessing the
                         database.
+        :param reservation: The reservation to commit.  Can be either
+                            a ``Reservation`` object or a UUID of an
+                            existing reservation.
+        :param lock: If ``True`` (the default), the usage records are
+                     locked against concurrent updates until the end
+                     of the current transaction.
+        :param ledger: If ``True``, the changes of the usages are
+                       appended to the usage ledger rather than made
+                       to the usage records.
         """
 
-        pass
+        self._finish_reservation(context, reservation, True, lock, ledger)
+
+    def rollback_reservation(self, context, reservation, lock=True,
+                             ledger=False):
+        """
+        Roll back a reservation.  Positive deltas of the reserved items
+        are released from the amount reserved in the corresponding
+        usage records, and the reservation is marked finished.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservation: The reservation to roll back.  Can be
+                            either a ``Reservation`` object or a UUID of
+                            an existing reservation.
+        :param lock: If ``True`` (the default), the usage records are
+                     locked against concurrent updates until the end
+                     of the current transaction.
+        :param ledger: If ``True``, the changes of the usages are
+                       appended to the usage ledger rather than made
+                       to the usage records.
+        """
+
+        self._finish_reservation(context, reservation, False, lock,
+                                 ledger)
+
+    def expire_reservations(self, context, lock=True, ledger=False,
+                            limit=None):
+        """
+        Rolls back expired reservations, oldest first.
+
+        :param context: The current context for accessing the
+                        database.
+        :param lock: If ``True`` (the default), the usage records are
+                     locked against concurrent updates until the end
+                     of the current transaction.
+        :param ledger: If ``True``, the changes of the usages are
+                       appended to the usage ledger rather than made
+                       to the usage records.
+        :param limit: The maximum number of reservations to roll back.
+                      Defaults to all of the expired reservations.
+
+        :returns: A list of the ``boson.db.models.Reservation``
+                  objects rolled back, in order of expiration.
+                  Reservations finished concurrently, between being
+                  found expired and being rolled back, are skipped.
+        """
+
+        query = context.session.query(sa_models.Reservation).\
+            filter(sa_models.Reservation.finished_at == sa.null()).\
+            filter(sa_models.Reservation.expire < timeutils.utcnow()).\
+            order_by(sa_models.Reservation.expire)
+        if limit:
+            query = query.limit(limit)
+        expired = query.all()
+
+        # Looking up the usages of a reservation flushes the updates
+        # made to those of the previous one
+        rolled_back = []
+        with _detect_conflicts(context.session):
+            for reservation in expired:
+                try:
+                    self._finish_reservation(context, reservation, False,
+                                             lock, ledger)
+                except KeyError:
+                    continue
+                rolled_back.append(reservation)
+
+        return rolled_back
+
+    def archive_reservations(self, context, before, limit):
+        """
+        Move reservations finished before a given time, oldest first,
+        and their reserved items, to the archive tables.  The
+        reservations archived are locked against concurrent archiving
+        until the end of the current transaction.
+
+        :param context: The current context for accessing the
+                        database.
+        :param before: The date and time before which reservations
+                       must have been finished to be archived.
+        :param limit: The maximum number of reservations to archive.
+
+        :returns: A list of the times at which the archived
+                  reservations were finished, oldest first.
+        """
+
+        session = context.session
+        reservations = sa_models.Reservation.__table__
+        items = sa_models.ReservedItem.__table__
+
+        rows = session.execute(
+            sa.select([reservations], for_update=True).
+            where(reservations.c.finished_at < before).
+            order_by(reservations.c.finished_at).
+            limit(limit)).fetchall()
+        if not rows:
+            return []
+
+        ids = [row['id'] for row in rows]
+        item_rows = session.execute(sa.select([items]).where(
+            items.c.reservation_id.in_(ids))).fetchall()
+
+        now = timeutils.utcnow()
+        if item_rows:
+            session.execute(
+                sa_models.ReservedItemArchive.__table__.insert(),
+                [dict(row, archived_at=now) for row in item_rows])
+        session.execute(sa_models.ReservationArchive.__table__.insert(),
+                        [dict(row, archived_at=now) for row in rows])
+        session.execute(items.delete().where(
+            items.c.reservation_id.in_(ids)))
+        session.execute(reservations.delete().where(
+            reservations.c.id.in_(ids)))
+        _mark_written(session)
+
+        return [row['finished_at'] for row in rows]
 
     def _lazy_get(self, context, base_obj, field, hints, klass):
         """
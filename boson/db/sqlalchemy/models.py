@@ -16,8 +16,12 @@
 #    under the License.
 
 import cPickle
+import hashlib
+import uuid
 
 import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext import declarative as sa_dec
 from sqlalchemy import orm
 from sqlalchemy import types as sa_types
@@ -29,6 +33,26 @@ from boson import utils
 BASE = sa_dec.declarative_base()
 
 
+def digest(*serialized):
+    """
+    Compute the digest of one or more dictionaries, given in the
+    serialized form produced by ``boson.utils.dict_serialize()``.
+    """
+
+    return hashlib.sha1('\n'.join(serialized)).hexdigest()
+
+
+def key_hash(*data):
+    """
+    Compute a digest of the serialized form of one or more
+    dictionaries.  Dictionaries are stored as text, which cannot be
+    part of a unique index on all databases, so unique keys involving
+    them use the digest instead.
+    """
+
+    return digest(*[utils.dict_serialize(d or {}) for d in data])
+
+
 class DictSerialized(sa_types.TypeDecorator):
     """
     Special SQLAlchemy type to support serializing dictionaries into
@@ -52,7 +76,7 @@ class DictSerialized(sa_types.TypeDecorator):
         """Marshal the value out of its serialized format."""
 
         if value is not None:
-            value = utils.dict_deserializer(value)
+            value = utils.dict_deserialize(value)
 
         return value
 
@@ -83,13 +107,57 @@ class PickledString(sa_types.TypeDecorator):
         return value
 
 
+class BinaryUUID(sa_types.TypeDecorator):
+    """
+    Special SQLAlchemy type to store UUIDs in 16 bytes rather than as
+    36-character strings, while still exposing them as strings: as a
+    ``BINARY(16)`` on MySQL, and with the native ``UUID`` type on
+    PostgreSQL.  Other databases store the string.
+
+    Values which are not UUIDs cannot be stored in 16 bytes, and are
+    bound as NULL, so that looking them up finds nothing.
+    """
+
+    impl = sa.String(36)
+
+    def load_dialect_impl(self, dialect):
+        """Select the column type for the dialect."""
+
+        if dialect.name == 'mysql':
+            return dialect.type_descriptor(mysql.BINARY(16))
+        elif dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID())
+        return dialect.type_descriptor(sa.String(36))
+
+    def process_bind_param(self, value, dialect):
+        """Marshal the value into its stored format."""
+
+        if value is None or dialect.name not in ('mysql', 'postgresql'):
+            return value
+
+        try:
+            value = uuid.UUID(value)
+        except ValueError:
+            return None
+
+        return value.bytes if dialect.name == 'mysql' else str(value)
+
+    def process_result_value(self, value, dialect):
+        """Marshal the value out of its stored format."""
+
+        if value is not None and dialect.name == 'mysql':
+            value = str(uuid.UUID(bytes=value))
+
+        return value
+
+
 class ModelBase(object):
     """Base class for model classes."""
 
     __table_initialized__ = False
     created_at = sa.Column(sa.DateTime, default=timeutils.utcnow)
     updated_at = sa.Column(sa.DateTime, onupdate=timeutils.utcnow)
-    id = sa.Column(sa.String(36), primary_key=True,
+    id = sa.Column(BinaryUUID, primary_key=True,
                    default=utils.generate_uuid)
 
 
@@ -97,6 +165,9 @@ class Service(BASE, ModelBase):
     """Represents a declared service."""
 
     __tablename__ = 'services'
+    __table_args__ = (
+        sa.Index('services_name_idx', 'name', unique=True),
+    )
 
     name = sa.Column(sa.String(64), nullable=False)
     auth_fields = sa.Column(PickledString)
@@ -106,12 +177,17 @@ class Category(BASE, ModelBase):
     """Represents a category of quotas for a given service."""
 
     __tablename__ = 'categories'
+    __table_args__ = (
+        sa.Index('categories_service_name_idx', 'service_id', 'name',
+                 unique=True),
+    )
 
-    service_id = sa.Column(sa.String(36), sa.ForeignKey('services.id'),
+    service_id = sa.Column(BinaryUUID, sa.ForeignKey('services.id'),
                            nullable=False)
     name = sa.Column(sa.String(64), nullable=False)
     usage_fset = sa.Column(PickledString)
     quota_fsets = sa.Column(PickledString)
+    last_seen = sa.Column(sa.DateTime, default=timeutils.utcnow)
 
     service = orm.relationship(Service, backref=orm.backref('categories'))
 
@@ -120,14 +196,19 @@ class Resource(BASE, ModelBase):
     """Represents an abstract resource for a given service."""
 
     __tablename__ = 'resources'
+    __table_args__ = (
+        sa.Index('resources_service_name_idx', 'service_id', 'name',
+                 unique=True),
+    )
 
-    service_id = sa.Column(sa.String(36), sa.ForeignKey('services.id'),
+    service_id = sa.Column(BinaryUUID, sa.ForeignKey('services.id'),
                            nullable=False)
-    category_id = sa.Column(sa.String(36), sa.ForeignKey('categories.id'),
+    category_id = sa.Column(BinaryUUID, sa.ForeignKey('categories.id'),
                             nullable=False)
     name = sa.Column(sa.String(64), nullable=False)
     parameters = sa.Column(PickledString)
     absolute = sa.Column(sa.Boolean, nullable=False)
+    last_seen = sa.Column(sa.DateTime, default=timeutils.utcnow)
 
     service = orm.relationship(Service, backref=orm.backref('resources'))
     category = orm.relationship(Category, backref=orm.backref('resources'))
@@ -137,38 +218,88 @@ class Usage(BASE, ModelBase):
     """Represents a resource usage."""
 
     __tablename__ = 'usages'
+    __table_args__ = (
+        sa.Index('usages_resource_key_idx', 'resource_id', 'key_hash',
+                 unique=True),
+    )
 
-    resource_id = sa.Column(sa.String(36), sa.ForeignKey('resources.id'),
-                         nullable=False)
+    resource_id = sa.Column(BinaryUUID, sa.ForeignKey('resources.id'),
+                            nullable=False)
     parameter_data = sa.Column(DictSerialized)
     auth_data = sa.Column(DictSerialized)
+    key_hash = sa.Column(sa.String(40), nullable=False)
     used = sa.Column(sa.BigInteger, nullable=False)
     reserved = sa.Column(sa.BigInteger, nullable=False)
     until_refresh = sa.Column(sa.Integer)
     refresh_id = sa.Column(sa.String(36))
+    generation = sa.Column(sa.BigInteger, nullable=False, default=0)
 
     resource = orm.relationship(Resource, backref=orm.backref('usages'))
 
+    # Every update is made conditional on the generation read, and
+    # increments it, so that concurrent updates of records read
+    # without locking are detected
+    __mapper_args__ = {'version_id_col': generation}
+
+    @staticmethod
+    def compute_key_hash(param_data, auth_data):
+        """Compute the ``key_hash`` of a usage."""
+
+        return key_hash(param_data, auth_data)
+
+    def _set_key_hash(self):
+        self.key_hash = self.compute_key_hash(self.parameter_data,
+                                              self.auth_data)
+
 
 class Quota(BASE, ModelBase):
     """Represents a quota."""
 
     __tablename__ = 'quotas'
+    __table_args__ = (
+        sa.Index('quotas_resource_key_idx', 'resource_id', 'key_hash',
+                 unique=True),
+    )
 
-    resource_id = sa.Column(sa.String(36), sa.ForeignKey('resources.id'),
+    resource_id = sa.Column(BinaryUUID, sa.ForeignKey('resources.id'),
                             nullable=False)
     auth_data = sa.Column(DictSerialized)
+    key_hash = sa.Column(sa.String(40), nullable=False)
     limit = sa.Column(sa.BigInteger)
 
     resource = orm.relationship(Resource, backref=orm.backref('quotas'))
 
+    @staticmethod
+    def compute_key_hash(auth_data):
+        """Compute the ``key_hash`` of a quota."""
+
+        return key_hash(auth_data)
+
+    def _set_key_hash(self):
+        self.key_hash = self.compute_key_hash(self.auth_data)
+
 
 class Reservation(BASE, ModelBase):
     """Represents a reservation of a selection of resources."""
 
     __tablename__ = 'reservations'
+    __table_args__ = (
+        sa.Index('reservations_service_req_idx', 'service_id', 'req_id',
+                 unique=True),
+        # Finds both the expired reservations not yet finished, and the
+        # finished reservations due to be archived
+        sa.Index('reservations_finished_expire_idx', 'finished_at',
+                 'expire'),
+    )
 
     expire = sa.Column(sa.DateTime, nullable=False)
+    service_id = sa.Column(BinaryUUID, sa.ForeignKey('services.id'))
+    auth_data = sa.Column(DictSerialized)
+    req_id = sa.Column(sa.String(255))
+    finished_at = sa.Column(sa.DateTime)
+    committed = sa.Column(sa.Boolean)
+
+    service = orm.relationship(Service)
 
 
 class ReservedItem(BASE, ModelBase):
@@ -176,11 +307,11 @@ class ReservedItem(BASE, ModelBase):
 
     __tablename__ = 'reserved_items'
 
-    reservation_id = sa.Column(sa.String(36), sa.ForeignKey('reservations.id'),
+    reservation_id = sa.Column(BinaryUUID, sa.ForeignKey('reservations.id'),
                                nullable=False)
-    resource_id = sa.Column(sa.String(36), sa.ForeignKey('resources.id'),
+    resource_id = sa.Column(BinaryUUID, sa.ForeignKey('resources.id'),
                             nullable=False)
-    usage_id = sa.Column(sa.String(36), sa.ForeignKey('usages.id'),
+    usage_id = sa.Column(BinaryUUID, sa.ForeignKey('usages.id'),
                          nullable=False)
     delta = sa.Column(sa.BigInteger, nullable=False)
 
@@ -189,3 +320,80 @@ class ReservedItem(BASE, ModelBase):
     resource = orm.relationship(Resource,
                                 backref=orm.backref('reserved_items'))
     usage = orm.relationship(Usage, backref=orm.backref('reserved_items'))
+
+
+class ReservationArchive(BASE):
+    """
+    Represents a finished reservation moved out of the reservations
+    table.  Archived rows are not referenced by, and do not reference,
+    any other table.
+    """
+
+    __tablename__ = 'reservations_archive'
+
+    id = sa.Column(BinaryUUID, primary_key=True)
+    created_at = sa.Column(sa.DateTime)
+    updated_at = sa.Column(sa.DateTime)
+    expire = sa.Column(sa.DateTime, nullable=False)
+    service_id = sa.Column(BinaryUUID)
+    auth_data = sa.Column(DictSerialized)
+    req_id = sa.Column(sa.String(255))
+    finished_at = sa.Column(sa.DateTime)
+    committed = sa.Column(sa.Boolean)
+    archived_at = sa.Column(sa.DateTime, nullable=False)
+
+
+class ReservedItemArchive(BASE):
+    """
+    Represents a reserved item of an archived reservation.
+    """
+
+    __tablename__ = 'reserved_items_archive'
+    __table_args__ = (
+        sa.Index('reserved_items_archive_reservation_idx',
+                 'reservation_id'),
+    )
+
+    id = sa.Column(BinaryUUID, primary_key=True)
+    created_at = sa.Column(sa.DateTime)
+    updated_at = sa.Column(sa.DateTime)
+    reservation_id = sa.Column(BinaryUUID, nullable=False)
+    resource_id = sa.Column(BinaryUUID, nullable=False)
+    usage_id = sa.Column(BinaryUUID, nullable=False)
+    delta = sa.Column(sa.BigInteger, nullable=False)
+    archived_at = sa.Column(sa.DateTime, nullable=False)
+
+
+class LedgerEntry(BASE):
+    """
+    Represents a change to the amounts of a usage, appended to the
+    usage ledger and not yet folded into the usage record.
+    """
+
+    __tablename__ = 'usage_ledger'
+    __table_args__ = (
+        sa.Index('usage_ledger_usage_idx', 'usage_id'),
+    )
+
+    # Entries are folded into the usage records in the order of their
+    # IDs; SQLite only generates IDs for INTEGER primary keys
+    id = sa.Column(sa.BigInteger().with_variant(sa.Integer(), 'sqlite'),
+                   primary_key=True, autoincrement=True)
+    created_at = sa.Column(sa.DateTime, default=timeutils.utcnow)
+    usage_id = sa.Column(BinaryUUID, sa.ForeignKey('usages.id'),
+                         nullable=False)
+    used = sa.Column(sa.BigInteger, nullable=False)
+    reserved = sa.Column(sa.BigInteger, nullable=False)
+
+    usage = orm.relationship(Usage)
+
+
+def _set_key_hash(mapper, connection, target):
+    """Keep the ``key_hash`` of a usage or quota up to date."""
+
+    target._set_key_hash()
+
+
+for _model in (Usage, Quota):
+    sa.event.listen(_model, 'before_insert', _set_key_hash)
+    sa.event.listen(_model, 'before_update', _set_key_hash)
@@ -0,0 +1,286 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+SQL statement profiling for the SQLAlchemy backend.
+
+Statements are attributed to the ``request_id`` of the context whose
+session executed them: sessions created by the database API are
+tagged with the request ID, and the tag is copied onto the connection
+whenever the session begins a transaction on it.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+import sqlalchemy
+from sqlalchemy import orm
+
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+profiling_opts = [
+    cfg.BoolOpt('sql_profiling',
+                default=False,
+                help='Count SQL statements and time spent in the database '
+                     'per request, and warn about repeated statements'),
+    cfg.IntOpt('sql_profiling_requests',
+               default=1000,
+               help='Number of recent requests to keep SQL statistics for'),
+    cfg.IntOpt('sql_repeat_threshold',
+               default=3,
+               help='Number of executions of an identical statement within '
+                    'one request at which a possible N+1 query pattern is '
+                    'reported'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(profiling_opts)
+
+_REQUEST_KEY = 'boson.request_id'
+
+
+class RequestStats(object):
+    """SQL statistics for a single request."""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.count = 0
+        self.time = 0.0
+        self.statements = {}
+
+    def record(self, statement, elapsed):
+        """
+        Record an executed statement.  Returns the number of times the
+        statement has now been executed within the request.
+        """
+
+        self.count += 1
+        self.time += elapsed
+        seen = self.statements.get(statement, 0) + 1
+        self.statements[statement] = seen
+        return seen
+
+    def repeated(self):
+        """
+        Return a dictionary mapping statements executed more than once
+        to their execution counts.
+        """
+
+        return dict((stmt, count) for stmt, count in self.statements.items()
+                    if count > 1)
+
+
+class Capture(object):
+    """The statements executed while a capture is active."""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        """The number of statements executed."""
+
+        return len(self.statements)
+
+
+class QueryProfiler(object):
+    """
+    Collect SQL statement statistics per request ID.  Listeners are
+    installed on each engine passed to ``install()``; statistics are
+    only collected while ``enabled`` is set or a capture is active.
+    """
+
+    def __init__(self, max_requests=1000, repeat_threshold=3):
+        """
+        Initialize a QueryProfiler.
+
+        :param max_requests: The number of recent requests to keep
+                             statistics for.
+        :param repeat_threshold: The number of executions of an
+                                 identical statement within one
+                                 request at which a warning is logged.
+        """
+
+        self.enabled = False
+        self.max_requests = max_requests
+        self.repeat_threshold = repeat_threshold
+        self._requests = {}
+        self._order = collections.deque()
+        self._captures = []
+        self._engines = set()
+        self._lock = threading.Lock()
+
+        # Start times are kept on the connection, under a key private
+        # to this profiler
+        self._start_key = 'boson.query_start.%x' % id(self)
+
+    def install(self, engine):
+        """Install the statement listeners on an engine."""
+
+        with self._lock:
+            if id(engine) in self._engines:
+                return
+            self._engines.add(id(engine))
+
+        sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                                self._before_cursor_execute)
+        sqlalchemy.event.listen(engine, 'after_cursor_execute',
+                                self._after_cursor_execute)
+        sqlalchemy.event.listen(engine, 'dbapi_error', self._dbapi_error)
+        sqlalchemy.event.listen(engine, 'checkin', _untag_connection)
+
+    def get(self, request_id):
+        """
+        Return the ``RequestStats`` for a request, or ``None`` if no
+        statements have been recorded for it.
+        """
+
+        return self._requests.get(request_id)
+
+    def pop(self, request_id):
+        """
+        Return the ``RequestStats`` for a request, or ``None``, and
+        stop keeping them.
+        """
+
+        with self._lock:
+            return self._requests.pop(request_id, None)
+
+    @contextlib.contextmanager
+    def capture(self, engine):
+        """
+        Capture all statements executed on an engine within a ``with``
+        block, whatever request they belong to.  Yields a ``Capture``.
+        """
+
+        self.install(engine)
+        capture = Capture()
+        self._captures.append(capture)
+        try:
+            yield capture
+        finally:
+            self._captures.remove(capture)
+
+    def _stats(self, request_id):
+        """Find or allocate the statistics for a request."""
+
+        stats = self._requests.get(request_id)
+        if stats is None:
+            with self._lock:
+                stats = self._requests.get(request_id)
+                if stats is None:
+                    stats = self._requests[request_id] = \
+                        RequestStats(request_id)
+                    self._order.append(request_id)
+                    while len(self._order) > self.max_requests:
+                        self._requests.pop(self._order.popleft(), None)
+        return stats
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if self.enabled or self._captures:
+            conn.info.setdefault(self._start_key, []).append(time.time())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        starts = conn.info.get(self._start_key)
+        if not starts:
+            return
+        elapsed = time.time() - starts.pop()
+
+        for capture in self._captures:
+            capture.statements.append(statement)
+
+        request_id = conn.info.get(_REQUEST_KEY)
+        if not self.enabled or request_id is None:
+            return
+
+        seen = self._stats(request_id).record(statement, elapsed)
+        if seen == self.repeat_threshold:
+            LOG.warning(_("Statement executed %(count)d times in request "
+                          "%(request_id)s; possible N+1 query: "
+                          "%(statement)s") %
+                        dict(count=seen, request_id=request_id,
+                             statement=statement))
+
+    def _dbapi_error(self, conn, cursor, statement, parameters, context,
+                     exception):
+        # A failed statement never reaches after_cursor_execute, so its
+        # start time must be discarded here to keep the stack balanced
+        starts = conn.info.get(self._start_key)
+        if starts:
+            starts.pop()
+
+
+PROFILER = QueryProfiler()
+
+
+def _tag_connection(session, transaction, connection):
+    """Attribute the statements on a connection to a session's request."""
+
+    request_id = getattr(session, 'boson_request_id', None)
+    if request_id is not None:
+        connection.info[_REQUEST_KEY] = request_id
+
+
+def _untag_connection(dbapi_conn, connection_record):
+    """Forget the request of a connection returned to the pool."""
+
+    connection_record.info.pop(_REQUEST_KEY, None)
+
+
+sqlalchemy.event.listen(orm.Session, 'after_begin', _tag_connection)
+
+
+def tag_session(session, request_id):
+    """Attribute the statements executed by a session to a request."""
+
+    session.boson_request_id = request_id
+
+
+def setup(engine):
+    """Configure the global profiler and install it on an engine."""
+
+    PROFILER.enabled = CONF.sql_profiling
+    PROFILER.max_requests = CONF.sql_profiling_requests
+    PROFILER.repeat_threshold = CONF.sql_repeat_threshold
+    if PROFILER.enabled:
+        PROFILER.install(engine)
+
+
+@contextlib.contextmanager
+def assert_max_queries(engine, count):
+    """
+    Assert that no more than ``count`` statements are executed on an
+    engine within a ``with`` block.  Raises an ``AssertionError``
+    listing the statements otherwise.
+    """
+
+    with PROFILER.capture(engine) as capture:
+        yield capture
+
+    if capture.count > count:
+        raise AssertionError('%d statements executed, expected at most '
+                             '%d:\n%s' % (capture.count, count,
+                                          '\n'.join(capture.statements)))
@@ -18,23 +18,38 @@
 
 """Session Handling for SQLAlchemy backend."""
 
+import os
 import re
-import time
+import threading
 
 import sqlalchemy.engine
 from sqlalchemy import engine
 from sqlalchemy.exc import DisconnectionError, OperationalError
 import sqlalchemy.orm
-from sqlalchemy.pool import NullPool, StaticPool
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
 
+from boson.db.sqlalchemy import profiling
 import boson.openstack.common.cfg as cfg
+from boson.openstack.common.gettextutils import _
 import boson.openstack.common.log as logging
+from boson import utils
 
 LOG = logging.getLogger(__name__)
 
 _MAKER = None
 _ENGINE = None
 
+# The process _ENGINE was created or last rebuilt in
+_ENGINE_PID = None
+
+# Serializes the creation of _ENGINE and _MAKER, and updates of _STATE;
+# see _lock()
+_LOCK = threading.RLock()
+_LOCK_PID = os.getpid()
+
+# The readiness of the database, as reported by status()
+_STATE = {'status': 'unknown', 'attempts': 0, 'error': None}
+
 sql_opts = [
             
     cfg.StrOpt('database_connection',
@@ -58,8 +73,21 @@ sql_opts = [
                help='maximum db connection retries during startup. '
                     '(setting -1 implies an infinite retry count)'),
     cfg.IntOpt('sql_retry_interval',
-               default=10,
-               help='interval between retries of opening a sql connection'),
+               default=1,
+               help='interval between the first retries of opening a sql '
+                    'connection; doubled after each retry'),
+    cfg.IntOpt('sql_max_retry_interval',
+               default=60,
+               help='maximum interval between retries of opening a sql '
+                    'connection'),
+    cfg.IntOpt('sql_max_pool_size',
+               default=5,
+               help='maximum number of SQL connections to keep open in a '
+                    'pool'),
+    cfg.BoolOpt('sql_pool_warm_up',
+                default=True,
+                help='open the connections of the pool in each process '
+                     'before it serves requests'),
            ]
 
 cfg.CONF.register_opts(sql_opts)
@@ -69,9 +97,13 @@ def get_session(autocommit=False, expire_on_commit=False, autoflush=True):
     """Return a SQLAlchemy session."""
     global _MAKER
 
-    if _MAKER is None:
-        engine = get_engine()
-        _MAKER = get_maker(engine, autocommit, expire_on_commit, autoflush)
+    if _MAKER is None or _ENGINE_PID != os.getpid():
+        with _lock():
+            # In a forked process, getting the engine resets _MAKER
+            engine = get_engine()
+            if _MAKER is None:
+                _MAKER = get_maker(engine, autocommit, expire_on_commit,
+                                   autoflush)
 
     session = _MAKER()
     return session
@@ -120,73 +152,236 @@ def is_db_connection_error(args):
     return False
 
 
+def _lock():
+    """
+    Return the lock serializing the creation of the engine and updates
+    of the readiness state.  A process forked while another thread
+    held the lock inherits it held, by a thread which does not exist
+    in the new process; a new lock is therefore created in each
+    process.
+    """
+    global _LOCK
+    global _LOCK_PID
+
+    if _LOCK_PID != os.getpid():
+        _LOCK = threading.RLock()
+        _LOCK_PID = os.getpid()
+    return _LOCK
+
+
 def get_engine():
-    """Return a SQLAlchemy engine."""
+    """
+    Return a SQLAlchemy engine.  The engine is created on first use;
+    in a process forked since, its connection pool is first rebuilt
+    by ``after_fork()``.
+    """
     global _ENGINE
-    if _ENGINE is None:
-        connection_dict = sqlalchemy.engine.url.make_url(
-                                                  cfg.CONF.database_connection)
-
-        engine_args = {
-            "pool_recycle": cfg.CONF.sql_idle_timeout,
-            "echo": False,
-            'convert_unicode': True,
-        }
-
-        # Map our SQL debug level to SQLAlchemy's options
-        if cfg.CONF.sql_connection_debug >= 100:
-            engine_args['echo'] = 'debug'
-        elif cfg.CONF.sql_connection_debug >= 50:
-            engine_args['echo'] = True
-
-        if "sqlite" in connection_dict.drivername:
-            engine_args["poolclass"] = NullPool
-
-            if cfg.CONF.database_connection == "sqlite://":
-                engine_args["poolclass"] = StaticPool
-                engine_args["connect_args"] = {'check_same_thread': False}
-
-        _ENGINE = sqlalchemy.create_engine(cfg.CONF.database_connection,
-                                           **engine_args)
-
-        if 'mysql' in connection_dict.drivername:
-            sqlalchemy.event.listen(_ENGINE, 'checkout', ping_listener)
-        elif "sqlite" in connection_dict.drivername:
-            if not cfg.CONF.sqlite_synchronous:
-                sqlalchemy.event.listen(_ENGINE, 'connect',
-                                        synchronous_switch_listener)
-            sqlalchemy.event.listen(_ENGINE, 'connect', add_regexp_listener)
-
-        """
-        if (cfg.CONF.sql_connection_trace and
-                _ENGINE.dialect.dbapi.__name__ == 'MySQLdb'):
-            import MySQLdb.cursors
-            _do_query = debug_mysql_do_query()
-            setattr(MySQLdb.cursors.BaseCursor, '_do_query', _do_query)
-        """
+    global _ENGINE_PID
+
+    if _ENGINE is not None and _ENGINE_PID == os.getpid():
+        return _ENGINE
+
+    with _lock():
+        if _ENGINE is None:
+            _ENGINE = _create_engine()
+            _ENGINE_PID = os.getpid()
+        elif _ENGINE_PID != os.getpid():
+            after_fork()
+    return _ENGINE
+
+
+def after_fork():
+    """
+    Rebuild the connection pool of the engine in a newly forked
+    process, then connect and warm it up in the background as by
+    ``start()``.  Servers forking worker processes should call this
+    in each worker; the engine otherwise does so on first use in the
+    worker.
+
+    The connections inherited from the parent are dropped without
+    being closed, since closing them would close them for the parent
+    as well.
+    """
+    global _ENGINE_PID
+    global _MAKER
+
+    with _lock():
+        if _ENGINE is None or _ENGINE_PID == os.getpid():
+            return
+
+        LOG.debug(_('Rebuilding SQL connection pool after fork'))
+        _ENGINE.pool = _ENGINE.pool.recreate()
+        _ENGINE_PID = os.getpid()
+        _MAKER = None
+        _STATE.update(status='starting', attempts=0, error=None)
+
+    utils.spawn(_connect, _ENGINE)
+
+
+def warm_up():
+    """
+    Open the connections of the pool of the engine, so that the first
+    requests served by the process do not have to.  Unlike
+    ``start()``, waits for the connections to be opened.
+    """
+
+    engine = get_engine()
+    if cfg.CONF.sql_pool_warm_up:
+        _warm_up(engine)
+
+
+def start():
+    """
+    Start connecting to the database in the background, retrying with
+    exponential backoff while it cannot be reached, and warm up the
+    connection pool once connected.  Returns at once; the progress is
+    reported by ``status()``.  Does nothing if already started.
+    """
+
+    with _lock():
+        if _STATE['status'] in ('starting', 'ready'):
+            return
+        _STATE.update(status='starting', attempts=0, error=None)
+
+    utils.spawn(_connect, get_engine())
+
+
+def status():
+    """
+    Report the readiness of the database, as a dictionary with the
+    following keys:
+
+    ``status``
+        ``'unknown'`` if ``start()`` has not been called,
+        ``'starting'`` while connecting, ``'ready'`` once connected,
+        or ``'failed'`` once connecting has been given up.
+    ``attempts``
+        The number of connection attempts made.
+    ``error``
+        The last connection error, if any.
+    """
+
+    with _lock():
+        return dict(_STATE)
+
+
+def _set_state(**kwargs):
+    """Update the readiness of the database."""
+
+    with _lock():
+        _STATE.update(kwargs)
+
+
+def _connect(engine):
+    """
+    Connect to the database, retrying while the connection fails, and
+    record the outcome in the readiness state.
+    """
+
+    remaining = cfg.CONF.sql_max_retries
+    interval = cfg.CONF.sql_retry_interval
+    attempts = 0
+    while True:
+        attempts += 1
+        _set_state(attempts=attempts)
         try:
-            _ENGINE.connect()
+            engine.connect().close()
+            if cfg.CONF.sql_pool_warm_up:
+                _warm_up(engine)
         except OperationalError, e:
-            if not is_db_connection_error(e.args[0]):
-                raise
-
-            remaining = cfg.CONF.sql_max_retries
-            if remaining == -1:
-                remaining = 'infinite'
-            while True:
-                msg = _('SQL connection failed. %s attempts left.')
-                LOG.warn(msg % remaining)
-                if remaining != 'infinite':
-                    remaining -= 1
-                time.sleep(cfg.CONF.sql_retry_interval)
-                try:
-                    _ENGINE.connect()
-                    break
-                except OperationalError, e:
-                    if (remaining != 'infinite' and remaining == 0) or \
-                       not is_db_connection_error(e.args[0]):
-                        raise
-    return _ENGINE
+            _set_state(error=unicode(e))
+            if remaining == 0 or not is_db_connection_error(e.args[0]):
+                LOG.error(_('SQL connection failed: %s') % e)
+                _set_state(status='failed')
+                return
+
+            if remaining < 0:
+                LOG.warn(_('SQL connection failed. Retrying in %s seconds.')
+                         % interval)
+            else:
+                LOG.warn(_('SQL connection failed. %(remaining)s attempts '
+                           'left; retrying in %(interval)s seconds.') %
+                         locals())
+                remaining -= 1
+            utils.sleep(interval)
+            interval = min(interval * 2, cfg.CONF.sql_max_retry_interval)
+        except Exception, e:
+            LOG.exception(_('SQL connection failed'))
+            _set_state(status='failed', error=unicode(e))
+            return
+        else:
+            _set_state(status='ready', error=None)
+            return
+
+
+def _warm_up(engine):
+    """Fill the connection pool of an engine up to its size."""
+
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return
+
+    conns = []
+    try:
+        while len(conns) + pool.checkedin() < pool.size():
+            conns.append(pool.connect())
+    finally:
+        # Return the connections to the pool
+        for conn in conns:
+            conn.close()
+
+
+def _create_engine():
+    """
+    Create the SQLAlchemy engine.  No connection is opened; see
+    ``start()``.
+    """
+
+    connection_dict = sqlalchemy.engine.url.make_url(
+        cfg.CONF.database_connection)
+
+    engine_args = {
+        "pool_recycle": cfg.CONF.sql_idle_timeout,
+        "echo": False,
+        'convert_unicode': True,
+    }
+
+    # Map our SQL debug level to SQLAlchemy's options
+    if cfg.CONF.sql_connection_debug >= 100:
+        engine_args['echo'] = 'debug'
+    elif cfg.CONF.sql_connection_debug >= 50:
+        engine_args['echo'] = True
+
+    if "sqlite" in connection_dict.drivername:
+        engine_args["poolclass"] = NullPool
+
+        if cfg.CONF.database_connection == "sqlite://":
+            engine_args["poolclass"] = StaticPool
+            engine_args["connect_args"] = {'check_same_thread': False}
+    else:
+        engine_args["pool_size"] = cfg.CONF.sql_max_pool_size
+
+    engine = sqlalchemy.create_engine(cfg.CONF.database_connection,
+                                      **engine_args)
+
+    if 'mysql' in connection_dict.drivername:
+        sqlalchemy.event.listen(engine, 'checkout', ping_listener)
+    elif "sqlite" in connection_dict.drivername:
+        if not cfg.CONF.sqlite_synchronous:
+            sqlalchemy.event.listen(engine, 'connect',
+                                    synchronous_switch_listener)
+        sqlalchemy.event.listen(engine, 'connect', add_regexp_listener)
+
+    profiling.setup(engine)
+
+    """
+    if (cfg.CONF.sql_connection_trace and
+            engine.dialect.dbapi.__name__ == 'MySQLdb'):
+        import MySQLdb.cursors
+        _do_query = debug_mysql_do_query()
+        setattr(MySQLdb.cursors.BaseCursor, '_do_query', _do_query)
+    """
+    return engine
 
 
 def get_maker(engine, autocommit=True, expire_on_commit=False, autoflush=True):
@@ -0,0 +1,139 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Precompiled SQL statements for the reservation hot path.
+
+Reserving goes through the same few statements many times a second:
+looking up a usage record, inserting the reservation and its items,
+and adding to the amount reserved.  Going through the ORM, each of
+these pays for query construction and compilation, the identity map,
+and the unit of work.  The statements here are built once with
+SQLAlchemy Core, compiled once per dialect, and executed directly on
+the connection of the session, returning plain result rows; the ORM
+remains in use for everything else.
+"""
+
+import weakref
+
+import sqlalchemy as sa
+
+from boson.db.sqlalchemy import models as sa_models
+
+
+_usages = sa_models.Usage.__table__
+_reservations = sa_models.Reservation.__table__
+_reserved_items = sa_models.ReservedItem.__table__
+_ledger = sa_models.LedgerEntry.__table__
+
+
+def _select_usage(lock):
+    """Build the lookup of a usage record by resource and key."""
+
+    return sa.select([_usages.c.id, _usages.c.used, _usages.c.reserved,
+                      _usages.c.generation],
+                     sa.and_(_usages.c.resource_id ==
+                             sa.bindparam('resource_id'),
+                             _usages.c.key_hash == sa.bindparam('key_hash')),
+                     for_update=lock)
+
+
+# The statements, with the names of the columns they set, if any
+_STATEMENTS = {
+    'select_usage': (_select_usage(False), None),
+    'select_usage_for_update': (_select_usage(True), None),
+
+    # Fails to match if the record was updated since it was read
+    'update_reserved': (
+        _usages.update().
+        where(sa.and_(_usages.c.id == sa.bindparam('usage_id'),
+                      _usages.c.generation ==
+                      sa.bindparam('old_generation'))).
+        values(reserved=_usages.c.reserved +
+               sa.bindparam('delta', type_=sa.BigInteger),
+               generation=_usages.c.generation + 1,
+               updated_at=sa.bindparam('now', type_=sa.DateTime)),
+        []),
+
+    'insert_reservation': (
+        _reservations.insert(),
+        ['id', 'created_at', 'updated_at', 'expire', 'service_id',
+         'auth_data', 'req_id']),
+    'insert_reserved_item': (
+        _reserved_items.insert(),
+        ['id', 'created_at', 'updated_at', 'reservation_id', 'resource_id',
+         'usage_id', 'delta']),
+
+    'insert_ledger_entry': (
+        _ledger.insert(),
+        ['created_at', 'usage_id', 'used', 'reserved']),
+    'delete_ledger_entry': (
+        _ledger.delete().where(_ledger.c.id == sa.bindparam('entry_id')),
+        []),
+
+    # Folds ledger entries into a usage record
+    'fold_ledger': (
+        _usages.update().
+        where(_usages.c.id == sa.bindparam('usage_id')).
+        values(used=_usages.c.used +
+               sa.bindparam('used_delta', type_=sa.BigInteger),
+               reserved=_usages.c.reserved +
+               sa.bindparam('reserved_delta', type_=sa.BigInteger),
+               generation=_usages.c.generation + 1,
+               updated_at=sa.bindparam('now', type_=sa.DateTime)),
+        []),
+}
+
+# The compiled statements, by dialect and name
+_COMPILED = weakref.WeakKeyDictionary()
+
+
+def compiled(name, dialect):
+    """
+    Return a statement compiled for a dialect, compiling it on first
+    use.
+
+    :param name: The name of the statement.
+    :param dialect: The SQLAlchemy dialect to compile it for.
+    """
+
+    cache = _COMPILED.get(dialect)
+    if cache is None:
+        cache = _COMPILED[dialect] = {}
+
+    stmt = cache.get(name)
+    if stmt is None:
+        statement, column_keys = _STATEMENTS[name]
+        stmt = cache[name] = statement.compile(dialect=dialect,
+                                               column_keys=column_keys)
+    return stmt
+
+
+def execute(connection, name, params):
+    """
+    Execute a precompiled statement.
+
+    :param connection: The SQLAlchemy connection to execute it on.
+    :param name: The name of the statement.
+    :param params: A dictionary of the parameters of the statement,
+                   or a list of such dictionaries to execute it with
+                   each of them, using ``executemany()``.
+
+    :returns: The ``ResultProxy`` of the execution.
+    """
+
+    return connection.execute(compiled(name, connection.dialect), params)
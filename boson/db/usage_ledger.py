@@ -0,0 +1,320 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Running totals of usages kept in an append-only ledger.
+
+In the ``ledger`` mode of the ``usage_concurrency`` option,
+reservations, commits, and rollbacks do not update the usage records;
+they append the changes of the amounts used and reserved to the
+insert-only ``usage_ledger`` table, so that concurrent writers never
+wait for each other's row locks.  The amounts of a usage are those of
+its record, the last compacted snapshot, plus the sum of its entries
+in the ledger.
+
+``TOTALS`` caches these amounts per usage, and adds the entries
+committed by this process as soon as they are; entries committed by
+other processes are seen once the cached amounts expire, after
+``usage_ledger_ttl`` seconds.  Limits are thus checked against amounts
+which may lag behind the reservations of other processes by up to
+that long.  A ``Compactor`` folds the entries of the ledger into the
+usage records in the background, in batches.
+
+Within this process, limits are checked exactly: a reservation checks
+and sets aside its amounts with ``TOTALS.hold()``, under the lock of
+``TOTALS``, before appending them to the ledger, and releases them once
+its transaction has committed, and the entries have been added to the
+cached amounts, or has failed.  Concurrent reservations therefore see
+each other's amounts even before they are committed.
+"""
+
+import threading
+import time
+
+from boson.db import periodic
+from boson import exceptions
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import log as logging
+from boson import utils
+
+
+LOG = logging.getLogger(__name__)
+
+usage_ledger_opts = [
+    cfg.IntOpt('usage_ledger_ttl',
+               default=1,
+               help='Number of seconds the amounts of usages read from '
+                    'the usage ledger are cached for, when '
+                    'usage_concurrency is ledger; 0 disables the cache'),
+    cfg.IntOpt('usage_ledger_compact_interval',
+               default=10,
+               help='Number of seconds between compactions of the usage '
+                    'ledger into the usage records'),
+    cfg.IntOpt('usage_ledger_compact_batch',
+               default=1000,
+               help='Maximum number of ledger entries folded into the '
+                    'usage records in one transaction'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(usage_ledger_opts)
+
+
+class RunningTotals(object):
+    """
+    A cache of the amounts used and reserved of usages, kept up to
+    date with the ledger entries committed by this process.
+
+    The amounts read from the database must not be cached if entries
+    were committed while reading them, since they may or may not
+    include those entries.  Callers therefore obtain the
+    ``generation()`` of the usage before reading, and pass it to
+    ``set()``; the amounts are only cached if no entries of the usage
+    were committed in the meantime, nor are being committed.
+
+    Amounts about to be reserved are set aside with ``hold()`` until
+    the transaction reserving them ends, and count against the limits
+    checked by other holds meanwhile.
+    """
+
+    def __init__(self, ttl=None):
+        """
+        Initialize a RunningTotals.
+
+        :param ttl: The number of seconds amounts are cached for.
+                    Defaults to the ``usage_ledger_ttl`` option.
+        """
+
+        self._ttl = ttl
+        self._totals = {}
+        self._generations = {}
+        self._committing = {}
+        self._held = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        """The number of seconds amounts are cached for."""
+
+        return CONF.usage_ledger_ttl if self._ttl is None else self._ttl
+
+    def generation(self, usage_id):
+        """
+        Return an opaque value which changes whenever entries of a
+        usage are committed.
+        """
+
+        return (self._epoch, self._generations.get(usage_id, 0))
+
+    def get(self, usage_id):
+        """
+        Look up the cached amounts of a usage.  Returns a tuple of the
+        amount used and the amount reserved.  Raises a ``KeyError`` if
+        the amounts are not cached.
+
+        :param usage_id: The ID of the usage.
+        """
+
+        expires, used, reserved = self._totals[usage_id]
+        if expires < time.time():
+            raise KeyError(usage_id)
+        return used, reserved
+
+    def set(self, usage_id, used, reserved, generation):
+        """
+        Cache the amounts of a usage, unless entries of the usage have
+        been committed since ``generation`` was obtained.
+
+        :param usage_id: The ID of the usage.
+        :param used: The amount used.
+        :param reserved: The amount reserved.
+        :param generation: The ``generation()`` of the usage before
+                           the amounts were read.
+        """
+
+        if self.ttl <= 0:
+            return
+
+        with self._lock:
+            if (self.generation(usage_id) == generation and
+                    not self._committing.get(usage_id)):
+                self._totals[usage_id] = [time.time() + self.ttl, used,
+                                          reserved]
+
+    def hold(self, usage_id, amount, limit, used, reserved, generation):
+        """
+        Check that an amount can be reserved on a usage without going
+        over a limit, counting the amounts held by other transactions,
+        and if so, hold it until ``release()``.  Returns ``True`` if
+        the amount is held, ``False`` if it would go over the limit,
+        and ``None`` if the amounts given are out of date, and must be
+        read again.
+
+        :param usage_id: The ID of the usage.
+        :param amount: The amount to reserve.
+        :param limit: The limit of the usage, or ``None`` if unlimited.
+        :param used: The amount used, as read.
+        :param reserved: The amount reserved, as read.
+        :param generation: The ``generation()`` of the usage before
+                           the amounts were read.
+        """
+
+        with self._lock:
+            # The cached amounts are at least as recent as those read
+            total = self._totals.get(usage_id)
+            if total is not None and total[0] >= time.time():
+                used, reserved = total[1:]
+            elif self.generation(usage_id) != generation:
+                return None
+
+            held = self._held.get(usage_id, 0)
+            if limit is not None and used + reserved + held + amount > limit:
+                return False
+            self._held[usage_id] = held + amount
+            return True
+
+    def release(self, holds):
+        """
+        Release amounts held by ``hold()``.
+
+        :param holds: A sequence of tuples of the ID of the usage and
+                      the amount held.
+        """
+
+        with self._lock:
+            for usage_id, amount in holds:
+                held = self._held.pop(usage_id, 0) - amount
+                if held > 0:
+                    self._held[usage_id] = held
+
+    def committing(self, entries):
+        """
+        Record that ledger entries are being committed.
+
+        :param entries: A sequence of tuples of the ID of the usage,
+                        and the amounts added to its amount used and
+                        amount reserved.
+        """
+
+        with self._lock:
+            for usage_id, _used, _reserved in entries:
+                self._committing[usage_id] = \
+                    self._committing.get(usage_id, 0) + 1
+
+    def committed(self, entries, success=True):
+        """
+        Record the outcome of committing ledger entries, adding them
+        to the cached amounts if they were committed.
+
+        :param entries: The entries passed to ``committing()``.
+        :param success: Whether the entries were committed.
+        """
+
+        with self._lock:
+            for usage_id, used, reserved in entries:
+                count = self._committing.pop(usage_id, 1) - 1
+                if count > 0:
+                    self._committing[usage_id] = count
+                self._generations[usage_id] = \
+                    self._generations.get(usage_id, 0) + 1
+
+                total = self._totals.get(usage_id)
+                if total is not None and success:
+                    total[1] += used
+                    total[2] += reserved
+
+    def clear(self):
+        """Discard all cached amounts."""
+
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            self._totals.clear()
+            self._committing.clear()
+
+
+TOTALS = RunningTotals()
+
+
+class Compactor(periodic.PeriodicTask):
+    """
+    Fold the entries of the usage ledger into the usage records, in
+    batches of at most ``usage_ledger_compact_batch`` entries, each in
+    its own transaction.  Compactions are timed into the
+    ``ledger.compact`` histogram of ``boson.utils.TIMERS``.
+
+    Compactors may run in several processes at once; a batch whose
+    entries were concurrently folded by another is rolled back.
+    """
+
+    task = 'compact'
+    interval_opt = 'usage_ledger_compact_interval'
+
+    def __init__(self, dbapi, interval=None, batch=None):
+        """
+        Initialize a Compactor.
+
+        :param dbapi: The database API object.
+        :param interval: The number of seconds between compactions run
+                         by ``start()``.  Defaults to the
+                         ``usage_ledger_compact_interval`` option.
+        :param batch: The maximum number of entries folded in one
+                      transaction.  Defaults to the
+                      ``usage_ledger_compact_batch`` option.
+        """
+
+        super(Compactor, self).__init__(dbapi, interval)
+        self._batch = batch
+
+    @property
+    def batch(self):
+        """The maximum number of entries folded in one transaction."""
+
+        if self._batch is None:
+            return CONF.usage_ledger_compact_batch
+        return self._batch
+
+    def compact(self, context):
+        """
+        Fold all the entries of the ledger into the usage records.
+        Stops early if another compactor is folding the same entries.
+
+        :param context: The current context for accessing the
+                        database.
+
+        :returns: The number of entries folded.
+        """
+
+        batch = self.batch
+        total = 0
+        with utils.timed('ledger.compact'):
+            while True:
+                try:
+                    with self.dbapi.transaction(context):
+                        count = self.dbapi.compact_ledger(context, batch)
+                except exceptions.ConcurrentUpdate:
+                    LOG.debug(_("Usage ledger compacted concurrently; "
+                                "stopping"))
+                    break
+
+                total += count
+                if count < batch:
+                    break
+
+        return total
@@ -50,5 +50,13 @@ class AmbiguousFieldUpdate(BosonException):
     message = _("Ambiguous update of field %(field)r")
 
 
+class ConcurrentUpdate(BosonException):
+    message = _("Concurrent update of usage records: %(reason)s")
+
+
 class Duplicate(BosonException):
     message = _("Duplicate object for %(klass)s")
+
+
+class OverQuota(BosonException):
+    message = _("Quota exceeded for resources: %(resources)s")
@@ -333,6 +333,24 @@ class RequiredOptError(Error):
                                                          self.opt_name)
 
 
+class InvalidChoiceError(Error):
+    """Raised if an option value is not one of the option's choices."""
+
+    def __init__(self, opt_name, value, choices, group=None):
+        self.opt_name = opt_name
+        self.value = value
+        self.choices = choices
+        self.group = group
+
+    def __str__(self):
+        if self.group is not None:
+            opt_name = '%s.%s' % (self.group.name, self.opt_name)
+        else:
+            opt_name = self.opt_name
+        return ("invalid value %r for option %s, must be one of: %s" %
+                (self.value, opt_name, ', '.join(self.choices)))
+
+
 class TemplateSubstitutionError(Error):
     """Raised if an error occurs substituting a variable in an opt value."""
 
@@ -639,8 +657,14 @@ class StrOpt(Opt):
     """
     String opts do not have their values transformed and are returned as
     str objects.
+
+    If a sequence of choices is given, the value must be one of them;
+    this is checked when ConfigOpts is called.
     """
-    pass
+
+    def __init__(self, name, choices=None, **kwargs):
+        super(StrOpt, self).__init__(name, **kwargs)
+        self.choices = choices
 
 
 class BoolOpt(Opt):
@@ -1015,7 +1039,7 @@ class ConfigOpts(collections.Mapping):
         :param default_config_files: config files to use by default
         :returns: the list of arguments left over after parsing options
         :raises: SystemExit, ConfigFilesNotFoundError, ConfigFileParseError,
-                 RequiredOptError, DuplicateOptError
+                 RequiredOptError, InvalidChoiceError, DuplicateOptError
         """
         self.clear()
 
@@ -1027,6 +1051,8 @@ class ConfigOpts(collections.Mapping):
 
         self._check_required_opts()
 
+        self._check_choices()
+
         return leftovers
 
     def __getattr__(self, name):
@@ -1510,6 +1536,21 @@ class ConfigOpts(collections.Mapping):
                 if self._get(opt.name, group) is None:
                     raise RequiredOptError(opt.name, group)
 
+    def _check_choices(self):
+        """Check that all opts with choices have one of them as value.
+
+        :raises: InvalidChoiceError
+        """
+        for info, group in self._all_opt_infos():
+            opt = info['opt']
+            choices = getattr(opt, 'choices', None)
+            if choices is None:
+                continue
+
+            value = self._get(opt.name, group)
+            if value is not None and value not in choices:
+                raise InvalidChoiceError(opt.name, value, choices, group)
+
     def _parse_cli_opts(self, args):
         """Parse command line options.
 
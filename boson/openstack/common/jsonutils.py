@@ -42,33 +42,82 @@ import xmlrpclib
 from boson.openstack.common import timeutils
 
 
-def to_primitive(value, convert_instances=False, level=0):
-    """Convert a complex object into primitives.
+_simple_types = (basestring, int, long, float, bool, type(None))
+_simple_type_set = frozenset([str, unicode, int, long, float, bool,
+                              type(None)])
+
+_nasty_type_tests = [inspect.ismodule, inspect.isclass, inspect.ismethod,
+                     inspect.isfunction, inspect.isgeneratorfunction,
+                     inspect.isgenerator, inspect.istraceback,
+                     inspect.isframe, inspect.iscode, inspect.isbuiltin,
+                     inspect.isroutine, inspect.isabstract]
+
+# Maps a type to a (converter, depth) tuple, or to None for types known
+# to have no converter.  Entries for subclasses of registered types are
+# added as they are looked up.
+_converters = {
+    datetime.datetime: (timeutils.strtime, 0),
+    xmlrpclib.DateTime: (lambda v: timeutils.strtime(
+        datetime.datetime(*tuple(v.timetuple())[:6])), 0),
+    set: (list, 0),
+    frozenset: (list, 0),
+}
+
+
+def register_converter(klass, converter):
+    """Register a function converting instances of klass for to_primitive().
+
+    The converter is passed the value and returns a replacement, which is
+    in turn converted to primitives one level deeper.  The converter also
+    applies to subclasses of klass.
+    """
+    _converters[klass] = (converter, 1)
 
-    Handy for JSON serialization. We can optionally handle instances,
-    but since this is a recursive function, we could have cyclical
-    data structures.
+    # Forget cached lookups, which may have been for subclasses
+    for key, value in _converters.items():
+        if value is None:
+            del _converters[key]
 
-    To handle cyclical data structures we could track the actual objects
-    visited in a set, but not all objects are hashable. Instead we just
-    track the depth of the object inspections and don't go too deep.
 
-    Therefore, convert_instances=True is lossy ... be aware.
+def _get_converter(klass):
+    try:
+        return _converters[klass]
+    except KeyError:
+        pass
+
+    converter = None
+    for base in inspect.getmro(klass)[1:]:
+        converter = _converters.get(base)
+        if converter is not None:
+            break
 
+    _converters[klass] = converter
+    return converter
+
+
+def _convert(value, convert_instances, level):
+    """Convert a value which is not a plain list, tuple or dict.
+
+    Returns a tuple of the converted value and the level at which the
+    converted value must itself be converted, or None if it is final.
     """
-    nasty = [inspect.ismodule, inspect.isclass, inspect.ismethod,
-             inspect.isfunction, inspect.isgeneratorfunction,
-             inspect.isgenerator, inspect.istraceback, inspect.isframe,
-             inspect.iscode, inspect.isbuiltin, inspect.isroutine,
-             inspect.isabstract]
-    for test in nasty:
+    if level > 3:
+        return '?', None
+
+    # NOTE: old-style class instances all have the same type()
+    converter = _get_converter(getattr(value, '__class__', type(value)))
+    if converter is not None:
+        func, depth = converter
+        return func(value), level + depth
+
+    for test in _nasty_type_tests:
         if test(value):
-            return unicode(value)
+            return unicode(value), None
 
     # value of itertools.count doesn't get caught by inspects
     # above and results in infinite loop when list(value) is called.
     if type(value) == itertools.count:
-        return unicode(value)
+        return unicode(value), None
 
     # FIXME(vish): Workaround for LP bug 852095. Without this workaround,
     #              tests that raise an exception in a mocked method that
@@ -76,54 +125,106 @@ def to_primitive(value, convert_instances=False, level=0):
     #              we up the dependency to 0.5.4 (when it is released) we
     #              can remove this workaround.
     if getattr(value, '__module__', None) == 'mox':
-        return 'mock'
-
-    if level > 3:
-        return '?'
+        return 'mock', None
 
     # The try block may not be necessary after the class check above,
     # but just in case ...
     try:
-        # It's not clear why xmlrpclib created their own DateTime type, but
-        # for our purposes, make it a datetime type which is explicitly
-        # handled
-        if isinstance(value, xmlrpclib.DateTime):
-            value = datetime.datetime(*tuple(value.timetuple())[:6])
-
-        if isinstance(value, (list, tuple)):
-            o = []
-            for v in value:
-                o.append(to_primitive(v, convert_instances=convert_instances,
-                                      level=level))
-            return o
+        if isinstance(value, _simple_types):
+            return value, None
+        elif isinstance(value, (list, tuple)):
+            return list(value), level
         elif isinstance(value, dict):
-            o = {}
-            for k, v in value.iteritems():
-                o[k] = to_primitive(v, convert_instances=convert_instances,
-                                    level=level)
-            return o
-        elif isinstance(value, datetime.datetime):
-            return timeutils.strtime(value)
+            return dict(value), level
         elif hasattr(value, 'iteritems'):
-            return to_primitive(dict(value.iteritems()),
-                                convert_instances=convert_instances,
-                                level=level + 1)
+            return dict(value.iteritems()), level + 1
         elif hasattr(value, '__iter__'):
-            return to_primitive(list(value),
-                                convert_instances=convert_instances,
-                                level=level)
+            return list(value), level
         elif convert_instances and hasattr(value, '__dict__'):
             # Likely an instance of something. Watch for cycles.
             # Ignore class member vars.
-            return to_primitive(value.__dict__,
-                                convert_instances=convert_instances,
-                                level=level + 1)
+            return value.__dict__, level + 1
         else:
-            return value
+            return value, None
     except TypeError, e:
         # Class objects are tricky since they may define something like
         # __iter__ defined but it isn't callable as list().
-        return unicode(value)
+        return unicode(value), None
+
+
+def to_primitive(value, convert_instances=False, level=0):
+    """Convert a complex object into primitives.
+
+    Handy for JSON serialization. We can optionally handle instances,
+    but since we walk the object graph, we could have cyclical data
+    structures.
+
+    To handle cyclical data structures we could track the actual objects
+    visited in a set, but not all objects are hashable. Instead we just
+    track the depth of the object inspections and don't go too deep;
+    a list, tuple or dict containing itself goes one level deeper each
+    time it is met again.
+
+    Therefore, convert_instances=True is lossy ... be aware.
+
+    Plain strings, numbers, booleans, None, lists, tuples and dicts are
+    handled without further inspection; other types are looked up in a
+    table of converters (see register_converter()) before falling back
+    to inspecting the value.  The object graph is walked with an
+    explicit stack rather than by recursion.
+
+    """
+    if type(value) in _simple_type_set:
+        return value
+
+    # Each stack entry holds a value to convert, its level, the
+    # container and key the converted value is to be stored under, and
+    # the containers on the path to the value.  A container found on
+    # its own path is a cycle, whose every turn counts toward the
+    # depth limit.  The path holds the objects themselves rather than
+    # their ids, so that converted copies are kept alive and their ids
+    # not reused while on the path.
+    result = [None]
+    stack = [(value, level, result, 0, ())]
+    while stack:
+        value, level, target, key, path = stack.pop()
+        vtype = type(value)
+
+        if vtype in _simple_type_set:
+            target[key] = value
+        elif vtype is dict or vtype is list or vtype is tuple:
+            if level > 3:
+                target[key] = '?'
+                continue
+
+            if vtype is dict:
+                o = {}
+                items = value.iteritems()
+            else:
+                o = [None] * len(value)
+                items = enumerate(value)
+            target[key] = o
+
+            path += (value,)
+            for k, v in items:
+                if type(v) in _simple_type_set:
+                    o[k] = v
+                elif any(v is parent for parent in path):
+                    stack.append((v, level + 1, o, k, path))
+                else:
+                    stack.append((v, level, o, k, path))
+        else:
+            converted, new_level = _convert(value, convert_instances, level)
+            if new_level is None:
+                target[key] = converted
+                continue
+
+            # Conversions which do not go deeper may still be cycles
+            if new_level == level:
+                path += (value,)
+            stack.append((converted, new_level, target, key, path))
+
+    return result[0]
 
 
 def dumps(value, default=to_primitive, **kwargs):
@@ -36,8 +36,10 @@ import logging
 import logging.config
 import logging.handlers
 import os
+import Queue
 import stat
 import sys
+import threading
 import traceback
 
 from boson.openstack.common import cfg
@@ -88,6 +90,9 @@ log_opts = [
                default='[instance: %(uuid)s] ',
                help='If an instance UUID is passed with the log message, '
                     'format it like this'),
+    cfg.BoolOpt('log_json',
+                default=False,
+                help='Format log records as JSON documents'),
 ]
 
 
@@ -104,6 +109,14 @@ generic_log_opts = [
     cfg.StrOpt('logfile_mode',
                default='0644',
                help='Default file mode used when creating log files'),
+    cfg.BoolOpt('use_async_logging',
+                default=False,
+                help='Format and write log records from a dedicated '
+                     'writer thread'),
+    cfg.IntOpt('async_log_queue_size',
+               default=10000,
+               help='Maximum number of log records waiting for the '
+                    'writer thread; further records are dropped'),
 ]
 
 
@@ -159,17 +172,108 @@ def _get_log_file_path(binary=None):
         return '%s.log' % (os.path.join(logdir, binary),)
 
 
-class ContextAdapter(logging.LoggerAdapter):
-    warn = logging.LoggerAdapter.warning
+def _find_caller():
+    """Find the caller's file name, line number and function name.
+
+    Like logging.Logger.findCaller(), but also skips the frames of this
+    module, so records logged through a ContextAdapter point at the code
+    doing the logging.
+    """
+    f = sys._getframe(1)
+    while f is not None:
+        filename = os.path.normcase(f.f_code.co_filename)
+        if filename not in _skip_srcfiles:
+            return (f.f_code.co_filename, f.f_lineno, f.f_code.co_name)
+        f = f.f_back
+    return "(unknown file)", 0, "(unknown function)"
+
+
+_skip_srcfiles = (logging._srcfile,
+                  os.path.normcase(_find_caller.__code__.co_filename))
+
+
+class ContextLogger(logging.Logger):
+    """A Logger that skips this module when finding the caller.
+
+    The ContextAdapter level methods are defined in this module, so a
+    plain Logger would report them as the caller.  Only the loggers
+    created by getLogger() are of this class; the class of the loggers
+    created by logging.getLogger() is left alone.
+    """
+
+    def findCaller(self):
+        return _find_caller()
+
+
+def _get_context_logger(name):
+    """Get the named logger, creating it as a ContextLogger if new."""
+
+    # The logger class is swapped under the logging module's lock, so
+    # that loggers created concurrently elsewhere keep their class
+    logging._acquireLock()
+    try:
+        logger_class = logging.getLoggerClass()
+        logging.setLoggerClass(ContextLogger)
+        try:
+            return logging.getLogger(name)
+        finally:
+            logging.setLoggerClass(logger_class)
+    finally:
+        logging._releaseLock()
+
 
+class ContextAdapter(logging.LoggerAdapter):
     def __init__(self, logger, project_name, version_string):
         self.logger = logger
         self.project = project_name
         self.version = version_string
 
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    # NOTE: process() is only called once the level check passes, so
+    #       suppressed records cost no more than the level check
+    def debug(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger.debug(msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.INFO):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger.info(msg, *args, **kwargs)
+
     def audit(self, msg, *args, **kwargs):
         self.log(logging.AUDIT, msg, *args, **kwargs)
 
+    def warning(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.WARNING):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger.warning(msg, *args, **kwargs)
+
+    warn = warning
+
+    def error(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.ERROR):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger.error(msg, *args, **kwargs)
+
+    def exception(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.ERROR):
+            msg, kwargs = self.process(msg, kwargs)
+            kwargs['exc_info'] = 1
+            self.logger.error(msg, *args, **kwargs)
+
+    def critical(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.CRITICAL):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger.critical(msg, *args, **kwargs)
+
+    def log(self, level, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(level):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger.log(level, msg, *args, **kwargs)
+
     def process(self, msg, kwargs):
         if 'extra' not in kwargs:
             kwargs['extra'] = {}
@@ -244,6 +348,65 @@ class JSONFormatter(logging.Formatter):
         return jsonutils.dumps(message)
 
 
+class AsyncHandler(logging.Handler):
+    """Pass log records to another handler from a writer thread.
+
+    The caller's thread only merges the message with its arguments, so
+    later changes to the arguments do not affect it, and queues the
+    record.  Applying the formatter, including formatting any
+    traceback, and writing are left to the wrapped handler, running in
+    the writer thread.  If the queue is full, records are dropped and
+    counted in the dropped attribute rather than holding up the caller.
+    """
+
+    def __init__(self, handler, queue_size=10000):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self.dropped = 0
+        self._queue = Queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def setFormatter(self, fmt):
+        self.handler.setFormatter(fmt)
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            try:
+                if record is None:
+                    return
+                self.handler.handle(record)
+            except Exception:
+                self.handler.handleError(record)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait for the queued records to be written."""
+        if self._thread.is_alive():
+            self._queue.join()
+        self.handler.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.handler.close()
+        logging.Handler.close(self)
+
+
 class PublishErrorsHandler(logging.Handler):
     def emit(self, record):
         if ('boson.openstack.common.notifier.log_notifier' in
@@ -304,8 +467,10 @@ def _find_facility_from_conf():
 
 def _setup_logging_from_conf(product_name):
     log_root = getLogger(product_name).logger
-    for handler in log_root.handlers:
+    for handler in list(log_root.handlers):
         log_root.removeHandler(handler)
+        if isinstance(handler, AsyncHandler):
+            handler.close()
 
     if CONF.use_syslog:
         facility = _find_facility_from_conf()
@@ -338,11 +503,20 @@ def _setup_logging_from_conf(product_name):
 
     for handler in log_root.handlers:
         datefmt = CONF.log_date_format
+        if CONF.log_json:
+            handler.setFormatter(JSONFormatter(datefmt=datefmt))
+            continue
         if CONF.log_format:
             handler.setFormatter(logging.Formatter(fmt=CONF.log_format,
                                                    datefmt=datefmt))
         handler.setFormatter(LegacyFormatter(datefmt=datefmt))
 
+    if CONF.use_async_logging:
+        for handler in list(log_root.handlers):
+            log_root.removeHandler(handler)
+            log_root.addHandler(AsyncHandler(handler,
+                                             CONF.async_log_queue_size))
+
     if CONF.verbose or CONF.debug:
         log_root.setLevel(logging.DEBUG)
     else:
@@ -362,7 +536,7 @@ _loggers = {}
 
 def getLogger(name='unknown', version='unknown'):
     if name not in _loggers:
-        _loggers[name] = ContextAdapter(logging.getLogger(name),
+        _loggers[name] = ContextAdapter(_get_context_logger(name),
                                         name,
                                         version)
     return _loggers[name]
@@ -21,6 +21,7 @@ from boson.openstack.common.gettextutils import _
 from boson.openstack.common import importutils
 from boson.openstack.common import jsonutils
 from boson.openstack.common import log as logging
+from boson.openstack.common.notifier import dispatcher
 from boson.openstack.common import timeutils
 
 
@@ -37,6 +38,30 @@ notifier_opts = [
     cfg.StrOpt('default_publisher_id',
                default='$host',
                help='Default publisher_id for outgoing notifications'),
+    cfg.BoolOpt('notification_async',
+                default=False,
+                help='Queue notifications and send them to the drivers '
+                     'in batches from a background thread'),
+    cfg.IntOpt('notification_queue_size',
+               default=1000,
+               help='Maximum number of queued notifications'),
+    cfg.IntOpt('notification_batch_size',
+               default=100,
+               help='Maximum number of notifications sent to a driver '
+                    'in one batch'),
+    cfg.FloatOpt('notification_flush_interval',
+                 default=1.0,
+                 help='Maximum number of seconds a queued notification '
+                      'waits for its batch to fill'),
+    cfg.StrOpt('notification_overflow_policy',
+               default=dispatcher.DROP,
+               choices=dispatcher.overflow_policies,
+               help='What to do with notifications when the queue is '
+                    'full: drop, block or spill'),
+    cfg.StrOpt('notification_spill_file',
+               default=None,
+               help='File to spill notifications to when the queue is '
+                    'full and the overflow policy is spill'),
 ]
 
 CONF = cfg.CONF
@@ -119,6 +144,10 @@ def notify(context, publisher_id, event_type, priority, payload):
          'event_type': 'compute.create_instance',
          'payload': {'instance_id': 12, ... }}
 
+    If notification_async is set, the message is queued and sent to the
+    drivers in batches from a background thread instead of being sent
+    before notify() returns.
+
     """
     if priority not in log_levels:
         raise BadPriorityException(
@@ -134,6 +163,10 @@ def notify(context, publisher_id, event_type, priority, payload):
                payload=payload,
                timestamp=str(timeutils.utcnow()))
 
+    if CONF.notification_async:
+        _get_dispatcher().put(context, msg)
+        return
+
     for driver in _get_drivers():
         try:
             driver.notify(context, msg)
@@ -144,6 +177,38 @@ def notify(context, publisher_id, event_type, priority, payload):
 
 
 _drivers = None
+_dispatcher = None
+
+
+def _get_dispatcher():
+    """Create, start, and return the notification dispatcher."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = dispatcher.NotificationDispatcher(
+            _get_drivers,
+            queue_size=CONF.notification_queue_size,
+            batch_size=CONF.notification_batch_size,
+            flush_interval=CONF.notification_flush_interval,
+            overflow_policy=CONF.notification_overflow_policy,
+            spill_path=CONF.notification_spill_file)
+        _dispatcher.start()
+
+    return _dispatcher
+
+
+def get_dispatch_stats():
+    """Return the queue depth and counters of the dispatcher."""
+    if _dispatcher is None:
+        return {}
+    return _dispatcher.get_stats()
+
+
+def flush():
+    """Send all queued notifications and stop the dispatcher."""
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop(flush=True)
+        _dispatcher = None
 
 
 def _get_drivers():
@@ -178,4 +243,5 @@ def add_driver(notification_driver):
 def _reset_drivers():
     """Used by unit tests to reset the drivers."""
     global _drivers
+    flush()
     _drivers = None
@@ -0,0 +1,263 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Asynchronous, batched dispatch of notifications to drivers.
+
+The dispatcher decouples the caller of notify() from the notification
+drivers.  Messages are placed on a bounded in-process queue and a
+background thread sends them to every driver in batches, flushing when
+either a batch fills up or the flush interval elapses.  Drivers may
+provide a notify_batch(items) function, where items is a list of
+(context, message) tuples; drivers without one have notify() called
+once per message.
+"""
+
+import os
+import Queue
+import threading
+import time
+
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import jsonutils
+from boson.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+DROP = 'drop'
+BLOCK = 'block'
+SPILL = 'spill'
+
+overflow_policies = (DROP, BLOCK, SPILL)
+
+
+class NotificationDispatcher(object):
+    """Queue notifications and send them from a background thread."""
+
+    def __init__(self, get_drivers, queue_size=1000, batch_size=100,
+                 flush_interval=1.0, overflow_policy=DROP, spill_path=None):
+        """Initialize the dispatcher.
+
+        :param get_drivers: A callable returning the list of drivers to
+                            send each batch to.
+        :param queue_size: The maximum number of queued messages.
+        :param batch_size: The maximum number of messages sent to a
+                           driver at once.
+        :param flush_interval: The maximum time, in seconds, a message
+                               waits in a partial batch.
+        :param overflow_policy: What to do with a message when the
+                                queue is full; one of 'drop', 'block'
+                                or 'spill'.
+        :param spill_path: The file messages are appended to under the
+                           'spill' policy.
+        """
+
+        if overflow_policy not in overflow_policies:
+            raise ValueError(_('%s not in valid overflow policies') %
+                             overflow_policy)
+        if overflow_policy == SPILL and not spill_path:
+            raise ValueError(_('spill overflow policy requires a '
+                               'spill file'))
+
+        self._get_drivers = get_drivers
+        self._queue = Queue.Queue(queue_size)
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.spill_path = spill_path
+
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._spilled = 0
+        self._unspilled = []
+        self._counters = dict(queued=0, sent=0, dropped=0, spilled=0,
+                              failed=0, batches=0)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def start(self):
+        """Start the background sender thread if it is not running."""
+
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run,
+                                            name='notification-dispatcher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, flush=True):
+        """Stop the background sender, optionally sending what is queued.
+
+        :param flush: If True (the default), queued and spilled
+                      messages are sent before returning.
+        """
+
+        with self._lock:
+            running, self._running = self._running, False
+            thread, self._thread = self._thread, None
+
+        if running and thread is not None:
+            thread.join()
+        if flush:
+            self.flush()
+
+    def put(self, context, message):
+        """Queue a message, applying the overflow policy if full."""
+
+        item = (context, message)
+        if self.overflow_policy == BLOCK:
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except Queue.Full:
+                if self.overflow_policy == SPILL:
+                    self._spill(message)
+                else:
+                    self._count('dropped')
+                return
+        self._count('queued')
+
+    def flush(self):
+        """Synchronously send everything queued or spilled."""
+
+        while True:
+            batch = self._get_batch(block=False)
+            if not batch:
+                batch = self._unspill()
+            if not batch:
+                return
+            self._send(batch)
+
+    @property
+    def depth(self):
+        """The number of messages waiting in the queue."""
+
+        return self._queue.qsize()
+
+    def get_stats(self):
+        """Return a dictionary of the queue depth and counters."""
+
+        with self._lock:
+            stats = dict(self._counters)
+            stats['spill_depth'] = self._spilled + len(self._unspilled)
+        stats['depth'] = self.depth
+        return stats
+
+    def _run(self):
+        while self._running:
+            batch = self._get_batch(block=True)
+            if not batch and not self._queue.qsize():
+                batch = self._unspill()
+            if batch:
+                self._send(batch)
+
+    def _get_batch(self, block):
+        """Collect up to batch_size messages.
+
+        When blocking, waits at most flush_interval for the batch to
+        fill up, so that a partial batch is never held back for longer
+        than that.
+        """
+
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if block:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        """Send a batch to every driver.
+
+        The batch is counted as sent only if no driver failed on it;
+        otherwise its messages are counted as failed, once per failing
+        driver.
+        """
+
+        sent = True
+        for driver in self._get_drivers():
+            try:
+                notify_batch = getattr(driver, 'notify_batch', None)
+                if notify_batch is not None:
+                    notify_batch(batch)
+                else:
+                    for context, message in batch:
+                        driver.notify(context, message)
+            except Exception, e:
+                sent = False
+                self._count('failed', len(batch))
+                LOG.exception(_("Problem '%(e)s' attempting to send a "
+                                "batch of %(count)d notifications to "
+                                "%(driver)s") %
+                              dict(e=e, count=len(batch), driver=driver))
+        if sent:
+            self._count('sent', len(batch))
+        self._count('batches')
+
+    def _spill(self, message):
+        """Append a message to the spill file.
+
+        The context is not preserved; spilled messages are sent with a
+        context of None, leaving drivers to use their default.
+        """
+
+        line = jsonutils.dumps(message)
+        with self._spill_lock:
+            with open(self.spill_path, 'a') as f:
+                f.write(line + '\n')
+            self._spilled += 1
+        self._count('spilled')
+
+    def _unspill(self):
+        """Return the next batch of spilled messages.
+
+        Once the messages read back are all returned, the spill file,
+        if there is one, is read back and truncated.  The file may have
+        been left behind by an earlier process, so its existence is
+        checked rather than the spill depth.
+        """
+
+        if self.spill_path is None:
+            return []
+
+        with self._spill_lock:
+            if not self._unspilled and os.path.exists(self.spill_path):
+                with open(self.spill_path) as f:
+                    lines = f.readlines()
+                os.unlink(self.spill_path)
+                self._spilled = 0
+                self._unspilled = [(None, jsonutils.loads(line))
+                                   for line in lines if line.strip()]
+
+            batch = self._unspilled[:self.batch_size]
+            del self._unspilled[:self.batch_size]
+        return batch
@@ -44,3 +44,27 @@ def notify(context, message):
         except Exception, e:
             LOG.exception(_("Could not send notification to %(topic)s. "
                             "Payload=%(message)s"), locals())
+
+
+def notify_batch(items):
+    """Sends a batch of (context, message) notifications to the RabbitMQ
+
+    Each message is sent on its own, with its own context, exactly as
+    by notify(); only the topics are worked out once per priority.
+    Failures are not caught, so that the caller can count them.
+    """
+    topics = {}
+    admin_context = None
+    for context, message in items:
+        if not context:
+            if admin_context is None:
+                admin_context = req_context.get_admin_context()
+            context = admin_context
+        priority = message.get('priority',
+                               CONF.default_notification_level)
+        priority = priority.lower()
+        if priority not in topics:
+            topics[priority] = ['%s.%s' % (topic, priority)
+                                for topic in CONF.notification_topics]
+        for topic in topics[priority]:
+            rpc.notify(context, topic, message)
@@ -0,0 +1,812 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import datetime
+
+from boson.data_model import reservation as dm_reservation
+from boson.db import limit_cache
+from boson.db import usage_ledger
+from boson import exceptions
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import log as logging
+from boson.openstack.common import timeutils
+from boson import utils
+
+
+LOG = logging.getLogger(__name__)
+
+quota_opts = [
+    cfg.IntOpt('reservation_expire',
+               default=86400,
+               help='Number of seconds until a reservation expires'),
+    cfg.IntOpt('reservation_expire_batch',
+               default=100,
+               help='Maximum number of expired reservations rolled back '
+                    'in one transaction; 0 rolls back all of them at '
+                    'once'),
+    cfg.StrOpt('usage_concurrency',
+               default='locking',
+               help="How concurrent updates of usage records are "
+                    "serialized: 'locking' locks the records until the "
+                    "transaction ends; 'optimistic' reads them without "
+                    "locking, detects conflicting updates by the "
+                    "generation of the records, and retries; 'ledger' "
+                    "appends the changes to an insert-only usage ledger, "
+                    "folded into the records in the background"),
+    cfg.IntOpt('usage_conflict_retries',
+               default=5,
+               help='Number of times a transaction is retried after a '
+                    'conflicting update of usage records, when '
+                    'usage_concurrency is optimistic'),
+    cfg.BoolOpt('reservation_fast_path',
+                default=True,
+                help='Look up and update usage records and record '
+                     'reservations with precompiled SQL statements, '
+                     'rather than through the ORM'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(quota_opts)
+
+
+class ResolutionPlan(object):
+    """
+    The precomputed steps for resolving the usage and the quotas of a
+    category for a user: the fields of the authentication and
+    authorization data selecting the usage and, in order from most
+    specific to least specific, the quotas, together with serializers
+    for each selection.
+    """
+
+    __slots__ = ('usage_fields', 'quota_fieldsets', '_usage_serializer',
+                 '_quota_serializers')
+
+    def __init__(self, usage_fields, quota_fieldsets):
+        """
+        Initialize a ResolutionPlan.
+
+        :param usage_fields: The field names selecting the usage.
+        :param quota_fieldsets: A list of sets of field names
+                                selecting the quotas, from most
+                                specific to least specific.
+        """
+
+        self.usage_fields = tuple(sorted(usage_fields))
+        self.quota_fieldsets = tuple(tuple(sorted(fset))
+                                     for fset in quota_fieldsets)
+        self._usage_serializer = utils.dict_serializer(self.usage_fields)
+        self._quota_serializers = tuple(utils.dict_serializer(fset)
+                                        for fset in self.quota_fieldsets)
+
+    def usage_key(self, auth_data):
+        """
+        Select the authentication and authorization data of a usage.
+        Returns a tuple of the selected data and its serialized form.
+        """
+
+        return (utils.project(auth_data, self.usage_fields),
+                self._usage_serializer(auth_data))
+
+    def quota_keys(self, auth_data):
+        """
+        Select the authentication and authorization data of each
+        applicable quota.  Returns a list of tuples of the selected
+        data and its serialized form, from most specific to least
+        specific.
+        """
+
+        return [(utils.project(auth_data, fset), serializer(auth_data))
+                for fset, serializer in zip(self.quota_fieldsets,
+                                            self._quota_serializers)]
+
+    def limit_key(self, auth_data):
+        """
+        Return a tuple of the serialized authentication and
+        authorization data of each applicable quota, from most
+        specific to least specific.  The limit of a resource in the
+        category is determined by this key.
+        """
+
+        return tuple(serializer(auth_data)
+                     for serializer in self._quota_serializers)
+
+
+# The amounts of a usage in ledger mode, including its ledger entries
+_LedgerUsage = collections.namedtuple('_LedgerUsage',
+                                      'id used reserved generation')
+
+# Resolution plans by category ID, with the modification time of the
+# category they were built from
+_PLANS = {}
+
+
+class _Pending(object):
+    """
+    The usage records looked up in a reservation transaction, and the
+    writes deferred until just before it commits.
+
+    ``usages`` maps the key of each usage record to a list of the
+    record and the amount reserved in the transaction so far, so that
+    requests made in the same transaction see each other's
+    reservations.  On the fast path, ``reservations`` and ``items``
+    collect the reservations and reserved items to insert.  In ledger
+    mode, the records are ``_LedgerUsage`` tuples, and ``holds`` collects
+    the amounts held in ``boson.db.usage_ledger.TOTALS``, to release
+    once the transaction ends.
+    """
+
+    __slots__ = ('fast', 'ledger', 'usages', 'reservations', 'items',
+                 'holds')
+
+    def __init__(self, fast, ledger=False):
+        self.fast = fast
+        self.ledger = ledger
+        self.usages = {}
+        self.reservations = []
+        self.items = []
+        self.holds = []
+
+
+def get_plan(category):
+    """
+    Return the ``ResolutionPlan`` for a category record.  Plans are
+    cached, and only rebuilt when the category has been modified.
+    """
+
+    cached = _PLANS.get(category.id)
+    if cached is None or cached[0] != category.updated_at:
+        plan = ResolutionPlan(category.usage_fset, category.quota_fsets)
+        cached = _PLANS[category.id] = (category.updated_at, plan)
+    return cached[1]
+
+
+class QuotaEngine(object):
+    """
+    Check reservation requests against the recorded quotas and usages,
+    and commit, roll back, and expire reservations.
+
+    The phases of a reservation are timed into the ``reserve.*``
+    histograms of ``boson.utils.TIMERS``: ``registry`` (looking up the
+    service, resources, and categories), ``quota`` (resolving the most
+    specific applicable limits), ``usage`` (locking or creating the
+    usage records and checking the limits), ``insert`` (recording the
+    reservation), and ``commit``.  Batches of reservations made with
+    ``reserve_batch()`` are timed as a whole into ``reserve.batch``.
+
+    Expired reservations are rolled back by ``expire()`` in batches of
+    at most ``reservation_expire_batch``, each in its own transaction,
+    so that locks are only held briefly.  Each batch is timed into
+    ``expire.batch``, and its size recorded in ``expire_batch_sizes``;
+    the time by which the oldest reservation of a batch had expired
+    is recorded into ``expire.lag``.
+
+    With the ``reservation_fast_path`` option, usage records are
+    looked up and updated and reservations recorded with the
+    precompiled statements of the database API rather than through
+    its object model, and the writes are timed into ``reserve.write``.
+
+    Usage records are updated according to the ``usage_concurrency``
+    option.  In the default ``locking`` mode, they are locked until the
+    end of the transaction.  In ``optimistic`` mode, they are read
+    without locking; a transaction whose usage records were updated
+    concurrently fails with ``ConcurrentUpdate`` and is retried, up to
+    ``usage_conflict_retries`` times.  In ``ledger`` mode, they are not
+    updated at all: the changes are appended to the usage ledger, and
+    limits are checked against the running totals of
+    ``boson.db.usage_ledger.TOTALS``, in which the amounts being
+    reserved are held until the transaction ends, so that concurrent
+    reservations in this process cannot together go over a limit.  A
+    ``boson.db.usage_ledger.Compactor`` must then run to fold the
+    ledger into the records; it must also have emptied the ledger
+    before switching to another mode.
+    """
+
+    def __init__(self, dbapi):
+        """
+        Initialize a QuotaEngine.
+
+        :param dbapi: The database API object.
+        """
+
+        self.dbapi = dbapi
+
+        # The number of reservations rolled back in each expiry batch
+        self.expire_batch_sizes = utils.Histogram()
+
+    @property
+    def _lock(self):
+        """Whether usage records are locked for update."""
+
+        return CONF.usage_concurrency not in ('optimistic', 'ledger')
+
+    @property
+    def _ledger(self):
+        """Whether changes of usages are appended to the ledger."""
+
+        return CONF.usage_concurrency == 'ledger'
+
+    @property
+    def _fast_path(self):
+        """Whether reservations are made with precompiled statements."""
+
+        return CONF.reservation_fast_path
+
+    def _retrying(self, name, func, *args):
+        """
+        Call a function running a transaction which updates usage
+        records, retrying it on conflicting updates.
+        """
+
+        # Appending to the ledger does not conflict
+        retries = (0 if self._lock or self._ledger else
+                   CONF.usage_conflict_retries)
+        for attempt in range(retries + 1):
+            try:
+                return func(*args)
+            except exceptions.ConcurrentUpdate:
+                if attempt >= retries:
+                    raise
+                LOG.debug(_("Conflicting usage update in %(name)s; "
+                            "retrying (attempt %(attempt)d of "
+                            "%(retries)d)") %
+                          dict(name=name, attempt=attempt + 1,
+                               retries=retries))
+
+    def _get_resources(self, context, svc_user, deltas):
+        """
+        Look up the service, resource, and category records for the
+        requested deltas.  Returns the service and a list of tuples of
+        the ``SpecificResource``, the delta, the resource, and the
+        ``ResolutionPlan`` of the category.
+        """
+
+        service = self.dbapi.get_service(context, name=svc_user.service.name)
+
+        plans = {}
+        items = []
+        for spc_resource, delta in deltas.items():
+            resource = self.dbapi.get_resource(
+                context, service=service, name=spc_resource.resource.name)
+            if resource.category_id not in plans:
+                plans[resource.category_id] = get_plan(
+                    self.dbapi.get_category(context, id=resource.category_id))
+            items.append((spc_resource, delta, resource,
+                          plans[resource.category_id]))
+
+        return service, items
+
+    def _get_limit(self, context, resource, quota_keys):
+        """
+        Find the most specific quota applicable to a resource and return
+        its limit, or ``None`` if the resource is unlimited.  Quotas
+        found missing are cached as such in
+        ``boson.db.limit_cache.LIMITS``, and not looked up again until
+        the quotas of the resource change or the entry expires.
+        """
+
+        cache = limit_cache.LIMITS
+        for auth_data, auth_key in quota_keys:
+            if cache.quota_missing(resource.id, auth_key):
+                continue
+
+            generation = cache.generation(resource.id)
+            try:
+                quota = self.dbapi.get_quota(context, resource=resource,
+                                             auth_data=auth_data,
+                                             auth_key=auth_key)
+            except KeyError:
+                cache.set_quota_missing(resource.id, auth_key, generation)
+                continue
+            return quota.limit
+
+        return None
+
+    def _get_usage(self, context, resource, param_data, usage_key, fast):
+        """
+        Look up the usage record for a resource, creating it if it
+        does not yet exist.  The record is locked only in locking
+        mode.  On the fast path, a row of its amounts is returned.
+        """
+
+        auth_data, auth_key = usage_key
+        get_usage = (self.dbapi.get_usage_row if fast else
+                     self.dbapi.get_usage)
+
+        # A usage certainly missing is created without looking it up
+        if self.dbapi.usage_might_exist(context, resource, param_data,
+                                        auth_data, auth_key=auth_key):
+            try:
+                return get_usage(context, resource=resource,
+                                 param_data=param_data, auth_data=auth_data,
+                                 lock=self._lock, auth_key=auth_key)
+            except KeyError:
+                pass
+
+        # Concurrent reservations may create the same usage; all of
+        # them get the one record
+        self.dbapi.create_usage(context, resource, param_data, auth_data)
+        return get_usage(context, resource=resource, param_data=param_data,
+                         auth_data=auth_data, lock=self._lock,
+                         auth_key=auth_key)
+
+    def _get_amounts(self, context, usage_id):
+        """
+        Look up the amounts of a usage in ledger mode, from the
+        running totals if cached.  Returns a ``_LedgerUsage``.
+        """
+
+        totals = usage_ledger.TOTALS
+        generation = totals.generation(usage_id)
+        try:
+            used, reserved = totals.get(usage_id)
+        except KeyError:
+            used, reserved = self.dbapi.get_usage_amounts(
+                context, [usage_id])[usage_id]
+            totals.set(usage_id, used, reserved, generation)
+
+        return _LedgerUsage(usage_id, used, reserved, generation)
+
+    def _hold(self, context, pending, entry, delta, limit):
+        """
+        Check a positive delta against the limit of a usage in ledger
+        mode, and hold it in the running totals until the transaction
+        ends.  Returns whether the delta is within the limit.
+
+        :param entry: The entry of the usage in ``pending.usages``.
+                      Its amounts are read again if out of date.
+        """
+
+        totals = usage_ledger.TOTALS
+        while True:
+            usage = entry[0]
+            held = totals.hold(usage.id, delta, limit, usage.used,
+                               usage.reserved, usage.generation)
+            if held is not None:
+                break
+
+            # Entries of the usage were committed since it was read
+            entry[0] = self._get_amounts(context, usage.id)
+
+        if held:
+            pending.holds.append((usage.id, delta))
+        return held
+
+    @staticmethod
+    def _release(pending, start=0):
+        """Release the amounts held by a transaction since ``start``."""
+
+        if len(pending.holds) > start:
+            usage_ledger.TOTALS.release(pending.holds[start:])
+            del pending.holds[start:]
+
+    def reserve(self, context, svc_user, deltas, expire=None, req_id=None):
+        """
+        Reserve resources.  Raises an ``OverQuota`` exception if any
+        positive delta would take the usage of a resource over its
+        limit, in which case nothing is reserved.
+
+        Absolute resources are only checked against their limits;
+        nothing is reserved for them.
+
+        :param context: The current context for accessing the
+                        database.
+        :param svc_user: The ``ServiceUser`` to reserve resources for.
+        :param deltas: A dictionary mapping ``SpecificResource``
+                       objects to the deltas to reserve.
+        :param expire: The date and time at which the reservation will
+                       expire.  Defaults to ``reservation_expire``
+                       seconds from now.
+        :param req_id: An optional ID provided by the caller, unique
+                       for the service.  If a reservation with this ID
+                       has already been made, it is returned, and
+                       nothing more is reserved; requests may thus be
+                       retried safely.
+
+        :returns: An instance of
+                  ``boson.data_model.reservation.Reservation``.
+        """
+
+        with utils.timed('reserve.total'):
+            return self._retrying('reserve', self._reserve, context,
+                                  svc_user, deltas, self._expire_at(expire),
+                                  req_id)
+
+    def reserve_batch(self, context, requests):
+        """
+        Make several reservations in a single transaction.  The
+        requests are evaluated in order, each against the usages as
+        left by those before it, so that a request fails if it would
+        take a usage over its limit together with the requests
+        already granted.  A request failing does not affect the
+        others.
+
+        :param context: The current context for accessing the
+                        database.
+        :param requests: A sequence of ``(svc_user, deltas, expire,
+                         req_id)`` tuples, with the arguments of
+                         ``reserve()``.
+
+        :returns: A list with, for each request, either an instance of
+                  ``boson.data_model.reservation.Reservation`` or the
+                  exception raised by the request (an ``OverQuota``,
+                  or a ``KeyError`` for an unknown service or
+                  resource).
+        """
+
+        requests = [(svc_user, deltas, self._expire_at(expire), req_id)
+                    for svc_user, deltas, expire, req_id in requests]
+
+        with utils.timed('reserve.batch'):
+            return self._retrying('reserve', self._reserve_batch, context,
+                                  requests)
+
+    @staticmethod
+    def _expire_at(expire):
+        """Default the expiration time of a reservation."""
+
+        if expire is None:
+            expire = (timeutils.utcnow() +
+                      datetime.timedelta(seconds=CONF.reservation_expire))
+        return expire
+
+    def _reserve(self, context, svc_user, deltas, expire, req_id):
+        """Reserve resources in one transaction; see ``reserve()``."""
+
+        pending = _Pending(self._fast_path, self._ledger)
+        try:
+            with self.dbapi.transaction(context) as txn:
+                resv, new = self._reserve_one(context, svc_user, deltas,
+                                              expire, req_id, pending)
+
+                # Nothing was reserved, so release any locks at once
+                if not new:
+                    txn.rollback()
+                    return resv
+
+                self._write(context, pending)
+                with utils.timed('reserve.commit'):
+                    txn.commit()
+        finally:
+            # Committed amounts are now in the running totals
+            self._release(pending)
+
+        return resv
+
+    def _reserve_batch(self, context, requests):
+        """
+        Make several reservations in one transaction; see
+        ``reserve_batch()``.
+        """
+
+        results = []
+        pending = _Pending(self._fast_path, self._ledger)
+        try:
+            with self.dbapi.transaction(context) as txn:
+                for svc_user, deltas, expire, req_id in requests:
+                    try:
+                        resv, _new = self._reserve_one(context, svc_user,
+                                                       deltas, expire, req_id,
+                                                       pending)
+                    except (exceptions.OverQuota, KeyError) as exc:
+                        results.append(exc)
+                    else:
+                        results.append(resv)
+
+                self._write(context, pending)
+                with utils.timed('reserve.commit'):
+                    txn.commit()
+        finally:
+            self._release(pending)
+
+        return results
+
+    def _reserve_one(self, context, svc_user, deltas, expire, req_id,
+                     pending):
+        """
+        Check and record one reservation within the current
+        transaction.  Returns the reservation, and whether anything
+        was recorded for it; if not, the reservation had already been
+        made.
+
+        :param pending: The ``_Pending`` state of the transaction.
+                        Updated by this method; the deferred writes
+                        are made by ``_write()``.
+        """
+
+        with utils.timed('reserve.registry'):
+            service, items = self._get_resources(context, svc_user, deltas)
+
+        # A retried request gets the reservation already made
+        if req_id is not None:
+            try:
+                reservation = self.dbapi.get_reservation(
+                    context, service=service, req_id=req_id)
+            except KeyError:
+                pass
+            else:
+                return dm_reservation.Reservation(
+                    svc_user, deltas, resv_id=reservation.id,
+                    req_id=req_id), False
+
+        # The keys depend only on the category, so are computed once
+        # per category
+        quota_keys = {}
+        usage_keys = {}
+
+        with utils.timed('reserve.quota'):
+            limits = []
+            for _spc, _delta, resource, plan in items:
+                keys = quota_keys.get(plan)
+                if keys is None:
+                    keys = quota_keys[plan] = plan.quota_keys(
+                        svc_user.auth_data)
+                limits.append(self._get_limit(context, resource, keys))
+
+        with utils.timed('reserve.usage'):
+            reserved = []
+            over = []
+            holds = len(pending.holds)
+            for (spc_resource, delta, resource, plan), limit in \
+                    zip(items, limits):
+                if resource.absolute:
+                    if limit is not None and delta > limit:
+                        over.append(spc_resource.name)
+                    continue
+
+                key = usage_keys.get(plan)
+                if key is None:
+                    key = usage_keys[plan] = plan.usage_key(
+                        svc_user.auth_data)
+                usage_id = (resource.id, key[1],
+                            utils.dict_serialize(spc_resource.param_data))
+                entry = pending.usages.get(usage_id)
+                if entry is None:
+                    usage = self._get_usage(context, resource,
+                                            spc_resource.param_data, key,
+                                            pending.fast)
+                    if pending.ledger:
+                        usage = self._get_amounts(context, usage.id)
+                    entry = pending.usages[usage_id] = [usage, 0]
+                usage, reserving = entry
+                if pending.ledger:
+                    # The amounts reserved so far in the transaction
+                    # are held, and counted by the check
+                    if delta > 0 and not self._hold(context, pending, entry,
+                                                    delta, limit):
+                        over.append(spc_resource.name)
+                elif (delta > 0 and limit is not None and
+                        usage.used + usage.reserved + reserving + delta >
+                        limit):
+                    over.append(spc_resource.name)
+                reserved.append((resource, entry, delta))
+
+            if over:
+                self._release(pending, holds)
+                raise exceptions.OverQuota(resources=', '.join(sorted(over)))
+
+        with utils.timed('reserve.insert'):
+            resv_id = utils.generate_uuid()
+            if pending.fast and req_id is None:
+                pending.reservations.append((resv_id, expire, service,
+                                             svc_user.auth_data))
+            else:
+                reservation = self.dbapi.create_reservation(
+                    context, expire, service=service,
+                    auth_data=svc_user.auth_data, req_id=req_id, id=resv_id)
+
+                # A concurrent retry of the request got there first
+                if reservation.id != resv_id:
+                    self._release(pending, holds)
+                    return dm_reservation.Reservation(
+                        svc_user, deltas, resv_id=reservation.id,
+                        req_id=req_id), False
+
+            for resource, entry, delta in reserved:
+                if pending.fast:
+                    pending.items.append((resv_id, resource.id, entry[0].id,
+                                          delta))
+                else:
+                    self.dbapi.reserve(context, resv_id, resource, entry[0],
+                                       delta)
+                if delta > 0:
+                    entry[1] += delta
+
+        return dm_reservation.Reservation(svc_user, deltas, resv_id=resv_id,
+                                          req_id=req_id), True
+
+    def _write(self, context, pending):
+        """
+        Make the writes deferred in a transaction: apply the amounts
+        reserved to the usage records, or append them to the ledger,
+        and, on the fast path, insert the reservations and reserved
+        items.  This is done just before committing, so that the
+        records are only written once, and conflicting updates are
+        only detected at the end.
+        """
+
+        reserved = [(usage, amount)
+                    for usage, amount in pending.usages.values() if amount]
+        if not pending.fast and not pending.ledger:
+            for usage, amount in reserved:
+                usage.reserved += amount
+            return
+
+        with utils.timed('reserve.write'):
+            if pending.fast:
+                self.dbapi.insert_reservations(context,
+                                               pending.reservations)
+                self.dbapi.insert_reserved_items(context, pending.items)
+            if pending.ledger:
+                self.dbapi.append_ledger(
+                    context, [(usage.id, 0, amount)
+                              for usage, amount in reserved])
+            else:
+                self.dbapi.update_reserved(context, reserved)
+
+    def check_absolute(self, context, svc_user, values):
+        """
+        Check values of absolute resources against their limits.
+        Raises an ``OverQuota`` exception if any value is over the
+        limit of its resource.  Nothing is reserved.
+
+        Resource lookups and limits are served from
+        ``boson.db.limit_cache.LIMITS``; the database is only
+        consulted for those not cached.
+
+        :param context: The current context for accessing the
+                        database.
+        :param svc_user: The ``ServiceUser`` to check the values for.
+        :param values: A dictionary mapping ``SpecificResource``
+                       objects to the values to check.
+        """
+
+        cache = limit_cache.LIMITS
+        svc_name = svc_user.service.name
+
+        with utils.timed('check_absolute.total'):
+            limits = {}
+            missing = {}
+            for spc_resource, value in values.items():
+                try:
+                    resource_id, plan = cache.get_resource(
+                        svc_name, spc_resource.resource.name)
+                    limits[spc_resource] = cache.get_limit(
+                        resource_id, plan.limit_key(svc_user.auth_data))
+                except KeyError:
+                    missing[spc_resource] = value
+
+            if missing:
+                with self.dbapi.transaction(context):
+                    _service, items = self._get_resources(context, svc_user,
+                                                          missing)
+                    for spc_resource, _value, resource, plan in items:
+                        cache.set_resource(svc_name, resource.name,
+                                           (resource.id, plan))
+                        generation = cache.generation(resource.id)
+                        limit = self._get_limit(
+                            context, resource,
+                            plan.quota_keys(svc_user.auth_data))
+                        cache.set_limit(resource.id,
+                                        plan.limit_key(svc_user.auth_data),
+                                        limit, generation)
+                        limits[spc_resource] = limit
+
+            over = [spc_resource.name
+                    for spc_resource, value in values.items()
+                    if (limits[spc_resource] is not None and
+                        value > limits[spc_resource])]
+            if over:
+                raise exceptions.OverQuota(resources=', '.join(sorted(over)))
+
+    def report(self, context, svc_user):
+        """
+        Report the usages and limits of all resources of a service for
+        a user.
+
+        :param context: The current context for accessing the
+                        database.
+        :param svc_user: The ``ServiceUser`` to report on.
+
+        :returns: A list of ``boson.db.api.UsageReport`` tuples.
+        """
+
+        with utils.timed('report.total'):
+            service = self.dbapi.get_service(context,
+                                             name=svc_user.service.name)
+            return self.dbapi.get_usage_report(context, service,
+                                               svc_user.auth_data)
+
+    def commit(self, context, resv_id):
+        """
+        Commit a reservation.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resv_id: The ID of the reservation.
+        """
+
+        with utils.timed('commit.total'):
+            self._retrying('commit', self._finish, context, resv_id, True)
+
+    def rollback(self, context, resv_id):
+        """
+        Roll back a reservation.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resv_id: The ID of the reservation.
+        """
+
+        with utils.timed('rollback.total'):
+            self._retrying('rollback', self._finish, context, resv_id,
+                           False)
+
+    def _finish(self, context, resv_id, commit):
+        """Commit or roll back a reservation in one transaction."""
+
+        with self.dbapi.transaction(context):
+            if commit:
+                self.dbapi.commit_reservation(context, resv_id,
+                                              lock=self._lock,
+                                              ledger=self._ledger)
+            else:
+                self.dbapi.rollback_reservation(context, resv_id,
+                                                lock=self._lock,
+                                                ledger=self._ledger)
+
+    def expire(self, context):
+        """
+        Roll back all expired reservations, in batches.
+
+        :param context: The current context for accessing the
+                        database.
+
+        :returns: The number of reservations rolled back.
+        """
+
+        batch = CONF.reservation_expire_batch
+        total = 0
+        with utils.timed('expire.total'):
+            while True:
+                count = self._retrying('expire', self._expire, context,
+                                       batch)
+                total += count
+                if not batch or count < batch:
+                    break
+
+        return total
+
+    def _expire(self, context, batch):
+        """
+        Roll back a batch of the oldest expired reservations in one
+        transaction.  Returns the number rolled back.
+        """
+
+        with utils.timed('expire.batch'):
+            with self.dbapi.transaction(context):
+                expired = self.dbapi.expire_reservations(
+                    context, lock=self._lock, ledger=self._ledger,
+                    limit=batch)
+                oldest = expired[0].expire if expired else None
+
+        self.expire_batch_sizes.record(len(expired))
+        if oldest is not None:
+            lag = utils.total_seconds(timeutils.utcnow() - oldest)
+            utils.TIMERS.record('expire.lag', max(lag, 0))
+        return len(expired)
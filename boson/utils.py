@@ -15,9 +15,38 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+import math
 import re
+import socket
+import threading
+import time
 import uuid
 
+try:
+    import eventlet
+    import greenlet
+except ImportError:
+    eventlet = None
+
+from boson.openstack.common import cfg
+
+
+timing_opts = [
+    cfg.StrOpt('statsd_host',
+               default=None,
+               help='Host to send timings to, using the statsd protocol; '
+                    'if unset, timings are only kept in memory'),
+    cfg.IntOpt('statsd_port',
+               default=8125,
+               help='UDP port of the statsd host'),
+    cfg.StrOpt('statsd_prefix',
+               default='boson.',
+               help='Prefix for the names of timings sent to statsd'),
+]
+
+cfg.CONF.register_opts(timing_opts)
+
 
 serialize_re = re.compile(r"""[/%="']""")
 deserialize_re = re.compile(r'%([0-9A-Fa-f]{2})')
@@ -74,6 +103,23 @@ def dict_serialize(data):
     return '/'.join(result)
 
 
+def dict_serializer(fields):
+    """
+    Return a function serializing only the given fields of a data
+    dictionary, with the same result as applying ``dict_serialize()``
+    to ``project(data, fields)``.  The key ordering and the key
+    prefixes are computed once, rather than on every call.
+    """
+
+    templates = tuple((k, '%s=%%s' % k) for k in sorted(fields))
+
+    def serialize(data):
+        return '/'.join(tmpl % _serialize(data[k])
+                        for k, tmpl in templates if k in data)
+
+    return serialize
+
+
 def dict_deserialize(data):
     """
     Deserialize a data string, as generated by dict_serialize(), into
@@ -81,6 +127,9 @@ def dict_deserialize(data):
     """
 
     result = {}
+    if not data:
+        return result
+
     for comp in data.split('/'):
         key, value = comp.split('=')
         result[key] = _deserialize(value)
@@ -88,9 +137,291 @@ def dict_deserialize(data):
     return result
 
 
+def project(data, fields):
+    """
+    Select the given fields from a data dictionary.  Fields missing
+    from the data are omitted.
+    """
+
+    return dict((k, data[k]) for k in fields if k in data)
+
+
 def generate_uuid():
     """
     Generate and return a string UUID.
     """
 
     return str(uuid.uuid4())
+
+
+def total_seconds(delta):
+    """
+    Return the number of seconds in a ``datetime.timedelta``, as
+    ``timedelta.total_seconds()`` does on Python 2.7 and later.
+    """
+
+    return (delta.days * 86400 + delta.seconds) + delta.microseconds / 1e6
+
+
+def in_green_thread():
+    """
+    Determine whether the caller is running in an eventlet green
+    thread, rather than directly in a native thread.
+    """
+
+    return eventlet is not None and greenlet.getcurrent().parent is not None
+
+
+def sleep(seconds):
+    """
+    Sleep, yielding to the other green threads if running in one, even
+    if ``time`` has not been monkey-patched.
+    """
+
+    if in_green_thread():
+        eventlet.sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+
+def spawn(func, *args):
+    """
+    Run a function in the background: in a new green thread if running
+    in one, otherwise in a new daemon thread.
+    """
+
+    if in_green_thread():
+        eventlet.spawn_n(func, *args)
+    else:
+        thread = threading.Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
+
+
+class Histogram(object):
+    """
+    A histogram of non-negative integer values, such as latencies in
+    microseconds.  As in HDR histograms, buckets are log-linear: each
+    power of two is split into the same number of equal-width buckets,
+    so values are recorded with a bounded relative error (about 3% with
+    the default precision) in constant time and space, however large.
+    """
+
+    def __init__(self, precision=5):
+        """
+        Initialize a Histogram.
+
+        :param precision: The number of bits of each value which are
+                          preserved exactly; each power of two is
+                          split into ``2 ** precision`` buckets.
+        """
+
+        self._sub_bits = precision + 1
+        self._sub_count = 1 << self._sub_bits
+        self._half_count = self._sub_count >> 1
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        """Return the index of the bucket for a value."""
+
+        if value < self._sub_count:
+            return value
+        shift = math.frexp(value)[1] - self._sub_bits
+        return (self._sub_count + (shift - 1) * self._half_count +
+                (value >> shift) - self._half_count)
+
+    def _highest(self, index):
+        """Return the highest value counted in a bucket."""
+
+        if index < self._sub_count:
+            return index
+        shift, offset = divmod(index - self._sub_count, self._half_count)
+        shift += 1
+        return ((offset + self._half_count + 1) << shift) - 1
+
+    def record(self, value):
+        """Record a value."""
+
+        value = max(int(value), 0)
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] = self._counts.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, pct):
+        """
+        Return the value below which the given percentage of the
+        recorded values fall, or ``None`` if nothing was recorded.
+        """
+
+        with self._lock:
+            if not self.count:
+                return None
+            wanted = max(int(math.ceil(self.count * pct / 100.0)), 1)
+            seen = 0
+            for index in sorted(self._counts):
+                seen += self._counts[index]
+                if seen >= wanted:
+                    return min(self._highest(index), self.max)
+            return self.max
+
+    def snapshot(self):
+        """Return a dictionary summarizing the recorded values."""
+
+        summary = dict(count=self.count, min=self.min, max=self.max,
+                       mean=(float(self.total) / self.count
+                             if self.count else None))
+        for pct in (50, 90, 99, 99.9):
+            summary['p%s' % pct] = self.percentile(pct)
+        return summary
+
+
+class Timer(object):
+    """
+    Time a block of code, for use as a context manager or decorator.
+    Elapsed times are recorded in the registry in microseconds.
+    """
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.registry.record(self.name, time.time() - self._start)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(self.registry, self.name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+class TimerRegistry(object):
+    """
+    A registry of named timing histograms.  Each recorded time is also
+    passed to any registered sinks.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.sinks = []
+
+    def timer(self, name):
+        """Return a ``Timer`` for the named histogram."""
+
+        return Timer(self, name)
+
+    def record(self, name, elapsed):
+        """
+        Record an elapsed time.
+
+        :param name: The name of the histogram.
+        :param elapsed: The elapsed time, in seconds.
+        """
+
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        histogram.record(elapsed * 1000000)
+
+        for sink in self.sinks:
+            sink.timing(name, elapsed)
+
+    def report(self):
+        """
+        Return a dictionary mapping histogram names to summaries, with
+        values in microseconds.
+        """
+
+        return dict((name, histogram.snapshot())
+                    for name, histogram in self._histograms.items())
+
+    def reset(self):
+        """Discard all recorded times."""
+
+        with self._lock:
+            self._histograms = {}
+
+
+class StatsdSink(object):
+    """
+    Send timings to a statsd-compatible daemon over UDP.  Send errors
+    are ignored; timings are best-effort.
+    """
+
+    def __init__(self, host, port=8125, prefix=''):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def timing(self, name, elapsed):
+        """Send an elapsed time, given in seconds."""
+
+        try:
+            packet = '%s%s:%.3f|ms' % (self.prefix, name, elapsed * 1000)
+            self._socket.sendto(packet, self.address)
+        except socket.error:
+            pass
+
+
+TIMERS = TimerRegistry()
+
+
+def timed(name):
+    """
+    Time a block of code or a function into the named histogram of the
+    global timer registry.  For use as a context manager or decorator.
+    """
+
+    return TIMERS.timer(name)
+
+
+def timed_methods(prefix):
+    """
+    Class decorator which times every public method of the class into
+    a histogram named after the prefix and the method name.
+    """
+
+    def decorator(cls):
+        for name, value in vars(cls).items():
+            if name[0] != '_' and callable(value):
+                setattr(cls, name, timed('%s.%s' % (prefix, name))(value))
+        return cls
+
+    return decorator
+
+
+def setup_timing():
+    """
+    Add a statsd sink to the global timer registry, if configured.
+    Any statsd sink added by an earlier call is replaced, so this may
+    be called once per application.
+    """
+
+    sinks = [sink for sink in TIMERS.sinks
+             if not isinstance(sink, StatsdSink)]
+    if cfg.CONF.statsd_host:
+        sinks.append(StatsdSink(cfg.CONF.statsd_host,
+                                cfg.CONF.statsd_port,
+                                cfg.CONF.statsd_prefix))
+    TIMERS.sinks = sinks
@@ -31,7 +31,7 @@ setuptools.setup(
     author='OpenStack',
     author_email='openstack-dev@lists.openstack.org',
     url='http://www.openstack.org/',
-    packages=setuptools.find_packages(exclude=['bin', 'tests']),
+    packages=setuptools.find_packages(exclude=['benchmarks', 'bin', 'tests']),
     test_suite='nose.collector',
     cmdclass=setup.get_cmdclass(),
     include_package_data=True,
@@ -15,8 +15,65 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+
 import unittest2
 
 
 class TestCase(unittest2.TestCase):
     pass
+
+
+class DBTestCase(TestCase):
+    """
+    Test case running against an in-memory SQLite database, with the
+    tables created afresh for each test.
+    """
+
+    def setUp(self):
+        super(DBTestCase, self).setUp()
+
+        # Imported here so tests not touching the database do not
+        # require SQLAlchemy
+        from boson import context
+        from boson.db import limit_cache
+        from boson.db import usage_ledger
+        from boson.db.sqlalchemy import api as sa_api
+        from boson.db.sqlalchemy import models as sa_models
+        from boson.db.sqlalchemy import session as db_session
+        from boson.openstack.common import cfg
+
+        cfg.CONF.set_override('database_connection', 'sqlite://')
+        cfg.CONF.set_override('sql_connection_debug', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'database_connection')
+        self.addCleanup(cfg.CONF.clear_override, 'sql_connection_debug')
+
+        # Key filters are rebuilt in the background, which the single
+        # connection to the in-memory database does not allow
+        cfg.CONF.set_override('key_filter_interval', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'key_filter_interval')
+
+        self.engine = db_session.get_engine()
+        sa_models.BASE.metadata.create_all(self.engine)
+        self.addCleanup(sa_models.BASE.metadata.drop_all, self.engine)
+        self.addCleanup(sa_api._RESOURCE_INDEX.forget)
+        self.addCleanup(sa_api._USAGE_KEYS.clear)
+        self.addCleanup(limit_cache.LIMITS.clear)
+        self.addCleanup(usage_ledger.TOTALS.clear)
+
+        self.dbapi = sa_api.API()
+        self.context = context.Context('user', 'tenant')
+        self.dbapi.create_session(self.context)
+        self.addCleanup(self.context.session.close)
+
+    @contextlib.contextmanager
+    def assert_max_queries(self, count):
+        """
+        Fail unless at most ``count`` SQL statements are executed
+        within the ``with`` block.
+        """
+
+        from boson.db.sqlalchemy import profiling
+
+        with profiling.assert_max_queries(self.engine, count) as capture:
+            yield capture
@@ -0,0 +1,91 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import webob
+
+from boson.api import admin
+from boson.db.sqlalchemy import session as db_session
+from boson.openstack.common import jsonutils
+from boson import utils
+
+import tests
+
+
+class AdminAppTestCase(tests.TestCase):
+    def setUp(self):
+        super(AdminAppTestCase, self).setUp()
+
+        patcher = mock.patch.object(utils, 'TIMERS', utils.TimerRegistry())
+        self.timers = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.app = admin.AdminApp()
+
+    def test_timings(self):
+        self.timers.record('reserve.total', 0.002)
+
+        resp = webob.Request.blank('/timings').get_response(self.app)
+
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+        body = jsonutils.loads(resp.body)
+        self.assertEqual(body['reserve.total']['count'], 1)
+        self.assertEqual(body['reserve.total']['max'], 2000)
+
+    @mock.patch.object(db_session, 'status')
+    def test_health(self, mock_status):
+        mock_status.return_value = dict(status='ready', attempts=1,
+                                        error=None)
+
+        resp = webob.Request.blank('/health').get_response(self.app)
+
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(jsonutils.loads(resp.body),
+                         dict(database=dict(status='ready', attempts=1,
+                                            error=None)))
+
+    @mock.patch.object(db_session, 'status')
+    def test_health_not_ready(self, mock_status):
+        mock_status.return_value = dict(status='starting', attempts=2,
+                                        error='gone away')
+
+        resp = webob.Request.blank('/health').get_response(self.app)
+
+        self.assertEqual(resp.status_int, 503)
+        self.assertEqual(jsonutils.loads(resp.body)['database']['status'],
+                         'starting')
+
+    def test_not_found(self):
+        resp = webob.Request.blank('/spam').get_response(self.app)
+
+        self.assertEqual(resp.status_int, 404)
+
+    def test_method_not_allowed(self):
+        resp = webob.Request.blank('/timings',
+                                   method='POST').get_response(self.app)
+
+        self.assertEqual(resp.status_int, 405)
+
+    @mock.patch.object(db_session, 'start')
+    @mock.patch.object(utils, 'setup_timing')
+    def test_app_factory(self, mock_setup_timing, mock_start):
+        app = admin.app_factory({})
+
+        self.assertTrue(isinstance(app, admin.AdminApp))
+        mock_setup_timing.assert_called_once_with()
+        mock_start.assert_called_once_with()
@@ -0,0 +1,55 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import os
+import subprocess
+import sys
+
+import tests
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+class BenchmarksTestCase(tests.TestCase):
+    """Smoke-run each benchmark as documented, on a small workload."""
+
+    def _run(self, module, *args):
+        proc = subprocess.Popen([sys.executable, '-m', module] + list(args),
+                                cwd=ROOT, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+
+        self.assertEqual(proc.returncode, 0, output)
+        return output
+
+    def test_jsonutils_bench(self):
+        output = self._run('benchmarks.jsonutils_bench', '10', '1')
+
+        self.assertTrue(output.startswith('dicts '))
+
+    def test_data_model_bench(self):
+        self._run('benchmarks.data_model_bench', '10')
+
+    def test_quota_bench(self):
+        output = self._run('benchmarks.quota_bench', '--ops', '10')
+
+        self.assertTrue(output.startswith('sqlite://, 1 threads'))
+
+    def test_quota_bench_ledger(self):
+        self._run('benchmarks.quota_bench', '--ops', '10',
+                  '--concurrency', 'ledger')
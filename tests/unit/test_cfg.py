@@ -0,0 +1,59 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+
+from boson.openstack.common import cfg
+
+import tests
+
+
+class ChoicesTestCase(tests.TestCase):
+    def setUp(self):
+        super(ChoicesTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        self.conf = cfg.ConfigOpts()
+        self.conf.register_opt(cfg.StrOpt('policy', default='drop',
+                                          choices=('drop', 'block')))
+
+    def _config_file(self, value):
+        path = os.path.join(self.tmpdir, 'test.conf')
+        with open(path, 'w') as f:
+            f.write('[DEFAULT]\npolicy = %s\n' % value)
+        return path
+
+    def test_default(self):
+        self.conf([], default_config_files=[])
+
+        self.assertEqual(self.conf.policy, 'drop')
+
+    def test_valid(self):
+        self.conf(['--config-file', self._config_file('block')])
+
+        self.assertEqual(self.conf.policy, 'block')
+
+    def test_invalid(self):
+        self.assertRaises(cfg.InvalidChoiceError, self.conf,
+                          ['--config-file', self._config_file('spam')])
+
+    def test_invalid_cli(self):
+        self.assertRaises(cfg.InvalidChoiceError, self.conf,
+                          ['--policy', 'spam'], default_config_files=[])
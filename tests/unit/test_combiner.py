@@ -0,0 +1,152 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+import mock
+
+from boson import combiner
+from boson.data_model import resource as dm_resource
+from boson.data_model import service as dm_service
+from boson import exceptions
+
+import tests
+
+
+class ReservationCombinerTestCase(tests.TestCase):
+    def setUp(self):
+        super(ReservationCombinerTestCase, self).setUp()
+
+        service = dm_service.Service('nova', ['tenant_id'])
+        self.svc_user = dm_service.ServiceUser(service,
+                                               dict(tenant_id='tenant'))
+        self.other_user = dm_service.ServiceUser(service,
+                                                 dict(tenant_id='other'))
+        self.instances = dm_resource.SpecificResource(
+            dm_resource.Resource(service, 'instances'))
+        self.engine = mock.Mock()
+
+    def _reserve_concurrently(self, combiner_, requests):
+        """
+        Make reservation requests from separate threads, and return
+        their results or exceptions, in order.
+        """
+
+        results = [None] * len(requests)
+
+        def target(idx, svc_user, deltas):
+            try:
+                results[idx] = combiner_.reserve('ctxt', svc_user, deltas)
+            except Exception as exc:
+                results[idx] = exc
+
+        threads = [threading.Thread(target=target, args=(idx,) + request)
+                   for idx, request in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_usage_key(self):
+        self.assertEqual(combiner.usage_key(self.svc_user,
+                                            {self.instances: 1}),
+                         combiner.usage_key(self.svc_user,
+                                            {self.instances: 5}))
+        self.assertNotEqual(combiner.usage_key(self.svc_user,
+                                               {self.instances: 1}),
+                            combiner.usage_key(self.other_user,
+                                               {self.instances: 1}))
+
+    def test_disabled(self):
+        combiner_ = combiner.ReservationCombiner(self.engine, window=0)
+
+        result = combiner_.reserve('ctxt', self.svc_user,
+                                   {self.instances: 1}, req_id='req-1')
+
+        self.assertEqual(result, self.engine.reserve.return_value)
+        self.engine.reserve.assert_called_once_with(
+            'ctxt', self.svc_user, {self.instances: 1}, expire=None,
+            req_id='req-1')
+
+    def test_single(self):
+        combiner_ = combiner.ReservationCombiner(self.engine, window=1)
+
+        result = combiner_.reserve('ctxt', self.svc_user,
+                                   {self.instances: 1})
+
+        self.assertEqual(result, self.engine.reserve.return_value)
+        self.assertFalse(self.engine.reserve_batch.called)
+        self.assertEqual(combiner_.batch_sizes.count, 1)
+
+    def test_single_error(self):
+        self.engine.reserve.side_effect = exceptions.OverQuota(
+            resources='instances')
+        combiner_ = combiner.ReservationCombiner(self.engine, window=1)
+
+        self.assertRaises(exceptions.OverQuota, combiner_.reserve, 'ctxt',
+                          self.svc_user, {self.instances: 1})
+
+    def test_combined(self):
+        over = exceptions.OverQuota(resources='instances')
+        self.engine.reserve_batch.return_value = ['resv0', over, 'resv2']
+        # The batch is made as soon as it is full
+        combiner_ = combiner.ReservationCombiner(self.engine, window=10000,
+                                                 size=3)
+
+        results = self._reserve_concurrently(combiner_, [
+            (self.svc_user, {self.instances: 1}),
+        ] * 3)
+
+        self.assertEqual(sorted(results), sorted(['resv0', over, 'resv2']))
+        self.assertEqual(self.engine.reserve_batch.call_count, 1)
+        requests = self.engine.reserve_batch.call_args[0][1]
+        self.assertEqual(requests, [(self.svc_user, {self.instances: 1},
+                                     None, None)] * 3)
+        self.assertFalse(self.engine.reserve.called)
+
+    def test_separate_keys(self):
+        self.engine.reserve_batch.return_value = ['resv0', 'resv1']
+        combiner_ = combiner.ReservationCombiner(self.engine, window=10000,
+                                                 size=2)
+
+        results = self._reserve_concurrently(combiner_, [
+            (self.svc_user, {self.instances: 1}),
+            (self.other_user, {self.instances: 1}),
+            (self.svc_user, {self.instances: 1}),
+            (self.other_user, {self.instances: 1}),
+        ])
+
+        self.assertEqual(self.engine.reserve_batch.call_count, 2)
+        for call in self.engine.reserve_batch.call_args_list:
+            users = set(request[0] for request in call[0][1])
+            self.assertEqual(len(users), 1)
+        self.assertEqual(sorted(results), ['resv0', 'resv0', 'resv1',
+                                           'resv1'])
+
+    def test_batch_failure(self):
+        self.engine.reserve_batch.side_effect = exceptions.ConcurrentUpdate(
+            reason='test')
+        combiner_ = combiner.ReservationCombiner(self.engine, window=10000,
+                                                 size=2)
+
+        results = self._reserve_concurrently(combiner_, [
+            (self.svc_user, {self.instances: 1}),
+        ] * 2)
+
+        for result in results:
+            self.assertTrue(isinstance(result, exceptions.ConcurrentUpdate))
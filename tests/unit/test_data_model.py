@@ -0,0 +1,131 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import gc
+
+from boson.data_model import resource
+from boson.data_model import service
+
+import tests
+
+
+class SpecificResourceTestCase(tests.TestCase):
+    def setUp(self):
+        super(SpecificResourceTestCase, self).setUp()
+
+        self.service = service.Service('nova', ['tenant_id'])
+        self.resource = resource.Resource(self.service, 'fixed_ips',
+                                          ['instance', 'network'])
+
+    def test_name(self):
+        spc = resource.SpecificResource(self.resource,
+                                        dict(network='net', instance='inst',
+                                             spam='spam'))
+
+        self.assertEqual(spc.name,
+                         "nova/fixed_ips/instance='inst'/network='net'")
+        self.assertEqual(spc.param_data,
+                         dict(instance='inst', network='net'))
+        self.assertEqual(hash(spc), hash(spc.name))
+
+    def test_missing(self):
+        self.assertRaises(ValueError, resource.SpecificResource,
+                          self.resource, dict(instance='inst'))
+
+    def test_interned(self):
+        spc1 = resource.SpecificResource(self.resource,
+                                         dict(instance='a', network='n'))
+        spc2 = resource.SpecificResource(self.resource,
+                                         dict(instance='a', network='n'))
+        spc3 = resource.SpecificResource(self.resource,
+                                         dict(instance='b', network='n'))
+
+        self.assertTrue(spc1.name is spc2.name)
+        self.assertEqual(spc1, spc2)
+        self.assertNotEqual(spc1, spc3)
+        self.assertEqual(len(set([spc1, spc2, spc3])), 2)
+
+    def test_cache_is_weak(self):
+        spc = resource.SpecificResource(self.resource,
+                                        dict(instance='a', network='n'))
+        self.assertEqual(len(self.resource._names), 1)
+
+        del spc
+        gc.collect()
+
+        self.assertEqual(len(self.resource._names), 0)
+
+    def test_unhashable_params(self):
+        spc1 = resource.SpecificResource(self.resource,
+                                         dict(instance=['a'], network='n'))
+        spc2 = resource.SpecificResource(self.resource,
+                                         dict(instance=['a'], network='n'))
+
+        self.assertEqual(spc1, spc2)
+        self.assertEqual(hash(spc1), hash(spc2))
+
+    def test_equal_values_of_other_types(self):
+        spc1 = resource.SpecificResource(self.resource,
+                                         dict(instance=True, network='n'))
+        spc2 = resource.SpecificResource(self.resource,
+                                         dict(instance=1, network='n'))
+        spc3 = resource.SpecificResource(self.resource,
+                                         dict(instance=u'a', network='n'))
+        spc4 = resource.SpecificResource(self.resource,
+                                         dict(instance='a', network='n'))
+
+        self.assertEqual(spc1.name, "nova/fixed_ips/instance=True/"
+                         "network='n'")
+        self.assertEqual(spc2.name, "nova/fixed_ips/instance=1/network='n'")
+        self.assertEqual(spc3.name, "nova/fixed_ips/instance=u'a'/"
+                         "network='n'")
+        self.assertEqual(spc4.name, "nova/fixed_ips/instance='a'/"
+                         "network='n'")
+        self.assertNotEqual(spc1, spc2)
+        self.assertNotEqual(spc3, spc4)
+
+    def test_slots(self):
+        spc = resource.SpecificResource(self.resource,
+                                        dict(instance='a', network='n'))
+
+        self.assertRaises(AttributeError, setattr, spc, 'spam', 1)
+
+
+class ServiceTestCase(tests.TestCase):
+    def setUp(self):
+        super(ServiceTestCase, self).setUp()
+
+        self.service = service.Service('nova', ['tenant_id', 'user_id'])
+
+    def test_category(self):
+        category = service.Category(self.service, 'compute',
+                                    ['tenant_id', 'spam'],
+                                    [['tenant_id', 'user_id'], ['eggs'], []])
+
+        self.assertEqual(category.usage_fields, set(['tenant_id']))
+        self.assertEqual(category.quota_fieldsets,
+                         [set(['tenant_id', 'user_id']), set(), set()])
+
+    def test_service_user(self):
+        svc_user = service.ServiceUser(self.service,
+                                       dict(tenant_id='t', user_id='u',
+                                            spam='spam'))
+
+        self.assertEqual(svc_user.auth_data, dict(tenant_id='t',
+                                                  user_id='u'))
+        self.assertRaises(ValueError, service.ServiceUser, self.service,
+                          dict(tenant_id='t'))
@@ -0,0 +1,77 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import datetime
+
+import mock
+
+from boson.db import archive
+from boson.openstack.common import timeutils
+from boson import utils
+
+import tests
+
+
+class ArchiverTestCase(tests.TestCase):
+    def setUp(self):
+        super(ArchiverTestCase, self).setUp()
+
+        self.dbapi = mock.MagicMock()
+        self.context = mock.Mock()
+        self.archiver = archive.Archiver(self.dbapi, retention=2, batch=2,
+                                         interval=5)
+
+        patcher = mock.patch.object(utils, 'TIMERS', utils.TimerRegistry())
+        self.timers = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        now = datetime.datetime(2012, 7, 15, 12)
+        timeutils.set_time_override(now)
+        self.addCleanup(timeutils.clear_time_override)
+        self.before = now - datetime.timedelta(hours=2)
+
+    def test_archive(self):
+        oldest = self.before - datetime.timedelta(seconds=30)
+        self.dbapi.archive_reservations.side_effect = [
+            [oldest, self.before], [self.before, self.before], []]
+
+        self.assertEqual(self.archiver.archive(self.context), 4)
+
+        self.assertEqual(self.dbapi.archive_reservations.call_args_list,
+                         [mock.call(self.context, self.before, 2)] * 3)
+        self.assertEqual(self.dbapi.transaction.call_count, 3)
+        self.assertEqual(self.archiver.batch_sizes.count, 3)
+        self.assertEqual(self.archiver.batch_sizes.max, 2)
+        report = self.timers.report()
+        self.assertEqual(report['archive.batch']['count'], 3)
+        self.assertEqual(report['archive.total']['count'], 1)
+        self.assertEqual(report['archive.lag']['count'], 2)
+        self.assertAlmostEqual(report['archive.lag']['max'] / 1e6, 30,
+                               delta=1)
+
+    def test_archive_nothing(self):
+        self.dbapi.archive_reservations.return_value = []
+
+        self.assertEqual(self.archiver.archive(self.context), 0)
+
+        self.assertFalse('archive.lag' in self.timers.report())
+
+    def test_defaults(self):
+        archiver = archive.Archiver(self.dbapi)
+
+        self.assertEqual(archiver.retention, 24)
+        self.assertEqual(archiver.batch, 100)
+        self.assertEqual(archiver.interval, 300)
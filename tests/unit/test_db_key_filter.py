@@ -0,0 +1,138 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.db import key_filter
+from boson import utils
+
+import tests
+
+
+class BloomFilterTestCase(tests.TestCase):
+    def test_contains(self):
+        bloom = key_filter.BloomFilter(100)
+        for i in range(100):
+            bloom.add('key-%d' % i)
+
+        for i in range(100):
+            self.assertTrue('key-%d' % i in bloom)
+
+    def test_error_rate(self):
+        bloom = key_filter.BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add('key-%d' % i)
+
+        misses = sum(1 for i in range(10000) if 'other-%d' % i in bloom)
+        self.assertTrue(misses < 300)
+
+
+class KeyFilterTestCase(tests.TestCase):
+    def setUp(self):
+        super(KeyFilterTestCase, self).setUp()
+
+        self.keys = ['a', 'b']
+        self.loader = mock.Mock(side_effect=lambda: list(self.keys))
+        self.filter = key_filter.KeyFilter(self.loader, interval=60)
+
+        # Rebuild at once rather than in the background
+        patcher = mock.patch.object(utils, 'spawn',
+                                    side_effect=lambda func, *args:
+                                    func(*args))
+        self.mock_spawn = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_might_contain(self):
+        self.assertTrue(self.filter.might_contain('a'))
+        self.assertFalse(self.filter.might_contain('c'))
+        self.loader.assert_called_once_with()
+
+    def test_rebuild_in_background(self):
+        self.mock_spawn.side_effect = None
+
+        # Not built yet, so every key may be present
+        self.assertTrue(self.filter.might_contain('c'))
+        self.assertTrue(self.filter.might_contain('c'))
+
+        self.assertEqual(self.mock_spawn.call_count, 1)
+        self.assertFalse(self.loader.called)
+
+    @mock.patch('time.time')
+    def test_rebuild(self, mock_time):
+        mock_time.return_value = 1000
+        self.assertFalse(self.filter.might_contain('c'))
+        self.keys.append('c')
+
+        mock_time.return_value = 1059
+        self.assertFalse(self.filter.might_contain('c'))
+        mock_time.return_value = 1061
+        self.assertTrue(self.filter.might_contain('c'))
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_disabled(self):
+        filter = key_filter.KeyFilter(self.loader, interval=0)
+
+        self.assertTrue(filter.might_contain('c'))
+        self.assertFalse(self.loader.called)
+
+    def test_add(self):
+        self.assertFalse(self.filter.might_contain('c'))
+        self.filter.add('c')
+
+        self.assertTrue(self.filter.might_contain('c'))
+
+    def test_add_uncommitted(self):
+        # Added before the filter is built, but not loaded
+        self.filter.add('c')
+        self.assertTrue(self.filter.might_contain('c'))
+
+        # Kept over the next rebuild, then dropped
+        self.filter._built = 0
+        self.assertTrue(self.filter.might_contain('c'))
+        self.filter._built = 0
+        self.assertFalse(self.filter.might_contain('c'))
+
+    def test_add_while_rebuilding(self):
+        def loader():
+            self.filter.add('c')
+            return list(self.keys)
+        self.loader.side_effect = loader
+
+        self.assertTrue(self.filter.might_contain('c'))
+
+    def test_rebuild_fails(self):
+        self.loader.side_effect = RuntimeError('db down')
+        self.filter.add('c')
+
+        with mock.patch.object(key_filter, 'LOG') as mock_log:
+            self.assertTrue(self.filter.might_contain('d'))
+        self.assertEqual(mock_log.exception.call_count, 1)
+
+        # Retried once the interval elapses
+        self.loader.side_effect = lambda: list(self.keys)
+        self.assertTrue(self.filter.might_contain('d'))
+        self.filter._built = 0
+        self.assertTrue(self.filter.might_contain('c'))
+        self.assertFalse(self.filter.might_contain('d'))
+
+    def test_clear(self):
+        self.assertFalse(self.filter.might_contain('c'))
+        self.keys.append('c')
+        self.filter.clear()
+
+        self.assertTrue(self.filter.might_contain('c'))
+        self.assertEqual(self.loader.call_count, 2)
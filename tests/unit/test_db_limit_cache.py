@@ -0,0 +1,177 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.db import limit_cache
+
+import tests
+
+
+class LimitCacheTestCase(tests.TestCase):
+    def setUp(self):
+        super(LimitCacheTestCase, self).setUp()
+
+        self.cache = limit_cache.LimitCache(ttl=10)
+
+    def test_resource(self):
+        self.assertRaises(KeyError, self.cache.get_resource, 'nova', 'spam')
+
+        self.cache.set_resource('nova', 'instances', 'value')
+
+        self.assertEqual(self.cache.get_resource('nova', 'instances'),
+                         'value')
+
+    def test_limit(self):
+        self.assertRaises(KeyError, self.cache.get_limit, 'res', ('a',))
+
+        self.cache.set_limit('res', ('a',), None,
+                             self.cache.generation('res'))
+
+        self.assertEqual(self.cache.get_limit('res', ('a',)), None)
+        self.assertRaises(KeyError, self.cache.get_limit, 'res', ('b',))
+
+    @mock.patch('time.time')
+    def test_expiry(self, mock_time):
+        mock_time.return_value = 1000.0
+        self.cache.set_resource('nova', 'instances', 'value')
+        self.cache.set_limit('res', ('a',), 5, self.cache.generation('res'))
+
+        mock_time.return_value = 1011.0
+
+        self.assertRaises(KeyError, self.cache.get_resource, 'nova',
+                          'instances')
+        self.assertRaises(KeyError, self.cache.get_limit, 'res', ('a',))
+
+    def test_invalidate(self):
+        self.cache.set_limit('res', ('a',), 5, self.cache.generation('res'))
+        self.cache.set_limit('other', ('a',), 5,
+                             self.cache.generation('other'))
+
+        self.cache.invalidate('res')
+
+        self.assertRaises(KeyError, self.cache.get_limit, 'res', ('a',))
+        self.assertEqual(self.cache.get_limit('other', ('a',)), 5)
+
+    def test_quota_missing(self):
+        self.assertFalse(self.cache.quota_missing('res', 'a'))
+
+        self.cache.set_quota_missing('res', 'a', self.cache.generation('res'))
+
+        self.assertTrue(self.cache.quota_missing('res', 'a'))
+        self.assertFalse(self.cache.quota_missing('res', 'b'))
+        self.assertFalse(self.cache.quota_missing('other', 'a'))
+
+    @mock.patch('time.time')
+    def test_quota_missing_expiry(self, mock_time):
+        mock_time.return_value = 1000.0
+        self.cache.set_quota_missing('res', 'a', self.cache.generation('res'))
+
+        mock_time.return_value = 1011.0
+
+        self.assertFalse(self.cache.quota_missing('res', 'a'))
+
+    def test_quota_missing_invalidate(self):
+        self.cache.set_quota_missing('res', 'a', self.cache.generation('res'))
+        generation = self.cache.generation('other')
+        self.cache.invalidate('other')
+        self.cache.set_quota_missing('other', 'a', generation)
+
+        self.cache.invalidate('res')
+
+        self.assertFalse(self.cache.quota_missing('res', 'a'))
+        self.assertFalse(self.cache.quota_missing('other', 'a'))
+
+    def test_stale_generation(self):
+        generation = self.cache.generation('res')
+        self.cache.invalidate('res')
+
+        self.cache.set_limit('res', ('a',), 5, generation)
+
+        self.assertRaises(KeyError, self.cache.get_limit, 'res', ('a',))
+
+    def test_clear(self):
+        generation = self.cache.generation('res')
+        self.cache.set_resource('nova', 'instances', 'value')
+
+        self.cache.set_quota_missing('res', 'a', generation)
+
+        self.cache.clear()
+        self.cache.set_limit('res', ('a',), 5, generation)
+
+        self.assertFalse(self.cache.quota_missing('res', 'a'))
+
+        self.assertRaises(KeyError, self.cache.get_resource, 'nova',
+                          'instances')
+        self.assertRaises(KeyError, self.cache.get_limit, 'res', ('a',))
+
+    @mock.patch('time.time')
+    def test_expired_dropped(self, mock_time):
+        mock_time.return_value = 1000.0
+        self.cache.set_resource('nova', 'instances', 'value')
+        self.cache.set_limit('res', ('a',), 5, self.cache.generation('res'))
+        mock_time.return_value = 1005.0
+        self.cache.set_limit('res', ('b',), 5, self.cache.generation('res'))
+
+        mock_time.return_value = 1011.0
+        self.cache.set_resource('nova', 'cores', 'value')
+        self.cache.set_limit('res', ('c',), 5, self.cache.generation('res'))
+
+        self.assertEqual(list(self.cache._resources), [('nova', 'cores')])
+        self.assertEqual(sorted(self.cache._limits),
+                         [('res', ('b',)), ('res', ('c',))])
+
+    def test_size(self):
+        cache = limit_cache.LimitCache(ttl=10, size=2)
+        for key in ('a', 'b', 'c'):
+            cache.set_resource('nova', key, key)
+            cache.set_limit('res', (key,), 5, cache.generation('res'))
+
+        self.assertRaises(KeyError, cache.get_resource, 'nova', 'a')
+        self.assertRaises(KeyError, cache.get_limit, 'res', ('a',))
+        self.assertEqual(cache.get_resource('nova', 'c'), 'c')
+        self.assertEqual(cache.get_limit('res', ('b',)), 5)
+        self.assertEqual(len(cache._resources), 2)
+        self.assertEqual(len(cache._limits), 2)
+
+    @mock.patch('time.time')
+    def test_size_cached_again(self, mock_time):
+        cache = limit_cache.LimitCache(ttl=10, size=2)
+        for now, key in ((1000.0, 'a'), (1001.0, 'b'), (1002.0, 'a'),
+                         (1003.0, 'c')):
+            mock_time.return_value = now
+            cache.set_resource('nova', key, key)
+
+        # The oldest entry is dropped, not the one cached again
+        self.assertRaises(KeyError, cache.get_resource, 'nova', 'b')
+        self.assertEqual(cache.get_resource('nova', 'a'), 'a')
+        self.assertEqual(cache.get_resource('nova', 'c'), 'c')
+        self.assertEqual(len(cache._resource_order), 2)
+
+    def test_size_default(self):
+        self.assertEqual(self.cache.size, 10000)
+
+    def test_disabled(self):
+        cache = limit_cache.LimitCache(ttl=0)
+
+        cache.set_resource('nova', 'instances', 'value')
+        cache.set_limit('res', ('a',), 5, cache.generation('res'))
+        cache.set_quota_missing('res', 'a', cache.generation('res'))
+
+        self.assertRaises(KeyError, cache.get_resource, 'nova', 'instances')
+        self.assertRaises(KeyError, cache.get_limit, 'res', ('a',))
+        self.assertFalse(cache.quota_missing('res', 'a'))
@@ -0,0 +1,151 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.db import models
+from boson import exceptions
+
+import tests
+
+
+class BaseModelTestCase(tests.TestCase):
+    def setUp(self):
+        super(BaseModelTestCase, self).setUp()
+
+        self.dbapi = mock.Mock()
+        self.base_obj = mock.Mock(id='usage_id', created_at=None,
+                                  updated_at=None, resource_id='res_id',
+                                  parameter_data={}, auth_data={}, used=3,
+                                  reserved=1, until_refresh=None,
+                                  refresh_id=None)
+        self.usage = models.Usage('context', self.dbapi, self.base_obj)
+
+    def test_no_dict(self):
+        self.assertFalse(hasattr(self.usage, '__dict__'))
+
+    def test_descriptors(self):
+        self.assertTrue(isinstance(models.Usage.used, models.Field))
+        self.assertTrue(isinstance(models.Usage.id, models.Field))
+        self.assertTrue(isinstance(models.Usage.resource, models.Ref))
+        self.assertTrue(isinstance(models.Usage.reserved_items,
+                                   models.ListRef))
+
+    def test_get_reads_through(self):
+        self.assertEqual(self.usage.used, 3)
+        self.assertEqual(self.usage['used'], 3)
+
+        self.base_obj.used = 5
+
+        self.assertEqual(self.usage.used, 5)
+        self.assertEqual(self.usage['used'], 5)
+
+    def test_get_unknown(self):
+        self.assertRaises(AttributeError, getattr, self.usage, 'spam')
+        self.assertRaises(KeyError, lambda: self.usage['spam'])
+
+    def test_get_ref_cached(self):
+        self.dbapi._lazy_get.return_value = 'resource'
+
+        self.assertEqual(self.usage.resource, 'resource')
+        self.assertEqual(self.usage['resource'], 'resource')
+        self.dbapi._lazy_get.assert_called_once_with(
+            'context', self.base_obj, 'resource_id', None, models.Resource)
+
+    def test_get_list_ref(self):
+        self.dbapi._lazy_get_list.return_value = ['item']
+
+        self.assertEqual(self.usage.reserved_items, ['item'])
+        self.assertEqual(self.usage.reserved_items, ['item'])
+        self.dbapi._lazy_get_list.assert_called_once_with(
+            'context', self.base_obj, 'reserved_items', None,
+            models.ReservedItem)
+
+    def test_set_field(self):
+        self.usage.used = 7
+        self.usage['reserved'] = 2
+
+        self.assertEqual(self.base_obj.used, 7)
+        self.assertEqual(self.base_obj.reserved, 2)
+        self.assertEqual(self.dbapi._save.call_count, 2)
+        self.dbapi._save.assert_called_with('context', self.base_obj)
+
+    def test_set_id_invalidates_ref(self):
+        self.dbapi._lazy_get.side_effect = ['resource1', 'resource2']
+        self.assertEqual(self.usage.resource, 'resource1')
+
+        self.usage.resource_id = 'other_id'
+
+        self.assertEqual(self.usage.resource, 'resource2')
+
+    def test_set_ref(self):
+        resource = mock.Mock(id='other_id')
+
+        self.usage.resource = resource
+
+        self.assertEqual(self.base_obj.resource_id, 'other_id')
+        self.assertEqual(self.usage.resource_id, 'other_id')
+        self.assertEqual(self.usage.resource, resource)
+        self.dbapi._save.assert_called_once_with('context', self.base_obj)
+        self.assertFalse(self.dbapi._lazy_get.called)
+
+    def test_set_list_ref(self):
+        self.assertRaises(AttributeError, setattr, self.usage,
+                          'reserved_items', [])
+        self.assertRaises(KeyError, self.usage.__setitem__,
+                          'reserved_items', [])
+        self.assertFalse(self.dbapi._save.called)
+
+    def test_set_unknown(self):
+        self.assertRaises(AttributeError, setattr, self.usage, 'spam', 1)
+        self.assertRaises(KeyError, self.usage.__setitem__, 'spam', 1)
+
+    def test_delete_field(self):
+        self.assertRaises(AttributeError, delattr, self.usage, 'used')
+        self.assertRaises(KeyError, self.usage.__delitem__, 'used')
+
+    def test_update(self):
+        self.dbapi._lazy_get.return_value = 'resource1'
+        self.assertEqual(self.usage.resource, 'resource1')
+        resource = mock.Mock(id='other_id')
+
+        self.usage.update(used=4, resource=resource)
+
+        self.assertEqual(self.base_obj.used, 4)
+        self.assertEqual(self.base_obj.resource_id, 'other_id')
+        self.assertEqual(self.usage.resource, resource)
+        self.dbapi._save.assert_called_once_with('context', self.base_obj)
+
+    def test_update_invalidates_ref(self):
+        self.dbapi._lazy_get.side_effect = ['resource1', 'resource2']
+        self.assertEqual(self.usage.resource, 'resource1')
+
+        self.usage.update(resource_id='other_id')
+
+        self.assertEqual(self.usage.resource, 'resource2')
+
+    def test_update_ambiguous(self):
+        self.assertRaises(exceptions.AmbiguousFieldUpdate, self.usage.update,
+                          resource_id='other_id',
+                          resource=mock.Mock(id='other_id'))
+        self.assertEqual(self.base_obj.resource_id, 'res_id')
+        self.assertFalse(self.dbapi._save.called)
+
+    def test_update_unknown(self):
+        self.assertRaises(KeyError, self.usage.update, used=4, spam=1)
+        self.assertEqual(self.base_obj.used, 3)
+        self.assertFalse(self.dbapi._save.called)
@@ -0,0 +1,90 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import mock
+
+from boson.db import periodic
+from boson.openstack.common import cfg
+from boson import utils
+
+import tests
+
+
+class Job(periodic.PeriodicTask):
+    task = 'work'
+    interval_opt = 'resource_purge_interval'
+
+    def __init__(self, dbapi, interval=None):
+        super(Job, self).__init__(dbapi, interval)
+        self.calls = []
+
+    def work(self, context):
+        self.calls.append(context)
+        if len(self.calls) == 1:
+            raise Exception('test')
+        self.stop()
+
+
+class PeriodicTaskTestCase(tests.TestCase):
+    def setUp(self):
+        super(PeriodicTaskTestCase, self).setUp()
+
+        self.dbapi = mock.MagicMock()
+        self.job = Job(self.dbapi, interval=5)
+
+    def test_interval(self):
+        cfg.CONF.set_override('resource_purge_interval', 10)
+        self.addCleanup(cfg.CONF.clear_override, 'resource_purge_interval')
+
+        self.assertEqual(Job(self.dbapi).interval, 10)
+        self.assertEqual(self.job.interval, 5)
+
+    @mock.patch.object(utils, 'spawn')
+    def test_start(self, mock_spawn):
+        self.job.start()
+
+        mock_spawn.assert_called_once_with(self.job._run)
+
+    @mock.patch.object(utils, 'sleep')
+    def test_run(self, mock_sleep):
+        sessions = []
+
+        def create_session(context):
+            context.session = mock.Mock()
+            sessions.append(context.session)
+
+        self.dbapi.create_session.side_effect = create_session
+        self.job._running = True
+        with mock.patch.object(periodic, 'LOG') as mock_log:
+            self.job._run()
+
+        self.assertEqual(len(self.job.calls), 2)
+        self.assertTrue(self.job.calls[0].is_admin)
+        self.assertEqual(mock_sleep.call_args_list, [mock.call(5)] * 2)
+        self.assertEqual(mock_log.exception.call_count, 1)
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(sessions[0].close.call_count, 2)
+
+    @mock.patch.object(utils, 'sleep')
+    def test_stopped_while_sleeping(self, mock_sleep):
+        mock_sleep.side_effect = lambda seconds: self.job.stop()
+        self.dbapi.create_session.side_effect = \
+            lambda context: setattr(context, 'session', mock.Mock())
+        self.job._running = True
+
+        self.job._run()
+
+        self.assertEqual(self.job.calls, [])
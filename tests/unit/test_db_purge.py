@@ -0,0 +1,71 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import datetime
+
+import mock
+
+from boson.db import purge
+from boson.openstack.common import timeutils
+from boson import utils
+
+import tests
+
+
+class PurgerTestCase(tests.TestCase):
+    def setUp(self):
+        super(PurgerTestCase, self).setUp()
+
+        self.dbapi = mock.MagicMock()
+        self.context = mock.Mock()
+        self.purger = purge.Purger(self.dbapi, age=7, batch=2, interval=5)
+
+        patcher = mock.patch.object(utils, 'TIMERS', utils.TimerRegistry())
+        self.timers = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        now = datetime.datetime(2012, 7, 15)
+        timeutils.set_time_override(now)
+        self.addCleanup(timeutils.clear_time_override)
+        self.before = now - datetime.timedelta(days=7)
+
+    def test_purge(self):
+        self.dbapi.purge_resources.side_effect = [['r1', 'r2'], ['r3']]
+        self.dbapi.purge_categories.side_effect = [['c1', 'c2'], []]
+
+        self.assertEqual(self.purger.purge(self.context), (3, 2))
+
+        self.assertEqual(self.dbapi.purge_resources.call_args_list,
+                         [mock.call(self.context, self.before, 2)] * 2)
+        self.assertEqual(self.dbapi.purge_categories.call_args_list,
+                         [mock.call(self.context, self.before, 2)] * 2)
+        self.assertEqual(self.dbapi.transaction.call_count, 4)
+        self.assertEqual(self.timers.report()['purge.total']['count'], 1)
+
+    def test_purge_disabled(self):
+        purger = purge.Purger(self.dbapi, age=0)
+
+        self.assertEqual(purger.purge(self.context), (0, 0))
+
+        self.assertFalse(self.dbapi.purge_resources.called)
+        self.assertFalse(self.dbapi.purge_categories.called)
+
+    def test_defaults(self):
+        purger = purge.Purger(self.dbapi)
+
+        self.assertEqual(purger.age, 0)
+        self.assertEqual(purger.batch, 10)
+        self.assertEqual(purger.interval, 3600)
@@ -0,0 +1,122 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.db import resource_index
+
+import tests
+
+
+NAMES = ['instances', 'network', 'network/fixed_ips',
+         'network/fixed_ips/v6', 'network/floating_ips', 'volume/gigabytes']
+
+
+class ResourceTrieTestCase(tests.TestCase):
+    def setUp(self):
+        super(ResourceTrieTestCase, self).setUp()
+
+        self.trie = resource_index.ResourceTrie()
+        for name in NAMES:
+            self.trie.add(name, 'id-%s' % name)
+
+    def _ids(self, *names):
+        return ['id-%s' % name for name in names]
+
+    def test_len(self):
+        self.assertEqual(len(self.trie), 6)
+
+        self.trie.add('network', 'other')
+
+        self.assertEqual(len(self.trie), 6)
+        self.assertEqual(self.trie.get('network'), 'other')
+
+    def test_get(self):
+        self.assertEqual(self.trie.get('network/fixed_ips'),
+                         'id-network/fixed_ips')
+        self.assertRaises(KeyError, self.trie.get, 'volume')
+        self.assertRaises(KeyError, self.trie.get, 'spam')
+
+    def test_prefix(self):
+        self.assertEqual(self.trie.prefix('network'),
+                         self._ids('network', 'network/fixed_ips',
+                                   'network/fixed_ips/v6',
+                                   'network/floating_ips'))
+        self.assertEqual(self.trie.prefix('volume'),
+                         self._ids('volume/gigabytes'))
+        self.assertEqual(self.trie.prefix('net'), [])
+        self.assertEqual(self.trie.prefix(''), self._ids(*NAMES))
+
+    def test_match_exact(self):
+        self.assertEqual(self.trie.match('network/fixed_ips'),
+                         self._ids('network/fixed_ips'))
+        self.assertEqual(self.trie.match('network/spam'), [])
+
+    def test_match_component(self):
+        self.assertEqual(self.trie.match('network/*'),
+                         self._ids('network/fixed_ips',
+                                   'network/floating_ips'))
+        self.assertEqual(self.trie.match('*/fi?ed_ips'),
+                         self._ids('network/fixed_ips'))
+        self.assertEqual(self.trie.match('[iv]*'), self._ids('instances'))
+
+    def test_match_any(self):
+        self.assertEqual(self.trie.match('network/**'),
+                         self._ids('network', 'network/fixed_ips',
+                                   'network/fixed_ips/v6',
+                                   'network/floating_ips'))
+        self.assertEqual(self.trie.match('**/v6'),
+                         self._ids('network/fixed_ips/v6'))
+        self.assertEqual(self.trie.match('**/**'), self._ids(*NAMES))
+
+
+class ResourceIndexTestCase(tests.TestCase):
+    def setUp(self):
+        super(ResourceIndexTestCase, self).setUp()
+
+        self.index = resource_index.ResourceIndex()
+        self.loader = mock.Mock(return_value=[('network', 'id1'),
+                                              ('network/fixed_ips', 'id2')])
+
+    def test_load_once(self):
+        self.assertEqual(self.index.prefix('svc', 'network', self.loader),
+                         ['id1', 'id2'])
+        self.assertEqual(self.index.match('svc', 'network/*', self.loader),
+                         ['id2'])
+        self.loader.assert_called_once_with()
+
+    def test_add(self):
+        self.index.add('svc', 'network/floating_ips', 'id3')
+        self.assertEqual(self.index.match('svc', 'network/*', self.loader),
+                         ['id2'])
+
+        self.index.add('svc', 'network/floating_ips', 'id3')
+
+        self.assertEqual(self.index.match('svc', 'network/*', self.loader),
+                         ['id2', 'id3'])
+
+    def test_forget(self):
+        self.index.prefix('svc', '', self.loader)
+        self.index.prefix('other', '', self.loader)
+
+        self.index.forget('svc')
+        self.index.prefix('svc', '', self.loader)
+        self.assertEqual(self.loader.call_count, 3)
+
+        self.index.forget()
+        self.index.prefix('other', '', self.loader)
+        self.assertEqual(self.loader.call_count, 4)
@@ -0,0 +1,126 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import eventlet
+
+from boson.db import single_flight
+
+import tests
+
+
+class SingleFlightTestCase(tests.TestCase):
+    def setUp(self):
+        super(SingleFlightTestCase, self).setUp()
+
+        self.flights = single_flight.SingleFlight()
+        self.calls = []
+
+    def test_sequential(self):
+        self.assertEqual(self.flights.do('key', self.calls.append, 1),
+                         (None, True))
+        self.assertEqual(self.flights.do('key', self.calls.append, 2),
+                         (None, True))
+        self.assertEqual(self.calls, [1, 2])
+
+    def _threaded(self, func, count=5):
+        """
+        Call ``func`` through the single flight from several threads,
+        letting it return only once all the other threads are waiting
+        for it.  Returns the outcomes.
+        """
+
+        entered = threading.Event()
+        release = threading.Event()
+        outcomes = []
+
+        def leader_func():
+            entered.set()
+            release.wait()
+            return func()
+
+        def target():
+            try:
+                outcomes.append(self.flights.do('key', leader_func))
+            except Exception as exc:
+                outcomes.append(exc)
+
+        threads = [threading.Thread(target=target) for i in range(count)]
+        threads[0].start()
+        entered.wait()
+
+        # Count the threads waiting for the call
+        flight = self.flights._flights['key']
+        waiting = []
+        done_wait = flight.done.wait
+
+        def wait():
+            waiting.append(1)
+            done_wait()
+
+        flight.done.wait = wait
+
+        for thread in threads[1:]:
+            thread.start()
+        while len(waiting) < count - 1:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_threads(self):
+        def func():
+            self.calls.append(1)
+            return 'result'
+
+        outcomes = self._threaded(func)
+
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(sorted(outcomes),
+                         [('result', False)] * 4 + [('result', True)])
+        self.assertEqual(self.flights._flights, {})
+
+    def test_threads_exception(self):
+        def func():
+            self.calls.append(1)
+            raise KeyError('missing')
+
+        outcomes = self._threaded(func)
+
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(len(outcomes), 5)
+        for outcome in outcomes:
+            self.assertTrue(isinstance(outcome, KeyError))
+
+    def test_green_threads(self):
+        def func():
+            # Let the other green threads run
+            eventlet.sleep(0)
+            self.calls.append(1)
+            return 'result'
+
+        pool = eventlet.GreenPool()
+        threads = [pool.spawn(self.flights.do, 'key', func)
+                   for i in range(5)]
+        outcomes = [thread.wait() for thread in threads]
+
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(outcomes,
+                         [('result', True)] + [('result', False)] * 4)
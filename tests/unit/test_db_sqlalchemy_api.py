@@ -0,0 +1,1148 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import mock
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+
+from boson.db import usage_ledger
+from boson.db.sqlalchemy import api as sa_api
+from boson.db.sqlalchemy import models as sa_models
+from boson.db.sqlalchemy import session as db_session
+from boson import exceptions
+from boson.openstack.common import cfg
+from boson.openstack.common import timeutils
+from boson import utils
+
+import tests
+
+
+class LookupFixture(tests.DBTestCase):
+    """A service with one resource, usage, quota, and reservation."""
+
+    def setUp(self):
+        super(LookupFixture, self).setUp()
+
+        session = self.context.session
+        self.service = sa_models.Service(name='nova',
+                                         auth_fields=set(['tenant_id']))
+        session.add(self.service)
+        session.flush()
+        self.category = sa_models.Category(service_id=self.service.id,
+                                           name='compute',
+                                           usage_fset=set(['tenant_id']),
+                                           quota_fsets=[set(['tenant_id']),
+                                                        set()])
+        session.add(self.category)
+        session.flush()
+        self.resource = sa_models.Resource(service_id=self.service.id,
+                                           category_id=self.category.id,
+                                           name='instances',
+                                           parameters=set(),
+                                           absolute=False)
+        session.add(self.resource)
+        session.flush()
+        self.usage = sa_models.Usage(resource_id=self.resource.id,
+                                     parameter_data={},
+                                     auth_data=dict(tenant_id='tenant'),
+                                     used=1, reserved=0)
+        self.quota = sa_models.Quota(resource_id=self.resource.id,
+                                     auth_data={}, limit=10)
+        self.reservation = sa_models.Reservation(
+            expire=datetime.datetime(2012, 1, 1), service_id=self.service.id,
+            req_id='req-1')
+        session.add_all([self.usage, self.quota, self.reservation])
+        session.commit()
+
+        patcher = mock.patch.object(sa_api, 'LOG')
+        self.mock_log = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class LookupTestCase(LookupFixture):
+    def test_get_service(self):
+        self.assertEqual(self.dbapi.get_service(self.context,
+                                                id=self.service.id),
+                         self.service)
+        self.assertEqual(self.dbapi.get_service(self.context, name='nova'),
+                         self.service)
+
+    def test_get_service_bad_args(self):
+        self.assertRaises(TypeError, self.dbapi.get_service, self.context)
+        self.assertRaises(TypeError, self.dbapi.get_service, self.context,
+                          id=self.service.id, name='nova')
+
+    def test_get_service_missing(self):
+        self.assertRaises(KeyError, self.dbapi.get_service, self.context,
+                          name='glance')
+        self.assertEqual(self.mock_log.method_calls, [])
+
+    def test_get_category(self):
+        self.assertEqual(self.dbapi.get_category(self.context,
+                                                 service=self.service,
+                                                 name='compute'),
+                         self.category)
+        self.assertRaises(TypeError, self.dbapi.get_category, self.context,
+                          service=self.service)
+        self.assertRaises(KeyError, self.dbapi.get_category, self.context,
+                          id='missing')
+
+    def test_get_resource(self):
+        self.assertEqual(self.dbapi.get_resource(self.context,
+                                                 service=self.service.id,
+                                                 name='instances'),
+                         self.resource)
+        self.assertRaises(TypeError, self.dbapi.get_resource, self.context,
+                          id=self.resource.id, name='instances')
+        self.assertRaises(KeyError, self.dbapi.get_resource, self.context,
+                          service=self.service.id, name='missing')
+
+    def test_get_usage(self):
+        self.assertEqual(self.dbapi.get_usage(self.context,
+                                              resource=self.resource,
+                                              param_data={},
+                                              auth_data=dict(
+                                                  tenant_id='tenant')),
+                         self.usage)
+        self.assertRaises(TypeError, self.dbapi.get_usage, self.context,
+                          resource=self.resource, auth_data={})
+
+    def test_get_usage_missing(self):
+        self.assertRaises(KeyError, self.dbapi.get_usage, self.context,
+                          resource=self.resource, param_data={},
+                          auth_data=dict(tenant_id='other'))
+        self.assertEqual(self.mock_log.method_calls, [])
+
+    def test_get_quota(self):
+        self.assertEqual(self.dbapi.get_quota(self.context,
+                                              resource=self.resource.id,
+                                              auth_data={}),
+                         self.quota)
+        self.assertEqual(self.dbapi.get_quota(self.context,
+                                              id=self.quota.id),
+                         self.quota)
+        self.assertRaises(TypeError, self.dbapi.get_quota, self.context)
+
+    def test_get_quota_missing(self):
+        self.assertRaises(KeyError, self.dbapi.get_quota, self.context,
+                          resource=self.resource.id,
+                          auth_data=dict(tenant_id='tenant'))
+        self.assertEqual(self.mock_log.method_calls, [])
+
+    def test_get_reservation(self):
+        self.assertEqual(self.dbapi.get_reservation(self.context,
+                                                    self.reservation.id),
+                         self.reservation)
+
+    def test_get_reservation_missing(self):
+        self.assertRaises(KeyError, self.dbapi.get_reservation,
+                          self.context, 'missing')
+        self.assertEqual(self.mock_log.method_calls, [])
+
+    def test_get_reservation_req_id(self):
+        self.assertEqual(self.dbapi.get_reservation(self.context,
+                                                    service=self.service,
+                                                    req_id='req-1'),
+                         self.reservation)
+        self.assertRaises(KeyError, self.dbapi.get_reservation,
+                          self.context, service=self.service.id,
+                          req_id='req-2')
+
+    def test_get_reservation_bad_args(self):
+        self.assertRaises(TypeError, self.dbapi.get_reservation,
+                          self.context, req_id='req-1')
+        self.assertRaises(TypeError, self.dbapi.get_reservation,
+                          self.context, self.reservation.id,
+                          service=self.service, req_id='req-1')
+
+
+class SharedLookupTestCase(LookupFixture):
+    def setUp(self):
+        super(SharedLookupTestCase, self).setUp()
+
+        # The session of a concurrent caller
+        self.other = db_session.get_session()
+        self.addCleanup(self.other.close)
+
+    def _shared(self, model):
+        """Look up a row as the leader of a shared lookup would."""
+
+        self.context.session.expunge_all()
+        return sa_api._first_values(self.other.query(model))
+
+    def test_shared(self):
+        shared = self._shared(sa_models.Service)
+
+        with mock.patch.object(sa_api._LOOKUPS, 'do',
+                               return_value=(shared, False)) as do:
+            with self.assert_max_queries(0):
+                service = self.dbapi.get_service(self.context, name='nova')
+
+        self.assertEqual(do.call_args[0][0], ('service', None, 'nova'))
+        self.assertFalse(service is shared[0])
+        self.assertTrue(service in self.context.session)
+        self.assertFalse(service in self.context.session.dirty)
+        self.assertEqual(service.id, self.service.id)
+        self.assertEqual(service.auth_fields, set(['tenant_id']))
+
+    def test_shared_leader_changes(self):
+        shared = self._shared(sa_models.Quota)
+
+        # The leader changes its row while others build theirs
+        shared[0].limit = 20
+        shared[0].auth_data['tenant_id'] = 'changed'
+        self.other.expire(shared[0], ['resource_id'])
+
+        with mock.patch.object(sa_api._LOOKUPS, 'do',
+                               return_value=(shared, False)):
+            quota = self.dbapi.get_quota(self.context,
+                                         resource=self.resource.id,
+                                         auth_data={})
+
+        self.assertFalse(quota is shared[0])
+        self.assertEqual(quota.limit, 10)
+        self.assertEqual(quota.auth_data, {})
+        self.assertEqual(quota.resource_id, self.resource.id)
+
+    def test_shared_missing(self):
+        with mock.patch.object(sa_api._LOOKUPS, 'do',
+                               return_value=((None, None), False)):
+            self.assertRaises(KeyError, self.dbapi.get_quota, self.context,
+                              resource=self.resource.id,
+                              auth_data=dict(tenant_id='tenant'))
+
+    def test_written_not_shared(self):
+        self.dbapi.create_quota(self.context, self.resource,
+                                dict(tenant_id='tenant'), 5)
+
+        with mock.patch.object(sa_api._LOOKUPS, 'do') as do:
+            quota = self.dbapi.get_quota(self.context,
+                                         resource=self.resource.id,
+                                         auth_data=dict(tenant_id='tenant'))
+
+        self.assertEqual(quota.limit, 5)
+        self.assertFalse(do.called)
+
+    def test_shared_after_commit(self):
+        self.dbapi.create_quota(self.context, self.resource,
+                                dict(tenant_id='tenant'), 5)
+        self.dbapi.commit(self.context)
+
+        with mock.patch.object(sa_api._LOOKUPS, 'do',
+                               wraps=sa_api._LOOKUPS.do) as do:
+            self.dbapi.get_quota(self.context, resource=self.resource.id,
+                                 auth_data=dict(tenant_id='tenant'))
+
+        self.assertTrue(do.called)
+
+
+class GenerationTestCase(LookupFixture):
+    def test_update_increments(self):
+        generation = self.usage.generation
+
+        self.usage.reserved = 2
+        self.dbapi.commit(self.context)
+
+        self.assertEqual(self.usage.generation, generation + 1)
+
+    def test_concurrent_update(self):
+        table = sa_models.Usage.__table__
+        self.usage.reserved = 2
+
+        # Another transaction updates the record after it was read
+        self.context.session.execute(
+            table.update().values(generation=table.c.generation + 1))
+
+        self.assertRaises(exceptions.ConcurrentUpdate, self.dbapi.commit,
+                          self.context)
+        self.assertEqual(self.dbapi.get_usage(self.context,
+                                              id=self.usage.id).reserved, 0)
+
+    def test_expire_conflict(self):
+        with mock.patch.object(self.dbapi, '_finish_reservation',
+                               side_effect=sa_api.orm_exc.StaleDataError):
+            self.assertRaises(exceptions.ConcurrentUpdate,
+                              self.dbapi.expire_reservations, self.context)
+
+    def test_finish_reservation_lock(self):
+        self.dbapi.reserve(self.context, self.reservation, self.resource,
+                           self.usage, 2)
+        self.dbapi.commit(self.context)
+        generation = self.usage.generation
+
+        with mock.patch.object(sa_api.orm.Query,
+                               'with_lockmode') as mock_lock:
+            self.dbapi.commit_reservation(self.context, self.reservation.id,
+                                          lock=False)
+        self.dbapi.commit(self.context)
+
+        self.assertFalse(mock_lock.called)
+        self.assertEqual(self.usage.used, 3)
+        self.assertEqual(self.usage.generation, generation + 1)
+
+    def _finish_concurrently(self):
+        table = sa_models.Reservation.__table__
+        self.context.session.execute(
+            table.update().where(table.c.id == self.reservation.id).
+            values(finished_at=datetime.datetime(2012, 1, 2),
+                   committed=True))
+
+    def test_finish_reservation_claimed(self):
+        self.dbapi.reserve(self.context, self.reservation, self.resource,
+                           self.usage, 2)
+        self.dbapi.commit(self.context)
+
+        # Another transaction commits the reservation after it was read
+        self._finish_concurrently()
+
+        self.assertRaises(KeyError, self.dbapi.commit_reservation,
+                          self.context, self.reservation)
+        self.dbapi.commit(self.context)
+        self.assertEqual(self.usage.used, 1)
+
+    def test_expire_reservations_claimed(self):
+        finish = self.dbapi._finish_reservation
+
+        def finish_concurrently(*args):
+            self._finish_concurrently()
+            return finish(*args)
+
+        with mock.patch.object(self.dbapi, '_finish_reservation',
+                               side_effect=finish_concurrently):
+            self.assertEqual(self.dbapi.expire_reservations(self.context),
+                             [])
+
+    def test_expire_reservations_limit(self):
+        older = sa_models.Reservation(expire=datetime.datetime(2011, 1, 1),
+                                      service_id=self.service.id)
+        current = sa_models.Reservation(expire=datetime.datetime(2100, 1, 1),
+                                        service_id=self.service.id)
+        self.context.session.add_all([older, current])
+        self.dbapi.commit(self.context)
+        ids = [older.id, self.reservation.id]
+
+        expired = self.dbapi.expire_reservations(self.context, limit=1)
+        self.dbapi.commit(self.context)
+
+        self.assertEqual([resv.id for resv in expired], ids[:1])
+        self.assertEqual([resv.id for resv in self.dbapi.expire_reservations(
+            self.context)], ids[1:])
+        self.assertEqual(self.dbapi.expire_reservations(self.context), [])
+        self.dbapi.get_reservation(self.context, current.id)
+
+
+class ArchiveTestCase(LookupFixture):
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+
+        self.dbapi.reserve(self.context, self.reservation, self.resource,
+                           self.usage, 2)
+        self.other = sa_models.Reservation(
+            expire=datetime.datetime(2012, 1, 1), service_id=self.service.id)
+        self.context.session.add(self.other)
+        self.dbapi.commit(self.context)
+
+    def _finish(self, reservation, when):
+        timeutils.set_time_override(when)
+        try:
+            self.dbapi.commit_reservation(self.context, reservation)
+            self.dbapi.commit(self.context)
+        finally:
+            timeutils.clear_time_override()
+
+    def _count(self, model):
+        return self.context.session.query(model).count()
+
+    def test_archive_reservations(self):
+        self._finish(self.reservation, datetime.datetime(2012, 5, 1))
+        self._finish(self.other, datetime.datetime(2012, 4, 1))
+
+        self.assertEqual(self.dbapi.archive_reservations(
+            self.context, datetime.datetime(2012, 6, 1), 1),
+            [datetime.datetime(2012, 4, 1)])
+        self.assertEqual(self.dbapi.archive_reservations(
+            self.context, datetime.datetime(2012, 6, 1), 1),
+            [datetime.datetime(2012, 5, 1)])
+        self.assertEqual(self.dbapi.archive_reservations(
+            self.context, datetime.datetime(2012, 6, 1), 1), [])
+        self.dbapi.commit(self.context)
+
+        self.assertEqual(self._count(sa_models.Reservation), 0)
+        self.assertEqual(self._count(sa_models.ReservedItem), 0)
+        archived = self.context.session.query(
+            sa_models.ReservationArchive).\
+            filter_by(id=self.reservation.id).one()
+        self.assertEqual((archived.req_id, archived.auth_data,
+                          archived.committed),
+                         ('req-1', None, True))
+        self.assertEqual(archived.finished_at, datetime.datetime(2012, 5, 1))
+        item = self.context.session.query(
+            sa_models.ReservedItemArchive).one()
+        self.assertEqual((item.reservation_id, item.usage_id, item.delta),
+                         (self.reservation.id, self.usage.id, 2))
+
+    def test_archive_reservations_retained(self):
+        self._finish(self.reservation, datetime.datetime(2012, 5, 1))
+
+        self.assertEqual(self.dbapi.archive_reservations(
+            self.context, datetime.datetime(2012, 5, 1), 10), [])
+        self.dbapi.commit(self.context)
+
+        # Neither the recent nor the outstanding reservation
+        self.assertEqual(self._count(sa_models.Reservation), 2)
+        self.assertEqual(self._count(sa_models.ReservationArchive), 0)
+
+
+class FastPathTestCase(LookupFixture):
+    def _get_row(self, **kwargs):
+        return self.dbapi.get_usage_row(self.context, self.resource, {},
+                                        dict(tenant_id='tenant'), **kwargs)
+
+    def test_get_usage_row(self):
+        row = self._get_row()
+
+        self.assertEqual((row.id, row.used, row.reserved, row.generation),
+                         (self.usage.id, 1, 0, self.usage.generation))
+        self.assertEqual(self._get_row(auth_key=utils.dict_serialize(
+            dict(tenant_id='tenant'))), row)
+
+    def test_get_usage_row_missing(self):
+        self.assertRaises(KeyError, self.dbapi.get_usage_row, self.context,
+                          self.resource.id, {}, dict(tenant_id='other'))
+
+    def test_get_usage_row_lock(self):
+        # SQLite has no FOR UPDATE; check the statement chosen
+        with mock.patch.object(sa_api.statements, 'execute') as mock_exec:
+            self._get_row(lock=True)
+        self.assertEqual(mock_exec.call_args[0][1], 'select_usage_for_update')
+
+    def test_update_reserved(self):
+        row = self._get_row()
+
+        with self.assert_max_queries(1):
+            self.dbapi.update_reserved(self.context, [(row, 3)])
+        self.dbapi.commit(self.context)
+
+        self.assertEqual(self.usage.reserved, 3)
+        self.assertEqual(self.usage.generation, row.generation + 1)
+
+    def test_update_reserved_conflict(self):
+        row = self._get_row()
+        self.usage.used = 2
+        self.dbapi.commit(self.context)
+
+        self.assertRaises(exceptions.ConcurrentUpdate,
+                          self.dbapi.update_reserved, self.context,
+                          [(row, 3)])
+
+    def test_update_reserved_no_multi_rowcount(self):
+        self.dbapi.create_usage(self.context, self.resource, {},
+                                dict(tenant_id='other'))
+        rows = [self._get_row(),
+                self.dbapi.get_usage_row(self.context, self.resource, {},
+                                         dict(tenant_id='other'))]
+
+        with mock.patch.object(self.engine.dialect,
+                               'supports_sane_multi_rowcount', False):
+            with self.assert_max_queries(2):
+                self.dbapi.update_reserved(self.context,
+                                           [(rows[0], 3), (rows[1], 2)])
+            self.assertRaises(exceptions.ConcurrentUpdate,
+                              self.dbapi.update_reserved, self.context,
+                              [(rows[0], 3), (rows[1], 2)])
+
+    def test_insert(self):
+        with self.assert_max_queries(2):
+            self.dbapi.insert_reservations(self.context, [
+                ('resv-1', datetime.datetime(2012, 1, 1), self.service,
+                 dict(tenant_id='tenant')),
+                ('resv-2', datetime.datetime(2012, 1, 1), self.service.id,
+                 dict(tenant_id='tenant')),
+            ])
+            self.dbapi.insert_reserved_items(self.context, [
+                ('resv-1', self.resource.id, self.usage.id, 2),
+                ('resv-2', self.resource.id, self.usage.id, -1),
+            ])
+        self.dbapi.commit(self.context)
+
+        resv = self.dbapi.get_reservation(self.context, 'resv-2')
+        self.assertEqual(resv.auth_data, dict(tenant_id='tenant'))
+        self.assertEqual(resv.service_id, self.service.id)
+        self.assertEqual([(item.usage_id, item.delta)
+                          for item in resv.reserved_items],
+                         [(self.usage.id, -1)])
+
+    def test_insert_nothing(self):
+        with self.assert_max_queries(0):
+            self.dbapi.insert_reservations(self.context, [])
+            self.dbapi.insert_reserved_items(self.context, [])
+            self.dbapi.update_reserved(self.context, [])
+
+
+class KeyFilterTestCase(LookupFixture):
+    def setUp(self):
+        super(KeyFilterTestCase, self).setUp()
+
+        cfg.CONF.set_override('key_filter_interval', 60)
+        self.addCleanup(cfg.CONF.clear_override, 'key_filter_interval')
+
+        # Rebuild at once, reading the committed fixture
+        patcher = mock.patch.object(utils, 'spawn',
+                                    side_effect=lambda func, *args:
+                                    func(*args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_missing_quota_queried(self):
+        self.dbapi.get_quota(self.context, resource=self.resource.id,
+                             auth_data={})
+
+        with self.assert_max_queries(1):
+            self.assertRaises(KeyError, self.dbapi.get_quota, self.context,
+                              resource=self.resource.id,
+                              auth_data=dict(tenant_id='tenant'))
+
+    def _might_exist(self, tenant_id):
+        return self.dbapi.usage_might_exist(self.context, self.resource, {},
+                                            dict(tenant_id=tenant_id))
+
+    def test_missing_usage_no_query(self):
+        self.assertTrue(self._might_exist('tenant'))
+
+        with self.assert_max_queries(0):
+            self.assertFalse(self._might_exist('other'))
+
+    def test_missing_usage_queried(self):
+        self._might_exist('tenant')
+
+        with self.assert_max_queries(1):
+            self.assertRaises(KeyError, self.dbapi.get_usage, self.context,
+                              resource=self.resource, param_data={},
+                              auth_data=dict(tenant_id='other'))
+
+    def test_created_usage(self):
+        self.assertFalse(self._might_exist('other'))
+
+        self.dbapi.create_usage(self.context, self.resource, {},
+                                dict(tenant_id='other'))
+
+        self.assertTrue(self._might_exist('other'))
+
+    def test_created_elsewhere(self):
+        self.assertFalse(self._might_exist('other'))
+
+        # As by another process
+        self.context.session.add(sa_models.Usage(
+            resource_id=self.resource.id, parameter_data={},
+            auth_data=dict(tenant_id='other'), used=2, reserved=0))
+        self.context.session.commit()
+
+        # Found at once by lookups, and by the filter once rebuilt
+        usage = self.dbapi.get_usage(self.context, resource=self.resource,
+                                     param_data={},
+                                     auth_data=dict(tenant_id='other'))
+        self.assertEqual(usage.used, 2)
+        row = self.dbapi.get_usage_row(self.context, self.resource, {},
+                                       dict(tenant_id='other'))
+        self.assertEqual(row['used'], 2)
+        self.assertFalse(self._might_exist('other'))
+        sa_api._USAGE_KEYS.clear()
+        self.assertTrue(self._might_exist('other'))
+
+
+class LedgerTestCase(LookupFixture):
+    def _totals(self, used=1, reserved=0):
+        usage_ledger.TOTALS.set(self.usage.id, used, reserved,
+                                usage_ledger.TOTALS.generation(
+                                    self.usage.id))
+
+    def test_append_ledger(self):
+        self._totals()
+
+        with self.assert_max_queries(1):
+            self.dbapi.append_ledger(self.context, [
+                (self.usage.id, 0, 3), (self.usage.id, 2, -3),
+                (self.usage.id, 0, 0)])
+
+        # Not added to the running totals until committed
+        self.assertEqual(usage_ledger.TOTALS.get(self.usage.id), (1, 0))
+        self.dbapi.commit(self.context)
+
+        self.assertEqual(usage_ledger.TOTALS.get(self.usage.id), (3, 0))
+        self.assertEqual(self.context.session.query(
+            sa_models.LedgerEntry).count(), 2)
+
+    def test_append_ledger_rollback(self):
+        self._totals()
+        self.dbapi.append_ledger(self.context, [(self.usage.id, 0, 3)])
+
+        self.dbapi.rollback(self.context)
+
+        self.assertEqual(usage_ledger.TOTALS.get(self.usage.id), (1, 0))
+        self.assertEqual(self.context.session.query(
+            sa_models.LedgerEntry).count(), 0)
+
+    def test_get_usage_amounts(self):
+        other = self.dbapi.create_usage(self.context, self.resource, {},
+                                        dict(tenant_id='other'), used=5)
+        self.dbapi.append_ledger(self.context, [(self.usage.id, 2, 3),
+                                                (self.usage.id, 0, -1)])
+
+        self.assertEqual(self.dbapi.get_usage_amounts(
+            self.context, [self.usage.id, other.id, 'missing']),
+            {self.usage.id: (3, 2), other.id: (5, 0)})
+        self.assertEqual(self.dbapi.get_usage_amounts(self.context, []), {})
+
+    def test_compact_ledger(self):
+        self.dbapi.append_ledger(self.context, [(self.usage.id, 2, 3),
+                                                (self.usage.id, 0, -1),
+                                                (self.usage.id, 4, 0)])
+        self.dbapi.commit(self.context)
+        generation = self.usage.generation
+
+        self.assertEqual(self.dbapi.compact_ledger(self.context, 2), 2)
+        self.dbapi.commit(self.context)
+
+        self.assertEqual((self.usage.used, self.usage.reserved),
+                         (3, 2))
+        self.assertEqual(self.usage.generation, generation + 1)
+        self.assertEqual(self.dbapi.get_usage_amounts(
+            self.context, [self.usage.id]), {self.usage.id: (7, 2)})
+
+        self.assertEqual(self.dbapi.compact_ledger(self.context, 2), 1)
+        self.assertEqual(self.dbapi.compact_ledger(self.context, 2), 0)
+        self.assertEqual(self.usage.used, 7)
+
+    def test_compact_ledger_concurrent(self):
+        self.dbapi.append_ledger(self.context, [(self.usage.id, 2, 3)])
+        self.dbapi.commit(self.context)
+        real_execute = sa_api.statements.execute
+
+        # Another compaction deletes the entry first
+        def execute(connection, name, params):
+            if name == 'delete_ledger_entry':
+                connection.execute(
+                    sa_models.LedgerEntry.__table__.delete())
+            return real_execute(connection, name, params)
+
+        with mock.patch.object(sa_api.statements, 'execute', execute):
+            self.assertRaises(exceptions.ConcurrentUpdate,
+                              self.dbapi.compact_ledger, self.context, 10)
+
+    def test_commit_reservation(self):
+        self.dbapi.reserve(self.context, self.reservation, self.resource,
+                           self.usage, 3)
+        self.dbapi.reserve(self.context, self.reservation, self.resource,
+                           self.usage, -1)
+        self.dbapi.commit(self.context)
+
+        self.dbapi.commit_reservation(self.context, self.reservation.id,
+                                      ledger=True)
+        self.dbapi.commit(self.context)
+
+        self.assertEqual((self.usage.used, self.usage.reserved), (1, 0))
+        self.assertEqual(
+            sorted(self.context.session.query(sa_models.LedgerEntry.used,
+                                              sa_models.LedgerEntry.reserved)),
+            [(-1, 0), (3, -3)])
+        self.assertTrue(self.reservation.committed)
+        self.assertRaises(KeyError, self.dbapi.commit_reservation,
+                          self.context, self.reservation.id, ledger=True)
+
+    def test_rollback_reservation(self):
+        self.dbapi.reserve(self.context, self.reservation, self.resource,
+                           self.usage, 3)
+        self.dbapi.reserve(self.context, self.reservation, self.resource,
+                           self.usage, -1)
+        self.dbapi.commit(self.context)
+
+        self.dbapi.rollback_reservation(self.context, self.reservation.id,
+                                        ledger=True)
+        self.dbapi.commit(self.context)
+
+        self.assertEqual(
+            self.context.session.query(sa_models.LedgerEntry.used,
+                                       sa_models.LedgerEntry.reserved).all(),
+            [(0, -3)])
+
+    def test_usage_report(self):
+        self.dbapi.append_ledger(self.context, [(self.usage.id, 2, 3)])
+
+        self.assertEqual(self.dbapi.get_usage_report(
+            self.context, self.service, dict(tenant_id='tenant')),
+            [('instances', {}, 3, 3, 10)])
+
+
+class PurgeTestCase(LookupFixture):
+    def setUp(self):
+        super(PurgeTestCase, self).setUp()
+
+        session = self.context.session
+        self.stale = datetime.datetime(2012, 1, 1)
+        self.before = datetime.datetime(2012, 6, 1)
+        self.other = sa_models.Resource(service_id=self.service.id,
+                                        category_id=self.category.id,
+                                        name='cores', parameters=set(),
+                                        absolute=False)
+        session.add(self.other)
+        session.flush()
+        session.add(sa_models.ReservedItem(
+            reservation_id=self.reservation.id, resource_id=self.resource.id,
+            usage_id=self.usage.id, delta=1))
+        session.add(sa_models.LedgerEntry(usage_id=self.usage.id, used=1,
+                                          reserved=0))
+        session.commit()
+
+    def _age(self, *objs):
+        for obj in objs:
+            obj.last_seen = self.stale
+        self.context.session.commit()
+
+    def _count(self, model):
+        return self.context.session.query(model).count()
+
+    def test_mark_seen(self):
+        self._age(self.category, self.resource, self.other)
+        updated_at = self.resource.updated_at
+
+        with self.assert_max_queries(2):
+            self.dbapi.mark_seen(self.context, [self.category.id],
+                                 [self.resource, self.other.id])
+        self.dbapi.commit(self.context)
+
+        for obj in (self.category, self.resource, self.other):
+            self.context.session.refresh(obj)
+            self.assertTrue(obj.last_seen > self.before)
+        self.assertEqual(self.resource.updated_at, updated_at)
+
+    def test_create_again_marks_seen(self):
+        self._age(self.category, self.resource)
+        updated_at = self.resource.updated_at
+
+        category = self.dbapi.create_category(self.context, self.service,
+                                              self.category.name, set(),
+                                              [])
+        resource = self.dbapi.create_resource(self.context, self.service,
+                                              category, self.resource.name,
+                                              set())
+        self.dbapi.commit(self.context)
+
+        self.assertTrue(resource.last_seen > self.before)
+        self.assertEqual(self.dbapi.purge_resources(
+            self.context, self.before, 10), [])
+        self.assertEqual(self.dbapi.purge_categories(
+            self.context, self.before, 10), [])
+        self.context.session.refresh(resource)
+        self.assertTrue(resource.last_seen > self.before)
+        self.assertEqual(resource.updated_at, updated_at)
+
+    def test_mark_seen_empty(self):
+        with self.assert_max_queries(0):
+            self.dbapi.mark_seen(self.context)
+
+    def test_purge_resources(self):
+        self._age(self.resource)
+
+        self.assertEqual(self.dbapi.purge_resources(
+            self.context, self.before, 10), ['instances'])
+        self.dbapi.commit(self.context)
+
+        self.assertEqual(
+            self.context.session.query(sa_models.Resource.name).all(),
+            [('cores',)])
+        for model in (sa_models.Usage, sa_models.Quota,
+                      sa_models.ReservedItem, sa_models.LedgerEntry):
+            self.assertEqual(self._count(model), 0)
+        self.assertEqual(self._count(sa_models.Reservation), 1)
+
+    def test_purge_resources_limit(self):
+        self._age(self.resource, self.other)
+        self.other.last_seen = self.stale - datetime.timedelta(days=1)
+        self.context.session.commit()
+
+        self.assertEqual(self.dbapi.purge_resources(
+            self.context, self.before, 1), ['cores'])
+        self.assertEqual(self.dbapi.purge_resources(
+            self.context, self.before, 1), ['instances'])
+        self.assertEqual(self.dbapi.purge_resources(
+            self.context, self.before, 1), [])
+
+    def test_purge_resources_invalidates(self):
+        self._age(self.resource)
+        self.assertEqual(len(self.dbapi.find_resources(
+            self.context, self.service, prefix='')), 2)
+
+        self.dbapi.purge_resources(self.context, self.before, 10)
+        self.dbapi.commit(self.context)
+
+        self.assertEqual(self.dbapi.find_resources(
+            self.context, self.service, prefix=''), [self.other.id])
+
+    def test_purge_resources_clears_caches(self):
+        self._age(self.resource)
+        usage_ledger.TOTALS.set('usage', 1, 0,
+                                usage_ledger.TOTALS.generation('usage'))
+        self.assertEqual(usage_ledger.TOTALS.get('usage'), (1, 0))
+
+        with mock.patch.object(sa_api._USAGE_KEYS, 'clear') as mock_clear:
+            self.dbapi.purge_resources(self.context, self.before, 10)
+
+        mock_clear.assert_called_once_with()
+        self.assertRaises(KeyError, usage_ledger.TOTALS.get, 'usage')
+
+    def test_purge_categories(self):
+        self._age(self.category)
+
+        # The category still has resources
+        self.assertEqual(self.dbapi.purge_categories(
+            self.context, self.before, 10), [])
+
+        self._age(self.resource, self.other)
+        self.dbapi.purge_resources(self.context, self.before, 10)
+
+        self.assertEqual(self.dbapi.purge_categories(
+            self.context, self.before, 10), ['compute'])
+        self.dbapi.commit(self.context)
+        self.assertEqual(self._count(sa_models.Category), 0)
+
+
+class CreateTestCase(tests.DBTestCase):
+    def setUp(self):
+        super(CreateTestCase, self).setUp()
+
+        self.service = self.dbapi.create_service(self.context, 'nova',
+                                                 set(['tenant_id']))
+        self.category = self.dbapi.create_category(self.context,
+                                                   self.service, 'compute',
+                                                   set(['tenant_id']),
+                                                   [set()])
+        self.resource = self.dbapi.create_resource(self.context,
+                                                   self.service,
+                                                   self.category,
+                                                   'instances', set())
+
+    def test_create_service(self):
+        self.assertEqual(self.service.name, 'nova')
+        self.assertEqual(self.service.auth_fields, set(['tenant_id']))
+        self.assertNotEqual(self.service.created_at, None)
+
+        with self.assert_max_queries(2):
+            service = self.dbapi.create_service(self.context, 'nova',
+                                                set(['user_id']))
+
+        self.assertEqual(service, self.service)
+        self.assertEqual(self.context.session.query(
+            sa_models.Service).count(), 1)
+
+    def test_create_category(self):
+        category = self.dbapi.create_category(self.context,
+                                              self.service.id, 'compute',
+                                              set(), [])
+
+        self.assertEqual(category, self.category)
+        self.assertEqual(category.quota_fsets, [set()])
+
+    def test_create_resource(self):
+        resource = self.dbapi.create_resource(self.context, self.service,
+                                              self.category, 'instances',
+                                              set(['spam']))
+
+        self.assertEqual(resource, self.resource)
+        self.assertEqual(resource.parameters, set())
+
+    def test_create_usage(self):
+        usage = self.dbapi.create_usage(self.context, self.resource, {},
+                                        dict(tenant_id='tenant'), used=3)
+        other = self.dbapi.create_usage(self.context, self.resource, {},
+                                        dict(tenant_id='other'))
+
+        self.assertEqual(usage.used, 3)
+        self.assertNotEqual(usage, other)
+        self.assertEqual(self.dbapi.create_usage(self.context,
+                                                 self.resource.id, {},
+                                                 dict(tenant_id='tenant')),
+                         usage)
+        self.assertEqual(self.dbapi.get_usage(self.context,
+                                              resource=self.resource,
+                                              param_data={},
+                                              auth_data=dict(
+                                                  tenant_id='tenant')),
+                         usage)
+
+    def test_create_quota(self):
+        quota = self.dbapi.create_quota(self.context, self.resource, {}, 5)
+
+        self.assertEqual(self.dbapi.create_quota(self.context,
+                                                 self.resource, {}, 10),
+                         quota)
+        self.assertEqual(quota.limit, 5)
+
+    def test_create_reservation(self):
+        expire = datetime.datetime(2012, 1, 1)
+        first = self.dbapi.create_reservation(self.context, expire)
+        second = self.dbapi.create_reservation(self.context, expire)
+
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(first.req_id, None)
+
+    def test_create_reservation_req_id(self):
+        expire = datetime.datetime(2012, 1, 1)
+        resv = self.dbapi.create_reservation(self.context, expire,
+                                             service=self.service,
+                                             auth_data=dict(tenant_id='t'),
+                                             req_id='req-1', id='resv-1')
+
+        self.assertEqual(resv.id, 'resv-1')
+        self.assertEqual(resv.service_id, self.service.id)
+        self.assertEqual(resv.auth_data, dict(tenant_id='t'))
+        self.assertEqual(self.dbapi.create_reservation(
+            self.context, expire, service=self.service.id, req_id='req-1',
+            id='resv-2'), resv)
+        self.assertEqual(self.context.session.query(
+            sa_models.Reservation).count(), 1)
+
+        other = self.dbapi.create_service(self.context, 'glance',
+                                          set(['tenant_id']))
+        self.assertEqual(self.dbapi.create_reservation(
+            self.context, expire, service=other, req_id='req-1').req_id,
+            'req-1')
+        self.assertEqual(self.context.session.query(
+            sa_models.Reservation).count(), 2)
+
+    def test_create_reservation_req_id_no_service(self):
+        self.assertRaises(TypeError, self.dbapi.create_reservation,
+                          self.context, datetime.datetime(2012, 1, 1),
+                          req_id='req-1')
+
+    def test_orm_key_hash(self):
+        usage = sa_models.Usage(resource_id=self.resource.id,
+                                parameter_data={}, auth_data=dict(a=1),
+                                used=0, reserved=0)
+        self.context.session.add(usage)
+        self.context.session.flush()
+
+        self.assertEqual(usage.key_hash,
+                         sa_models.Usage.compute_key_hash({}, dict(a=1)))
+
+
+class UsageReportTestCase(tests.DBTestCase):
+    def setUp(self):
+        super(UsageReportTestCase, self).setUp()
+
+        ctxt = self.context
+        self.service = self.dbapi.create_service(ctxt, 'nova',
+                                                 set(['tenant_id',
+                                                      'user_id']))
+        compute = self.dbapi.create_category(ctxt, self.service, 'compute',
+                                             set(['tenant_id']),
+                                             [set(['tenant_id']), set()])
+        user = self.dbapi.create_category(ctxt, self.service, 'user',
+                                          set(['tenant_id', 'user_id']),
+                                          [set(['tenant_id', 'user_id']),
+                                           set(['tenant_id'])])
+        instances = self.dbapi.create_resource(ctxt, self.service, compute,
+                                               'instances', set())
+        fixed_ips = self.dbapi.create_resource(ctxt, self.service, compute,
+                                               'fixed_ips',
+                                               set(['network']))
+        keypairs = self.dbapi.create_resource(ctxt, self.service, user,
+                                              'keypairs', set())
+        self.dbapi.create_resource(ctxt, self.service, compute, 'cores',
+                                   set())
+
+        self.dbapi.create_quota(ctxt, instances, {}, 10)
+        self.dbapi.create_quota(ctxt, instances, dict(tenant_id='t1'), 20)
+        self.dbapi.create_quota(ctxt, instances, dict(tenant_id='t2'), 30)
+        self.dbapi.create_quota(ctxt, fixed_ips, {}, 5)
+        self.dbapi.create_quota(ctxt, keypairs, dict(tenant_id='t1'), 2)
+        self.dbapi.create_quota(ctxt, keypairs,
+                                dict(tenant_id='t1', user_id='u1'), 3)
+
+        self.dbapi.create_usage(ctxt, instances, {}, dict(tenant_id='t1'),
+                                used=4, reserved=1)
+        self.dbapi.create_usage(ctxt, instances, {}, dict(tenant_id='t2'),
+                                used=7)
+        self.dbapi.create_usage(ctxt, fixed_ips, dict(network='a'),
+                                dict(tenant_id='t1'), used=1)
+        self.dbapi.create_usage(ctxt, fixed_ips, dict(network='b'),
+                                dict(tenant_id='t1'), used=2)
+        self.dbapi.create_usage(ctxt, keypairs, {},
+                                dict(tenant_id='t1', user_id='u1'), used=1)
+        self.dbapi.create_usage(ctxt, keypairs, {},
+                                dict(tenant_id='t1', user_id='u2'), used=2)
+        self.dbapi.commit(ctxt)
+
+    def _report(self, auth_data):
+        return self.dbapi.get_usage_report(self.context, self.service,
+                                           auth_data)
+
+    def test_report(self):
+        with self.assert_max_queries(2):
+            report = self._report(dict(tenant_id='t1', user_id='u1',
+                                       roles=['admin']))
+
+        self.assertEqual(report, [
+            ('cores', {}, 0, 0, None),
+            ('fixed_ips', dict(network='a'), 1, 0, 5),
+            ('fixed_ips', dict(network='b'), 2, 0, 5),
+            ('instances', {}, 4, 1, 20),
+            ('keypairs', {}, 1, 0, 3),
+        ])
+        self.assertEqual(report[0].resource, 'cores')
+        self.assertEqual(report[3].limit, 20)
+
+    def test_report_less_specific(self):
+        report = self._report(dict(tenant_id='t1', user_id='u2'))
+
+        self.assertEqual(report[3], ('instances', {}, 4, 1, 20))
+        self.assertEqual(report[4], ('keypairs', {}, 2, 0, 2))
+
+    def test_report_default(self):
+        report = self._report(dict(tenant_id='t3', user_id='u3'))
+
+        self.assertEqual(report, [
+            ('cores', {}, 0, 0, None),
+            ('fixed_ips', {}, 0, 0, 5),
+            ('instances', {}, 0, 0, 10),
+            ('keypairs', {}, 0, 0, None),
+        ])
+
+    def test_report_other_tenant(self):
+        report = self._report(dict(tenant_id='t2', user_id='u1'))
+
+        self.assertEqual(report[2], ('instances', {}, 7, 0, 30))
+
+    def test_report_unlimited_quota(self):
+        self.dbapi.create_quota(self.context, self.dbapi.get_resource(
+            self.context, service=self.service, name='instances'),
+            dict(tenant_id='t3'), None)
+
+        report = self._report(dict(tenant_id='t3', user_id='u3'))
+
+        self.assertEqual(report[2], ('instances', {}, 0, 0, None))
+
+    def test_report_unknown_service(self):
+        self.assertEqual(self.dbapi.get_usage_report(self.context,
+                                                     'no-such-id', {}), [])
+
+
+class FindResourcesTestCase(tests.DBTestCase):
+    def setUp(self):
+        super(FindResourcesTestCase, self).setUp()
+
+        ctxt = self.context
+        self.service = self.dbapi.create_service(ctxt, 'nova',
+                                                 set(['tenant_id']))
+        self.category = self.dbapi.create_category(ctxt, self.service,
+                                                   'compute',
+                                                   set(['tenant_id']),
+                                                   [set()])
+        self.ids = {}
+        for name in ('instances', 'network', 'network/fixed_ips',
+                     'network/floating_ips', 'network/fixed_ips/v6'):
+            self.ids[name] = self.dbapi.create_resource(
+                ctxt, self.service, self.category, name, set()).id
+
+        other = self.dbapi.create_service(ctxt, 'glance', set(['tenant_id']))
+        self.dbapi.create_resource(
+            ctxt, other, self.dbapi.create_category(
+                ctxt, other, 'images', set(['tenant_id']), [set()]),
+            'network/images', set())
+        self.dbapi.commit(ctxt)
+
+    def _ids(self, *names):
+        return [self.ids[name] for name in names]
+
+    def test_prefix(self):
+        with self.assert_max_queries(1):
+            result = self.dbapi.find_resources(self.context, self.service,
+                                               prefix='network')
+        with self.assert_max_queries(0):
+            self.dbapi.find_resources(self.context, self.service.id,
+                                      prefix='network/fixed_ips')
+
+        self.assertEqual(result, self._ids('network', 'network/fixed_ips',
+                                           'network/fixed_ips/v6',
+                                           'network/floating_ips'))
+
+    def test_pattern(self):
+        result = self.dbapi.find_resources(self.context, self.service,
+                                           pattern='network/f*_ips')
+
+        self.assertEqual(result, self._ids('network/fixed_ips',
+                                           'network/floating_ips'))
+
+    def test_created_after_load(self):
+        self.dbapi.find_resources(self.context, self.service, prefix='')
+        resource = self.dbapi.create_resource(self.context, self.service,
+                                              self.category, 'network/ports',
+                                              set())
+
+        with self.assert_max_queries(0):
+            result = self.dbapi.find_resources(self.context, self.service,
+                                               pattern='network/p*')
+
+        self.assertEqual(result, [resource.id])
+
+    def test_prefix_and_pattern(self):
+        self.assertRaises(TypeError, self.dbapi.find_resources,
+                          self.context, self.service)
+        self.assertRaises(TypeError, self.dbapi.find_resources,
+                          self.context, self.service, prefix='network',
+                          pattern='network/*')
+
+    def test_get_usages(self):
+        for name in ('network/fixed_ips', 'network/floating_ips',
+                     'instances'):
+            for tenant in ('t1', 't2'):
+                self.dbapi.create_usage(self.context, self.ids[name], {},
+                                        dict(tenant_id=tenant), used=1)
+
+        ids = self.dbapi.find_resources(self.context, self.service,
+                                        pattern='network/*')
+        with self.assert_max_queries(1):
+            usages = self.dbapi.get_usages(self.context, resource=ids,
+                                           auth_data=dict(tenant_id='t1'))
+
+        self.assertEqual(sorted(usage.resource_id for usage in usages),
+                         sorted(ids))
+        self.assertEqual(self.dbapi.get_usages(self.context, resource=[]),
+                         [])
+        self.assertEqual(len(self.dbapi.get_usages(
+            self.context, resource=self.ids['instances'])), 2)
+
+
+class InsertOrIgnoreTestCase(tests.TestCase):
+    def _compile(self, dialect):
+        insert = sa_api._InsertOrIgnore(sa_models.Service.__table__,
+                                        dict(id='id', name='nova'))
+        return str(insert.compile(dialect=dialect))
+
+    def test_sqlite(self):
+        self.assertTrue(self._compile(sqlite.dialect()).startswith(
+            'INSERT OR IGNORE INTO services '))
+
+    def test_mysql(self):
+        self.assertTrue(self._compile(mysql.dialect()).endswith(
+            ' ON DUPLICATE KEY UPDATE id = id'))
+
+    def test_postgresql(self):
+        self.assertTrue(self._compile(postgresql.dialect()).endswith(
+            ' ON CONFLICT DO NOTHING'))
@@ -0,0 +1,99 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import uuid
+
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+
+from boson.db.sqlalchemy import models as sa_models
+
+import tests
+
+
+UUID = '9bb4060a-3a1d-49e0-8c9b-b6f16b430cac'
+
+
+class BinaryUUIDTestCase(tests.TestCase):
+    def setUp(self):
+        super(BinaryUUIDTestCase, self).setUp()
+
+        self.type = sa_models.BinaryUUID()
+
+    def test_dialect_impl(self):
+        self.assertTrue(isinstance(
+            self.type.load_dialect_impl(mysql.dialect()), mysql.BINARY))
+        self.assertEqual(
+            self.type.load_dialect_impl(mysql.dialect()).length, 16)
+        self.assertTrue(isinstance(
+            self.type.load_dialect_impl(postgresql.dialect()),
+            postgresql.UUID))
+        self.assertEqual(
+            self.type.load_dialect_impl(sqlite.dialect()).length, 36)
+
+    def test_mysql(self):
+        dialect = mysql.dialect()
+
+        value = self.type.process_bind_param(UUID, dialect)
+        self.assertEqual(value, uuid.UUID(UUID).bytes)
+        self.assertEqual(self.type.process_result_value(value, dialect),
+                         UUID)
+
+    def test_mysql_uppercase(self):
+        value = self.type.process_bind_param(UUID.upper(), mysql.dialect())
+
+        self.assertEqual(value, uuid.UUID(UUID).bytes)
+
+    def test_postgresql(self):
+        dialect = postgresql.dialect()
+
+        self.assertEqual(self.type.process_bind_param(UUID, dialect), UUID)
+        self.assertEqual(self.type.process_result_value(UUID, dialect),
+                         UUID)
+
+    def test_sqlite(self):
+        dialect = sqlite.dialect()
+
+        self.assertEqual(self.type.process_bind_param('spam', dialect),
+                         'spam')
+        self.assertEqual(self.type.process_result_value('spam', dialect),
+                         'spam')
+
+    def test_not_uuid(self):
+        for dialect in (mysql.dialect(), postgresql.dialect()):
+            self.assertEqual(self.type.process_bind_param('spam', dialect),
+                             None)
+
+    def test_none(self):
+        for dialect in (mysql.dialect(), postgresql.dialect(),
+                        sqlite.dialect()):
+            self.assertEqual(self.type.process_bind_param(None, dialect),
+                             None)
+            self.assertEqual(self.type.process_result_value(None, dialect),
+                             None)
+
+    def test_columns(self):
+        for model in (sa_models.Service, sa_models.Category,
+                      sa_models.Resource, sa_models.Usage, sa_models.Quota,
+                      sa_models.Reservation, sa_models.ReservedItem):
+            for column in model.__table__.columns:
+                if column.primary_key or column.foreign_keys:
+                    self.assertTrue(isinstance(column.type,
+                                               sa_models.BinaryUUID),
+                                    '%s.%s' % (model.__tablename__,
+                                               column.name))
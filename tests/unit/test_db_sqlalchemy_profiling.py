@@ -0,0 +1,122 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.db.sqlalchemy import models as sa_models
+from boson.db.sqlalchemy import profiling
+
+import tests
+
+
+class RequestStatsTestCase(tests.TestCase):
+    def test_record(self):
+        stats = profiling.RequestStats('req-1')
+
+        self.assertEqual(stats.record('SELECT 1', 0.5), 1)
+        self.assertEqual(stats.record('SELECT 2', 0.25), 1)
+        self.assertEqual(stats.record('SELECT 1', 0.25), 2)
+
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.time, 1.0)
+        self.assertEqual(stats.repeated(), {'SELECT 1': 2})
+
+
+class QueryProfilerTestCase(tests.DBTestCase):
+    def setUp(self):
+        super(QueryProfilerTestCase, self).setUp()
+
+        self.profiler = profiling.QueryProfiler(max_requests=2,
+                                                repeat_threshold=2)
+        self.profiler.enabled = True
+        self.profiler.install(self.engine)
+        self.addCleanup(setattr, self.profiler, 'enabled', False)
+
+        session = self.context.session
+        self.service = sa_models.Service(name='nova',
+                                         auth_fields=set(['tenant_id']))
+        session.add(self.service)
+        session.commit()
+
+        patcher = mock.patch.object(profiling, 'LOG')
+        self.mock_log = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_per_request(self):
+        self.profiler.pop(self.context.request_id)
+
+        self.dbapi.get_service(self.context, name='nova')
+
+        stats = self.profiler.get(self.context.request_id)
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.repeated(), {})
+        self.assertFalse(self.mock_log.warning.called)
+
+    def test_repeated(self):
+        self.profiler.pop(self.context.request_id)
+
+        for i in range(3):
+            self.dbapi.get_service(self.context, id=self.service.id)
+
+        stats = self.profiler.get(self.context.request_id)
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.repeated().values(), [3])
+        self.assertEqual(self.mock_log.warning.call_count, 1)
+
+    def test_untagged(self):
+        self.engine.execute('SELECT 1')
+
+        self.assertEqual(self.profiler.get(None), None)
+
+    def test_error(self):
+        conn = self.engine.connect()
+        self.addCleanup(conn.close)
+
+        self.assertRaises(Exception, conn.execute, 'SELECT spam FROM eggs')
+
+        self.assertEqual(conn.info[self.profiler._start_key], [])
+
+    def test_max_requests(self):
+        for request_id in ('req-1', 'req-2', 'req-3'):
+            self.profiler._stats(request_id)
+
+        self.assertEqual(self.profiler.get('req-1'), None)
+        self.assertNotEqual(self.profiler.get('req-3'), None)
+
+    def test_disabled(self):
+        self.profiler.enabled = False
+        self.profiler.pop(self.context.request_id)
+
+        self.dbapi.get_service(self.context, name='nova')
+
+        self.assertEqual(self.profiler.get(self.context.request_id), None)
+
+
+class AssertMaxQueriesTestCase(tests.DBTestCase):
+    def test_within_limit(self):
+        with self.assert_max_queries(1) as capture:
+            self.engine.execute('SELECT 1')
+
+        self.assertEqual(capture.statements, ['SELECT 1'])
+
+    def test_over_limit(self):
+        def over():
+            with self.assert_max_queries(1):
+                self.engine.execute('SELECT 1')
+                self.engine.execute('SELECT 2')
+
+        self.assertRaises(AssertionError, over)
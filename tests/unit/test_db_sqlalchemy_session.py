@@ -0,0 +1,267 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+import sqlalchemy
+from sqlalchemy import exc
+from sqlalchemy import pool
+
+from boson.db.sqlalchemy import session as db_session
+from boson.openstack.common import cfg
+from boson import utils
+
+import tests
+
+
+class GetEngineTestCase(tests.TestCase):
+    def setUp(self):
+        super(GetEngineTestCase, self).setUp()
+
+        for name in ('_ENGINE', '_ENGINE_PID', '_MAKER'):
+            patcher = mock.patch.object(db_session, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(db_session, '_STATE', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for name in ('_LOCK', '_LOCK_PID'):
+            patcher = mock.patch.object(db_session, name,
+                                        getattr(db_session, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.engine = mock.Mock()
+        patcher = mock.patch.object(db_session, '_create_engine',
+                                    side_effect=self._create_engine)
+        self.mock_create = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_engine(self):
+        # Give other threads a chance to race
+        time.sleep(0.01)
+        return self.engine
+
+    def test_created_once(self):
+        engines = []
+        threads = [threading.Thread(
+            target=lambda: engines.append(db_session.get_engine()))
+            for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(engines, [self.engine] * 5)
+        self.assertEqual(self.mock_create.call_count, 1)
+        self.assertFalse(self.engine.pool.recreate.called)
+
+    def test_maker_created_once(self):
+        with mock.patch.object(db_session, 'get_maker') as mock_get_maker:
+            db_session.get_session()
+            db_session.get_session()
+
+        mock_get_maker.assert_called_once_with(self.engine, False, False,
+                                               True)
+
+    @mock.patch.object(utils, 'spawn')
+    def test_forked(self, mock_spawn):
+        old_pool = self.engine.pool
+        db_session.get_engine()
+
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            self.assertEqual(db_session.get_engine(), self.engine)
+            db_session.get_engine()
+
+        self.assertEqual(self.mock_create.call_count, 1)
+        old_pool.recreate.assert_called_once_with()
+        self.assertFalse(old_pool.dispose.called)
+        self.assertEqual(self.engine.pool, old_pool.recreate.return_value)
+        mock_spawn.assert_called_once_with(db_session._connect, self.engine)
+        self.assertEqual(db_session.status()['status'], 'starting')
+
+    @mock.patch.object(utils, 'spawn')
+    def test_forked_lock_held(self, mock_spawn):
+        db_session.get_engine()
+
+        # As if another thread held the lock when the process forked
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with db_session._lock():
+                held.set()
+                release.wait()
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        try:
+            with mock.patch('os.getpid', return_value=os.getpid() + 1):
+                self.assertEqual(db_session.get_engine(), self.engine)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(mock_spawn.call_count, 1)
+
+    @mock.patch.object(utils, 'spawn')
+    def test_forked_maker(self, mock_spawn):
+        old_pool = self.engine.pool
+        with mock.patch.object(db_session, 'get_maker') as mock_get_maker:
+            db_session.get_session()
+            with mock.patch('os.getpid', return_value=os.getpid() + 1):
+                db_session.get_session()
+                db_session.get_session()
+
+        self.assertEqual(mock_get_maker.call_count, 2)
+        old_pool.recreate.assert_called_once_with()
+
+    @mock.patch.object(utils, 'spawn')
+    def test_after_fork_not_forked(self, mock_spawn):
+        old_pool = self.engine.pool
+        db_session.get_engine()
+        db_session.after_fork()
+
+        self.assertFalse(old_pool.recreate.called)
+        self.assertFalse(mock_spawn.called)
+
+    def test_no_connection(self):
+        db_session.get_engine()
+
+        self.assertFalse(self.engine.connect.called)
+
+
+class StartTestCase(tests.TestCase):
+    def setUp(self):
+        super(StartTestCase, self).setUp()
+
+        patcher = mock.patch.object(db_session, '_STATE',
+                                    dict(status='unknown', attempts=0,
+                                         error=None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for name, value in (('sql_max_retries', 3),
+                            ('sql_retry_interval', 1),
+                            ('sql_max_retry_interval', 3),
+                            ('sql_pool_warm_up', True)):
+            cfg.CONF.set_override(name, value)
+            self.addCleanup(cfg.CONF.clear_override, name)
+
+        self.engine = mock.Mock()
+        self.sleeps = []
+        patcher = mock.patch.object(utils, 'sleep',
+                                    side_effect=self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(db_session, '_warm_up')
+        self.mock_warm_up = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fail(self, *codes):
+        self.engine.connect.side_effect = [
+            exc.OperationalError('connect', {}, Exception(code))
+            for code in codes] + [mock.Mock()]
+
+    @mock.patch.object(utils, 'spawn')
+    def test_start(self, mock_spawn):
+        with mock.patch.object(db_session, 'get_engine',
+                               return_value=self.engine):
+            db_session.start()
+            db_session.start()
+
+        mock_spawn.assert_called_once_with(db_session._connect, self.engine)
+        self.assertEqual(db_session.status()['status'], 'starting')
+
+    def test_connect(self):
+        self._fail()
+        db_session._connect(self.engine)
+
+        self.assertEqual(db_session.status(),
+                         dict(status='ready', attempts=1, error=None))
+        self.mock_warm_up.assert_called_once_with(self.engine)
+        self.assertEqual(self.sleeps, [])
+
+    def test_backoff(self):
+        self._fail('2003', '2003', '2003')
+        db_session._connect(self.engine)
+
+        self.assertEqual(self.sleeps, [1, 2, 3])
+        self.assertEqual(db_session.status(),
+                         dict(status='ready', attempts=4, error=None))
+
+    def test_retries_exhausted(self):
+        self._fail('2003', '2003', '2003', '2003')
+        db_session._connect(self.engine)
+
+        self.assertEqual(self.sleeps, [1, 2, 3])
+        state = db_session.status()
+        self.assertEqual(state['status'], 'failed')
+        self.assertEqual(state['attempts'], 4)
+        self.assertTrue('2003' in state['error'])
+        self.assertFalse(self.mock_warm_up.called)
+
+    def test_infinite_retries(self):
+        cfg.CONF.set_override('sql_max_retries', -1)
+        self._fail(*(['2003'] * 10))
+        db_session._connect(self.engine)
+
+        self.assertEqual(len(self.sleeps), 10)
+        self.assertEqual(db_session.status()['status'], 'ready')
+
+    def test_not_connection_error(self):
+        self._fail('1045')
+        db_session._connect(self.engine)
+
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(db_session.status()['status'], 'failed')
+
+
+class WarmUpTestCase(tests.TestCase):
+    def setUp(self):
+        super(WarmUpTestCase, self).setUp()
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.engine = sqlalchemy.create_engine(
+            'sqlite:///%s' % os.path.join(tmpdir, 'test.db'),
+            poolclass=pool.QueuePool, pool_size=3)
+        self.addCleanup(self.engine.dispose)
+
+    def test_warm_up(self):
+        db_session._warm_up(self.engine)
+
+        self.assertEqual(self.engine.pool.checkedin(), 3)
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+
+    def test_warm_up_partly_open(self):
+        conn = self.engine.connect()
+        db_session._warm_up(self.engine)
+        conn.close()
+
+        self.assertEqual(self.engine.pool.checkedin(), 3)
+
+    def test_not_queue_pool(self):
+        engine = sqlalchemy.create_engine('sqlite://',
+                                          poolclass=pool.NullPool)
+
+        db_session._warm_up(engine)
@@ -0,0 +1,58 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import sqlite
+
+from boson.db.sqlalchemy import statements
+
+import tests
+
+
+class CompiledTestCase(tests.TestCase):
+    def test_cached_per_dialect(self):
+        dialect = sqlite.dialect()
+
+        stmt = statements.compiled('select_usage', dialect)
+        self.assertTrue(statements.compiled('select_usage', dialect) is stmt)
+        self.assertFalse(statements.compiled('select_usage',
+                                             sqlite.dialect()) is stmt)
+
+    def test_for_update(self):
+        dialect = mysql.dialect()
+
+        self.assertFalse(str(statements.compiled(
+            'select_usage', dialect)).endswith('FOR UPDATE'))
+        self.assertTrue(str(statements.compiled(
+            'select_usage_for_update', dialect)).endswith('FOR UPDATE'))
+
+    def test_update_reserved(self):
+        stmt = statements.compiled('update_reserved', sqlite.dialect())
+
+        self.assertEqual(
+            str(stmt),
+            'UPDATE usages SET updated_at=?, '
+            'reserved=(usages.reserved + ?), '
+            'generation=(usages.generation + ?) '
+            'WHERE usages.id = ? AND usages.generation = ?')
+
+    def test_insert_columns(self):
+        stmt = statements.compiled('insert_reserved_item', sqlite.dialect())
+
+        self.assertEqual(sorted(stmt.positiontup),
+                         ['created_at', 'delta', 'id', 'reservation_id',
+                          'resource_id', 'updated_at', 'usage_id'])
@@ -0,0 +1,185 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.db import usage_ledger
+from boson import exceptions
+from boson import utils
+
+import tests
+
+
+class RunningTotalsTestCase(tests.TestCase):
+    def setUp(self):
+        super(RunningTotalsTestCase, self).setUp()
+
+        self.totals = usage_ledger.RunningTotals(ttl=10)
+
+    def _set(self, used, reserved):
+        self.totals.set('usage', used, reserved,
+                        self.totals.generation('usage'))
+
+    def test_get_set(self):
+        self.assertRaises(KeyError, self.totals.get, 'usage')
+
+        self._set(1, 2)
+
+        self.assertEqual(self.totals.get('usage'), (1, 2))
+
+    @mock.patch('time.time')
+    def test_expiry(self, mock_time):
+        mock_time.return_value = 1000.0
+        self._set(1, 2)
+
+        mock_time.return_value = 1011.0
+
+        self.assertRaises(KeyError, self.totals.get, 'usage')
+
+    def test_committed(self):
+        self._set(1, 2)
+        entries = [('usage', 0, 3), ('usage', 2, -3), ('other', 1, 0)]
+
+        self.totals.committing(entries)
+        self.totals.committed(entries)
+
+        self.assertEqual(self.totals.get('usage'), (3, 2))
+        self.assertRaises(KeyError, self.totals.get, 'other')
+
+    def test_not_committed(self):
+        self._set(1, 2)
+        entries = [('usage', 0, 3)]
+
+        self.totals.committing(entries)
+        self.totals.committed(entries, False)
+
+        self.assertEqual(self.totals.get('usage'), (1, 2))
+
+    def test_set_after_commit(self):
+        # The amounts read may or may not include the entries
+        generation = self.totals.generation('usage')
+        self.totals.committing([('usage', 0, 3)])
+        self.totals.committed([('usage', 0, 3)])
+
+        self.totals.set('usage', 1, 2, generation)
+
+        self.assertRaises(KeyError, self.totals.get, 'usage')
+
+    def test_set_while_committing(self):
+        self.totals.committing([('usage', 0, 3)])
+        self.totals.committing([('usage', 0, 1)])
+        self.totals.committed([('usage', 0, 3)])
+
+        self._set(1, 2)
+        self.assertRaises(KeyError, self.totals.get, 'usage')
+
+        self.totals.committed([('usage', 0, 1)])
+        self._set(1, 6)
+        self.assertEqual(self.totals.get('usage'), (1, 6))
+
+    def test_clear(self):
+        self._set(1, 2)
+        generation = self.totals.generation('usage')
+
+        self.totals.clear()
+
+        self.assertRaises(KeyError, self.totals.get, 'usage')
+        self.assertNotEqual(self.totals.generation('usage'), generation)
+
+    def test_hold(self):
+        generation = self.totals.generation('usage')
+
+        self.assertTrue(self.totals.hold('usage', 3, 10, 1, 2, generation))
+        self.assertFalse(self.totals.hold('usage', 5, 10, 1, 2, generation))
+        self.assertTrue(self.totals.hold('usage', 4, 10, 1, 2, generation))
+        self.assertTrue(self.totals.hold('usage', 4, None, 1, 2,
+                                         generation))
+
+        self.totals.release([('usage', 3), ('usage', 4)])
+
+        self.assertTrue(self.totals.hold('usage', 3, 10, 1, 2, generation))
+        self.assertFalse(self.totals.hold('usage', 4, 10, 1, 2, generation))
+
+    def test_hold_cached(self):
+        generation = self.totals.generation('usage')
+        self._set(1, 2)
+        self.totals.committing([('usage', 0, 5)])
+        self.totals.committed([('usage', 0, 5)])
+
+        # The cached amounts include the committed entries
+        self.assertFalse(self.totals.hold('usage', 3, 10, 1, 2, generation))
+        self.assertTrue(self.totals.hold('usage', 2, 10, 1, 2, generation))
+
+    def test_hold_out_of_date(self):
+        generation = self.totals.generation('usage')
+        self.totals.committing([('usage', 0, 5)])
+        self.totals.committed([('usage', 0, 5)])
+
+        self.assertEqual(self.totals.hold('usage', 1, 10, 1, 2, generation),
+                         None)
+
+    def test_release(self):
+        generation = self.totals.generation('usage')
+        self.totals.hold('usage', 3, 10, 0, 0, generation)
+
+        self.totals.release([('usage', 3), ('other', 1)])
+
+        self.assertEqual(self.totals._held, {})
+
+    def test_disabled(self):
+        totals = usage_ledger.RunningTotals(ttl=0)
+
+        totals.set('usage', 1, 2, totals.generation('usage'))
+
+        self.assertRaises(KeyError, totals.get, 'usage')
+
+
+class CompactorTestCase(tests.TestCase):
+    def setUp(self):
+        super(CompactorTestCase, self).setUp()
+
+        self.dbapi = mock.MagicMock()
+        self.context = mock.Mock()
+        self.compactor = usage_ledger.Compactor(self.dbapi, interval=5,
+                                                batch=10)
+
+        patcher = mock.patch.object(utils, 'TIMERS', utils.TimerRegistry())
+        self.timers = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_compact(self):
+        self.dbapi.compact_ledger.side_effect = [10, 10, 3]
+
+        self.assertEqual(self.compactor.compact(self.context), 23)
+
+        self.assertEqual(self.dbapi.compact_ledger.call_args_list,
+                         [mock.call(self.context, 10)] * 3)
+        self.assertEqual(self.dbapi.transaction.call_count, 3)
+        self.assertEqual(
+            self.timers.report()['ledger.compact']['count'], 1)
+
+    def test_compact_concurrent(self):
+        self.dbapi.compact_ledger.side_effect = [
+            10, exceptions.ConcurrentUpdate(reason='test')]
+
+        self.assertEqual(self.compactor.compact(self.context), 10)
+
+    def test_defaults(self):
+        compactor = usage_ledger.Compactor(self.dbapi)
+
+        self.assertEqual(compactor.interval, 10)
+        self.assertEqual(compactor.batch, 1000)
@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import itertools
+import xmlrpclib
+
+import mock
+
+from boson.db import models
+from boson.openstack.common import jsonutils
+
+import tests
+
+
+class ToPrimitiveTestCase(tests.TestCase):
+    def test_simple(self):
+        for value in ('spam', u'spam', 1, 1L, 1.5, True, None):
+            self.assertEqual(jsonutils.to_primitive(value), value)
+
+    def test_containers(self):
+        value = dict(a=[1, (2, 3)], b=dict(c='d'), e=set([4]))
+
+        self.assertEqual(jsonutils.to_primitive(value),
+                         dict(a=[1, [2, 3]], b=dict(c='d'), e=[4]))
+
+    def test_datetime(self):
+        value = datetime.datetime(2012, 10, 26, 17, 37, 18, 592202)
+
+        self.assertEqual(jsonutils.to_primitive([value]),
+                         ['2012-10-26T17:37:18.592202'])
+
+    def test_xmlrpc_datetime(self):
+        value = xmlrpclib.DateTime(
+            datetime.datetime(2012, 10, 26, 17, 37, 18))
+
+        self.assertEqual(jsonutils.to_primitive(value),
+                         '2012-10-26T17:37:18.000000')
+
+    def test_iteritems(self):
+        class IterItems(object):
+            def iteritems(self):
+                return iter([('a', 1), ('b', [2])])
+
+        self.assertEqual(jsonutils.to_primitive(IterItems()),
+                         dict(a=1, b=[2]))
+
+    def test_instance(self):
+        class Instance(object):
+            def __init__(self):
+                self.a = 1
+
+        value = Instance()
+
+        self.assertEqual(jsonutils.to_primitive(value), value)
+        self.assertEqual(jsonutils.to_primitive(value,
+                                                convert_instances=True),
+                         dict(a=1))
+
+    def test_cycle(self):
+        class Instance(object):
+            pass
+
+        value = Instance()
+        value.value = value
+
+        self.assertEqual(jsonutils.to_primitive(value,
+                                                convert_instances=True),
+                         dict(value=dict(value=dict(value='?'))))
+
+    def test_cycle_list(self):
+        value = [1]
+        value.append(value)
+
+        self.assertEqual(jsonutils.to_primitive(value),
+                         [1, [1, [1, [1, '?']]]])
+
+    def test_cycle_dict(self):
+        value = dict(a=1)
+        value['b'] = [value]
+
+        self.assertEqual(jsonutils.to_primitive(value),
+                         dict(a=1, b=[dict(a=1, b=[dict(a=1, b='?')])]))
+
+    def test_cycle_converted(self):
+        class List(list):
+            pass
+
+        value = List([1])
+        value.append(value)
+
+        self.assertEqual(jsonutils.to_primitive(value),
+                         [1, [1, [1, [1, '?']]]])
+
+    def test_nasty(self):
+        self.assertEqual(jsonutils.to_primitive([jsonutils]),
+                         [unicode(jsonutils)])
+        self.assertEqual(jsonutils.to_primitive(itertools.count(1)),
+                         unicode(itertools.count(1)))
+
+    def test_model(self):
+        base_obj = mock.Mock(id='id', created_at=None, updated_at=None,
+                             resource_id='resource_id', auth_data=dict(a=1),
+                             limit=5)
+        quota = models.Quota('context', 'dbapi', base_obj)
+
+        self.assertEqual(jsonutils.to_primitive([quota]), [dict(
+            id='id',
+            created_at=None,
+            updated_at=None,
+            resource_id='resource_id',
+            auth_data=dict(a=1),
+            limit=5,
+        )])
+
+    def test_register_converter(self):
+        class Spam(object):
+            pass
+
+        class SubSpam(Spam):
+            pass
+
+        self.assertEqual(jsonutils.to_primitive(SubSpam()).__class__,
+                         SubSpam)
+
+        with mock.patch.dict(jsonutils._converters):
+            jsonutils.register_converter(Spam, lambda v: dict(spam=[1]))
+
+            self.assertEqual(jsonutils.to_primitive(SubSpam()),
+                             dict(spam=[1]))
@@ -0,0 +1,131 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import threading
+
+import mock
+
+from boson.openstack.common import log
+
+import tests
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.threads = []
+
+    def emit(self, record):
+        self.records.append(record)
+        self.threads.append(threading.current_thread().name)
+
+
+class ContextAdapterTestCase(tests.TestCase):
+    def setUp(self):
+        super(ContextAdapterTestCase, self).setUp()
+
+        self.logger = log.getLogger('boson.tests.log').logger
+        self.logger.propagate = False
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.adapter = log.ContextAdapter(self.logger, 'boson', '1.0')
+
+    def test_disabled_level_skips_process(self):
+        self.logger.setLevel(logging.INFO)
+
+        with mock.patch.object(self.adapter, 'process') as mock_process:
+            self.adapter.debug('spam %s', 'spam')
+
+        self.assertFalse(mock_process.called)
+        self.assertEqual(self.handler.records, [])
+
+    def test_enabled_level(self):
+        self.logger.setLevel(logging.DEBUG)
+
+        self.adapter.debug('spam %s', 'eggs')
+        self.adapter.audit('audit')
+
+        self.assertEqual([r.getMessage() for r in self.handler.records],
+                         ['spam eggs', 'audit'])
+        self.assertEqual(self.handler.records[0].project, 'boson')
+        self.assertEqual(self.handler.records[1].levelno, logging.AUDIT)
+
+    def test_caller(self):
+        self.logger.setLevel(logging.DEBUG)
+
+        self.adapter.warn('spam')
+
+        record = self.handler.records[0]
+        self.assertEqual(record.funcName, 'test_caller')
+        self.assertEqual(record.module, 'test_log')
+
+    def test_logger_not_patched(self):
+        self.assertIsInstance(self.logger, log.ContextLogger)
+        self.assertNotIn('findCaller', vars(self.logger))
+
+    def test_logger_class_not_installed(self):
+        self.assertFalse(isinstance(logging.getLogger('boson.tests.other'),
+                                    log.ContextLogger))
+        self.assertFalse(issubclass(logging.getLoggerClass(),
+                                    log.ContextLogger))
+
+
+class AsyncHandlerTestCase(tests.TestCase):
+    def setUp(self):
+        super(AsyncHandlerTestCase, self).setUp()
+
+        self.target = RecordingHandler()
+        self.handler = log.AsyncHandler(self.target)
+        self.addCleanup(self.handler.close)
+
+    def _record(self, msg, *args):
+        return logging.LogRecord('spam', logging.INFO, __file__, 1, msg,
+                                 args, None)
+
+    def test_emit(self):
+        args = ['eggs']
+        self.handler.handle(self._record('spam %s', args))
+        args.append('spam')
+
+        self.handler.flush()
+
+        self.assertEqual(len(self.target.records), 1)
+        self.assertEqual(self.target.records[0].getMessage(),
+                         "spam ['eggs']")
+        self.assertEqual(self.target.threads, ['log-writer'])
+
+    def test_overflow(self):
+        handler = log.AsyncHandler(self.target, queue_size=1)
+        self.addCleanup(handler.close)
+
+        with mock.patch.object(handler._queue, 'put_nowait',
+                               side_effect=log.Queue.Full):
+            handler.handle(self._record('spam'))
+
+        self.assertEqual(handler.dropped, 1)
+
+    def test_close_flushes(self):
+        for i in range(10):
+            self.handler.handle(self._record('spam %d', i))
+
+        self.handler.close()
+
+        self.assertEqual([r.getMessage() for r in self.target.records],
+                         ['spam %d' % i for i in range(10)])
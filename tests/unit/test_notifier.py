@@ -0,0 +1,187 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from boson.openstack.common.notifier import dispatcher
+
+import tests
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self.messages = []
+
+    def notify(self, context, message):
+        self.messages.append((context, message))
+
+
+class FakeBatchDriver(object):
+    def __init__(self):
+        self.batches = []
+
+    def notify_batch(self, items):
+        self.batches.append(list(items))
+
+
+class NotificationDispatcherTestCase(tests.TestCase):
+    def setUp(self):
+        super(NotificationDispatcherTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.driver = FakeDriver()
+        self.batch_driver = FakeBatchDriver()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(NotificationDispatcherTestCase, self).tearDown()
+
+    def _dispatcher(self, **kwargs):
+        return dispatcher.NotificationDispatcher(
+            lambda: [self.driver, self.batch_driver], **kwargs)
+
+    def test_bad_policy(self):
+        self.assertRaises(ValueError, self._dispatcher,
+                          overflow_policy='spam')
+
+    def test_spill_requires_path(self):
+        self.assertRaises(ValueError, self._dispatcher,
+                          overflow_policy=dispatcher.SPILL)
+
+    def test_flush_batches(self):
+        disp = self._dispatcher(batch_size=2)
+        for i in range(5):
+            disp.put('ctx', dict(seq=i))
+
+        self.assertEqual(disp.depth, 5)
+
+        disp.flush()
+
+        self.assertEqual(self.driver.messages,
+                         [('ctx', dict(seq=i)) for i in range(5)])
+        self.assertEqual([len(b) for b in self.batch_driver.batches],
+                         [2, 2, 1])
+        self.assertEqual(disp.get_stats(), dict(
+            queued=5,
+            sent=5,
+            dropped=0,
+            spilled=0,
+            failed=0,
+            batches=3,
+            depth=0,
+            spill_depth=0,
+        ))
+
+    def test_drop(self):
+        disp = self._dispatcher(queue_size=2)
+        for i in range(4):
+            disp.put(None, dict(seq=i))
+
+        disp.flush()
+
+        self.assertEqual(self.driver.messages,
+                         [(None, dict(seq=0)), (None, dict(seq=1))])
+        stats = disp.get_stats()
+        self.assertEqual(stats['queued'], 2)
+        self.assertEqual(stats['dropped'], 2)
+
+    def test_spill(self):
+        spill_path = os.path.join(self.tmpdir, 'spill')
+        disp = self._dispatcher(queue_size=1,
+                                overflow_policy=dispatcher.SPILL,
+                                spill_path=spill_path)
+        for i in range(3):
+            disp.put('ctx', dict(seq=i))
+
+        self.assertTrue(os.path.exists(spill_path))
+        stats = disp.get_stats()
+        self.assertEqual(stats['spilled'], 2)
+        self.assertEqual(stats['spill_depth'], 2)
+
+        disp.flush()
+
+        self.assertEqual(self.driver.messages, [
+            ('ctx', dict(seq=0)),
+            (None, dict(seq=1)),
+            (None, dict(seq=2)),
+        ])
+        self.assertFalse(os.path.exists(spill_path))
+        self.assertEqual(disp.get_stats()['spill_depth'], 0)
+
+    def test_spill_left_behind(self):
+        spill_path = os.path.join(self.tmpdir, 'spill')
+        with open(spill_path, 'w') as f:
+            f.write('{"seq": 0}\n{"seq": 1}\n')
+        disp = self._dispatcher(overflow_policy=dispatcher.SPILL,
+                                spill_path=spill_path)
+
+        disp.flush()
+
+        self.assertEqual(self.driver.messages,
+                         [(None, dict(seq=0)), (None, dict(seq=1))])
+        self.assertFalse(os.path.exists(spill_path))
+        self.assertEqual(disp.get_stats()['sent'], 2)
+
+    def test_unspill_batches(self):
+        spill_path = os.path.join(self.tmpdir, 'spill')
+        disp = self._dispatcher(queue_size=1, batch_size=2,
+                                overflow_policy=dispatcher.SPILL,
+                                spill_path=spill_path)
+        for i in range(6):
+            disp.put(None, dict(seq=i))
+        disp._get_batch(block=False)
+
+        self.assertEqual(disp._unspill(), [(None, dict(seq=1)),
+                                           (None, dict(seq=2))])
+        self.assertFalse(os.path.exists(spill_path))
+        self.assertEqual(disp.get_stats()['spill_depth'], 3)
+
+        disp.flush()
+
+        self.assertEqual([len(b) for b in self.batch_driver.batches],
+                         [2, 1])
+        self.assertEqual(disp.get_stats()['spill_depth'], 0)
+
+    def test_driver_failure(self):
+        self.driver.notify = mock.Mock(side_effect=Exception('spam'))
+        disp = self._dispatcher()
+        disp.put(None, dict(seq=0))
+
+        disp.flush()
+
+        self.assertEqual(len(self.batch_driver.batches), 1)
+        stats = disp.get_stats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['sent'], 0)
+        self.assertEqual(stats['batches'], 1)
+
+    def test_background_sender(self):
+        disp = self._dispatcher(batch_size=10, flush_interval=0.01,
+                                overflow_policy=dispatcher.BLOCK)
+        disp.start()
+        try:
+            for i in range(3):
+                disp.put(None, dict(seq=i))
+        finally:
+            disp.stop()
+
+        self.assertEqual(self.driver.messages,
+                         [(None, dict(seq=i)) for i in range(3)])
+        self.assertEqual(disp.depth, 0)
@@ -0,0 +1,727 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import mock
+
+from boson.data_model import resource as dm_resource
+from boson.data_model import service as dm_service
+from boson.db import usage_ledger
+from boson.db.sqlalchemy import models as sa_models
+from boson import exceptions
+from boson.openstack.common import cfg
+from boson.openstack.common import timeutils
+from boson import quota
+from boson import utils
+
+import tests
+
+
+class ResolutionPlanTestCase(tests.TestCase):
+    def setUp(self):
+        super(ResolutionPlanTestCase, self).setUp()
+
+        self.plan = quota.ResolutionPlan(
+            set(['tenant_id', 'user_id']),
+            [set(['user_id', 'tenant_id']), set(['tenant_id']), set()])
+        self.auth_data = dict(tenant_id='t/1', user_id=5, roles='admin')
+
+    def test_usage_key(self):
+        expected = dict(tenant_id='t/1', user_id=5)
+
+        self.assertEqual(self.plan.usage_key(self.auth_data),
+                         (expected, utils.dict_serialize(expected)))
+
+    def test_quota_keys(self):
+        expected = [dict(tenant_id='t/1', user_id=5), dict(tenant_id='t/1'),
+                    {}]
+
+        self.assertEqual(self.plan.quota_keys(self.auth_data),
+                         [(auth_data, utils.dict_serialize(auth_data))
+                          for auth_data in expected])
+
+    def test_limit_key(self):
+        self.assertEqual(self.plan.limit_key(self.auth_data),
+                         tuple(key for _auth_data, key in
+                               self.plan.quota_keys(self.auth_data)))
+
+    def test_missing_fields(self):
+        self.assertEqual(self.plan.quota_keys(dict(user_id=5))[1],
+                         ({}, ''))
+
+    def test_get_plan(self):
+        category = mock.Mock(id='category_id', updated_at=None,
+                             usage_fset=set(['tenant_id']),
+                             quota_fsets=[set(['tenant_id']), set()])
+        self.addCleanup(quota._PLANS.pop, 'category_id', None)
+
+        plan = quota.get_plan(category)
+        self.assertEqual(plan.usage_fields, ('tenant_id',))
+        self.assertTrue(quota.get_plan(category) is plan)
+
+        category.updated_at = datetime.datetime(2012, 1, 1)
+        category.usage_fset = set()
+        new_plan = quota.get_plan(category)
+
+        self.assertFalse(new_plan is plan)
+        self.assertEqual(new_plan.usage_fields, ())
+
+
+class QuotaEngineTestCase(tests.DBTestCase):
+    # Run against the precompiled statements of the fast path
+    fast_path = True
+    get_usage = 'get_usage_row'
+
+    def setUp(self):
+        super(QuotaEngineTestCase, self).setUp()
+
+        cfg.CONF.set_override('reservation_fast_path', self.fast_path)
+        self.addCleanup(cfg.CONF.clear_override, 'reservation_fast_path')
+
+        ctxt = self.context
+        service = self.dbapi.create_service(ctxt, 'nova', set(['tenant_id']))
+        category = self.dbapi.create_category(ctxt, service, 'compute',
+                                              set(['tenant_id']),
+                                              [set(['tenant_id']), set()])
+        self.instances = self.dbapi.create_resource(ctxt, service, category,
+                                                    'instances', set())
+        self.files = self.dbapi.create_resource(ctxt, service, category,
+                                                'injected_files', set(),
+                                                absolute=True)
+        self.dbapi.create_quota(ctxt, self.instances, {}, 10)
+        self.dbapi.create_quota(ctxt, self.instances,
+                                dict(tenant_id='big'), 100)
+        self.dbapi.create_quota(ctxt, self.files, {}, 5)
+        self.dbapi.commit(ctxt)
+
+        dm_svc = dm_service.Service('nova', ['tenant_id'])
+        self.svc_user = dm_service.ServiceUser(dm_svc,
+                                               dict(tenant_id='tenant'))
+        self.dm_instances = dm_resource.SpecificResource(
+            dm_resource.Resource(dm_svc, 'instances'))
+        self.dm_files = dm_resource.SpecificResource(
+            dm_resource.Resource(dm_svc, 'injected_files'))
+
+        self.quotas = quota.QuotaEngine(self.dbapi)
+
+        patcher = mock.patch.object(utils, 'TIMERS', utils.TimerRegistry())
+        self.timers = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _usage(self, tenant_id='tenant'):
+        return self.context.session.query(sa_models.Usage).\
+            filter(sa_models.Usage.auth_data == dict(tenant_id=tenant_id)).\
+            one()
+
+    def test_reserve(self):
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 3, self.dm_files: 2},
+                                   req_id='req-1')
+
+        self.assertEqual(resv.req_id, 'req-1')
+        db_resv = self.dbapi.get_reservation(self.context, resv.resv_id)
+        self.assertEqual([(i.resource_id, i.delta)
+                          for i in db_resv.reserved_items],
+                         [(self.instances.id, 3)])
+        usage = self._usage()
+        self.assertEqual((usage.used, usage.reserved), (0, 3))
+
+    def test_reserve_retry(self):
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 3}, req_id='req-1')
+
+        retry = self.quotas.reserve(self.context, self.svc_user,
+                                    {self.dm_instances: 3}, req_id='req-1')
+
+        self.assertEqual(retry.resv_id, resv.resv_id)
+        self.assertEqual(self._usage().reserved, 3)
+        db_resv = self.dbapi.get_reservation(self.context, retry.resv_id)
+        self.assertEqual(db_resv.auth_data, dict(tenant_id='tenant'))
+        self.assertEqual(db_resv.service.name, 'nova')
+
+    def test_reserve_retry_finished(self):
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 3}, req_id='req-1')
+        self.quotas.commit(self.context, resv.resv_id)
+
+        retry = self.quotas.reserve(self.context, self.svc_user,
+                                    {self.dm_instances: 3}, req_id='req-1')
+
+        self.assertEqual(retry.resv_id, resv.resv_id)
+        usage = self._usage()
+        self.assertEqual((usage.used, usage.reserved), (3, 0))
+
+    def test_reserve_concurrent_retry(self):
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 3}, req_id='req-1')
+
+        # The retry does not see the reservation until it creates one
+        with mock.patch.object(self.dbapi, 'get_reservation',
+                               side_effect=KeyError('req-1')):
+            retry = self.quotas.reserve(self.context, self.svc_user,
+                                        {self.dm_instances: 3},
+                                        req_id='req-1')
+
+        self.assertEqual(retry.resv_id, resv.resv_id)
+        self.assertEqual(self._usage().reserved, 3)
+        self.assertEqual(len(self.dbapi.get_reservation(
+            self.context, resv.resv_id).reserved_items), 1)
+
+    def test_reserve_default_expire(self):
+        now = datetime.datetime(2012, 1, 1)
+        timeutils.set_time_override(now)
+        self.addCleanup(timeutils.clear_time_override)
+
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 1})
+
+        db_resv = self.dbapi.get_reservation(self.context, resv.resv_id)
+        self.assertEqual(db_resv.expire, now + datetime.timedelta(days=1))
+
+    def test_reserve_over_quota(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 8})
+
+        self.assertRaises(exceptions.OverQuota, self.quotas.reserve,
+                          self.context, self.svc_user,
+                          {self.dm_instances: 3})
+        self.assertRaises(exceptions.OverQuota, self.quotas.reserve,
+                          self.context, self.svc_user, {self.dm_files: 6})
+        self.assertEqual(self._usage().reserved, 8)
+
+    def test_reserve_new_usage(self):
+        cfg.CONF.set_override('key_filter_interval', 60)
+        self.addCleanup(cfg.CONF.clear_override, 'key_filter_interval')
+        with mock.patch.object(utils, 'spawn',
+                               side_effect=lambda func, *args: func(*args)):
+            self.assertFalse(self.dbapi.usage_might_exist(
+                self.context, self.instances, {}, self.svc_user.auth_data))
+
+        # The usage is known to be missing, so is created without
+        # being looked up first
+        with self.assert_max_queries(100) as capture:
+            self.quotas.reserve(self.context, self.svc_user,
+                                {self.dm_instances: 1})
+
+        statements = [stmt for stmt in capture.statements
+                      if 'usages' in stmt]
+        self.assertTrue(statements[0].startswith('INSERT'))
+        self.assertEqual(self._usage().reserved, 1)
+
+    def test_reserve_most_specific_quota(self):
+        svc_user = dm_service.ServiceUser(self.svc_user.service,
+                                          dict(tenant_id='big'))
+
+        self.quotas.reserve(self.context, svc_user, {self.dm_instances: 50})
+
+        self.assertEqual(self._usage('big').reserved, 50)
+
+    def test_reserve_negative_delta(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: -2})
+
+        self.assertEqual(self._usage().reserved, 0)
+
+    def test_commit(self):
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 3})
+
+        self.quotas.commit(self.context, resv.resv_id)
+
+        usage = self._usage()
+        self.assertEqual((usage.used, usage.reserved), (3, 0))
+
+        # Kept until archived, but not finished again
+        db_resv = self.dbapi.get_reservation(self.context, resv.resv_id)
+        self.assertTrue(db_resv.finished_at is not None)
+        self.assertTrue(db_resv.committed)
+        self.assertEqual(len(db_resv.reserved_items), 1)
+        self.assertRaises(KeyError, self.quotas.commit, self.context,
+                          resv.resv_id)
+        self.assertRaises(KeyError, self.quotas.rollback, self.context,
+                          resv.resv_id)
+        self.assertEqual(self._usage().used, 3)
+
+    def test_rollback(self):
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 3})
+
+        self.quotas.rollback(self.context, resv.resv_id)
+
+        usage = self._usage()
+        self.assertEqual((usage.used, usage.reserved), (0, 0))
+        db_resv = self.dbapi.get_reservation(self.context, resv.resv_id)
+        self.assertTrue(db_resv.finished_at is not None)
+        self.assertFalse(db_resv.committed)
+
+    def test_expire(self):
+        expired = self.quotas.reserve(self.context, self.svc_user,
+                                      {self.dm_instances: 3},
+                                      expire=datetime.datetime(2000, 1, 1))
+        current = self.quotas.reserve(self.context, self.svc_user,
+                                      {self.dm_instances: 2})
+
+        self.quotas.expire(self.context)
+
+        self.assertEqual(self._usage().reserved, 2)
+        self.assertFalse(self.dbapi.get_reservation(
+            self.context, expired.resv_id).committed)
+        self.assertEqual(self.dbapi.get_reservation(
+            self.context, current.resv_id).finished_at, None)
+        self.assertEqual(self.quotas.expire(self.context), 0)
+
+    def test_expire_batches(self):
+        cfg.CONF.set_override('reservation_expire_batch', 2)
+        self.addCleanup(cfg.CONF.clear_override, 'reservation_expire_batch')
+        for day in range(1, 6):
+            self.quotas.reserve(self.context, self.svc_user,
+                                {self.dm_instances: 1},
+                                expire=datetime.datetime(2000, 1, day))
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 2})
+
+        self.assertEqual(self.quotas.expire(self.context), 5)
+
+        self.assertEqual(self._usage().reserved, 2)
+        self.assertEqual(self.quotas.expire_batch_sizes.count, 3)
+        self.assertEqual(self.quotas.expire_batch_sizes.max, 2)
+        report = self.timers.report()
+        self.assertEqual(report['expire.batch']['count'], 3)
+        self.assertEqual(report['expire.lag']['count'], 3)
+        self.assertEqual(report['expire.total']['count'], 1)
+
+    def test_expire_unbatched(self):
+        cfg.CONF.set_override('reservation_expire_batch', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'reservation_expire_batch')
+        for day in range(1, 4):
+            self.quotas.reserve(self.context, self.svc_user,
+                                {self.dm_instances: 1},
+                                expire=datetime.datetime(2000, 1, day))
+
+        self.assertEqual(self.quotas.expire(self.context), 3)
+
+        self.assertEqual(self.quotas.expire_batch_sizes.count, 1)
+        self.assertEqual(self.quotas.expire(self.context), 0)
+        self.assertEqual(self.timers.report()['expire.lag']['count'], 1)
+
+    def test_reserve_batch(self):
+        results = self.quotas.reserve_batch(self.context, [
+            (self.svc_user, {self.dm_instances: 4}, None, None),
+            (self.svc_user, {self.dm_instances: 4}, None, 'req-1'),
+            (self.svc_user, {self.dm_instances: 4}, None, None),
+            (self.svc_user, {self.dm_instances: 2}, None, None),
+        ])
+
+        self.assertEqual(results[1].req_id, 'req-1')
+        self.assertTrue(isinstance(results[2], exceptions.OverQuota))
+        self.assertEqual(self._usage().reserved, 10)
+        self.assertEqual(self.context.session.query(
+            sa_models.Reservation).count(), 3)
+        for resv in (results[0], results[1], results[3]):
+            self.dbapi.get_reservation(self.context, resv.resv_id)
+
+    def test_reserve_batch_duplicate(self):
+        results = self.quotas.reserve_batch(self.context, [
+            (self.svc_user, {self.dm_instances: 3}, None, 'req-1'),
+            (self.svc_user, {self.dm_instances: 3}, None, 'req-1'),
+        ])
+
+        self.assertEqual(results[0].resv_id, results[1].resv_id)
+        self.assertEqual(self._usage().reserved, 3)
+
+    def test_reserve_batch_unknown_resource(self):
+        unknown = dm_resource.SpecificResource(
+            dm_resource.Resource(self.svc_user.service, 'spam'))
+
+        results = self.quotas.reserve_batch(self.context, [
+            (self.svc_user, {unknown: 1}, None, None),
+            (self.svc_user, {self.dm_instances: 3}, None, None),
+        ])
+
+        self.assertTrue(isinstance(results[0], KeyError))
+        self.assertEqual(self._usage().reserved, 3)
+
+    def test_reserve_batch_query_counts(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+
+        # The usage record is looked up and written once
+        with self.assert_max_queries(23) as capture:
+            self.quotas.reserve_batch(
+                self.context,
+                [(self.svc_user, {self.dm_instances: 1}, None, None)] * 3)
+
+        self.assertEqual(len([stmt for stmt in capture.statements
+                              if stmt.startswith('UPDATE usages')]), 1)
+
+    def _optimistic(self, retries=2):
+        cfg.CONF.set_override('usage_concurrency', 'optimistic')
+        cfg.CONF.set_override('usage_conflict_retries', retries)
+        self.addCleanup(cfg.CONF.clear_override, 'usage_concurrency')
+        self.addCleanup(cfg.CONF.clear_override, 'usage_conflict_retries')
+
+    def _conflict(self, times):
+        """
+        Simulate a concurrent update of the usage records after they
+        are read, the given number of times.
+        """
+
+        table = sa_models.Usage.__table__
+        real_get_usage = self.quotas._get_usage
+        calls = []
+
+        def get_usage(*args):
+            usage = real_get_usage(*args)
+            calls.append(args)
+            if len(calls) <= times:
+                self.context.session.execute(
+                    table.update().values(generation=table.c.generation + 1,
+                                          reserved=table.c.reserved + 5))
+            return usage
+
+        patcher = mock.patch.object(self.quotas, '_get_usage', get_usage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls
+
+    def test_reserve_optimistic(self):
+        self._optimistic()
+
+        with mock.patch.object(self.dbapi, self.get_usage,
+                               wraps=getattr(self.dbapi,
+                                             self.get_usage)) as mock_get:
+            resv = self.quotas.reserve(self.context, self.svc_user,
+                                       {self.dm_instances: 3})
+        self.quotas.commit(self.context, resv.resv_id)
+
+        self.assertFalse(mock_get.call_args[1]['lock'])
+        usage = self._usage()
+        self.assertEqual((usage.used, usage.reserved, usage.generation),
+                         (3, 0, 2))
+
+    def test_reserve_optimistic_conflict(self):
+        self._optimistic()
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+        calls = self._conflict(2)
+
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 2})
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self._usage().reserved, 3)
+        self.assertEqual(self.context.session.query(
+            sa_models.Reservation).count(), 2)
+
+    def test_reserve_optimistic_retries_exhausted(self):
+        self._optimistic()
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+        calls = self._conflict(3)
+
+        self.assertRaises(exceptions.ConcurrentUpdate, self.quotas.reserve,
+                          self.context, self.svc_user,
+                          {self.dm_instances: 2})
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self._usage().reserved, 1)
+
+    def test_reserve_locking_not_retried(self):
+        with mock.patch.object(self.dbapi, 'commit',
+                               side_effect=exceptions.ConcurrentUpdate(
+                                   reason='test')) as mock_commit:
+            self.assertRaises(exceptions.ConcurrentUpdate,
+                              self.quotas.reserve, self.context,
+                              self.svc_user, {self.dm_instances: 2})
+
+        self.assertEqual(mock_commit.call_count, 1)
+
+    def test_commit_optimistic_conflict(self):
+        self._optimistic()
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 3})
+        real_commit = self.dbapi.commit
+        calls = []
+
+        def commit(context):
+            calls.append(context)
+            if len(calls) == 1:
+                context.session.rollback()
+                raise exceptions.ConcurrentUpdate(reason='test')
+            real_commit(context)
+
+        with mock.patch.object(self.dbapi, 'commit', commit):
+            self.quotas.commit(self.context, resv.resv_id)
+
+        self.assertEqual(len(calls), 2)
+        usage = self._usage()
+        self.assertEqual((usage.used, usage.reserved), (3, 0))
+
+    def test_query_counts(self):
+        # Create the usage record first
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+
+        with self.assert_max_queries(9):
+            resv = self.quotas.reserve(self.context, self.svc_user,
+                                       {self.dm_instances: 1})
+        with self.assert_max_queries(6):
+            self.quotas.commit(self.context, resv.resv_id)
+
+    def _quota_queries(self, capture):
+        return [stmt for stmt in capture.statements
+                if 'FROM quotas' in stmt]
+
+    def test_quota_missing_cached(self):
+        with self.assert_max_queries(100) as capture:
+            self.quotas.reserve(self.context, self.svc_user,
+                                {self.dm_instances: 1})
+        self.assertEqual(len(self._quota_queries(capture)), 2)
+
+        # The tenant has no quota of its own; only the default is read
+        with self.assert_max_queries(100) as capture:
+            self.quotas.reserve(self.context, self.svc_user,
+                                {self.dm_instances: 1})
+        self.assertEqual(len(self._quota_queries(capture)), 1)
+
+    def test_quota_missing_create_quota(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+
+        self.dbapi.create_quota(self.context, self.instances,
+                                dict(tenant_id='tenant'), 1)
+        self.dbapi.commit(self.context)
+
+        self.assertRaises(exceptions.OverQuota, self.quotas.reserve,
+                          self.context, self.svc_user,
+                          {self.dm_instances: 1})
+
+    def test_check_absolute(self):
+        self.quotas.check_absolute(self.context, self.svc_user,
+                                   {self.dm_files: 5})
+        self.assertRaises(exceptions.OverQuota, self.quotas.check_absolute,
+                          self.context, self.svc_user, {self.dm_files: 6})
+
+    def test_check_absolute_cached(self):
+        self.quotas.check_absolute(self.context, self.svc_user,
+                                   {self.dm_files: 1})
+
+        with self.assert_max_queries(0):
+            self.quotas.check_absolute(self.context, self.svc_user,
+                                       {self.dm_files: 5})
+            self.assertRaises(exceptions.OverQuota,
+                              self.quotas.check_absolute, self.context,
+                              self.svc_user, {self.dm_files: 6})
+
+    def test_check_absolute_create_quota(self):
+        self.quotas.check_absolute(self.context, self.svc_user,
+                                   {self.dm_files: 5})
+
+        self.dbapi.create_quota(self.context, self.files,
+                                dict(tenant_id='tenant'), 3)
+        self.dbapi.commit(self.context)
+
+        self.assertRaises(exceptions.OverQuota, self.quotas.check_absolute,
+                          self.context, self.svc_user, {self.dm_files: 4})
+
+    def test_check_absolute_update_limit(self):
+        self.quotas.check_absolute(self.context, self.svc_user,
+                                   {self.dm_files: 5})
+
+        self.dbapi.get_quota(self.context, resource=self.files,
+                             auth_data={}).limit = 10
+        self.dbapi.commit(self.context)
+
+        with self.assert_max_queries(5):
+            self.quotas.check_absolute(self.context, self.svc_user,
+                                       {self.dm_files: 10})
+
+    def test_check_absolute_per_user(self):
+        big = dm_service.ServiceUser(self.svc_user.service,
+                                     dict(tenant_id='big'))
+        self.quotas.check_absolute(self.context, self.svc_user,
+                                   {self.dm_instances: 10})
+
+        self.quotas.check_absolute(self.context, big,
+                                   {self.dm_instances: 100})
+        self.assertRaises(exceptions.OverQuota, self.quotas.check_absolute,
+                          self.context, self.svc_user,
+                          {self.dm_instances: 11})
+
+    def test_check_absolute_disabled(self):
+        cfg.CONF.set_override('limit_cache_ttl', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'limit_cache_ttl')
+        self.quotas.check_absolute(self.context, self.svc_user,
+                                   {self.dm_files: 1})
+
+        with self.assert_max_queries(5):
+            self.quotas.check_absolute(self.context, self.svc_user,
+                                       {self.dm_files: 1})
+
+    def test_report(self):
+        resv = self.quotas.reserve(self.context, self.svc_user,
+                                   {self.dm_instances: 2})
+        self.quotas.commit(self.context, resv.resv_id)
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+
+        self.assertEqual(self.quotas.report(self.context, self.svc_user), [
+            ('injected_files', {}, 0, 0, 5),
+            ('instances', {}, 2, 1, 10),
+        ])
+        self.assertEqual(self.timers.report()['report.total']['count'], 1)
+
+    def test_timings(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+
+        report = self.timers.report()
+        for phase in ('total', 'registry', 'quota', 'usage', 'insert',
+                      'commit'):
+            self.assertEqual(report['reserve.%s' % phase]['count'], 1)
+        self.assertEqual('reserve.write' in report, self.fast_path)
+
+    def test_reserve_stale_object(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+        usage = self._usage()
+
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 2})
+
+        self.assertEqual(usage.reserved, 3)
+
+    def test_reserve_batch_statements(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+
+        with self.assert_max_queries(100) as capture:
+            self.quotas.reserve_batch(
+                self.context,
+                [(self.svc_user, {self.dm_instances: 1}, None, None)] * 3)
+
+        inserts = [stmt for stmt in capture.statements
+                   if stmt.startswith('INSERT INTO reserved_items')]
+        self.assertEqual(len(inserts), 1 if self.fast_path else 3)
+
+
+class OrmQuotaEngineTestCase(QuotaEngineTestCase):
+    # Run the same tests through the ORM
+    fast_path = False
+    get_usage = 'get_usage'
+
+
+class LedgerQuotaEngineTestCase(QuotaEngineTestCase):
+    # Run the same tests appending to the usage ledger
+    def setUp(self):
+        super(LedgerQuotaEngineTestCase, self).setUp()
+
+        cfg.CONF.set_override('usage_concurrency', 'ledger')
+        self.addCleanup(cfg.CONF.clear_override, 'usage_concurrency')
+
+    def _usage(self, tenant_id='tenant'):
+        # Fold the ledger into the usage records first
+        usage_ledger.Compactor(self.dbapi).compact(self.context)
+        return super(LedgerQuotaEngineTestCase, self)._usage(tenant_id)
+
+    def test_reserve_batch_query_counts(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+
+        # The amounts reserved are appended to the ledger at once
+        with self.assert_max_queries(23) as capture:
+            self.quotas.reserve_batch(
+                self.context,
+                [(self.svc_user, {self.dm_instances: 1}, None, None)] * 3)
+
+        self.assertEqual(len([stmt for stmt in capture.statements
+                              if stmt.startswith('UPDATE usages')]), 0)
+        self.assertEqual(len([stmt for stmt in capture.statements
+                              if stmt.startswith('INSERT INTO '
+                                                 'usage_ledger')]), 1)
+
+    def test_reserve_stale_object(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+        usage = self._usage()
+
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 2})
+
+        # The record is only updated by compacting the ledger
+        self.assertEqual(usage.reserved, 1)
+        self._usage()
+        self.assertEqual(usage.reserved, 3)
+
+    def test_reserve_no_usage_updates(self):
+        with self.assert_max_queries(100) as capture:
+            resv = self.quotas.reserve(self.context, self.svc_user,
+                                       {self.dm_instances: 3})
+            self.quotas.commit(self.context, resv.resv_id)
+
+        self.assertFalse([stmt for stmt in capture.statements
+                          if stmt.startswith('UPDATE usages') or
+                          'FOR UPDATE' in stmt])
+        self.assertEqual(self.context.session.query(
+            sa_models.LedgerEntry).count(), 2)
+
+    def test_reserve_running_totals(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 8})
+        usage_id = self.context.session.query(sa_models.Usage.id).scalar()
+
+        self.assertEqual(usage_ledger.TOTALS.get(usage_id), (0, 8))
+        self.assertRaises(exceptions.OverQuota, self.quotas.reserve,
+                          self.context, self.svc_user,
+                          {self.dm_instances: 3})
+
+        # Uncompacted entries are read back from the ledger
+        usage_ledger.TOTALS.clear()
+        self.assertRaises(exceptions.OverQuota, self.quotas.reserve,
+                          self.context, self.svc_user,
+                          {self.dm_instances: 3})
+        self.assertEqual(usage_ledger.TOTALS.get(usage_id), (0, 8))
+
+    def test_reserve_held(self):
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 1})
+        usage_id = self.context.session.query(sa_models.Usage.id).scalar()
+        totals = usage_ledger.TOTALS
+
+        # A concurrent reservation in this process has not committed yet
+        self.assertTrue(totals.hold(usage_id, 7, 10, 0, 1,
+                                    totals.generation(usage_id)))
+        self.addCleanup(totals.release, [(usage_id, 7)])
+
+        self.assertRaises(exceptions.OverQuota, self.quotas.reserve,
+                          self.context, self.svc_user,
+                          {self.dm_instances: 3})
+        self.quotas.reserve(self.context, self.svc_user,
+                            {self.dm_instances: 2})
+        self.assertEqual(totals._held, {usage_id: 7})
+        self.assertEqual(totals.get(usage_id), (0, 3))
+
+    def test_reserve_batch_held(self):
+        results = self.quotas.reserve_batch(
+            self.context,
+            [(self.svc_user, {self.dm_instances: 6}, None, None),
+             (self.svc_user, {self.dm_instances: 6}, None, None),
+             (self.svc_user, {self.dm_instances: 4}, None, None)])
+
+        self.assertTrue(isinstance(results[1], exceptions.OverQuota))
+        self.assertFalse(isinstance(results[2], Exception))
+        self.assertEqual(usage_ledger.TOTALS._held, {})
@@ -15,10 +15,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+import socket
+import threading
+import time
 import uuid
 
+import eventlet
 import mock
 
+from boson.openstack.common import cfg
 from boson import utils
 
 import tests
@@ -84,6 +90,16 @@ class DictSerializeTestCase(tests.TestCase):
         self.assertEqual(utils.dict_serialize(test_data), exemplar)
 
 
+class DictSerializerTestCase(tests.TestCase):
+    def test_dict_serializer(self):
+        data = dict(b=True, a='a/b', c=None, d=5)
+        serialize = utils.dict_serializer(['d', 'a', 'c', 'e'])
+
+        self.assertEqual(serialize(data),
+                         utils.dict_serialize(dict(a='a/b', c=None, d=5)))
+        self.assertEqual(serialize({}), '')
+
+
 class DictDeserializeTestCase(tests.TestCase):
     def test_dict_deserialize(self):
         test_data = ("""alpha="alpha%2F%25%3D%22%27"/bravo=54321/"""
@@ -98,6 +114,16 @@ class DictDeserializeTestCase(tests.TestCase):
 
         self.assertEqual(utils.dict_deserialize(test_data), exemplar)
 
+    def test_empty(self):
+        self.assertEqual(utils.dict_deserialize(''), {})
+
+
+class ProjectTestCase(tests.TestCase):
+    def test_project(self):
+        result = utils.project(dict(a=1, b=2, c=3), ['a', 'c', 'd'])
+
+        self.assertEqual(result, dict(a=1, c=3))
+
 
 class GenerateUuidTestCase(tests.TestCase):
     @mock.patch.object(uuid, 'uuid4',
@@ -106,3 +132,213 @@ class GenerateUuidTestCase(tests.TestCase):
     def test_generate_uuid(self, _mock_uuid4):
         self.assertEqual(utils.generate_uuid(),
                          '9bb4060a-3a1d-49e0-8c9b-b6f16b430cac')
+
+
+class TotalSecondsTestCase(tests.TestCase):
+    def test_total_seconds(self):
+        delta = datetime.timedelta(days=2, seconds=5, microseconds=250000)
+
+        self.assertEqual(utils.total_seconds(delta), 172805.25)
+
+    def test_negative(self):
+        delta = datetime.timedelta(seconds=-1.5)
+
+        self.assertEqual(utils.total_seconds(delta), -1.5)
+
+
+class GreenThreadTestCase(tests.TestCase):
+    def test_native(self):
+        self.assertFalse(utils.in_green_thread())
+
+    def test_green(self):
+        self.assertTrue(eventlet.spawn(utils.in_green_thread).wait())
+
+    def test_sleep_cooperative(self):
+        order = []
+
+        def sleeper():
+            utils.sleep(0.01)
+            order.append('sleeper')
+
+        def other():
+            order.append('other')
+
+        with mock.patch.object(time, 'sleep') as mock_sleep:
+            threads = [eventlet.spawn(sleeper), eventlet.spawn(other)]
+            for thread in threads:
+                thread.wait()
+
+        self.assertEqual(order, ['other', 'sleeper'])
+        self.assertFalse(mock_sleep.called)
+
+    @mock.patch.object(time, 'sleep')
+    def test_sleep_native(self, mock_sleep):
+        utils.sleep(5)
+
+        mock_sleep.assert_called_once_with(5)
+
+    def test_spawn_native(self):
+        done = threading.Event()
+        utils.spawn(done.set)
+
+        self.assertTrue(done.wait(5))
+
+    def test_spawn_green(self):
+        calls = []
+
+        def target():
+            utils.spawn(calls.append, 1)
+            eventlet.sleep(0)
+
+        eventlet.spawn(target).wait()
+        self.assertEqual(calls, [1])
+
+
+class HistogramTestCase(tests.TestCase):
+    def test_empty(self):
+        histogram = utils.Histogram()
+
+        self.assertEqual(histogram.percentile(50), None)
+        self.assertEqual(histogram.snapshot()['count'], 0)
+
+    def test_small_values_exact(self):
+        histogram = utils.Histogram()
+        for value in range(1, 11):
+            histogram.record(value)
+
+        self.assertEqual(histogram.percentile(50), 5)
+        self.assertEqual(histogram.percentile(90), 9)
+        self.assertEqual(histogram.percentile(100), 10)
+
+    def test_relative_error(self):
+        histogram = utils.Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+
+        for pct in (50, 90, 99, 99.9):
+            exact = 100000 * pct / 100.0
+            self.assertAlmostEqual(histogram.percentile(pct) / exact, 1.0,
+                                   delta=0.04)
+
+    def test_snapshot(self):
+        histogram = utils.Histogram()
+        histogram.record(100)
+        histogram.record(300)
+
+        snapshot = histogram.snapshot()
+
+        self.assertEqual(snapshot['count'], 2)
+        self.assertEqual(snapshot['min'], 100)
+        self.assertEqual(snapshot['max'], 300)
+        self.assertEqual(snapshot['mean'], 200.0)
+        self.assertEqual(snapshot['p99.9'], 300)
+
+
+class TimerRegistryTestCase(tests.TestCase):
+    def setUp(self):
+        super(TimerRegistryTestCase, self).setUp()
+
+        self.registry = utils.TimerRegistry()
+
+    @mock.patch('time.time', side_effect=[10.0, 10.25])
+    def test_timer(self, _mock_time):
+        with self.registry.timer('spam'):
+            pass
+
+        report = self.registry.report()
+        self.assertEqual(report['spam']['count'], 1)
+        self.assertEqual(report['spam']['max'], 250000)
+
+    def test_decorator(self):
+        @self.registry.timer('spam')
+        def spam(a, b=2):
+            return a + b
+
+        self.assertEqual(spam(1, b=3), 4)
+        self.assertEqual(spam.__name__, 'spam')
+        self.assertEqual(self.registry.report()['spam']['count'], 1)
+
+    def test_exception(self):
+        def raiser():
+            with self.registry.timer('spam'):
+                raise ValueError()
+
+        self.assertRaises(ValueError, raiser)
+        self.assertEqual(self.registry.report()['spam']['count'], 1)
+
+    def test_sinks(self):
+        sink = mock.Mock()
+        self.registry.sinks.append(sink)
+
+        self.registry.record('spam', 0.5)
+
+        sink.timing.assert_called_once_with('spam', 0.5)
+
+    def test_reset(self):
+        self.registry.record('spam', 0.5)
+        self.registry.reset()
+
+        self.assertEqual(self.registry.report(), {})
+
+
+class TimedMethodsTestCase(tests.TestCase):
+    def test_timed_methods(self):
+        with mock.patch.object(utils, 'TIMERS',
+                               utils.TimerRegistry()) as registry:
+            @utils.timed_methods('test')
+            class Spam(object):
+                def spam(self):
+                    return 'spam'
+
+                def _eggs(self):
+                    return 'eggs'
+
+            obj = Spam()
+            self.assertEqual(obj.spam(), 'spam')
+            self.assertEqual(obj._eggs(), 'eggs')
+
+        self.assertEqual(registry.report().keys(), ['test.spam'])
+
+
+class StatsdSinkTestCase(tests.TestCase):
+    def test_timing(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+
+        sink = utils.StatsdSink('127.0.0.1', server.getsockname()[1],
+                                'boson.')
+        sink.timing('db.get_usage', 0.0125)
+
+        self.assertEqual(server.recv(1024), 'boson.db.get_usage:12.500|ms')
+
+
+class SetupTimingTestCase(tests.TestCase):
+    def setUp(self):
+        super(SetupTimingTestCase, self).setUp()
+        self.registry = utils.TimerRegistry()
+        patcher = mock.patch.object(utils, 'TIMERS', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _set_host(self, host):
+        cfg.CONF.set_override('statsd_host', host)
+        self.addCleanup(cfg.CONF.clear_override, 'statsd_host')
+
+    def test_unconfigured(self):
+        utils.setup_timing()
+
+        self.assertEqual(self.registry.sinks, [])
+
+    def test_idempotent(self):
+        other = mock.Mock()
+        self.registry.sinks.append(other)
+        self._set_host('127.0.0.1')
+
+        utils.setup_timing()
+        utils.setup_timing()
+
+        self.assertEqual(len(self.registry.sinks), 2)
+        self.assertEqual(self.registry.sinks[0], other)
+        self.assertIsInstance(self.registry.sinks[1], utils.StatsdSink)